@@ -0,0 +1,9 @@
+import time
+
+# Taken before any app module loads, so app.main can report its own import time
+IMPORT_STARTED = time.perf_counter()
+
+from dotenv import load_dotenv
+
+# Every app module reads its settings with os.getenv at import time; parse .env once, first
+load_dotenv()
@@ -0,0 +1,300 @@
+import os
+import heapq
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .database import supabase
+from .timezones import parse_instant
+
+FEED_MAX_USERS = int(os.getenv("FEED_MAX_USERS", "10000"))
+FEED_RESEED_SECONDS = int(os.getenv("FEED_RESEED_SECONDS", "300"))
+
+GRACE_MINUTES = 10
+EVENT_WINDOW = timedelta(hours=24)   # taken/snoozed/new-medication items
+MISSED_WINDOW = timedelta(days=2)    # overdue pending doses
+SEED_LOOKAHEAD = timedelta(hours=1)  # pending doses loaded ahead of time; reseeding covers the rest
+
+
+class _Entry:
+    __slots__ = ("seq", "at", "item")
+
+    def __init__(self, seq: int, at: datetime, item: Dict[str, Any]):
+        self.seq = seq
+        self.at = at        # event time (UTC) used for ordering and expiry
+        self.item = item    # AlertFeedItem fields; createdAt is UTC ISO
+
+
+class _UserFeed:
+    __slots__ = ("user_id", "entries", "pending", "due", "med_names", "seeded_at", "live")
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.entries: Dict[str, _Entry] = {}
+        # dose_id -> (scheduled_at UTC, scheduled ISO, medication_id) for doses still pending
+        self.pending: Dict[str, Tuple[datetime, str, Optional[str]]] = {}
+        self.due: List[Tuple[datetime, str]] = []  # heap of (scheduled_at, dose_id)
+        self.med_names: Dict[str, str] = {}
+        self.seeded_at = 0.0
+        self.live = False  # listeners are not notified while a feed is first being seeded
+
+
+class AlertFeedService:
+    """Per-user alerts feed, materialized in memory and updated by events.
+
+    Handlers report dose status changes, new medications and refreshed risk
+    scores; the feed applies each as an upsert of one item instead of
+    rebuilding from the database on every poll. Overdue doses need no event:
+    pending doses sit in a heap by scheduled time and become "missed_dose"
+    items when a read finds them past the grace period.
+
+    Every change stamps the item with a new sequence number (epoch
+    microseconds), which doubles as the ``since`` cursor. Items that stop
+    applying (a missed dose gets taken) are re-emitted with status "resolved"
+    so cursor readers see the change. Each user's state is reseeded from the
+    database every FEED_RESEED_SECONDS to pick up writes made by other workers.
+    """
+
+    def __init__(self, max_users: int = FEED_MAX_USERS, reseed_seconds: int = FEED_RESEED_SECONDS):
+        self.max_users = max_users
+        self.reseed_seconds = reseed_seconds
+        self._feeds: "OrderedDict[str, _UserFeed]" = OrderedDict()
+        self._risk: "OrderedDict[str, Tuple[int, str, datetime]]" = OrderedDict()  # last score per user
+        self._last_seq = 0
+        # Called with (user_id, item) whenever an item is added or changes
+        self.listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+
+    # ---------- internals ----------
+
+    def _next_seq(self) -> int:
+        self._last_seq = max(self._last_seq + 1, time.time_ns() // 1000)
+        return self._last_seq
+
+    def _feed(self, user_id: str) -> Optional[_UserFeed]:
+        feed = self._feeds.get(user_id)
+        if feed is not None:
+            self._feeds.move_to_end(user_id)
+        return feed
+
+    def _emit(self, feed: _UserFeed, item: Dict[str, Any]) -> None:
+        if not feed.live:
+            return
+        for listener in self.listeners:
+            try:
+                listener(feed.user_id, item)
+            except Exception as e:
+                print(f"Alert feed listener error: {e}")
+
+    def _put(self, feed: _UserFeed, at: datetime, item: Dict[str, Any]) -> None:
+        cur = feed.entries.get(item["id"])
+        if cur is not None and cur.item == item:
+            return
+        feed.entries[item["id"]] = _Entry(self._next_seq(), at, item)
+        self._emit(feed, item)
+
+    def _resolve(self, feed: _UserFeed, item_id: str) -> None:
+        cur = feed.entries.get(item_id)
+        if cur is not None and cur.item.get("status") != "resolved":
+            item = {**cur.item, "status": "resolved"}
+            feed.entries[item_id] = _Entry(self._next_seq(), cur.at, item)
+            self._emit(feed, item)
+
+    def _med_name(self, feed: _UserFeed, medication_id: Optional[str]) -> str:
+        return feed.med_names.get(medication_id or "", "Medication")
+
+    def _apply_dose(self, feed: _UserFeed, dose: Dict[str, Any], now: datetime) -> None:
+        dose_id = dose.get("id")
+        sched_iso = dose.get("scheduled_at")
+        if not dose_id or not sched_iso:
+            return
+        status = dose.get("status")
+        med_id = dose.get("medication_id")
+        if status == "pending":
+            sched = parse_instant(sched_iso)
+            if dose_id not in feed.pending:
+                heapq.heappush(feed.due, (sched, dose_id))
+            feed.pending[dose_id] = (sched, sched_iso, med_id)
+            return
+
+        feed.pending.pop(dose_id, None)
+        self._resolve(feed, dose_id)
+        if status in ("snoozed", "taken"):
+            ts_iso = dose.get("taken_at") or sched_iso
+            at = parse_instant(ts_iso)
+            if at < now - EVENT_WINDOW:
+                return
+            med = self._med_name(feed, med_id)
+            if status == "snoozed":
+                item = {"id": f"snoozed-{dose_id}", "type": "dose_snoozed", "title": "Dose Snoozed",
+                        "message": f"{med} was snoozed", "priority": "low"}
+            else:
+                item = {"id": f"taken-{dose_id}", "type": "dose_taken", "title": "Dose Taken",
+                        "message": f"{med} taken on time", "priority": "low"}
+            item.update(status="active", createdAt=ts_iso, medicationName=med)
+            self._put(feed, at, item)
+
+    def _apply_medication(self, feed: _UserFeed, med: Dict[str, Any], now: datetime) -> None:
+        feed.med_names[med["id"]] = med.get("name") or "Medication"
+        created_iso = med.get("created_at") or now.isoformat()
+        at = parse_instant(created_iso)
+        if at < now - EVENT_WINDOW:
+            return
+        self._put(feed, at, {
+            "id": f"med-{med['id']}", "type": "medication_added", "title": "Medication Added",
+            "message": f"Added {med.get('name')}", "priority": "medium", "status": "active",
+            "createdAt": created_iso, "medicationName": med.get("name") or "Medication",
+        })
+
+    def _apply_risk(self, feed: _UserFeed, user_id: str) -> None:
+        if user_id not in self._risk:
+            return
+        score, bucket, at = self._risk[user_id]
+        item_id = f"risk-{at:%Y%m%d%H%M}"
+        for k in [k for k in feed.entries if k.startswith("risk-") and k != item_id]:
+            self._resolve(feed, k)
+        if score < 50 or bucket == "high":
+            self._put(feed, at, {
+                "id": item_id, "type": "adherence_warning", "title": "Adherence Risk",
+                "message": f"Risk {bucket} ({score})", "priority": "high" if bucket == "high" else "medium",
+                "status": "active", "createdAt": at.isoformat(), "medicationName": None,
+            })
+
+    def _promote_overdue(self, feed: _UserFeed, now: datetime) -> None:
+        """Turn pending doses past their grace period into missed_dose items."""
+        cutoff = now - timedelta(minutes=GRACE_MINUTES)
+        while feed.due and feed.due[0][0] < cutoff:
+            sched, dose_id = heapq.heappop(feed.due)
+            info = feed.pending.get(dose_id)
+            if info is None or info[0] != sched:
+                continue  # stale heap entry: status changed or dose rescheduled
+            med = self._med_name(feed, info[2])
+            self._put(feed, sched, {
+                "id": dose_id, "type": "missed_dose", "title": "Missed Dose",
+                "message": "", "priority": "low", "status": "active",
+                "createdAt": info[1], "medicationName": med,
+            })
+
+    def _expire(self, feed: _UserFeed, now: datetime) -> None:
+        stale = [
+            k for k, e in feed.entries.items()
+            if e.at < now - (MISSED_WINDOW if e.item["type"] == "missed_dose" else EVENT_WINDOW)
+        ]
+        for k in stale:
+            del feed.entries[k]
+            feed.pending.pop(k, None)
+
+    def _seed(self, user_id: str, now: datetime) -> _UserFeed:
+        doses = (
+            supabase
+            .table("doses")
+            .select("id, medication_id, scheduled_at, status, taken_at")
+            .eq("user_id", user_id)
+            .gte("scheduled_at", (now - MISSED_WINDOW).isoformat())
+            .lte("scheduled_at", (now + SEED_LOOKAHEAD).isoformat())
+            .order("scheduled_at")
+            .execute()
+        ).data or []
+        meds = (
+            supabase
+            .table("medications")
+            .select("id, name, created_at")
+            .eq("user_id", user_id)
+            .execute()
+        ).data or []
+
+        old = self._feeds.get(user_id)
+        feed = _UserFeed(user_id)
+        if old is not None:
+            # Keep existing entries (and their cursors); anything unchanged is not re-emitted
+            feed.entries = old.entries
+            feed.live = True
+        for m in meds:
+            self._apply_medication(feed, m, now)
+        seen = set()
+        for d in doses:
+            seen.add(d["id"])
+            self._apply_dose(feed, d, now)
+        if old is not None:
+            # Missed doses that vanished from the window (deleted) are resolved
+            for item_id, entry in list(feed.entries.items()):
+                if entry.item["type"] == "missed_dose" and item_id not in seen:
+                    self._resolve(feed, item_id)
+        self._apply_risk(feed, user_id)
+        feed.seeded_at = time.monotonic()
+        feed.live = True
+
+        self._feeds[user_id] = feed
+        self._feeds.move_to_end(user_id)
+        while len(self._feeds) > self.max_users:
+            self._feeds.popitem(last=False)
+        return feed
+
+    # ---------- events ----------
+
+    def on_dose_changed(self, user_id: str, dose: Dict[str, Any], medication_name: Optional[str] = None) -> None:
+        feed = self._feed(user_id)
+        if feed is None:
+            return  # not materialized yet; the first read seeds from the database
+        if medication_name and dose.get("medication_id"):
+            feed.med_names[dose["medication_id"]] = medication_name
+        self._apply_dose(feed, dose, datetime.now(timezone.utc))
+
+    def on_medication_added(self, user_id: str, medication: Dict[str, Any]) -> None:
+        feed = self._feed(user_id)
+        if feed is not None:
+            self._apply_medication(feed, medication, datetime.now(timezone.utc))
+
+    def on_risk(self, user_id: str, score: int, bucket: str) -> None:
+        self._risk[user_id] = (score, bucket, datetime.now(timezone.utc))
+        self._risk.move_to_end(user_id)
+        while len(self._risk) > self.max_users:
+            self._risk.popitem(last=False)
+        feed = self._feed(user_id)
+        if feed is not None:
+            self._apply_risk(feed, user_id)
+
+    def tick(self, user_id: str) -> None:
+        """Promote newly overdue doses for a materialized feed without reading it (no database access)."""
+        feed = self._feeds.get(user_id)
+        if feed is not None:
+            self._promote_overdue(feed, datetime.now(timezone.utc))
+
+    def invalidate(self, user_id: str) -> None:
+        self._feeds.pop(user_id, None)
+
+    # ---------- reads ----------
+
+    def read(self, user_id: str, since: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Return (items newest first, cursor). With ``since``, only items changed after that cursor."""
+        now = datetime.now(timezone.utc)
+        feed = self._feed(user_id)
+        if feed is None or time.monotonic() - feed.seeded_at > self.reseed_seconds:
+            feed = self._seed(user_id, now)
+        self._promote_overdue(feed, now)
+        self._expire(feed, now)
+
+        entries = [
+            e for e in feed.entries.values()
+            if (e.seq > since if since is not None else e.item.get("status") != "resolved")
+        ]
+        entries.sort(key=lambda e: e.at, reverse=True)
+
+        items: List[Dict[str, Any]] = []
+        for e in entries:
+            item = e.item
+            if item["type"] == "missed_dose":
+                # Overdue minutes are a function of the read time, not stored state
+                mins_over = int((now - e.at).total_seconds() // 60)
+                item = {
+                    **item,
+                    "message": f"{item['medicationName']} overdue by {mins_over} min",
+                    "priority": "high" if mins_over >= 60 else ("medium" if mins_over >= 30 else "low"),
+                }
+            items.append(item)
+        cursor = max((e.seq for e in feed.entries.values()), default=since or 0)
+        return items, max(cursor, since or 0)
+
+
+# Global instance
+alert_feed = AlertFeedService()
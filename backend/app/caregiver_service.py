@@ -0,0 +1,140 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from .alert_feed import GRACE_MINUTES
+from .database import supabase, select_in
+from .timezones import parse_instant, to_local_iso
+
+ADHERENCE_WINDOW = timedelta(days=7)
+
+
+def risk_bucket(score: int) -> str:
+    return "low" if score < 35 else ("medium" if score < 65 else "high")
+
+
+class CaregiverService:
+    """Builds the caregiver dashboard for all linked patients at once.
+
+    Patients are resolved from caregiver_links in one query; 7-day dose
+    history and the latest risk_daily score are then loaded with one IN query
+    per table (chunked by select_in), concurrently with one next_doses() call
+    for the whole patient set, so the number of round-trips does not grow with
+    the number of patients.
+    """
+
+    def _links(self, caregiver_id: str) -> List[Dict[str, Any]]:
+        res = (
+            supabase
+            .table("caregiver_links")
+            .select("patient_id, patient:patient_id(id, name, timezone)")
+            .eq("caregiver_id", caregiver_id)
+            .execute()
+        )
+        return res.data or []
+
+    def _recent_doses(self, patient_ids: List[str], now: datetime) -> List[Dict[str, Any]]:
+        return select_in(
+            "doses", "id, user_id, status, scheduled_at", "user_id", patient_ids,
+            refine=lambda q: (
+                q.gte("scheduled_at", (now - ADHERENCE_WINDOW).isoformat())
+                .lte("scheduled_at", now.isoformat())
+            ),
+            page_by="id",
+        )
+
+    def _next_doses(self, patient_ids: List[str]) -> List[Dict[str, Any]]:
+        # At most one row per patient, with the medication name joined in (see supabase/final_schema.sql)
+        return supabase.rpc("next_doses", {"p_user_ids": patient_ids}).execute().data or []
+
+    def _latest_risk(self, patient_ids: List[str], now: datetime) -> List[Dict[str, Any]]:
+        since = (now - ADHERENCE_WINDOW).date().isoformat()
+        return select_in(
+            "risk_daily", "user_id, for_date, score", "user_id", patient_ids,
+            refine=lambda q: q.gte("for_date", since).order("for_date"),
+        )
+
+    @staticmethod
+    def aggregate(
+        patients: List[Dict[str, Any]],
+        recent: List[Dict[str, Any]],
+        next_doses: List[Dict[str, Any]],
+        risks: List[Dict[str, Any]],
+        now: datetime,
+    ) -> List[Dict[str, Any]]:
+        """Fold the per-table result sets into one summary per patient (single pass each)."""
+        overdue_before = now - timedelta(minutes=GRACE_MINUTES)
+        counts: Dict[str, List[int]] = {p["id"]: [0, 0, 0] for p in patients}  # due, taken, overdue
+        for d in recent:
+            c = counts.get(d.get("user_id") or "")
+            if c is None:
+                continue
+            c[0] += 1
+            status = d.get("status")
+            if status == "taken":
+                c[1] += 1
+            elif status == "pending" and parse_instant(d["scheduled_at"]) < overdue_before:
+                c[2] += 1
+
+        next_by_user = {nd["user_id"]: nd for nd in next_doses}
+
+        risk_by_user: Dict[str, Dict[str, Any]] = {}
+        for r in risks:  # ascending for_date, so the last row per patient wins
+            risk_by_user[r["user_id"]] = r
+
+        out: List[Dict[str, Any]] = []
+        for p in patients:
+            pid = p["id"]
+            tz_name = p.get("timezone") or "UTC"
+            due, taken, overdue = counts[pid]
+            nd = next_by_user.get(pid)
+            risk = risk_by_user.get(pid)
+            out.append({
+                "patient_id": pid,
+                "name": p.get("name") or "Patient",
+                "timezone": tz_name,
+                "next_dose_at": to_local_iso(nd["scheduled_at"], tz_name) if nd else None,
+                "next_medication": (nd.get("medication_name") or "Medication") if nd else None,
+                "adherence_7d": round(taken / due, 3) if due else None,
+                "taken_7d": taken,
+                "due_7d": due,
+                "overdue_count": overdue,
+                "risk_score": int(risk["score"]) if risk else None,
+                "risk_bucket": risk_bucket(int(risk["score"])) if risk else None,
+                "risk_date": str(risk["for_date"]) if risk else None,
+            })
+        out.sort(key=lambda s: (-s["overdue_count"], s["name"]))
+        return out
+
+    async def patients_summary(self, caregiver_id: str, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        now = now or datetime.now(timezone.utc)
+        links = await asyncio.to_thread(self._links, caregiver_id)
+        patients: Dict[str, Dict[str, Any]] = {}
+        for link in links:
+            p = link.get("patient") or {"id": link["patient_id"]}
+            patients[link["patient_id"]] = {**p, "id": link["patient_id"]}
+        if not patients:
+            return []
+        ids = sorted(patients)
+
+        recent, next_doses, risks = await asyncio.gather(
+            asyncio.to_thread(self._recent_doses, ids, now),
+            asyncio.to_thread(self._next_doses, ids),
+            asyncio.to_thread(self._latest_risk, ids, now),
+        )
+        return self.aggregate(list(patients.values()), recent, next_doses, risks, now)
+
+
+def record_daily_risk(user_id: str, score: int, for_date: Optional[date] = None) -> None:
+    """Persist today's score so caregivers can read it without re-scoring the patient."""
+    try:
+        supabase.table("risk_daily").upsert(
+            {"user_id": user_id, "for_date": (for_date or datetime.now(timezone.utc).date()).isoformat(), "score": score},
+            on_conflict="user_id,for_date",
+        ).execute()
+    except Exception as e:
+        print(f"risk_daily upsert failed: {e}")
+
+
+# Global instance
+caregiver_service = CaregiverService()
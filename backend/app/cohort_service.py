@@ -0,0 +1,140 @@
+import os
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .database import LeaderLock, supabase
+
+COHORT_REFRESH_ENABLED = os.getenv("COHORT_REFRESH_ENABLED", "true").lower() in ("1", "true", "yes")
+COHORT_REFRESH_MINUTES = int(os.getenv("COHORT_REFRESH_MINUTES", "10"))
+COHORT_REFRESH_LEADER_LOCK = os.getenv("COHORT_REFRESH_LEADER_LOCK", "true").lower() in ("1", "true", "yes")
+
+_LEADER_LOCK_KEY = 0x50696C6C03  # pg_try_advisory_lock key for the cohort refresh
+
+# Public sort key -> cohort_stats column; each has a (column, user_id) index
+COHORT_SORTS = {
+    "adherence": "adherence_7d",
+    "risk": "risk_score",
+    "name": "name",
+    "last_taken": "last_taken_day",
+}
+RISK_BUCKETS = ("low", "medium", "high")
+COHORT_MAX_LIMIT = 200
+_SUMMARY_CACHE_SIZE = 1024  # clinicians whose overview is kept between refreshes
+
+
+class CohortService:
+    """Clinician cohort reads over precomputed rollups.
+
+    The database keeps adherence_daily current with a trigger on doses
+    (see supabase/final_schema.sql). This service periodically folds it into
+    cohort_stats, one row per patient, with refresh_cohort_stats(); with a
+    ``leader`` lock only the process holding it refreshes. Reads go through
+    clinician_cohort_page() / clinician_cohort_summary(), which scope
+    cohort_stats to the clinician's panel in clinician_links. Overviews only
+    change on refresh, so they are cached per clinician between refreshes.
+    """
+
+    def __init__(self, refresh_minutes: int = COHORT_REFRESH_MINUTES, leader: Optional[LeaderLock] = None):
+        self.refresh_minutes = refresh_minutes
+        self.leader = leader
+        self._task: Optional[asyncio.Task] = None
+        self._summaries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.stats = {"refreshes": 0, "last_refresh_seconds": 0.0}
+
+    # ---------- refresh ----------
+
+    def refresh(self) -> None:
+        supabase.rpc("refresh_cohort_stats", {}).execute()
+        self._summaries.clear()
+
+    async def run(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                if self.leader is None or await asyncio.to_thread(self.leader.acquire):
+                    await asyncio.to_thread(self.refresh)
+                    self.stats["refreshes"] += 1
+                    self.stats["last_refresh_seconds"] = round(time.monotonic() - started, 3)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Cohort refresh error: {e}")
+            await asyncio.sleep(self.refresh_minutes * 60)
+
+    def start(self) -> None:
+        if self.leader is not None and not self.leader.available:
+            print("Cohort refresh not started: the leader lock needs DATABASE_URL and psycopg "
+                  "(or set COHORT_REFRESH_LEADER_LOCK=false when only one process runs it)")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.leader is not None:
+            await asyncio.to_thread(self.leader.release)
+
+    # ---------- reads ----------
+
+    def page(
+        self,
+        clinician_id: str,
+        sort: str = "adherence",
+        descending: bool = False,
+        risk: Optional[List[str]] = None,
+        search: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """One page of the clinician's patients plus the total matching count."""
+        res = supabase.rpc("clinician_cohort_page", {
+            "p_clinician": clinician_id,
+            "p_sort": COHORT_SORTS[sort],
+            "p_desc": descending,
+            "p_risk": risk or None,
+            "p_search": search or None,
+            "p_offset": offset,
+            "p_limit": limit,
+        }).execute()
+        data = res.data or {}
+        rows = data.get("rows") or []
+        return rows, int(data.get("total") or 0)
+
+    def summary(self, clinician_id: str) -> Dict[str, Any]:
+        """Panel overview and 14-day trend, cached until the next refresh."""
+        ttl = self.refresh_minutes * 60
+        cached = self._summaries.get(clinician_id)
+        if cached and time.monotonic() - cached[0] < ttl:
+            self._summaries.move_to_end(clinician_id)
+            return cached[1]
+
+        data = supabase.rpc("clinician_cohort_summary", {"p_clinician": clinician_id}).execute().data or {}
+        trend = data.get("trend") or []
+        counts = data.get("risk_counts") or {}
+        # Weighted by doses due over the same window as adherence_7d (7 complete days + today)
+        taken = sum(int(r.get("taken") or 0) for r in trend[-8:])
+        due = sum(int(r.get("due") or 0) for r in trend[-8:])
+
+        summary = {
+            "total_patients": int(data.get("total_patients") or 0),
+            "avg_adherence": round(taken / due, 3) if due else None,
+            "risk_counts": {bucket: int(counts.get(bucket) or 0) for bucket in RISK_BUCKETS},
+            "trend": trend,
+        }
+        self._summaries[clinician_id] = (time.monotonic(), summary)
+        self._summaries.move_to_end(clinician_id)
+        while len(self._summaries) > _SUMMARY_CACHE_SIZE:
+            self._summaries.popitem(last=False)
+        return summary
+
+
+# Global instance
+cohort_service = CohortService(leader=LeaderLock(_LEADER_LOCK_KEY) if COHORT_REFRESH_LEADER_LOCK else None)
@@ -0,0 +1,292 @@
+import os
+import asyncio
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional; br is not offered without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional; zstd is not offered without it
+    zstandard = None
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+# Bodies smaller than this go out as they are: the headers and the CPU cost more than the bytes saved
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+# Bodies at least this large are compressed on a worker thread so the event loop keeps serving
+COMPRESSION_THREAD_BYTES = int(os.getenv("COMPRESSION_THREAD_BYTES", "262144"))
+# Server preference when the client accepts several with the same q
+COMPRESSION_ENCODINGS = tuple(
+    e.strip() for e in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if e.strip()
+)
+# Levels for dynamic responses (see benchmarks/bench_compression.py): past these the ratio barely moves while CPU climbs
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "5"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+# text/event-stream is deliberately absent: each event has to reach the client as it is sent
+_COMPRESSIBLE = ("application/json", "text/csv", "text/plain", "text/html", "application/x-ndjson")
+
+
+class _Stream:
+    """Incremental compressor: ``chunk`` returns what can be sent so far, ``finish`` the rest."""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        self._z: Any
+        if encoding == "gzip":
+            self._z = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+            self._flush = zlib.Z_SYNC_FLUSH
+        elif encoding == "br" and brotli is not None:
+            self._z = brotli.Compressor(quality=level)
+        elif encoding == "zstd" and zstandard is not None:
+            self._z = zstandard.ZstdCompressor(level=level).compressobj()
+            self._flush = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            raise ValueError(f"Unsupported content encoding: {encoding}")
+
+    def chunk(self, data: bytes) -> bytes:
+        # Flush after every chunk so a streamed export reaches the client as it is produced
+        if self.encoding == "br":
+            return self._z.process(data) + self._z.flush()
+        return self._z.compress(data) + self._z.flush(self._flush)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._z.finish()
+        return self._z.flush()
+
+
+def available_encodings() -> Tuple[str, ...]:
+    installed = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+    return tuple(e for e in COMPRESSION_ENCODINGS if installed.get(e))
+
+
+def default_levels() -> Dict[str, int]:
+    return {"gzip": COMPRESSION_GZIP_LEVEL, "br": COMPRESSION_BROTLI_QUALITY, "zstd": COMPRESSION_ZSTD_LEVEL}
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """One-shot compression of a complete body."""
+    if encoding == "gzip":
+        z = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return z.compress(data) + z.flush()
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=level)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=level, write_content_size=True).compress(data)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def negotiate(accept_encoding: str, offered: Tuple[str, ...]) -> Optional[str]:
+    """Pick an encoding from ``offered`` (in server preference order) for an Accept-Encoding value."""
+    if not accept_encoding or not offered:
+        return None
+    qualities: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[name] = q
+    wildcard = qualities.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in offered:
+        q = qualities.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _compressible(content_type: str) -> bool:
+    return content_type.split(";", 1)[0].strip().lower() in _COMPRESSIBLE
+
+
+class CompressionStats:
+    """Bytes in and out per encoding, for /metrics."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counts: Dict[str, List[int]] = {}  # encoding -> [responses, bytes in, bytes out]
+
+    def observe(self, encoding: str, raw: int, sent: int, responses: int = 1) -> None:
+        with self._lock:
+            c = self.counts.setdefault(encoding, [0, 0, 0])
+            c[0] += responses
+            c[1] += raw
+            c[2] += sent
+
+    def render(self) -> str:
+        with self._lock:
+            counts = {k: list(v) for k, v in self.counts.items()}
+        out = [
+            "# HELP pillpal_compressed_responses_total Responses sent compressed.",
+            "# TYPE pillpal_compressed_responses_total counter",
+        ]
+        out += [f'pillpal_compressed_responses_total{{encoding="{e}"}} {c[0]}' for e, c in sorted(counts.items())]
+        out += [
+            "# HELP pillpal_compression_bytes_total Response body bytes before (in) and after (out) compression.",
+            "# TYPE pillpal_compression_bytes_total counter",
+        ]
+        for e, c in sorted(counts.items()):
+            out.append(f'pillpal_compression_bytes_total{{encoding="{e}",direction="in"}} {c[1]}')
+            out.append(f'pillpal_compression_bytes_total{{encoding="{e}",direction="out"}} {c[2]}')
+        return "\n".join(out) + "\n"
+
+
+class CompressionMiddleware:
+    """ASGI middleware: compress JSON and CSV responses with the best encoding the client accepts.
+
+    Offers zstd, br and gzip (COMPRESSION_ENCODINGS, in that preference);
+    br and zstd only when the brotli / zstandard packages are installed.
+    Complete bodies under COMPRESSION_MIN_BYTES are sent as they are, and
+    large ones are compressed on a worker thread. Streamed responses (the
+    CSV export) are compressed chunk by chunk and flushed after each, so
+    the client still sees rows as they are produced. The SSE stream,
+    HEAD requests, 304s and responses that already carry a
+    Content-Encoding pass through untouched.
+
+    Compressible responses get ``Vary: Accept-Encoding``. A strong ETag on a
+    compressed body is weakened, as the bytes differ from the identity
+    representation; the weak tags from app/http_cache.py are left as they
+    are and keep validating whichever encoding the client stored.
+    Written as plain ASGI rather than Starlette's GZipMiddleware, which only
+    does gzip and holds streamed chunks in the compressor until it fills.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MIN_BYTES,
+        thread_size: int = COMPRESSION_THREAD_BYTES,
+        encodings: Optional[Tuple[str, ...]] = None,
+        levels: Optional[Dict[str, int]] = None,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_size = thread_size
+        self.encodings = available_encodings() if encodings is None else encodings
+        self.levels = {**default_levels(), **(levels or {})}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not COMPRESSION_ENABLED or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = negotiate(accept, self.encodings)
+
+        start: Optional[Message] = None
+        stream: Optional[_Stream] = None
+        passthrough = False
+        raw = sent = 0
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, stream, passthrough, raw, sent
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                content_type = ""
+                already_encoded = False
+                for name, value in headers:
+                    if name == b"content-type":
+                        content_type = value.decode("latin-1")
+                    elif name == b"content-encoding":
+                        already_encoded = True
+                if message["status"] == 304:
+                    # Same Vary as the 200 it revalidates
+                    passthrough = True
+                    await send({**message, "headers": _add_vary(headers)})
+                    return
+                if message["status"] < 200 or message["status"] == 204 or already_encoded \
+                        or not _compressible(content_type):
+                    passthrough = True
+                    await send(message)
+                    return
+                headers = _add_vary(headers)
+                if encoding is None:
+                    passthrough = True
+                    await send({**message, "headers": headers})
+                    return
+                start = {**message, "headers": headers}  # held until the first body chunk decides
+                return
+            if message["type"] != "http.response.body" or passthrough or start is None or encoding is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if stream is None:
+                if not more:
+                    # Complete body in one message: the common case for JSON endpoints
+                    if len(body) < self.minimum_size:
+                        passthrough = True
+                        await send(start)
+                        await send(message)
+                        return
+                    level = self.levels[encoding]
+                    if len(body) >= self.thread_size:
+                        out = await asyncio.to_thread(compress, body, encoding, level)
+                    else:
+                        out = compress(body, encoding, level)
+                    compression_stats.observe(encoding, len(body), len(out))
+                    await send({**start, "headers": _encoded_headers(start["headers"], encoding, len(out))})
+                    await send({"type": "http.response.body", "body": out})
+                    return
+                stream = _Stream(encoding, self.levels[encoding])
+                await send({**start, "headers": _encoded_headers(start["headers"], encoding, None)})
+            raw += len(body)
+            out = stream.chunk(body) if body else b""
+            if not more:
+                out += stream.finish()
+            sent += len(out)
+            if out or not more:
+                await send({"type": "http.response.body", "body": out, "more_body": more})
+            if not more:
+                compression_stats.observe(encoding, raw, sent)
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _add_vary(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    for i, (name, value) in enumerate(headers):
+        if name == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[i] = (name, value + b", Accept-Encoding")
+            return headers
+    headers.append((b"vary", b"Accept-Encoding"))
+    return headers
+
+
+def _encoded_headers(headers: List[Tuple[bytes, bytes]], encoding: str, length: Optional[int]) -> List[Tuple[bytes, bytes]]:
+    out = []
+    for name, value in headers:
+        if name == b"content-length":
+            continue
+        if name == b"etag" and not value.startswith(b"W/"):
+            value = b"W/" + value
+        out.append((name, value))
+    out.append((b"content-encoding", encoding.encode("latin-1")))
+    if length is not None:
+        out.append((b"content-length", str(length).encode("latin-1")))
+    return out
+
+
+# Global instance
+compression_stats = CompressionStats()
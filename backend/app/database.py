@@ -1,26 +1,140 @@
 import os
+from typing import Any, Callable, Dict, List, Optional
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from .services import registry
 
-# Load environment variables
-load_dotenv()
+try:
+    import psycopg
+except ImportError:  # only needed for direct connections (advisory locks, archiving, LISTEN/NOTIFY)
+    psycopg = None
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_SERVICE_ROLE = os.getenv("SUPABASE_SERVICE_ROLE", "")
 
-# SQLAlchemy setup
+SUPABASE_CONFIGURED = bool(SUPABASE_URL and SUPABASE_SERVICE_ROLE)
+
+# SQLAlchemy setup (create_engine does not connect; the pool opens on first checkout)
 engine = create_engine(DATABASE_URL) if DATABASE_URL else None
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine) if engine else None
 Base = declarative_base()
 
-# Supabase client (only create if credentials exist)
-supabase: Client = None
-if SUPABASE_URL and SUPABASE_SERVICE_ROLE:
-    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE)
+def _open_pool(eng) -> None:
+    with eng.connect():
+        pass
+
+if engine is not None:
+    registry.register("db_pool", lambda: engine, warm=_open_pool, close=lambda eng: eng.dispose())
+
+def _create_supabase():
+    """Build the Supabase client (only if credentials exist)."""
+    if not SUPABASE_CONFIGURED:
+        return None
+    # Deferred: supabase pulls in httpx, gotrue, storage and realtime (~0.25s)
+    from supabase import create_client
+    from .telemetry import instrument_postgrest
+    client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE)
+    instrument_postgrest()
+    return client
+
+def _warm_supabase(client) -> None:
+    # One cheap round trip opens the PostgREST HTTP connection pool
+    client.table("users").select("id").limit(1).execute()
+
+# Supabase client, built on first use (or by the startup warmup)
+supabase = registry.register("supabase", _create_supabase, warm=_warm_supabase)
+
+# PostgREST caps each response (1000 rows by default) and IN lists travel in the URL
+PAGE_SIZE = 1000
+IN_CHUNK = 200
+
+def select_paged(build_query: Callable[[], Any], page_size: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Run a PostgREST query page by page until exhausted. build_query must apply a stable order."""
+    rows: List[Dict[str, Any]] = []
+    offset = 0
+    while True:
+        page = build_query().range(offset, offset + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        offset += page_size
+
+def select_in(
+    table: str,
+    columns: str,
+    column: str,
+    ids: List[Any],
+    chunk: int = IN_CHUNK,
+    refine: Optional[Callable[[Any], Any]] = None,
+    page_by: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """SELECT ... WHERE column IN ids, split into URL-safe chunks.
+
+    refine adds further filters. Pass a unique column as page_by when a chunk
+    can match more rows than one PostgREST response holds.
+    """
+    rows: List[Dict[str, Any]] = []
+    for i in range(0, len(ids), chunk):
+        def build(part=ids[i:i + chunk]):
+            query = supabase.table(table).select(columns).in_(column, part)
+            if refine is not None:
+                query = refine(query)
+            return query.order(page_by) if page_by else query
+        if page_by:
+            rows.extend(select_paged(build))
+        else:
+            rows.extend(build().execute().data or [])
+    return rows
+
+class LeaderLock:
+    """Postgres session advisory lock electing one process to run a job.
+
+    Held on a dedicated connection, so it is released when the holder exits
+    or its connection drops. ``acquire`` blocks (run it on a thread) and is
+    called before each cycle: the holder checks its connection is still
+    alive, everyone else tries to take the lock.
+    """
+
+    def __init__(self, key: int, dsn: Optional[str] = DATABASE_URL):
+        self.key = key
+        self.dsn = dsn
+        self._conn: Any = None
+
+    @property
+    def available(self) -> bool:
+        return psycopg is not None and bool(self.dsn)
+
+    @property
+    def held(self) -> bool:
+        return self._conn is not None
+
+    def acquire(self) -> bool:
+        if psycopg is None or not self.dsn:
+            return False
+        try:
+            if self._conn is not None:
+                self._conn.execute("select 1")
+                return True
+            conn = psycopg.connect(self.dsn, autocommit=True)
+            row = conn.execute("select pg_try_advisory_lock(%s)", (self.key,)).fetchone()
+            if row and row[0]:
+                self._conn = conn
+                return True
+            conn.close()
+        except Exception as e:
+            print(f"Leader lock {self.key} error: {e}")
+            self.release()
+        return False
+
+    def release(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
 
 def get_db():
     """Dependency to get database session"""
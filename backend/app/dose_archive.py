@@ -0,0 +1,270 @@
+import os
+import re
+import asyncio
+import time
+import uuid
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+from .database import DATABASE_URL, LeaderLock, supabase
+from .http_cache import http_cache, DOSES
+
+try:
+    import psycopg
+except ImportError:  # archiving needs a direct connection; exports still work without it
+    psycopg = None
+
+if TYPE_CHECKING:
+    from psycopg import Connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # cold tier is optional
+    pa = None
+    pq = None
+
+DOSE_ARCHIVE_ENABLED = os.getenv("DOSE_ARCHIVE_ENABLED", "false").lower() in ("1", "true", "yes")
+DOSE_ARCHIVE_DIR = os.getenv("DOSE_ARCHIVE_DIR", "./archive/doses")
+DOSE_HOT_MONTHS = int(os.getenv("DOSE_HOT_MONTHS", "3"))
+DOSE_PARTITIONS_AHEAD = int(os.getenv("DOSE_PARTITIONS_AHEAD", "3"))
+DOSE_ARCHIVE_INTERVAL_HOURS = int(os.getenv("DOSE_ARCHIVE_INTERVAL_HOURS", "24"))
+
+_PARTITION = re.compile(r"^doses_p(\d{4})(\d{2})$")
+_FETCH_ROWS = 50_000
+_ROW_GROUP_ROWS = 64_000
+_LEADER_LOCK_KEY = 0x50696C6C02  # pg_try_advisory_lock key for the archiver
+_PARTITION_LOCK_CLASS = 0x5050  # pg_advisory_xact_lock(class, hashtext(partition)) while one is archived
+
+# Column order of the Parquet files; medication_name is captured at archive
+# time so archived months stay readable after a medication is deleted
+ARCHIVE_COLUMNS = ("id", "user_id", "medication_id", "medication_name", "scheduled_at", "status", "taken_at", "notes")
+
+_ARCHIVE_QUERY = """
+select d.id::text, d.user_id::text, d.medication_id::text, m.name, d.scheduled_at,
+       d.status::text, d.taken_at, d.notes
+from {table} d
+left join medications m on m.id = d.medication_id
+order by d.user_id, d.scheduled_at
+"""
+
+
+def _arrow_schema():
+    if pa is None:
+        raise RuntimeError("Dose archive needs pyarrow")
+    ts = pa.timestamp("us", tz="UTC")
+    return pa.schema([
+        ("id", pa.string()),
+        ("user_id", pa.string()),
+        ("medication_id", pa.string()),
+        ("medication_name", pa.string()),
+        ("scheduled_at", ts),
+        ("status", pa.string()),
+        ("taken_at", ts),
+        ("notes", pa.string()),
+    ])
+
+
+def _fsync(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _month_start(months_ago: int, today: Optional[date] = None) -> date:
+    today = today or datetime.now(timezone.utc).date()
+    index = today.year * 12 + (today.month - 1) - months_ago
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class DoseArchiver:
+    """Hot/cold tiering for the monthly-partitioned doses table.
+
+    Daily it makes sure partitions exist DOSE_PARTITIONS_AHEAD months ahead
+    (ensure_dose_partitions()) and moves every partition that ended more than
+    DOSE_HOT_MONTHS ago to a Parquet file under DOSE_ARCHIVE_DIR: rows are
+    written sorted by user, so row-group statistics let a single user's read
+    skip most of the file. The export, the dose_archives row and the detach
+    and drop run in one transaction that locks the partition against writes
+    first, and the file is fsynced (written to a temp name, then renamed,
+    then the directory synced) before the drop, so a crash at any point
+    leaves either the partition or a complete file to retry from.
+
+    DOSE_ARCHIVE_DIR must be shared by every worker that serves exports.
+    Only the holder of the ``leader`` lock archives, each partition is also
+    locked by name for its transaction, and exports are written under a
+    temp name unique to the process.
+    """
+
+    def __init__(
+        self,
+        archive_dir: str = DOSE_ARCHIVE_DIR,
+        hot_months: int = DOSE_HOT_MONTHS,
+        months_ahead: int = DOSE_PARTITIONS_AHEAD,
+        interval_hours: int = DOSE_ARCHIVE_INTERVAL_HOURS,
+        leader: Optional[LeaderLock] = None,
+    ):
+        self.archive_dir = Path(archive_dir)
+        self.hot_months = hot_months
+        self.months_ahead = months_ahead
+        self.interval_hours = interval_hours
+        self.leader = leader
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"runs": 0, "archived_months": 0, "archived_rows": 0, "last_run_seconds": 0.0}
+
+    def path_for(self, month: date) -> Path:
+        return self.archive_dir / f"doses_{month:%Y_%m}.parquet"
+
+    # ---------- hot tier maintenance ----------
+
+    def ensure_partitions(self) -> int:
+        created = supabase.rpc(
+            "ensure_dose_partitions", {"p_months_back": 0, "p_months_ahead": self.months_ahead}
+        ).execute().data
+        return int(created or 0)
+
+    def _closed_partitions(self, conn: "Connection") -> List[Tuple[str, date]]:
+        cutoff = _month_start(self.hot_months)
+        rows = conn.execute(
+            "select c.relname from pg_inherits i join pg_class c on c.oid = i.inhrelid "
+            "where i.inhparent = 'doses'::regclass"
+        ).fetchall()
+        closed = []
+        for (name,) in rows:
+            m = _PARTITION.match(name)
+            if m:
+                month = date(int(m.group(1)), int(m.group(2)), 1)
+                if month < cutoff:
+                    closed.append((name, month))
+        return sorted(closed, key=lambda p: p[1])
+
+    # ---------- archiving ----------
+
+    def _write_parquet(self, conn: "Connection", table: str, path: Path) -> int:
+        schema = _arrow_schema()
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            count = self._export(conn, table, tmp, schema)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        _fsync(tmp)
+        os.replace(tmp, path)
+        _fsync(path.parent)  # the rename itself must survive a crash before the drop
+        return count
+
+    def _export(self, conn: "Connection", table: str, tmp: Path, schema: Any) -> int:
+        if pa is None or pq is None:
+            raise RuntimeError("Dose archive needs pyarrow")
+        count = 0
+        with conn.cursor(name=f"archive_{table}") as cur:
+            cur.execute(_ARCHIVE_QUERY.format(table=table))
+            with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+                while True:
+                    rows = cur.fetchmany(_FETCH_ROWS)
+                    if not rows:
+                        break
+                    columns = list(zip(*rows))
+                    writer.write_table(
+                        pa.Table.from_arrays([pa.array(col, type=f.type) for col, f in zip(columns, schema)], schema=schema),
+                        row_group_size=_ROW_GROUP_ROWS,
+                    )
+                    count += len(rows)
+        return count
+
+    def archive_partition(self, conn: "Connection", table: str, month: date) -> Optional[int]:
+        """Export, record, detach and drop one partition; None if another process already archived it."""
+        path = self.path_for(month)
+        with conn.transaction():
+            conn.execute("select pg_advisory_xact_lock(%s, hashtext(%s))", (_PARTITION_LOCK_CLASS, table))
+            attached = conn.execute(
+                "select 1 from pg_inherits where inhrelid = to_regclass(%s) and inhparent = 'doses'::regclass",
+                (table,),
+            ).fetchone()
+            if not attached:
+                return None
+            # Held until the drop commits: no dose in the month can change after it is exported.
+            # SHARE ROW EXCLUSIVE conflicts with itself, so a second archiver waits here too.
+            conn.execute(f'lock table "{table}" in share row exclusive mode')
+            count = self._write_parquet(conn, table, path)
+            conn.execute(
+                "insert into dose_archives (month, path, row_count) values (%s, %s, %s) "
+                "on conflict (month) do update set path = excluded.path, row_count = excluded.row_count, archived_at = now()",
+                (month, str(path), count),
+            )
+            conn.execute(f'alter table doses detach partition "{table}"')
+            conn.execute(f'drop table "{table}"')
+        return count
+
+    def archive_closed(self) -> Dict[str, int]:
+        if psycopg is None or pa is None or not DATABASE_URL:
+            print("Dose archive skipped: needs psycopg, pyarrow and DATABASE_URL")
+            return {"months": 0, "rows": 0}
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        months = rows = 0
+        with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+            for table, month in self._closed_partitions(conn):
+                n = self.archive_partition(conn, table, month)
+                if n is None:
+                    continue
+                print(f"Archived {table}: {n} doses -> {self.path_for(month)}")
+                months += 1
+                rows += n
+        if rows:
+            http_cache.bump_all(DOSES)  # archived rows move out of the hot table
+        self.stats["archived_months"] += months
+        self.stats["archived_rows"] += rows
+        return {"months": months, "rows": rows}
+
+    async def run(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                await asyncio.to_thread(self.ensure_partitions)
+                if self.leader is None or await asyncio.to_thread(self.leader.acquire):
+                    await asyncio.to_thread(self.archive_closed)
+                self.stats["runs"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Dose archive error: {e}")
+            self.stats["last_run_seconds"] = round(time.monotonic() - started, 3)
+            await asyncio.sleep(self.interval_hours * 3600)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.leader is not None:
+            await asyncio.to_thread(self.leader.release)
+
+    # ---------- cold tier reads ----------
+
+    def read_user(self, user_id: str) -> Iterator[Dict[str, Any]]:
+        """Archived doses of one user, oldest month first, sorted by scheduled_at within each month."""
+        if pq is None or not self.archive_dir.is_dir():
+            return
+        for path in sorted(self.archive_dir.glob("doses_*.parquet")):
+            table = pq.read_table(path, columns=list(ARCHIVE_COLUMNS), filters=[("user_id", "=", user_id)])
+            if not table.num_rows:
+                continue
+            for row in table.sort_by("scheduled_at").to_pylist():
+                for key in ("scheduled_at", "taken_at"):
+                    if row[key] is not None:
+                        row[key] = row[key].isoformat()
+                yield row
+
+
+# Global instance
+dose_archiver = DoseArchiver(leader=LeaderLock(_LEADER_LOCK_KEY))
@@ -0,0 +1,224 @@
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+from .timezones import local_instant, parse_instant, resolve_zone
+
+# Status codes stored in DoseHistory.status
+PENDING, TAKEN, SKIPPED, SNOOZED, MISSED = range(5)
+STATUS_CODES: Dict[str, int] = {
+    "pending": PENDING,
+    "taken": TAKEN,
+    "skipped": SKIPPED,
+    "snoozed": SNOOZED,
+    "missed": MISSED,
+}
+
+BLOCKS = ("morning", "midday", "evening", "night")
+# Local hour -> index into BLOCKS: morning 05-12, midday 12-17, evening 17-21, night otherwise
+_HOUR_TO_BLOCK = np.array([3] * 5 + [0] * 7 + [1] * 5 + [2] * 4 + [3] * 3, dtype=np.int8)
+
+NO_TIME = -1
+MINUTES_PER_DAY = 1440
+
+
+@lru_cache(maxsize=64)
+def _status_table(statuses: Tuple[int, ...]) -> np.ndarray:
+    """Boolean lookup table indexed by status code; ``table[status]`` is a vectorized membership test."""
+    table = np.zeros(len(STATUS_CODES), dtype=bool)
+    table[list(statuses)] = True
+    return table
+
+
+def epoch_minute(dt: datetime) -> int:
+    return int(dt.timestamp()) // 60
+
+
+def block_of(dt: datetime) -> str:
+    return BLOCKS[_HOUR_TO_BLOCK[dt.hour]]
+
+
+class DoseHistory:
+    """A user's doses as parallel NumPy arrays, sorted by scheduled time.
+
+    ``at`` and ``taken_at`` hold epoch minutes (UTC; NO_TIME when absent),
+    ``status`` the codes above and ``med`` an index into ``medication_ids``.
+    Timestamps are parsed once on load; every query afterwards is a slice
+    (``searchsorted`` on ``at``) plus vectorized counting, instead of
+    re-scanning dicts and slicing ISO strings. Day and time-block helpers use
+    the user's timezone.
+    """
+
+    __slots__ = ("at", "taken_at", "status", "med", "medication_ids", "tz_name", "_local")
+
+    def __init__(
+        self,
+        at: np.ndarray,
+        taken_at: np.ndarray,
+        status: np.ndarray,
+        med: np.ndarray,
+        medication_ids: Sequence[Optional[str]],
+        tz_name: Optional[str] = None,
+    ):
+        self.at = at
+        self.taken_at = taken_at
+        self.status = status
+        self.med = med
+        self.medication_ids = list(medication_ids)
+        self.tz_name = tz_name or "UTC"
+        self._local: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict[str, Any]], tz_name: Optional[str] = None) -> "DoseHistory":
+        """Build from dose rows ({scheduled_at, status, taken_at, medication_id})."""
+        rows = list(rows)
+        n = len(rows)
+        at = np.empty(n, dtype=np.int64)
+        taken_at = np.full(n, NO_TIME, dtype=np.int64)
+        status = np.empty(n, dtype=np.int8)
+        med = np.empty(n, dtype=np.int32)
+        med_index: Dict[Optional[str], int] = {}
+        k = 0
+        for r in rows:
+            sched = r.get("scheduled_at")
+            if not sched:
+                continue
+            at[k] = epoch_minute(parse_instant(sched))
+            if r.get("taken_at"):
+                taken_at[k] = epoch_minute(parse_instant(r["taken_at"]))
+            status[k] = STATUS_CODES.get(r.get("status") or "", PENDING)
+            med[k] = med_index.setdefault(r.get("medication_id"), len(med_index))
+            k += 1
+        order = np.argsort(at[:k], kind="stable")
+        return cls(at[:k][order], taken_at[:k][order], status[:k][order], med[:k][order], list(med_index), tz_name)
+
+    def __len__(self) -> int:
+        return int(self.at.size)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.at.nbytes + self.taken_at.nbytes + self.status.nbytes + self.med.nbytes)
+
+    # ---------- local time ----------
+
+    def _utc_offsets(self, minutes: np.ndarray) -> np.ndarray:
+        """UTC offset in minutes for each instant.
+
+        The zone is sampled at the start and end of each distinct UTC day; a
+        day whose two offsets differ is bisected down to the minute of its DST
+        transition. Instants are then mapped onto those transitions with one
+        ``searchsorted``.
+        """
+        if not minutes.size:
+            return np.zeros(0, dtype=np.int64)
+        zone = resolve_zone(self.tz_name)
+
+        def offset_at(minute: int) -> int:
+            utc = datetime.fromtimestamp(minute * 60, timezone.utc)
+            return int((utc.astimezone(zone).utcoffset() or timedelta()).total_seconds()) // 60
+
+        edges: List[int] = []  # first minute of each new offset
+        values: List[int] = []
+        prev: Optional[int] = None
+        for d in np.unique(minutes // MINUTES_PER_DAY).tolist():
+            lo, hi = d * MINUTES_PER_DAY, (d + 1) * MINUTES_PER_DAY
+            start, end = offset_at(lo), offset_at(hi)
+            if prev is None:
+                values.append(start)
+            elif start != prev:
+                edges.append(lo)
+                values.append(start)
+            if end != start:
+                while hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    if offset_at(mid) == start:
+                        lo = mid
+                    else:
+                        hi = mid
+                edges.append(hi)
+                values.append(end)
+            prev = end
+        return np.array(values, dtype=np.int64)[np.searchsorted(np.array(edges, dtype=np.int64), minutes, side="right")]
+
+    @property
+    def local(self) -> np.ndarray:
+        """Scheduled times as local epoch minutes (wall clock expressed as if it were UTC)."""
+        if self._local is None:
+            self._local = self.at + self._utc_offsets(self.at)
+        return self._local
+
+    def local_day_start(self, day: date) -> int:
+        """Epoch minute (UTC) of local midnight starting ``day``."""
+        return epoch_minute(local_instant(day, time(0), resolve_zone(self.tz_name)))
+
+    # ---------- windows ----------
+
+    def span(self, start: Optional[int] = None, end: Optional[int] = None) -> slice:
+        """Index range with start <= at < end (epoch minutes; None for open ends)."""
+        lo = 0 if start is None else int(np.searchsorted(self.at, start, side="left"))
+        hi = len(self) if end is None else int(np.searchsorted(self.at, end, side="left"))
+        return slice(lo, max(lo, hi))
+
+    def count(self, statuses: Optional[Sequence[int]] = None, start: Optional[int] = None, end: Optional[int] = None) -> int:
+        sl = self.span(start, end)
+        if statuses is None:
+            return sl.stop - sl.start
+        return int(np.count_nonzero(_status_table(tuple(statuses))[self.status[sl]]))
+
+    def adherence(self, start: Optional[int] = None, end: Optional[int] = None) -> Optional[float]:
+        """Taken / all doses in the window, or None when the window is empty."""
+        total = self.count(None, start, end)
+        return self.count((TAKEN,), start, end) / total if total else None
+
+    def daily_counts(self, first_day: date, days: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(taken, total) per local day for ``days`` days starting at ``first_day``."""
+        day_idx = self.local // MINUTES_PER_DAY - (first_day - date(1970, 1, 1)).days
+        inside = (day_idx >= 0) & (day_idx < days)
+        idx = day_idx[inside]
+        total = np.bincount(idx, minlength=days)
+        taken = np.bincount(idx[self.status[inside] == TAKEN], minlength=days)
+        return taken, total
+
+    def streak(self, first_day: date, days: int) -> int:
+        """Consecutive fully-taken days ending on the last day of the range (empty days break it)."""
+        taken, total = self.daily_counts(first_day, days)
+        full = (total > 0) & (taken == total)
+        broken = np.flatnonzero(~full)
+        return int(days - 1 - broken[-1]) if broken.size else days
+
+    def block_histogram(
+        self,
+        statuses: Optional[Sequence[int]] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Dict[str, int]:
+        """Doses per local time block, optionally filtered by status and window."""
+        sl = self.span(start, end)
+        local = self.local[sl]
+        if statuses is not None:
+            local = local[_status_table(tuple(statuses))[self.status[sl]]]
+        blocks = _HOUR_TO_BLOCK[(local % MINUTES_PER_DAY) // 60]
+        counts = np.bincount(blocks, minlength=len(BLOCKS))
+        return {BLOCKS[i]: int(counts[i]) for i in range(len(BLOCKS))}
+
+    # ---------- points ----------
+
+    def last_taken_minute(self) -> Optional[int]:
+        """Latest taken_at (or scheduled time when taken_at is missing) among taken doses."""
+        mask = self.status == TAKEN
+        if not mask.any():
+            return None
+        ts = np.where(self.taken_at[mask] != NO_TIME, self.taken_at[mask], self.at[mask])
+        return int(ts.max())
+
+    def first_scheduled(self, statuses: Sequence[int], start: Optional[int] = None) -> Optional[int]:
+        sl = self.span(start, None)
+        hits = np.flatnonzero(_status_table(tuple(statuses))[self.status[sl]])
+        return int(self.at[sl][hits[0]]) if hits.size else None
+
+
+def top_blocks(histogram: Dict[str, int], n: int) -> List[str]:
+    """Block names with non-zero counts, most frequent first (ties keep BLOCKS order)."""
+    ranked = sorted((b for b in BLOCKS if histogram.get(b)), key=lambda b: -histogram[b])
+    return ranked[:n]
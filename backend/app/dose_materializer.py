@@ -0,0 +1,237 @@
+import os
+import asyncio
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .database import LeaderLock, supabase, select_paged, select_in
+from .http_cache import http_cache, DOSES
+from .schedule_compiler import Recurrence, compile_schedule
+from .timezones import local_instant, parse_instant, resolve_zone
+
+DOSE_MATERIALIZER_ENABLED = os.getenv("DOSE_MATERIALIZER_ENABLED", "true").lower() in ("1", "true", "yes")
+DOSE_HORIZON_DAYS = int(os.getenv("DOSE_HORIZON_DAYS", "30"))
+DOSE_MATERIALIZE_INTERVAL_MINUTES = int(os.getenv("DOSE_MATERIALIZE_INTERVAL_MINUTES", "60"))
+DOSE_MATERIALIZER_LEADER_LOCK = os.getenv("DOSE_MATERIALIZER_LEADER_LOCK", "true").lower() in ("1", "true", "yes")
+
+_MED_CHUNK = 200     # medications planned per round-trip group
+_WRITE_CHUNK = 1000  # rows per multi-row upsert / ids per bulk delete
+_LEADER_LOCK_KEY = 0x50696C6C04  # pg_try_advisory_lock key for the periodic run
+SOURCE = "schedule"  # doses.source of the rows this materializer writes
+
+DoseKey = Tuple[str, int]  # (medication_id, epoch seconds)
+
+
+def _epoch(value: str) -> int:
+    return int(parse_instant(value).timestamp())
+
+
+class DoseMaterializer:
+    """Keeps pending doses materialized for a rolling horizon of days.
+
+    For each group of medications the desired set of (medication_id, scheduled_at)
+    pairs is computed from med_times in the owner's timezone and diffed against
+    the doses already stored in the window:
+
+    - missing pairs are written with large multi-row upserts
+      (ON CONFLICT (medication_id, scheduled_at) DO NOTHING), tagged
+      ``source = 'schedule'``
+    - future *pending* doses it wrote itself that no longer match a med_time
+      (the time was deleted or edited) are removed in bulk
+
+    Only instants from ``now`` onward are touched, so history and doses the
+    patient already acted on are never rewritten. Manual doses, and every dose
+    of a medication whose schedule compiles to no daily times (weekly, as
+    needed, ...), are left alone. With a ``leader`` lock only the process
+    holding it runs the periodic pass; endpoints still materialize the
+    medications they change directly.
+    """
+
+    def __init__(
+        self,
+        horizon_days: int = DOSE_HORIZON_DAYS,
+        interval_minutes: int = DOSE_MATERIALIZE_INTERVAL_MINUTES,
+        leader: Optional[LeaderLock] = None,
+    ):
+        self.horizon_days = horizon_days
+        self.interval_minutes = interval_minutes
+        self.leader = leader
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"runs": 0, "inserted": 0, "deleted": 0, "last_run_seconds": 0.0}
+
+    # ---------- planning (pure) ----------
+
+    def desired_instants(self, schedule: Recurrence, tz_name: Optional[str], now: datetime) -> Tuple[Set[int], int]:
+        """Epoch seconds of every dose from now until the end of the horizon, plus the window end."""
+        zone = resolve_zone(tz_name)
+        today = now.astimezone(zone).date()
+        now_ts = int(now.timestamp())
+        times = schedule.clock_times()
+        out: Set[int] = set()
+        for i in range(self.horizon_days):
+            day = today + timedelta(days=i)
+            for t in times:
+                ts = int(local_instant(day, t, zone).timestamp())
+                if ts >= now_ts:
+                    out.add(ts)
+        window_end = int(local_instant(today + timedelta(days=self.horizon_days), time(0), zone).timestamp())
+        return out, window_end
+
+    def plan(
+        self,
+        meds: List[Dict[str, Any]],
+        schedules: Dict[str, Recurrence],
+        zones: Dict[str, Optional[str]],
+        existing: List[Dict[str, Any]],
+        now: datetime,
+    ) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Return (rows to insert, dose ids to delete) for a group of medications."""
+        have: Dict[DoseKey, Dict[str, Any]] = {}
+        for d in existing:
+            have[(d["medication_id"], _epoch(d["scheduled_at"]))] = d
+
+        want: Set[DoseKey] = set()
+        owner: Dict[str, str] = {}
+        window_end: Dict[str, int] = {}
+        for m in meds:
+            mid = m["id"]
+            owner[mid] = m["user_id"]
+            if not schedules[mid].clock_times():
+                continue  # no daily times: generate nothing and prune nothing
+            instants, window_end[mid] = self.desired_instants(schedules[mid], zones.get(m["user_id"]), now)
+            want.update((mid, ts) for ts in instants)
+
+        missing = want - have.keys()
+        inserts = [
+            {
+                "user_id": owner[mid],
+                "medication_id": mid,
+                "scheduled_at": datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+                "status": "pending",
+                "source": SOURCE,
+            }
+            for mid, ts in sorted(missing)
+        ]
+        stale = [
+            have[key]["id"]
+            for key in have.keys() - want
+            if have[key].get("status") == "pending"
+            and have[key].get("source") == SOURCE
+            and key[1] < window_end.get(key[0], 0)
+        ]
+        return inserts, stale
+
+    # ---------- database ----------
+
+    def _write(self, inserts: List[Dict[str, Any]], stale: List[str]) -> None:
+        for i in range(0, len(inserts), _WRITE_CHUNK):
+            (
+                supabase
+                .table("doses")
+                .upsert(inserts[i:i + _WRITE_CHUNK], on_conflict="medication_id,scheduled_at", ignore_duplicates=True)
+                .execute()
+            )
+        for i in range(0, len(stale), _WRITE_CHUNK):
+            (
+                supabase.table("doses").delete()
+                .in_("id", stale[i:i + _WRITE_CHUNK])
+                .eq("status", "pending")
+                .eq("source", SOURCE)
+                .execute()
+            )
+
+    def _materialize_group(self, meds: List[Dict[str, Any]], now: datetime) -> Tuple[int, int]:
+        if not meds:
+            return 0, 0
+        med_ids = [m["id"] for m in meds]
+
+        times_by_med: Dict[str, List[str]] = {}
+        for row in select_in("med_times", "medication_id, time_of_day", "medication_id", med_ids, page_by="id"):
+            times_by_med.setdefault(row["medication_id"], []).append(row["time_of_day"])
+        # Stored med_times are authoritative; medications without any fall back to their sig text
+        schedules = {
+            m["id"]: (
+                Recurrence.from_times(times_by_med[m["id"]]) if m["id"] in times_by_med
+                else compile_schedule(m.get("instructions"))
+            )
+            for m in meds
+        }
+
+        user_ids = sorted({m["user_id"] for m in meds})
+        zones = {u["id"]: u.get("timezone") for u in select_in("users", "id, timezone", "id", user_ids)}
+
+        existing = select_in(
+            "doses", "id, medication_id, scheduled_at, status, source", "medication_id", med_ids,
+            refine=lambda q: q.gte("scheduled_at", now.isoformat()),
+            page_by="id",
+        )
+
+        inserts, stale = self.plan(meds, schedules, zones, existing, now)
+        self._write(inserts, stale)
+        if inserts or stale:
+            owner = {m["id"]: m["user_id"] for m in meds}
+            stale_ids = set(stale)
+            changed = {row["user_id"] for row in inserts}
+            changed.update(owner[d["medication_id"]] for d in existing if d["id"] in stale_ids)
+            for user_id in changed:
+                http_cache.bump(user_id, DOSES)
+        return len(inserts), len(stale)
+
+    def materialize_medications(self, medication_ids: List[str], now: Optional[datetime] = None) -> Dict[str, int]:
+        """Bring the given medications' future doses in line with their med_times."""
+        now = now or datetime.now(timezone.utc)
+        meds = select_in("medications", "id, user_id, instructions", "id", list(medication_ids))
+        inserted, deleted = self._materialize_group(meds, now)
+        self.stats["inserted"] += inserted
+        self.stats["deleted"] += deleted
+        return {"inserted": inserted, "deleted": deleted}
+
+    def materialize_all(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        now = now or datetime.now(timezone.utc)
+        meds = select_paged(lambda: supabase.table("medications").select("id, user_id, instructions").order("id"))
+        inserted = deleted = 0
+        for i in range(0, len(meds), _MED_CHUNK):
+            ins, dele = self._materialize_group(meds[i:i + _MED_CHUNK], now)
+            inserted += ins
+            deleted += dele
+        self.stats["inserted"] += inserted
+        self.stats["deleted"] += deleted
+        return {"medications": len(meds), "inserted": inserted, "deleted": deleted}
+
+    # ---------- background loop ----------
+
+    async def run(self) -> None:
+        while True:
+            started = asyncio.get_running_loop().time()
+            try:
+                if self.leader is None or await asyncio.to_thread(self.leader.acquire):
+                    await asyncio.to_thread(self.materialize_all)
+                    self.stats["runs"] += 1
+                    self.stats["last_run_seconds"] = round(asyncio.get_running_loop().time() - started, 3)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Dose materializer error: {e}")
+            await asyncio.sleep(self.interval_minutes * 60)
+
+    def start(self) -> None:
+        if self.leader is not None and not self.leader.available:
+            print("Dose materializer not started: the leader lock needs DATABASE_URL and psycopg "
+                  "(or set DOSE_MATERIALIZER_LEADER_LOCK=false when only one process runs it)")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.leader is not None:
+            await asyncio.to_thread(self.leader.release)
+
+
+# Global instance
+dose_materializer = DoseMaterializer(leader=LeaderLock(_LEADER_LOCK_KEY) if DOSE_MATERIALIZER_LEADER_LOCK else None)
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, NamedTuple, Optional, Set
+
+try:
+    import psycopg
+except ImportError:  # LISTEN/NOTIFY fan-out is optional
+    psycopg = None
+
+STREAM_HEARTBEAT_SECONDS = int(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "64"))
+STREAM_REPLAY_SIZE = int(os.getenv("STREAM_REPLAY_SIZE", "100"))
+STREAM_REPLAY_USERS = int(os.getenv("STREAM_REPLAY_USERS", "10000"))
+EVENTS_PG_NOTIFY = os.getenv("EVENTS_PG_NOTIFY", "false").lower() in ("1", "true", "yes")
+EVENTS_PG_CHANNEL = os.getenv("EVENTS_PG_CHANNEL", "pillpal_events")
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+_NOTIFY_MAX_BYTES = 7900  # Postgres caps NOTIFY payloads at 8000 bytes
+_RETRY_FRAME = f"retry: {STREAM_HEARTBEAT_SECONDS * 1000}\n\n".encode()
+_PING_FRAME = b": ping\n\n"
+# No id line, so the client's Last-Event-ID keeps pointing at the last real event
+_RESYNC_FRAME = b'event: resync\ndata: {"reason":"events dropped; refetch state"}\n\n'
+# Signal name sent to signal_hooks when LISTEN (re)connects
+RESYNC = "resync"
+
+
+class Event(NamedTuple):
+    id: int
+    user_id: str
+    type: str
+    frame: bytes  # encoded once, shared by every subscriber
+
+
+def _frame(event_id: int, event_type: str, data: Any) -> bytes:
+    body = json.dumps(data, separators=(",", ":"), default=str)
+    return f"id: {event_id}\nevent: {event_type}\ndata: {body}\n\n".encode()
+
+
+class Subscription:
+    """One open stream. Holds at most ``maxlen`` undelivered events; on overflow
+    the oldest are dropped and the client is told to resync."""
+
+    __slots__ = ("user_id", "queue", "wake", "overflowed")
+
+    def __init__(self, user_id: str, maxlen: int):
+        self.user_id = user_id
+        self.queue: Deque[Event] = deque(maxlen=maxlen)
+        self.wake = asyncio.Event()
+        self.overflowed = False
+
+    def push(self, event: Event) -> None:
+        if len(self.queue) == self.queue.maxlen:
+            self.overflowed = True
+        self.queue.append(event)
+        self.wake.set()
+
+
+class EventHub:
+    """In-process pub/sub for per-user server-sent events.
+
+    ``publish`` encodes an event once and appends it to every open stream of
+    that user plus a short per-user replay buffer used to resume from
+    Last-Event-ID. One ticker task wakes all streams every heartbeat interval
+    (idle connections cost no timers of their own) and runs ``tick_hooks`` for
+    each connected user.
+
+    With EVENTS_PG_NOTIFY, events are also sent through Postgres NOTIFY on
+    EVENTS_PG_CHANNEL and events from other workers are delivered locally, so
+    any node can publish for any connected user.
+
+    ``signal`` is the same fan-out for process state rather than clients: it
+    runs ``signal_hooks`` here and, with NOTIFY, on every other worker, and is
+    never sent to streams. ``relaying`` tells whether both NOTIFY connections
+    are up; each time LISTEN (re)connects, signals sent meanwhile may have
+    been missed, so the hooks get a ``RESYNC`` signal for user "".
+    """
+
+    def __init__(
+        self,
+        queue_size: int = STREAM_QUEUE_SIZE,
+        replay_size: int = STREAM_REPLAY_SIZE,
+        replay_users: int = STREAM_REPLAY_USERS,
+        heartbeat_seconds: int = STREAM_HEARTBEAT_SECONDS,
+    ):
+        self.queue_size = queue_size
+        self.replay_size = replay_size
+        self.replay_users = replay_users
+        self.heartbeat_seconds = heartbeat_seconds
+        self.node_id = uuid.uuid4().hex[:12]
+        self.tick_hooks: List[Callable[[str], None]] = []
+        self.signal_hooks: List[Callable[[str, str, Any], None]] = []
+        self._subs: Dict[str, Set[Subscription]] = {}
+        self._replay: "OrderedDict[str, Deque[Event]]" = OrderedDict()
+        self._last_id = 0
+        self._ticker: Optional[asyncio.Task] = None
+        self._pg_tasks: List[asyncio.Task] = []
+        self._outbox: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listening = False
+        self._notifying = False
+        self.stats = {"connections": 0, "published": 0, "remote": 0, "dropped": 0}
+
+    # ---------- publishing ----------
+
+    def _next_id(self) -> int:
+        self._last_id = max(self._last_id + 1, time.time_ns() // 1000)
+        return self._last_id
+
+    def _deliver(self, event: Event) -> None:
+        replay = self._replay.get(event.user_id)
+        if replay is None:
+            replay = self._replay[event.user_id] = deque(maxlen=self.replay_size)
+            while len(self._replay) > self.replay_users:
+                self._replay.popitem(last=False)
+        else:
+            self._replay.move_to_end(event.user_id)
+        replay.append(event)
+        for sub in self._subs.get(event.user_id, ()):
+            if len(sub.queue) == sub.queue.maxlen:
+                self.stats["dropped"] += 1
+            sub.push(event)
+
+    def publish(self, user_id: str, event_type: str, data: Any) -> None:
+        """Send an event to the user's open streams (and other workers when NOTIFY is on)."""
+        if not user_id:
+            return
+        event_id = self._next_id()
+        self._deliver(Event(event_id, user_id, event_type, _frame(event_id, event_type, data)))
+        self.stats["published"] += 1
+        if self._outbox is not None:
+            payload = json.dumps(
+                {"n": self.node_id, "i": event_id, "u": user_id, "t": event_type, "d": data},
+                separators=(",", ":"), default=str,
+            )
+            if len(payload.encode()) > _NOTIFY_MAX_BYTES:
+                payload = json.dumps({"n": self.node_id, "i": event_id, "u": user_id, "t": "resync", "d": {}})
+            try:
+                self._outbox.put_nowait(payload)
+            except asyncio.QueueFull:
+                self.stats["dropped"] += 1
+
+    def signal(self, user_id: str, name: str, data: Any = None) -> None:
+        """Run signal_hooks in this worker and (with NOTIFY) the others. Safe to call from any thread."""
+        self._run_signal_hooks(user_id, name, data)
+        if self._outbox is not None and self._loop is not None:
+            payload = json.dumps({"n": self.node_id, "s": name, "u": user_id, "d": data}, separators=(",", ":"), default=str)
+            self._loop.call_soon_threadsafe(self._enqueue, payload)
+
+    @property
+    def relaying(self) -> bool:
+        """Signals from other workers reach this one and ours reach them (NOTIFY connected both ways)."""
+        return self._listening and self._notifying
+
+    def _enqueue(self, payload: str) -> None:
+        if self._outbox is None:
+            return
+        try:
+            self._outbox.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    def _run_signal_hooks(self, user_id: str, name: str, data: Any) -> None:
+        for hook in self.signal_hooks:
+            try:
+                hook(user_id, name, data)
+            except Exception as e:
+                print(f"Event hub signal error: {e}")
+
+    def _on_notify(self, payload: str) -> None:
+        try:
+            msg = json.loads(payload)
+        except ValueError:
+            return
+        if msg.get("n") == self.node_id:
+            return
+        if "s" in msg:
+            self._run_signal_hooks(str(msg.get("u") or ""), str(msg["s"]), msg.get("d"))
+            return
+        if not msg.get("u"):
+            return
+        event_id = int(msg.get("i") or self._next_id())
+        self._last_id = max(self._last_id, event_id)
+        event_type = str(msg.get("t") or "message")
+        self._deliver(Event(event_id, msg["u"], event_type, _frame(event_id, event_type, msg.get("d"))))
+        self.stats["remote"] += 1
+
+    # ---------- subscribing ----------
+
+    def subscribe(self, user_id: str, last_event_id: Optional[int] = None) -> Subscription:
+        """Open a stream; with ``last_event_id`` the buffered events after it are queued first."""
+        self._ensure_ticker()
+        sub = Subscription(user_id, self.queue_size)
+        if last_event_id is not None:
+            replay = self._replay.get(user_id) or ()
+            missed = [e for e in replay if e.id > last_event_id]
+            # The buffer no longer reaches back to last_event_id: events were lost
+            gap = not replay or (replay[0].id > last_event_id + 1 and len(replay) == replay.maxlen)
+            if gap:
+                sub.overflowed = True
+            for e in missed[-self.queue_size:]:
+                sub.queue.append(e)
+            if len(missed) > self.queue_size:
+                sub.overflowed = True
+        self._subs.setdefault(user_id, set()).add(sub)
+        self.stats["connections"] += 1
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subs.get(sub.user_id)
+        if subs is not None and sub in subs:
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.user_id]
+            self.stats["connections"] -= 1
+
+    async def stream(self, sub: Subscription) -> AsyncIterator[bytes]:
+        """Yield SSE frames for a subscription until the client disconnects."""
+        try:
+            yield _RETRY_FRAME
+            while True:
+                if sub.overflowed:
+                    sub.overflowed = False
+                    yield _RESYNC_FRAME
+                if sub.queue:
+                    while sub.queue:
+                        yield sub.queue.popleft().frame
+                    continue
+                sub.wake.clear()
+                await sub.wake.wait()
+                if not sub.queue and not sub.overflowed:
+                    yield _PING_FRAME
+        finally:
+            self.unsubscribe(sub)
+
+    # ---------- background tasks ----------
+
+    def _ensure_ticker(self) -> None:
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.get_running_loop().create_task(self._tick_loop())
+
+    async def _tick_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            for user_id, subs in list(self._subs.items()):
+                for hook in self.tick_hooks:
+                    try:
+                        hook(user_id)
+                    except Exception as e:
+                        print(f"Event hub tick error: {e}")
+                for sub in subs:
+                    sub.wake.set()
+
+    async def _pg_listen(self) -> None:
+        if psycopg is None or not DATABASE_URL:
+            return
+        while True:
+            try:
+                conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True)
+                async with conn:
+                    await conn.execute(f"LISTEN {EVENTS_PG_CHANNEL}")
+                    self._listening = True
+                    self._run_signal_hooks("", RESYNC, None)
+                    async for note in conn.notifies():
+                        self._on_notify(note.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Event hub LISTEN error: {e}")
+            finally:
+                self._listening = False
+            await asyncio.sleep(5)
+
+    async def _pg_notify(self) -> None:
+        if psycopg is None or not DATABASE_URL or self._outbox is None:
+            return
+        outbox = self._outbox
+        payload: Optional[str] = None
+        while True:
+            try:
+                conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True)
+                async with conn:
+                    self._notifying = True
+                    while True:
+                        if payload is None:
+                            payload = await outbox.get()
+                        await conn.execute("SELECT pg_notify(%s, %s)", (EVENTS_PG_CHANNEL, payload))
+                        payload = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Event hub NOTIFY error: {e}")
+            finally:
+                self._notifying = False
+            await asyncio.sleep(5)
+
+    def start(self) -> None:
+        self._ensure_ticker()
+        if EVENTS_PG_NOTIFY and DATABASE_URL and psycopg is not None and not self._pg_tasks:
+            self._outbox = asyncio.Queue(maxsize=10_000)
+            self._loop = asyncio.get_running_loop()
+            self._pg_tasks = [asyncio.create_task(self._pg_listen()), asyncio.create_task(self._pg_notify())]
+
+    async def stop(self) -> None:
+        tasks = self._pg_tasks + ([self._ticker] if self._ticker is not None else [])
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._pg_tasks = []
+        self._ticker = None
+        self._outbox = None
+        self._loop = None
+
+
+# Global instance
+event_hub = EventHub()
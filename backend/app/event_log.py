@@ -0,0 +1,310 @@
+import os
+import json
+import asyncio
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .database import supabase
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+LOG_FLUSH_SECONDS = float(os.getenv("LOG_FLUSH_SECONDS", "1.0"))
+LOG_SPILL_PATH = os.getenv("LOG_SPILL_PATH", "./spill/event_log.jsonl")
+LOG_DEAD_LETTER_PATH = os.getenv("LOG_DEAD_LETTER_PATH", "./spill/event_log.dead.jsonl")
+LOG_MAX_ATTEMPTS = int(os.getenv("LOG_MAX_ATTEMPTS", "3"))
+LOG_SHUTDOWN_SECONDS = float(os.getenv("LOG_SHUTDOWN_SECONDS", "5"))
+AUDIT_LOG_ENABLED = os.getenv("AUDIT_LOG_ENABLED", "true").lower() in ("1", "true", "yes")
+
+_RETRY_SECONDS = 5.0
+
+Record = Tuple[str, Dict[str, Any]]  # (table, row)
+
+
+def _rejected(e: Exception) -> bool:
+    """True when Postgres refused the rows themselves (data, constraint or column errors), not the connection."""
+    code = str(getattr(e, "code", "") or "")
+    return code[:2] in ("22", "23", "42") or code.startswith("PGRST2")
+
+
+class LogWriter:
+    """Write-behind pipeline for intake_events and audit_log rows.
+
+    Handlers call ``log`` which only appends to a bounded in-memory queue, so
+    logging adds no round-trip to the request. One background task flushes the
+    queue as multi-row INSERTs per table, every LOG_FLUSH_SECONDS or as soon as
+    LOG_BATCH_SIZE rows are waiting.
+
+    When Postgres is slow or failing the queue fills up; rows that do not fit
+    (and batches whose insert failed) are appended to a local JSON-lines spill
+    file instead of being dropped, and replayed once inserts succeed again.
+    Spill writes run in a thread, off the event loop. A batch that Postgres
+    rejects outright, or that has failed LOG_MAX_ATTEMPTS times, is bisected
+    until the offending rows are isolated; those go to the dead-letter file
+    and the rest are written. On shutdown the queue is drained within
+    LOG_SHUTDOWN_SECONDS and whatever is left goes to the spill file.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = LOG_QUEUE_SIZE,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_seconds: float = LOG_FLUSH_SECONDS,
+        spill_path: str = LOG_SPILL_PATH,
+        dead_letter_path: str = LOG_DEAD_LETTER_PATH,
+        max_attempts: int = LOG_MAX_ATTEMPTS,
+    ):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.spill_path = Path(spill_path)
+        self.dead_letter_path = Path(dead_letter_path)
+        self.max_attempts = max_attempts
+        self._queue: Deque[Record] = deque()
+        self._overflow: List[Record] = []  # rows waiting for the spill thread
+        self._spiller: Optional[asyncio.Task] = None
+        self._file_lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._retry_at = 0.0
+        self._stopping = False
+        self.stats = {
+            "logged": 0, "written": 0, "batches": 0, "spilled": 0, "replayed": 0, "lost": 0, "failures": 0,
+            "quarantined": 0,
+        }
+
+    # ---------- producers ----------
+
+    def log(self, table: str, row: Dict[str, Any]) -> None:
+        """Queue one row for ``table``; never blocks and never raises."""
+        self.stats["logged"] += 1
+        if len(self._queue) >= self.queue_size:
+            # Backpressure: the writer is behind, keep the row on disk instead
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                self._spill([(table, row)])  # sync handler in a worker thread: blocking is fine here
+                return
+            self._overflow.append((table, row))
+            if self._spiller is None or self._spiller.done():
+                self._spiller = asyncio.create_task(self._drain_overflow())
+            return
+        self._queue.append((table, row))
+        if self._wake is not None and len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    def audit(
+        self,
+        user_id: Optional[str],
+        action: str,
+        entity_type: str,
+        entity_id: Optional[str],
+        meta: Optional[Dict[str, Any]] = None,
+        actor_id: Optional[str] = None,
+    ) -> None:
+        if not AUDIT_LOG_ENABLED or not entity_id:
+            return
+        self.log("audit_log", {
+            "user_id": user_id,
+            "actor_id": actor_id or user_id,
+            "action": action,
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "meta": meta or {},
+        })
+
+    # ---------- spill file ----------
+
+    def _append(self, path: Path, lines: List[Dict[str, Any]]) -> None:
+        with self._file_lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(line, separators=(",", ":"), default=str) + "\n" for line in lines))
+
+    def _spill(self, records: List[Record], attempts: int = 0) -> None:
+        """Append rows to the spill file; ``attempts`` is how many inserts of them have failed."""
+        if not records:
+            return
+        try:
+            self._append(self.spill_path, [
+                {"t": t, "r": r, "a": attempts} if attempts else {"t": t, "r": r} for t, r in records
+            ])
+            self.stats["spilled"] += len(records)
+        except Exception as e:
+            self.stats["lost"] += len(records)
+            print(f"Event log spill failed, {len(records)} rows lost: {e}")
+
+    def _quarantine(self, records: List[Record], error: Exception) -> None:
+        try:
+            self._append(self.dead_letter_path, [{"t": t, "r": r, "error": str(error)} for t, r in records])
+            self.stats["quarantined"] += len(records)
+        except Exception as e:
+            self.stats["lost"] += len(records)
+            print(f"Event log dead-letter write failed, {len(records)} rows lost: {e}")
+            return
+        print(f"Event log quarantined {len(records)} rows in {self.dead_letter_path}: {error}")
+
+    async def _drain_overflow(self) -> None:
+        while self._overflow:
+            records, self._overflow = self._overflow, []
+            await asyncio.to_thread(self._spill, records)
+
+    def _take_spill(self) -> List[Tuple[Record, int]]:
+        """Move the spill file aside and load it as (record, failed attempts) (rows spilled meanwhile start a new file)."""
+        replay = self.spill_path.with_suffix(self.spill_path.suffix + ".replay")
+        with self._file_lock:
+            if not replay.exists():
+                if not self.spill_path.exists():
+                    return []
+                os.replace(self.spill_path, replay)
+        records: List[Tuple[Record, int]] = []
+        with open(replay, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    msg = json.loads(line)
+                    records.append(((msg["t"], msg["r"]), int(msg.get("a") or 0)))
+                except (ValueError, KeyError, TypeError):
+                    continue
+        replay.unlink()
+        return records
+
+    # ---------- writer ----------
+
+    def _insert(self, records: List[Record]) -> None:
+        by_table: Dict[str, List[Dict[str, Any]]] = {}
+        for table, row in records:
+            by_table.setdefault(table, []).append(row)
+        for table, rows in by_table.items():
+            supabase.table(table).insert(rows).execute()
+
+    async def _write(self, records: List[Record], attempts: int = 0) -> bool:
+        """Insert one batch; on failure spill it (or isolate rejected rows). False means back off."""
+        try:
+            await asyncio.to_thread(self._insert, records)
+        except asyncio.CancelledError:
+            # Shutdown deadline hit mid-insert: keep a copy (may duplicate, never loses)
+            self._spill(records, attempts)
+            raise
+        except Exception as e:
+            self.stats["failures"] += 1
+            if _rejected(e) or attempts + 1 >= self.max_attempts:
+                return await self._isolate(records, attempts + 1, e)
+            self._retry_at = time.monotonic() + _RETRY_SECONDS
+            print(f"Event log insert failed, spilling {len(records)} rows: {e}")
+            await asyncio.to_thread(self._spill, records, attempts + 1)
+            return False
+        self.stats["written"] += len(records)
+        self.stats["batches"] += 1
+        return True
+
+    async def _isolate(self, records: List[Record], attempts: int, error: Exception) -> bool:
+        """Bisect a failing batch: write the halves that go in, quarantine single rows that do not.
+
+        A half that fails for another reason (connection, timeout) before its
+        rows have used up their attempts is spilled for a later retry instead.
+        """
+        if len(records) == 1:
+            await asyncio.to_thread(self._quarantine, records, error)
+            return True
+        ok = True
+        mid = len(records) // 2
+        for start, half in ((0, records[:mid]), (mid, records[mid:])):
+            try:
+                await asyncio.to_thread(self._insert, half)
+            except asyncio.CancelledError:
+                self._spill(records[start:], attempts)
+                raise
+            except Exception as e:
+                self.stats["failures"] += 1
+                if _rejected(e) or attempts >= self.max_attempts:
+                    ok = await self._isolate(half, attempts, e) and ok
+                else:
+                    self._retry_at = time.monotonic() + _RETRY_SECONDS
+                    await asyncio.to_thread(self._spill, half, attempts)
+                    ok = False
+                continue
+            self.stats["written"] += len(half)
+            self.stats["batches"] += 1
+        return ok
+
+    async def flush(self) -> None:
+        """Write everything queued now, then replay one spill file if inserts are healthy."""
+        while self._queue:
+            if time.monotonic() < self._retry_at:
+                return  # still backing off; the queue absorbs new rows meanwhile
+            n = min(len(self._queue), self.batch_size)
+            batch = [self._queue.popleft() for _ in range(n)]
+            if not await self._write(batch):
+                return
+        if time.monotonic() >= self._retry_at and (self.spill_path.exists() or self.spill_path.with_suffix(self.spill_path.suffix + ".replay").exists()):
+            spilled = await asyncio.to_thread(self._take_spill)
+            # Rows that failed more often go last, so a poison batch cannot hold up the others
+            spilled.sort(key=lambda item: item[1])
+            for i in range(0, len(spilled), self.batch_size):
+                chunk = spilled[i:i + self.batch_size]
+                records = [record for record, _ in chunk]
+                try:
+                    ok = await self._write(records, max(a for _, a in chunk))
+                except asyncio.CancelledError:
+                    for record, a in spilled[i + self.batch_size:]:
+                        self._spill([record], a)
+                    raise
+                if not ok:
+                    rest = spilled[i + self.batch_size:]
+                    for a in sorted({a for _, a in rest}):
+                        await asyncio.to_thread(self._spill, [record for record, n in rest if n == a], a)
+                    return
+                self.stats["replayed"] += len(chunk)
+
+    async def run(self) -> None:
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        wake = self._wake
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(wake.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Event log flush error: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float = LOG_SHUTDOWN_SECONDS) -> None:
+        if self._task is not None:
+            # The flag ends the loop even if wait_for() swallows the cancel
+            # because the wake event fired at the same moment
+            self._stopping = True
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._spiller is not None:
+            await self._spiller
+            self._spiller = None
+        self._retry_at = 0.0
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except Exception as e:
+            print(f"Event log final flush incomplete: {e}")
+        records = list(self._queue) + self._overflow
+        self._queue.clear()
+        self._overflow = []
+        await asyncio.to_thread(self._spill, records)
+
+
+# Global instance
+log_writer = LogWriter()
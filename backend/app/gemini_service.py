@@ -1,28 +1,113 @@
 import os
 import json
-import re
-from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta
-import google.generativeai as genai
-from dotenv import load_dotenv
-
-load_dotenv()
+import threading
+import time
+from typing import Dict, Any, Optional
+from .schedule_compiler import compile_schedule
+from .services import registry
+from .telemetry import span
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
+GEMINI_CIRCUIT_FAILURES = int(os.getenv("GEMINI_CIRCUIT_FAILURES", "5"))  # consecutive failures that open it
+GEMINI_CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("GEMINI_CIRCUIT_COOLDOWN_SECONDS", "30"))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Stops calling an upstream after repeated failures, then retries one call after a cooldown.
+
+    closed: calls go through. open: calls fail fast with CircuitOpenError
+    (callers already fall back on any exception). half_open: the cooldown has
+    passed and one trial call is let through; success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, failures: int = GEMINI_CIRCUIT_FAILURES, cooldown_seconds: float = GEMINI_CIRCUIT_COOLDOWN_SECONDS):
+        self.threshold = failures
+        self.cooldown = cooldown_seconds
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self.last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half_open" and self._trial):
+                raise CircuitOpenError("Gemini unavailable (circuit open)")
+            if state == "half_open":
+                self._trial = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self, error: Exception) -> None:
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)[:200]
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+def _create_model():
+    # Deferred: google.generativeai (grpc, protobuf) takes about a second to import
+    import google.generativeai as genai
+    if GOOGLE_API_KEY:
+        genai.configure(api_key=GOOGLE_API_KEY)
+    return genai.GenerativeModel(
+        'gemini-1.5-flash',
+        generation_config={"response_mime_type": "application/json", "temperature": 0.2}
+    )
 
 
 class GeminiService:
     def __init__(self):
-        self.model_vision = genai.GenerativeModel(
-            'gemini-1.5-flash',
-            generation_config={"response_mime_type": "application/json", "temperature": 0.2}
-        )
-        self.model_text = genai.GenerativeModel(
-            'gemini-1.5-flash',
-            generation_config={"response_mime_type": "application/json", "temperature": 0.2}
-        )
+        self._vision = registry.register("gemini_vision", _create_model)
+        self._text = registry.register("gemini_text", _create_model)
+        self.circuit = CircuitBreaker()
+
+    @property
+    def model_vision(self):
+        return self._vision.get()
+
+    @model_vision.setter
+    def model_vision(self, model) -> None:
+        self._vision.override(model)
+
+    @property
+    def model_text(self):
+        return self._text.get()
+
+    @model_text.setter
+    def model_text(self, model) -> None:
+        self._text.override(model)
+
+    def _generate(self, model, op: str, contents):
+        self.circuit.before_call()
+        try:
+            with span("gemini", op):
+                response = model.generate_content(contents)
+        except Exception as e:
+            self.circuit.record_failure(e)
+            raise
+        self.circuit.record_success()
+        return response
 
     async def parse_voice_intent(self, voice_query: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         ctx_json = "{}"
@@ -55,7 +140,7 @@ Return JSON exactly in this shape:
 }}
 """
         try:
-            response = self.model_text.generate_content(prompt)
+            response = self._generate(self.model_text, "parse_intent", prompt)
             return json.loads(response.text)
         except Exception as e:
             return {
@@ -66,61 +151,7 @@ Return JSON exactly in this shape:
             }
 
     def _parse_frequency_and_times(self, instructions: str) -> Dict[str, Any]:
-        frequency_text: Optional[str] = None
-        times: List[str] = []
-        s = (instructions or "").lower()
-
-        if "once daily" in s or "qd" in s or "every day" in s or "daily" in s:
-            frequency_text = "Once daily"
-        elif "twice daily" in s or "bid" in s or re.search(r"morning.*evening|evening.*morning", s):
-            frequency_text = "Twice daily"
-        elif "three times" in s or "tid" in s:
-            frequency_text = "Three times daily"
-        elif "four times" in s or "qid" in s:
-            frequency_text = "Four times daily"
-        elif re.search(r"every\s+\d+\s+hours", s):
-            m = re.search(r"every\s+(\d+)\s+hours", s)
-            if m:
-                h = int(m.group(1))
-                frequency_text = f"Every {h} hours"
-        elif re.search(r"q\d+h", s):
-            m = re.search(r"q(\d+)h", s)
-            if m:
-                h = int(m.group(1))
-                frequency_text = f"Every {h} hours"
-
-        # explicit HH:MM
-        times += sorted(list({m for m in re.findall(r"\b(\d{1,2}:\d{2})\b", instructions or "")}))
-
-        if "morning" in s or "breakfast" in s:
-            times.append("08:00")
-        if "noon" in s or "lunch" in s:
-            times.append("12:00")
-        if "evening" in s or "dinner" in s:
-            times.append("18:00")
-        if "bedtime" in s or "night" in s:
-            times.append("21:00")
-
-        if frequency_text and not times:
-            if frequency_text == "Once daily":
-                times = ["09:00"]
-            elif frequency_text == "Twice daily":
-                times = ["09:00", "21:00"]
-            elif frequency_text == "Three times daily":
-                times = ["08:00", "14:00", "20:00"]
-            elif frequency_text == "Four times daily":
-                times = ["06:00", "12:00", "18:00", "00:00"]
-            elif frequency_text.startswith("Every"):
-                m = re.search(r"Every\s+(\d+)\s+hours", frequency_text)
-                if m:
-                    h = int(m.group(1))
-                    cur = datetime.strptime("08:00", "%H:%M")
-                    for _ in range(max(1, 24 // max(1, h))):
-                        times.append(cur.strftime("%H:%M"))
-                        cur += timedelta(hours=h)
-
-        times = sorted(list({t for t in times}))
-        return {"frequency_text": frequency_text, "times": times}
+        return compile_schedule(instructions).as_dict()
 
     async def extract_medication_from_label(self, image_data: bytes, mime_type: str) -> Dict[str, Any]:
         prompt_parts = [
@@ -136,7 +167,7 @@ Return JSON as {"medications": [...]} only.
 """
         ]
         try:
-            response = self.model_vision.generate_content(prompt_parts)
+            response = self._generate(self.model_vision, "label_extract", prompt_parts)
             raw = response.text.strip()
             if raw.startswith("```json") and raw.endswith("```"):
                 raw = raw[7:-3].strip()
@@ -181,7 +212,7 @@ Return JSON as {"medications": [...]} only.
         )
         payload = {"features": features}
         try:
-            response = self.model_text.generate_content([
+            response = self._generate(self.model_text, "risk_score", [
                 instruction,
                 {"text": json.dumps(payload)},
             ])
@@ -227,7 +258,7 @@ Return JSON as {"medications": [...]} only.
             "Keep it specific to the patterns in the data. No invented details. Output JSON only."
         )
         try:
-            response = self.model_text.generate_content([
+            response = self._generate(self.model_text, "risk_insights", [
                 instruction,
                 {"text": json.dumps(context)},
             ])
@@ -0,0 +1,180 @@
+import os
+import hashlib
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from fastapi import Request, Response
+
+from .event_hub import RESYNC
+
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Set only when exactly one worker process serves the API: then 304s need no EVENTS_PG_NOTIFY relay
+HTTP_CACHE_SINGLE_PROCESS = os.getenv("HTTP_CACHE_SINGLE_PROCESS", "false").lower() in ("1", "true", "yes")
+# Backstop for a relayed bump that never arrived (outbox full, NOTIFY lost); 0 = no bound
+HTTP_CACHE_MAX_STALE_SECONDS = int(os.getenv("HTTP_CACHE_MAX_STALE_SECONDS", "60"))
+
+# What a cached response depends on; writers bump the scopes they change
+PROFILE = "profile"
+MEDICATIONS = "medications"
+DOSES = "doses"
+
+_SIGNAL = "cache_bump"
+
+
+class Conditional(NamedTuple):
+    """Outcome of checking a request against the current version token."""
+
+    etag: str
+    headers: Dict[str, str]  # put these on the full response too
+    not_modified: bool
+
+    def response(self) -> Response:
+        return Response(status_code=304, headers=self.headers)
+
+
+class HttpCache:
+    """Per-user version tokens for ETag / If-None-Match on read endpoints.
+
+    Each user has a counter per scope (profile, medications, doses) that
+    writers bump. A read endpoint's ETag is a hash of the counters of the
+    scopes it depends on plus any request variant (e.g. the timezone times
+    are rendered in), so checking If-None-Match needs no database access and
+    a matching request gets 304 before any query runs.
+
+    Counters live in this process, so tags are only trustworthy while every
+    bump made elsewhere reaches it: conditional requests are answered only
+    while the EVENTS_PG_NOTIFY relay through app.event_hub is connected
+    (``shared``), or with HTTP_CACHE_SINGLE_PROCESS. Otherwise responses
+    carry no ETag and are always sent in full. When LISTEN reconnects the
+    nonce is renewed, as bumps made during the gap were missed; the same
+    per-process nonce keeps tags from before a restart (when counters start
+    over) from matching. HTTP_CACHE_MAX_STALE_SECONDS, folded into every
+    tag, bounds the damage of a single lost NOTIFY.
+
+    Responses that also go stale with time (the next dose, Gemini insights)
+    record an expiry with ``expire_at``; past it the tag changes.
+
+    Headers are ``Cache-Control: private, no-cache`` and ``Vary:
+    Authorization``: the browser keeps the response but revalidates on every
+    request, and shared caches never store it. frontend/public/sw.js passes
+    /api/ requests straight to the network, so these conditional requests
+    come from the browser's HTTP cache and the 304s never reach the service
+    worker's dynamic cache.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = HTTP_CACHE_ENABLED,
+        max_stale_seconds: int = HTTP_CACHE_MAX_STALE_SECONDS,
+        single_process: bool = HTTP_CACHE_SINGLE_PROCESS,
+    ):
+        self.enabled = enabled
+        self.max_stale_seconds = max_stale_seconds
+        self.single_process = single_process
+        self.nonce = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._versions: Dict[str, Dict[str, int]] = {}
+        self._everyone: Dict[str, int] = {}  # bumps that apply to every user (e.g. archiving)
+        self._expires: Dict[Tuple[str, str], float] = {}  # (user_id, route) -> epoch seconds
+        self._generation: Dict[Tuple[str, str], int] = {}
+        # event_hub.signal, which runs on_signal here and on the other workers; None = this process only
+        self.relay: Optional[Callable[[str, str, Any], None]] = None
+        # Whether bumps from every other worker currently reach this one (event_hub.relaying)
+        self.shared: Optional[Callable[[], bool]] = None
+        self.stats = {"not_modified": 0, "full": 0, "bumps": 0}
+
+    # ---------- writes ----------
+
+    def bump(self, user_id: Optional[str], *scopes: str) -> None:
+        """Invalidate the user's cached responses that depend on any of ``scopes``."""
+        if user_id:
+            self._send(user_id, scopes)
+
+    def bump_all(self, *scopes: str) -> None:
+        self._send("", scopes)
+
+    def _send(self, user_id: str, scopes: Tuple[str, ...]) -> None:
+        if self.relay is not None:
+            self.relay(user_id, _SIGNAL, list(scopes))
+        else:
+            self._bump(user_id, scopes)
+
+    def _bump(self, user_id: str, scopes: Iterable[str]) -> None:
+        with self._lock:
+            versions = self._versions.setdefault(user_id, {}) if user_id else self._everyone
+            for scope in scopes:
+                versions[scope] = versions.get(scope, 0) + 1
+            self.stats["bumps"] += 1
+
+    def on_signal(self, user_id: str, name: str, data: Any) -> None:
+        """event_hub signal hook: apply a bump made in this worker or another."""
+        if name == _SIGNAL and isinstance(data, list):
+            self._bump(user_id, data)
+        elif name == RESYNC:
+            self.nonce = uuid.uuid4().hex[:8]  # every tag handed out so far stops matching
+
+    def coherent(self) -> bool:
+        """Whether a tag from this process reflects writes made by every process."""
+        return self.single_process or (self.shared is not None and self.shared())
+
+    # ---------- reads ----------
+
+    def _tag(self, user_id: str, route: str, scopes: Tuple[str, ...], variant: str) -> str:
+        versions = self._versions.get(user_id, {})
+        parts = [self.nonce, user_id, route, variant, str(self._generation.get((user_id, route), 0))]
+        parts.extend(f"{versions.get(s, 0)}.{self._everyone.get(s, 0)}" for s in scopes)
+        if self.max_stale_seconds > 0:
+            parts.append(str(int(time.time() // self.max_stale_seconds)))
+        digest = hashlib.blake2b("|".join(parts).encode(), digest_size=12).hexdigest()
+        return f'W/"{digest}"'
+
+    def conditional(
+        self,
+        request: Optional[Request],
+        user_id: str,
+        route: str,
+        scopes: Tuple[str, ...],
+        variant: str = "",
+        vary: Tuple[str, ...] = (),
+    ) -> Conditional:
+        """Current tag for the user's view of ``route``, and whether the client already has it."""
+        if not self.enabled or request is None or not self.coherent():
+            return Conditional("", {}, False)
+        key = (user_id, route)
+        expires = self._expires.get(key)
+        if expires is not None and time.time() >= expires:
+            with self._lock:
+                self._generation[key] = self._generation.get(key, 0) + 1
+                self._expires.pop(key, None)
+        tag = self._tag(user_id, route, scopes, variant)
+        headers = {
+            "ETag": tag,
+            "Cache-Control": "private, no-cache",
+            "Vary": ", ".join(("Authorization",) + vary),
+        }
+        hit = _matches(request.headers.get("if-none-match"), tag)
+        self.stats["not_modified" if hit else "full"] += 1
+        return Conditional(tag, headers, hit)
+
+    def expire_at(self, user_id: str, route: str, at: Optional[float]) -> None:
+        """The response just built for ``route`` goes stale at ``at`` (epoch seconds) even without writes."""
+        if at is None:
+            self._expires.pop((user_id, route), None)
+        else:
+            self._expires[(user_id, route)] = at
+
+
+def _matches(header: Optional[str], tag: str) -> bool:
+    """Weak comparison of If-None-Match against our tag (RFC 9110 13.1.2)."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = tag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
+
+
+# Global instance
+http_cache = HttpCache()
@@ -1,21 +1,56 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request, Response
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime, time, timedelta
+from typing import Iterator, List, Optional, Tuple
+from datetime import date, datetime, time, timedelta, timezone
 import os
-from .security import verify_jwt
-from .database import get_db, supabase
+from contextlib import asynccontextmanager
+from . import IMPORT_STARTED
+from .security import verify_jwt, verify_jwt_or_query
+from .database import get_db, supabase, select_in, select_paged, SUPABASE_CONFIGURED
 from .models import User, Medication, MedTime, Dose, DoseStatus, UserRole
 from .gemini_service import gemini_service
 from .sns_service import sns_service
+from .reminder_service import reminder_dispatcher, REMINDERS_ENABLED
+from .dose_materializer import dose_materializer, DOSE_MATERIALIZER_ENABLED
+from .dose_archive import dose_archiver, DOSE_ARCHIVE_ENABLED
+from .event_log import log_writer
+from .telemetry import TimingMiddleware, metrics, METRICS_TOKEN
+from .compression import CompressionMiddleware, compression_stats
+from .services import registry, SERVICE_WARMUP
+from .http_cache import http_cache, PROFILE, MEDICATIONS, DOSES
+from .readiness import readiness
+from .profiler import profiler, slow_requests, ADMIN_TOKEN, PROFILE_MAX_SECONDS
+from .schedule_compiler import Recurrence, compile_schedule
+from .sms_reply_service import sms_reply_service, parse_inbound_payload, SMS_WEBHOOK_TOKEN
+from .alert_feed import alert_feed
+from .dose_history import DoseHistory, PENDING, SKIPPED, SNOOZED, MISSED, block_of, epoch_minute, top_blocks
+from .event_hub import event_hub, RESYNC
+from .caregiver_service import caregiver_service, record_daily_risk
+from .cohort_service import cohort_service, COHORT_REFRESH_ENABLED, COHORT_SORTS, COHORT_MAX_LIMIT, RISK_BUCKETS
+from .sync_service import sync_service, SYNC_MAX_MUTATIONS, SYNC_PRUNE_ENABLED
+from .timezones import is_valid_zone, local_instant, parse_instant, resolve_zone, to_local, to_local_iso, to_local_json
+from .fast_json import FastJSONResponse
 from sqlalchemy.orm import Session
 from typing import Dict, Any
 import io
 import csv
+import hmac
+import json
+import asyncio
+from collections import OrderedDict
+from time import monotonic, perf_counter
 
-app = FastAPI(title="PillPal API", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_background_jobs()
+    yield
+    await stop_background_jobs()
+
+
+app = FastAPI(title="PillPal API", version="0.1.0", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 origins = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
 
@@ -26,6 +61,49 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+# Outermost, so the Server-Timing total includes the other middleware
+app.add_middleware(TimingMiddleware)
+# ETag version bumps run through the event hub so other workers see them; without a live relay no 304s
+http_cache.relay = event_hub.signal
+http_cache.shared = lambda: event_hub.relaying
+event_hub.signal_hooks.append(http_cache.on_signal)
+
+
+async def start_background_jobs() -> None:
+    if SERVICE_WARMUP:
+        # Build clients and open their pools now rather than inside the first requests
+        registry.start_warmup()
+    event_hub.start()
+    slow_requests.start()
+    readiness.start()
+    if not SUPABASE_CONFIGURED:
+        return
+    log_writer.start()
+    if DOSE_MATERIALIZER_ENABLED:
+        dose_materializer.start()
+    if REMINDERS_ENABLED:
+        reminder_dispatcher.start()
+    if COHORT_REFRESH_ENABLED:
+        cohort_service.start()
+    if SYNC_PRUNE_ENABLED:
+        sync_service.start()
+    if DOSE_ARCHIVE_ENABLED:
+        dose_archiver.start()
+
+
+async def stop_background_jobs() -> None:
+    await reminder_dispatcher.stop()
+    await dose_materializer.stop()
+    await cohort_service.stop()
+    await sync_service.stop()
+    await dose_archiver.stop()
+    # After the jobs above, so their audit rows are flushed (or spilled)
+    await log_writer.stop()
+    await event_hub.stop()
+    slow_requests.stop()
+    await readiness.stop()
+    await registry.close()
 
 
 class IntentRequest(BaseModel):
@@ -46,12 +124,14 @@ class UserResponse(BaseModel):
     name: str
     role: UserRole
     phone_enc: Optional[str] = None
+    timezone: Optional[str] = None
     created_at: datetime
 
 class UserUpdate(BaseModel):
     name: Optional[str] = None
     role: Optional[UserRole] = None
     phone_enc: Optional[str] = None
+    timezone: Optional[str] = None  # IANA name, e.g. "America/New_York"
 
 class MedicationCreate(BaseModel):
     name: str
@@ -61,6 +141,15 @@ class MedicationCreate(BaseModel):
     times: List[str] = []  # ["08:00", "20:00"]
     frequency_text: Optional[str] = None
 
+class MedicationBatchItem(MedicationCreate):
+    client_key: str  # idempotency key, unique per user; retries return the same medication
+
+class MedicationBatch(BaseModel):
+    medications: List[MedicationBatchItem]
+
+class MedTimesUpdate(BaseModel):
+    times: List[str]  # replaces all times, e.g. ["08:00", "20:00"]
+
 class MedicationResponse(BaseModel):
     id: str
     name: str
@@ -71,6 +160,20 @@ class MedicationResponse(BaseModel):
     frequency_text: Optional[str] = None
     created_at: datetime
 
+class MedicationBatchResult(BaseModel):
+    client_key: str
+    result: str  # created | existing | rejected
+    detail: Optional[str] = None
+    medication: Optional[MedicationResponse] = None
+
+class MedicationBatchResponse(BaseModel):
+    created: int
+    existing: int
+    rejected: int
+    results: List[MedicationBatchResult]
+
+MEDICATION_BATCH_MAX_ITEMS = 100
+
 class DoseCreate(BaseModel):
     medication_id: str
     scheduled_at: datetime
@@ -90,12 +193,144 @@ class DoseUpdate(BaseModel):
     taken_at: Optional[datetime] = None
     notes: Optional[str] = None
 
+class BulkDoseItem(DoseUpdate):
+    id: str
+    expected_status: Optional[DoseStatus] = None  # apply only while the dose still has this status
+
+class BulkDoseUpdate(BaseModel):
+    items: List[BulkDoseItem]
+
+class BulkDoseResult(BaseModel):
+    id: str
+    result: str  # updated | conflict | not_found
+    dose: Optional[DoseResponse] = None  # new values when updated, current ones on conflict
+
+class BulkDoseResponse(BaseModel):
+    updated: int
+    conflicts: int
+    not_found: int
+    results: List[BulkDoseResult]
+
+BULK_DOSE_MAX_ITEMS = 500
+
+class SyncMutation(BaseModel):
+    key: str  # client idempotency key, unique per user
+    entity: str  # dose | medication
+    op: str  # update | delete
+    id: str
+    data: Dict[str, Any] = {}
+    expected_status: Optional[DoseStatus] = None  # doses only, as in the bulk update
+
+class SyncRequest(BaseModel):
+    cursor: Dict[str, int] = {}  # medications / med_times / doses / tombstones -> last version seen
+    mutations: List[SyncMutation] = []
+    limit: Optional[int] = None
+
+class SyncMutationResult(BaseModel):
+    key: str
+    entity: str
+    id: str
+    result: str  # updated | conflict | deleted | not_found | rejected
+    detail: Optional[str] = None
+    replayed: bool = False
+
+class SyncResponse(BaseModel):
+    cursor: Dict[str, int]
+    reset: bool
+    has_more: bool
+    medications: List[Dict[str, Any]]
+    med_times: List[Dict[str, Any]]
+    doses: List[Dict[str, Any]]
+    deleted: Dict[str, List[str]]
+    mutations: List[SyncMutationResult]
+
+SYNC_MEDICATION_FIELDS = ("name", "strength_text", "dose_text", "instructions")
+
 
 @app.get("/healthz")
 async def healthz() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/readyz")
+async def readyz(response: Response) -> dict:
+    """Dependency readiness from the background prober's last snapshot (503 when not ready).
+
+    Never calls an upstream itself; see app/readiness.py for what is probed and how often.
+    """
+    ready, body = readiness.status()
+    if not ready:
+        response.status_code = 503
+    return body
+
+
+@app.get("/metrics")
+async def prometheus_metrics(request: Request) -> Response:
+    """Request and upstream latency histograms in Prometheus text format (this worker only)."""
+    if METRICS_TOKEN:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(token, METRICS_TOKEN):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    body = metrics.render() + registry.render() + compression_stats.render()
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _require_admin(request: Request) -> None:
+    """Operator endpoints take the ADMIN_TOKEN bearer token, not a user JWT."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.post("/api/v1/admin/profile")
+async def profile_worker(request: Request, seconds: float = 10, interval_ms: float = 5, idle: bool = False) -> Response:
+    """Sample every thread of this worker for ``seconds`` and return folded stacks.
+
+    The body is flamegraph.pl / speedscope input ("frame;frame;frame count"
+    per line). Parked threads (select(), Condition.wait()) are left out
+    unless ``idle`` is set.
+    """
+    _require_admin(request)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS}")
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    try:
+        result = await asyncio.to_thread(profiler.run, seconds, max(interval_ms, 1) / 1000, idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(
+        "\n".join(result["stacks"]) + "\n",
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Profile-Ticks": str(result["ticks"]), "X-Profile-Interval-Ms": str(result["interval_ms"])},
+    )
+
+
+@app.get("/api/v1/admin/slow-requests")
+async def list_slow_requests(request: Request) -> dict:
+    """Most recent requests slower than SLOW_REQUEST_MS on this worker, newest first."""
+    _require_admin(request)
+    return {
+        "threshold_ms": slow_requests.threshold * 1000,
+        "enabled": slow_requests.enabled,
+        "requests": slow_requests.recent(),
+    }
+
+
+@app.get("/api/v1/admin/slow-requests/{entry_id}")
+async def get_slow_request(entry_id: int, request: Request, format: str = "json"):
+    """Span tree and stack samples of one slow request; ``format=folded`` returns only the stacks."""
+    _require_admin(request)
+    entry = slow_requests.get(entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Slow request not found (the buffer may have rotated)")
+    if format == "folded":
+        return Response("\n".join(entry["stacks"]) + "\n", media_type="text/plain; charset=utf-8")
+    return entry
+
+
 @app.post("/api/v1/intent", response_model=IntentResponse)
 async def parse_intent(body: IntentRequest, claims: dict = Depends(verify_jwt)):
     """Parse voice/text intent using Gemini AI"""
@@ -107,7 +342,7 @@ async def parse_intent(body: IntentRequest, claims: dict = Depends(verify_jwt)):
     try:
         meds = supabase.table("medications").select("id,name,strength_text,instructions").eq("user_id", user_id).execute()
         context["medications"] = meds.data or []
-        nd = supabase.rpc("exec_sql", {"sql": f"SELECT * FROM v_next_dose WHERE user_id = '{user_id}'"}).execute()
+        nd = supabase.rpc("next_doses", {"p_user_ids": [user_id]}).execute()
         if nd.data:
             context["next_dose"] = nd.data[0]
     except Exception:
@@ -125,10 +360,7 @@ async def parse_intent(body: IntentRequest, claims: dict = Depends(verify_jwt)):
         "gemini_output": result
     }
     
-    try:
-        supabase.table("intake_events").insert(intent_data).execute()
-    except Exception:
-        pass  # Don't fail the request if logging fails
+    log_writer.log("intake_events", intent_data)  # written in the background
     
     return IntentResponse(
         intent=result.get("intent", "unknown"),
@@ -169,10 +401,7 @@ async def label_extract(
             "gemini_output": result
         }
         
-        try:
-            supabase.table("intake_events").insert(intake_data).execute()
-        except Exception:
-            pass  # Don't fail the request if logging fails
+        log_writer.log("intake_events", intake_data)  # written in the background
         
         return {
             "success": True,
@@ -208,81 +437,55 @@ class RiskInsights(BaseModel):
     top_missed_block: Optional[str] = None
 
 
-async def _compute_features_for_user_today(user_id: str) -> Dict[str, Any]:
-    """Compute derived, non-PHI features from Supabase tables for the current user."""
-    now = datetime.utcnow()
-    start_today = datetime(now.year, now.month, now.day)
-    end_today = datetime(now.year, now.month, now.day, 23, 59, 59)
-
-    def _block(dt_iso: str) -> str:
-        try:
-            hh = int(dt_iso[11:13])
-        except Exception:
-            return "morning"
-        if 5 <= hh < 12:
-            return "morning"
-        if 12 <= hh < 17:
-            return "midday"
-        if 17 <= hh < 21:
-            return "evening"
-        return "night"
-
-    # Last 7 days doses
-    start7 = datetime.utcnow() - timedelta(days=6)
+def _load_dose_history(user_id: str, user_tz: str, first_day: date, days: int) -> DoseHistory:
+    """Doses from local midnight of first_day through the end of the following day
+    after the window, as a compact DoseHistory (one query, timestamps parsed once)."""
+    zone = resolve_zone(user_tz)
+    start = local_instant(first_day, time(0), zone)
+    end = local_instant(first_day + timedelta(days=days + 1), time(0), zone)
     try:
-        # Pull all doses for last 7 days
-        res7 = (
+        rows = (
             supabase
             .table("doses")
-            .select("id, scheduled_at, status, taken_at, medication_id")
+            .select("scheduled_at, status, taken_at, medication_id")
             .eq("user_id", user_id)
-            .gte("scheduled_at", start7.isoformat())
+            .gte("scheduled_at", start.isoformat())
+            .lt("scheduled_at", end.isoformat())
             .execute()
-        )
-        rows7 = res7.data or []
+        ).data or []
     except Exception:
-        rows7 = []
+        rows = []
+    return DoseHistory.from_rows(rows, user_tz)
 
-    taken7 = [r for r in rows7 if r.get("status") == "taken"]
-    adherence_7d = (len(taken7) / len(rows7)) if rows7 else 0.0
 
+async def _compute_features_for_user_today(user_id: str, history: Optional[DoseHistory] = None) -> Dict[str, Any]:
+    """Compute derived, non-PHI features from Supabase tables for the current user.
+
+    Days and time blocks are the user's local ones. Pass ``history`` to reuse an
+    already loaded 7-day DoseHistory.
+    """
+    user_tz = get_user_timezone(user_id)
+    zone = resolve_zone(user_tz)
+    now = datetime.now(timezone.utc)
+    now_min = epoch_minute(now)
+    today = now.astimezone(zone).date()
+    first_day = today - timedelta(days=6)
+    if history is None:
+        history = _load_dose_history(user_id, user_tz, first_day, 7)
+    today_start = history.local_day_start(today)
+    tomorrow_start = history.local_day_start(today + timedelta(days=1))
+
+    # Last 7 days (through the end of today)
+    adherence_7d = history.adherence(None, tomorrow_start) or 0.0
     # Streak: consecutive days with 100% adherence
-    streak_taken_days = 0
-    by_day: Dict[str, List[Dict[str, Any]]] = {}
-    for r in rows7:
-        dkey = (r["scheduled_at"] or "")[:10]
-        by_day.setdefault(dkey, []).append(r)
-    for i in range(0, 7):
-        d = (start7 + timedelta(days=i)).strftime("%Y-%m-%d")
-        day_rows = by_day.get(d, [])
-        if day_rows and all(rr.get("status") == "taken" for rr in day_rows):
-            streak_taken_days += 1
-        else:
-            streak_taken_days = 0
+    streak_taken_days = history.streak(first_day, 7)
 
     # Recent misses/snoozes
-    t48 = datetime.utcnow() - timedelta(hours=48)
-    misses_48h = len([
-        r for r in rows7
-        if r.get("status") in ("skipped", "missed") and (r.get("scheduled_at") or "") >= t48.isoformat()
-    ])
-    snoozes_24h = len([r for r in rows7 if r.get("status") == "snoozed" and (r.get("scheduled_at") or "") >= (datetime.utcnow() - timedelta(hours=24)).isoformat()])
+    misses_48h = history.count((SKIPPED, MISSED), now_min - 48 * 60)
+    snoozes_24h = history.count((SNOOZED,), now_min - 24 * 60)
 
     # Today doses
-    try:
-        today_res = (
-            supabase
-            .table("doses")
-            .select("id, scheduled_at, status, taken_at")
-            .eq("user_id", user_id)
-            .gte("scheduled_at", start_today.isoformat())
-            .lte("scheduled_at", end_today.isoformat())
-            .execute()
-        )
-        today_rows = today_res.data or []
-    except Exception:
-        today_rows = []
-    dose_count_today = len(today_rows)
+    dose_count_today = history.count(None, today_start, tomorrow_start)
 
     # Complexity: average distinct meds per day in last week
     try:
@@ -302,30 +505,10 @@ async def _compute_features_for_user_today(user_id: str) -> Dict[str, Any]:
     age_band = "unknown"
 
     # Last taken delta and time to next
-    last_taken_delta_min = None
-    time_to_next_min = None
-    try:
-        last_taken = max(
-            [r for r in rows7 if r.get("status") == "taken"],
-            key=lambda r: r.get("taken_at") or r.get("scheduled_at") or "",
-        ) if rows7 else None
-        if last_taken:
-            ts = last_taken.get("taken_at") or last_taken.get("scheduled_at")
-            if ts:
-                tdt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
-                last_taken_delta_min = int((datetime.utcnow() - tdt.replace(tzinfo=None)).total_seconds() // 60)
-    except Exception:
-        pass
-    try:
-        upcoming = min(
-            [r for r in rows7 if (r.get("status") in ("pending", "snoozed")) and r.get("scheduled_at")],
-            key=lambda r: r.get("scheduled_at"),
-        ) if rows7 else None
-        if upcoming and upcoming.get("scheduled_at"):
-            ndt = datetime.fromisoformat(upcoming["scheduled_at"].replace("Z", "+00:00"))
-            time_to_next_min = int((ndt.replace(tzinfo=None) - datetime.utcnow()).total_seconds() // 60)
-    except Exception:
-        pass
+    last_taken = history.last_taken_minute()
+    last_taken_delta_min = now_min - last_taken if last_taken is not None else None
+    upcoming = history.first_scheduled((PENDING, SNOOZED), now_min)
+    time_to_next_min = upcoming - now_min if upcoming is not None else None
 
     # Caregiver acknowledgments in 7d
     try:
@@ -333,15 +516,14 @@ async def _compute_features_for_user_today(user_id: str) -> Dict[str, Any]:
             supabase
             .table("alerts")
             .select("id, ack_at")
-            .gte("ack_at", start7.isoformat())
+            .gte("ack_at", local_instant(first_day, time(0), zone).isoformat())
             .execute()
         )
         caregiver_ack_7d = len(acks_res.data or [])
     except Exception:
         caregiver_ack_7d = 0
 
-    now_block = _block(datetime.utcnow().isoformat())
-    weekday = datetime.utcnow().weekday()
+    now_local = now.astimezone(zone)
 
     return {
         "adherence_7d": round(adherence_7d, 3),
@@ -349,8 +531,8 @@ async def _compute_features_for_user_today(user_id: str) -> Dict[str, Any]:
         "misses_48h": misses_48h,
         "snoozes_24h": snoozes_24h,
         "dose_count_today": dose_count_today,
-        "now_block": now_block,
-        "weekday": weekday,
+        "now_block": block_of(now_local),
+        "weekday": now_local.weekday(),
         "complexity": complexity,
         "age_band": age_band,
         "last_taken_delta_min": last_taken_delta_min,
@@ -359,7 +541,7 @@ async def _compute_features_for_user_today(user_id: str) -> Dict[str, Any]:
     }
 
 
-# ---------- Alerts feed (synthetic, event-style) ----------
+# ---------- Alerts feed (incremental, event-driven) ----------
 
 class AlertFeedItem(BaseModel):
     id: str
@@ -373,156 +555,139 @@ class AlertFeedItem(BaseModel):
 
 
 @app.get("/api/v1/alerts/feed", response_model=List[AlertFeedItem])
-async def alerts_feed(claims: dict = Depends(verify_jwt)):
-    """Return a live alerts feed generated from real data without requiring stored alerts.
+async def alerts_feed(claims: dict = Depends(verify_jwt), since: Optional[int] = None):
+    """Return the user's alerts feed, served from the incrementally maintained alert_feed.
 
     Includes:
     - Missed/overdue doses (pending past grace period)
     - Snoozed/taken dose events in the last 24h
     - Newly added medications in the last 24h
     - Adherence/risk warning if risk is high or score < 50
-    """
-    user_id = await get_or_create_user(claims)
-
-    now = datetime.utcnow()
-    start_24h = now - timedelta(hours=24)
-    grace_min = 10
-
-    items: List[AlertFeedItem] = []
-
-    # Fetch doses for last 2 days through next 60 minutes
-    try:
-        doses_res = (
-            supabase
-            .table("doses")
-            .select("id, medication_id, scheduled_at, status, taken_at")
-            .eq("user_id", user_id)
-            .gte("scheduled_at", (now - timedelta(days=2)).isoformat())
-            .lte("scheduled_at", (now + timedelta(hours=1)).isoformat())
-            .order("scheduled_at")
-            .execute()
-        )
-        doses = doses_res.data or []
-    except Exception:
-        doses = []
 
-    # Map med id -> name
-    med_names: Dict[str, str] = {}
-    try:
-        med_ids = sorted({d.get("medication_id") for d in doses if d.get("medication_id")})
-        if med_ids:
-            mres = supabase.table("medications").select("id,name,created_at").in_("id", med_ids).execute()
-            for m in mres.data or []:
-                med_names[m["id"]] = m.get("name") or "Medication"
-    except Exception:
-        pass
+    The X-Feed-Cursor response header carries a cursor; passing it back as
+    ``since`` returns only items added or changed after it, including items
+    whose status became "resolved" (e.g. a missed dose that was then taken).
+    """
+    items, cursor = await _alert_feed_items(claims, since)
+    return FastJSONResponse(items, headers={"X-Feed-Cursor": str(cursor)})
 
-    # Overdue pending doses (missed)
-    for d in doses:
-        try:
-            sched_iso = d.get("scheduled_at")
-            if not sched_iso:
-                continue
-            sched = datetime.fromisoformat(sched_iso.replace("Z", "+00:00")).replace(tzinfo=None)
-            mins_over = int((now - sched).total_seconds() // 60)
-            if d.get("status") == "pending" and mins_over > grace_min:
-                med = med_names.get(d.get("medication_id"), "Medication")
-                items.append(AlertFeedItem(
-                    id=d.get("id"),
-                    type="missed_dose",
-                    title="Missed Dose",
-                    message=f"{med} overdue by {mins_over} min",
-                    priority=("high" if mins_over >= 60 else ("medium" if mins_over >= 30 else "low")),
-                    createdAt=sched_iso,
-                    medicationName=med,
-                ))
-        except Exception:
-            continue
 
-    # Snoozed / Taken events within last 24h
-    for d in doses:
-        try:
-            status = d.get("status")
-            med = med_names.get(d.get("medication_id"), "Medication")
-            if status in ("snoozed", "taken"):
-                ts_iso = (d.get("taken_at") or d.get("scheduled_at"))
-                if not ts_iso:
-                    continue
-                tdt = datetime.fromisoformat(ts_iso.replace("Z", "+00:00")).replace(tzinfo=None)
-                if tdt >= start_24h:
-                    if status == "snoozed":
-                        items.append(AlertFeedItem(
-                            id=f"snoozed-{d.get('id')}",
-                            type="dose_snoozed",
-                            title="Dose Snoozed",
-                            message=f"{med} was snoozed",
-                            priority="low",
-                            createdAt=ts_iso,
-                            medicationName=med,
-                        ))
-                    else:
-                        items.append(AlertFeedItem(
-                            id=f"taken-{d.get('id')}",
-                            type="dose_taken",
-                            title="Dose Taken",
-                            message=f"{med} taken on time",
-                            priority="low",
-                            createdAt=ts_iso,
-                            medicationName=med,
-                        ))
-        except Exception:
-            continue
+async def _alert_feed_items(claims: dict, since: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+    """Feed items as dicts in AlertFeedItem's shape, plus the cursor."""
+    user_id = await get_or_create_user(claims)
+    user_tz = get_user_timezone(user_id)
 
-    # Newly added medications (24h)
+    # The feed never calls Gemini itself; the risk item comes from alert_feed.on_risk
+    # whenever /risk/today scores the user.
     try:
-        meds_new = (
-            supabase
-            .table("medications")
-            .select("id,name,created_at")
-            .eq("user_id", user_id)
-            .gte("created_at", start_24h.isoformat())
-            .execute()
-        )
-        for m in meds_new.data or []:
-            items.append(AlertFeedItem(
-                id=f"med-{m.get('id')}",
-                type="medication_added",
-                title="Medication Added",
-                message=f"Added {m.get('name')}",
-                priority="medium",
-                createdAt=m.get("created_at") or now.isoformat(),
-                medicationName=m.get("name") or "Medication",
-            ))
-    except Exception:
-        pass
-
-    # Risk/adherence warning
+        rows, cursor = alert_feed.read(user_id, since)
+    except Exception as e:
+        print(f"Alerts feed error: {e}")
+        rows, cursor = [], since or 0
+
+    # Feed items already have AlertFeedItem's shape; encode them without a model per row
+    items = [
+        {
+            "id": r["id"],
+            "type": r["type"],
+            "title": r["title"],
+            "message": r["message"],
+            "priority": r["priority"],
+            "status": r.get("status", "active"),
+            "createdAt": to_local_iso(r["createdAt"], user_tz),
+            "medicationName": r.get("medicationName"),
+        }
+        for r in rows
+    ]
+    return items, cursor
+
+
+# ---------- Live updates (server-sent events) ----------
+
+def _dose_changed(
+    user_id: str,
+    dose: Dict[str, Any],
+    medication_name: Optional[str] = None,
+    action: Optional[str] = None,
+    source: str = "api",
+) -> None:
+    """Fan a dose write out to the alerts feed, the user's open streams, cached responses and the audit log."""
+    alert_feed.on_dose_changed(user_id, dose, medication_name)
+    http_cache.bump(user_id, DOSES)
+    log_writer.audit(user_id, action or f"DOSE_{str(dose.get('status') or 'updated').upper()}", "dose", dose.get("id"), {
+        "medication_id": dose.get("medication_id"),
+        "scheduled_at": dose.get("scheduled_at"),
+        "taken_at": dose.get("taken_at"),
+        "source": source,
+    })
+    user_tz = get_user_timezone(user_id)
+    event_hub.publish(user_id, "dose", {
+        "id": dose.get("id"),
+        "medication_id": dose.get("medication_id"),
+        "medication_name": medication_name,
+        "scheduled_at": to_local_iso(dose["scheduled_at"], user_tz) if dose.get("scheduled_at") else None,
+        "status": dose.get("status"),
+        "taken_at": to_local_iso(dose["taken_at"], user_tz) if dose.get("taken_at") else None,
+    })
+
+
+def _publish_alert(user_id: str, item: Dict[str, Any]) -> None:
+    event_hub.publish(user_id, "alert", {**item, "createdAt": to_local_iso(item["createdAt"], get_user_timezone(user_id))})
+
+
+alert_feed.listeners.append(_publish_alert)
+# Overdue doses surface on the stream even when nobody polls the feed
+event_hub.tick_hooks.append(alert_feed.tick)
+
+
+@app.get("/api/v1/stream")
+async def event_stream(request: Request, claims: dict = Depends(verify_jwt_or_query)):
+    """Server-sent events: "dose", "alert" and "risk" updates for the current user.
+
+    Browsers' EventSource resends the last id in Last-Event-ID on reconnect and
+    buffered events after it are replayed. A "resync" event means events were
+    dropped and the client should refetch. The token may be passed as
+    ?access_token= because EventSource cannot set headers.
+    """
+    user_id = await get_or_create_user(claims)
+    # Materialize the feed so its changes are published from now on
     try:
-        r = await risk_today(claims)
-        if r.score_0_100 < 50 or r.bucket == "high":
-            items.append(AlertFeedItem(
-                id=f"risk-{now.strftime('%Y%m%d%H%M')}",
-                type="adherence_warning",
-                title="Adherence Risk",
-                message=f"Risk {r.bucket} ({r.score_0_100})",
-                priority=("high" if r.bucket == "high" else "medium"),
-                createdAt=now.isoformat(),
-            ))
+        alert_feed.read(user_id)
     except Exception:
         pass
+    last_id = request.headers.get("Last-Event-ID") or request.query_params.get("lastEventId")
+    sub = event_hub.subscribe(user_id, int(last_id) if last_id and last_id.isdigit() else None)
+    return StreamingResponse(
+        event_hub.stream(sub),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    # Sort newest first
-    try:
-        items.sort(key=lambda x: x.createdAt, reverse=True)
-    except Exception:
-        pass
 
-    return items
+RISK_CACHE_TTL_SECONDS = int(os.getenv("RISK_CACHE_TTL_SECONDS", "900"))
+RISK_CACHE_MAX_USERS = int(os.getenv("RISK_CACHE_MAX_USERS", "10000"))
+_risk_cache: "OrderedDict[str, Tuple[float, RiskOut]]" = OrderedDict()  # user_id -> (expires monotonic, RiskOut), LRU
 
 
 @app.get("/api/v1/risk/today", response_model=RiskOut)
 async def risk_today(claims: dict = Depends(verify_jwt)):
     user_id = await get_or_create_user(claims)
+    cached = _risk_cache.get(user_id)
+    if cached and cached[0] > monotonic():
+        _risk_cache.move_to_end(user_id)
+        return cached[1]
+    risk = await _score_risk_today(user_id)
+    _risk_cache[user_id] = (monotonic() + RISK_CACHE_TTL_SECONDS, risk)
+    _risk_cache.move_to_end(user_id)
+    while len(_risk_cache) > RISK_CACHE_MAX_USERS:
+        _risk_cache.popitem(last=False)
+    record_daily_risk(user_id, risk.score_0_100)
+    alert_feed.on_risk(user_id, risk.score_0_100, risk.bucket)
+    event_hub.publish(user_id, "risk", risk.model_dump())
+    return risk
+
+
+async def _score_risk_today(user_id: str) -> RiskOut:
     features = await _compute_features_for_user_today(user_id)
     # Ask Gemini
     result = await gemini_service.score_adherence_risk(features)
@@ -560,73 +725,47 @@ async def risk_today(claims: dict = Depends(verify_jwt)):
 
 
 @app.get("/api/v1/risk/insights", response_model=RiskInsights)
-async def risk_insights(claims: dict = Depends(verify_jwt)):
+async def risk_insights(request: Request, response: Response, claims: dict = Depends(verify_jwt)):
     user_id = await get_or_create_user(claims)
-    features = await _compute_features_for_user_today(user_id)
+    user_tz = get_user_timezone(user_id)
+    # Also stale after the risk cache TTL: the features move with the clock, and a new card costs a Gemini call
+    cond = http_cache.conditional(request, user_id, "risk_insights", (DOSES, MEDICATIONS), variant=user_tz)
+    if cond.not_modified:
+        return cond.response()
+    insights = await _risk_insights(claims)
+    response.headers.update(cond.headers)
+    http_cache.expire_at(user_id, "risk_insights", datetime.now(timezone.utc).timestamp() + RISK_CACHE_TTL_SECONDS)
+    return insights
+
+
+async def _risk_insights(claims: dict) -> RiskInsights:
+    """The insights card, also sent in the SMS summary."""
+    user_id = await get_or_create_user(claims)
+    user_tz = get_user_timezone(user_id)
+    today = datetime.now(timezone.utc).astimezone(resolve_zone(user_tz)).date()
+    first_day = today - timedelta(days=6)
+    # One load shared by the features and the series/histograms below
+    history = _load_dose_history(user_id, user_tz, first_day, 7)
+    features = await _compute_features_for_user_today(user_id, history)
 
     # Build 7-day adherence series
-    now = datetime.utcnow()
-    start7 = now - timedelta(days=6)
-    try:
-        res7 = (
-            supabase
-            .table("doses")
-            .select("id, scheduled_at, status")
-            .eq("user_id", user_id)
-            .gte("scheduled_at", start7.isoformat())
-            .execute()
-        )
-        rows7 = res7.data or []
-    except Exception:
-        rows7 = []
-
-    series = []
-    for i in range(6, -1, -1):
-        day = datetime(now.year, now.month, now.day) - timedelta(days=i)
-        d0 = day
-        d1 = day + timedelta(hours=23, minutes=59, seconds=59)
-        day_rows = [r for r in rows7 if (r.get("scheduled_at") or "") >= d0.isoformat() and (r.get("scheduled_at") or "") <= d1.isoformat()]
-        if day_rows:
-            taken = len([r for r in day_rows if r.get("status") == "taken"]) 
-            series.append({"date": day.strftime("%Y-%m-%d"), "adherence": int(round(100 * taken / len(day_rows)))})
-        else:
-            series.append({"date": day.strftime("%Y-%m-%d"), "adherence": 0})
-
-    # Identify top snooze windows (rough bins)
-    def _bin(ts: str) -> str:
-        try:
-            hh = int(ts[11:13])
-        except Exception:
-            return "morning"
-        if 5 <= hh < 12: return "morning"
-        if 12 <= hh < 17: return "midday"
-        if 17 <= hh < 21: return "evening"
-        return "night"
+    taken, total = history.daily_counts(first_day, 7)
+    series = [
+        {
+            "date": (first_day + timedelta(days=i)).isoformat(),
+            "adherence": int(round(100 * taken[i] / total[i])) if total[i] else 0,
+        }
+        for i in range(7)
+    ]
 
-    try:
-        snoozes = [r for r in rows7 if r.get("status") == "snoozed" and r.get("scheduled_at")]
-        from collections import Counter
-        bins = Counter(_bin(s.get("scheduled_at")) for s in snoozes)
-        top_snooze_windows = [b for b,_ in bins.most_common(3)]
-    except Exception:
-        top_snooze_windows = []
-        snoozes = []
-
-    # Miss counts and most-missed block (rough) for last 7 days
-    try:
-        misses = [
-            r for r in rows7
-            if r.get("status") in ("skipped", "missed") and r.get("scheduled_at")
-        ]
-        from collections import Counter
-        miss_bins = Counter(_bin(m.get("scheduled_at")) for m in misses)
-        top_miss_block = miss_bins.most_common(1)[0][0] if miss_bins else None
-        misses_7d = len(misses)
-        snoozes_7d = len(snoozes)
-    except Exception:
-        top_miss_block = None
-        misses_7d = None
-        snoozes_7d = None
+    # Top snooze windows and most-missed block (local time blocks) for the window
+    window_end = history.local_day_start(today + timedelta(days=1))
+    snooze_bins = history.block_histogram((SNOOZED,), None, window_end)
+    miss_bins = history.block_histogram((SKIPPED, MISSED), None, window_end)
+    top_snooze_windows = top_blocks(snooze_bins, 3)
+    top_miss_block = (top_blocks(miss_bins, 1) or [None])[0]
+    misses_7d = sum(miss_bins.values())
+    snoozes_7d = sum(snooze_bins.values())
 
     context = {
         "features": features,
@@ -644,14 +783,14 @@ async def risk_insights(claims: dict = Depends(verify_jwt)):
 
     # Light-touch alerts context: summarize counts only to avoid overweighting
     try:
-        recent_alerts = await alerts_feed(claims)  # reuse synthesized feed
+        recent_alerts, _ = await _alert_feed_items(claims)  # reuse synthesized feed
         from collections import Counter
-        type_counts = Counter(a.type for a in recent_alerts)
-        priority_counts = Counter(getattr(a, "priority", "low") for a in recent_alerts)
+        type_counts = Counter(a["type"] for a in recent_alerts)
+        priority_counts = Counter(a.get("priority", "low") for a in recent_alerts)
         context["alerts_summary"] = {
             "counts_by_type": dict(type_counts),
             "high_priority": int(priority_counts.get("high", 0)),
-            "recent_titles": [a.title for a in recent_alerts[:5]],
+            "recent_titles": [a["title"] for a in recent_alerts[:5]],
         }
     except Exception:
         context["alerts_summary"] = {"counts_by_type": {}, "high_priority": 0, "recent_titles": []}
@@ -673,15 +812,22 @@ async def risk_insights(claims: dict = Depends(verify_jwt)):
 def get_current_user_id(claims: dict) -> str:
     return claims.get("sub", "")
 
+# auth0 sub -> user id; ids never change, so conditional requests can be answered without a lookup
+_user_ids: Dict[str, str] = {}
+
 async def get_or_create_user(claims: dict) -> str:
     """Get user ID, creating user if doesn't exist"""
     auth0_sub = claims.get("sub", "")
+    cached = _user_ids.get(auth0_sub)
+    if cached is not None:
+        return cached
     name = claims.get("name", claims.get("nickname", "Unknown User"))
     
     # Check if user exists
     result = supabase.table("users").select("id").eq("auth0_sub", auth0_sub).execute()
     
     if result.data:
+        _user_ids[auth0_sub] = result.data[0]["id"]
         return result.data[0]["id"]
     
     # Create new user (default to patient role)
@@ -692,13 +838,77 @@ async def get_or_create_user(claims: dict) -> str:
     }
     
     result = supabase.table("users").insert(user_data).execute()
+    _user_ids[auth0_sub] = result.data[0]["id"]
     return result.data[0]["id"]
 
 
+# user_id -> (expires monotonic, stored timezone) from the X-User-Timezone header or PATCH /user/me.
+# A change is signalled to every worker; the TTL bounds staleness if a signal is lost.
+USER_TIMEZONE_TTL_SECONDS = int(os.getenv("USER_TIMEZONE_TTL_SECONDS", "300"))
+_USER_TIMEZONE_SIGNAL = "timezone"
+_user_timezones: Dict[str, Tuple[float, str]] = {}
+
+def _cache_user_timezone(user_id: str, tz_name: str) -> None:
+    _user_timezones[user_id] = (monotonic() + USER_TIMEZONE_TTL_SECONDS, tz_name)
+
+def _cached_user_timezone(user_id: str) -> Optional[str]:
+    cached = _user_timezones.get(user_id)
+    if cached is None or cached[0] <= monotonic():
+        return None
+    return cached[1]
+
+def _user_timezone_changed(user_id: str, tz_name: str) -> None:
+    """Cache the new zone in this worker and, through the signal, in every other one."""
+    _cache_user_timezone(user_id, tz_name)
+    event_hub.signal(user_id, _USER_TIMEZONE_SIGNAL, tz_name)
+
+def _on_timezone_signal(user_id: str, name: str, data: Any) -> None:
+    """event_hub signal hook: a user's timezone changed in some worker."""
+    if name == _USER_TIMEZONE_SIGNAL:
+        if isinstance(data, str):
+            _cache_user_timezone(user_id, data)
+        else:
+            _user_timezones.pop(user_id, None)
+    elif name == RESYNC:
+        _user_timezones.clear()  # changes may have been missed while LISTEN was down
+
+event_hub.signal_hooks.append(_on_timezone_signal)
+
+def get_user_timezone(user_id: str, header_tz: Optional[str] = None) -> str:
+    """Resolve the zone to render times in: request header, then stored value, then UTC."""
+    if header_tz and is_valid_zone(header_tz):
+        remember_user_timezone(user_id, header_tz)
+        return header_tz
+    tz_name = _cached_user_timezone(user_id)
+    if tz_name is None:
+        try:
+            res = supabase.table("users").select("timezone").eq("id", user_id).execute()
+            tz_name = (res.data[0].get("timezone") if res.data else None) or "UTC"
+        except Exception:
+            tz_name = "UTC"
+        _cache_user_timezone(user_id, tz_name)
+    return tz_name
+
+def remember_user_timezone(user_id: str, tz_name: Optional[str]) -> None:
+    """Store the client's X-User-Timezone on the user so background jobs (reminders) can use it."""
+    if not tz_name or not is_valid_zone(tz_name) or get_user_timezone(user_id) == tz_name:
+        return
+    try:
+        supabase.table("users").update({"timezone": tz_name}).eq("id", user_id).execute()
+        _user_timezone_changed(user_id, tz_name)
+        http_cache.bump(user_id, PROFILE)
+    except Exception:
+        pass  # Column may be missing on older schemas
+
+
 # User management endpoints
 @app.get("/api/v1/user/me", response_model=UserResponse)
-async def get_current_user(claims: dict = Depends(verify_jwt)):
+async def get_current_user(request: Request, response: Response, claims: dict = Depends(verify_jwt)):
     user_id = await get_or_create_user(claims)
+    cond = http_cache.conditional(request, user_id, "user_me", (PROFILE,))
+    if cond.not_modified:
+        return cond.response()
+    response.headers.update(cond.headers)
     
     result = supabase.table("users").select("*").eq("id", user_id).execute()
     user = result.data[0]
@@ -709,6 +919,7 @@ async def get_current_user(claims: dict = Depends(verify_jwt)):
         name=user["name"],
         role=user["role"],
         phone_enc=user.get("phone_enc"),
+        timezone=user.get("timezone"),
         created_at=user["created_at"]
     )
 
@@ -719,6 +930,11 @@ async def update_current_user(update: UserUpdate, claims: dict = Depends(verify_
     if update.name is not None:
         update_data["name"] = update.name
     if update.role is not None:
+        if update.role == UserRole.CLINICIAN:
+            # Clinician accounts are provisioned server-side (they see patient panels)
+            current = (supabase.table("users").select("role").eq("id", user_id).execute().data or [{}])[0].get("role")
+            if current != UserRole.CLINICIAN.value:
+                raise HTTPException(status_code=403, detail="Clinician role cannot be self-assigned")
         update_data["role"] = update.role.value
     if update.phone_enc is not None:
         # Accept E.164-like strings; light validation only
@@ -727,6 +943,10 @@ async def update_current_user(update: UserUpdate, claims: dict = Depends(verify_
             update_data["phone_enc"] = None
         else:
             update_data["phone_enc"] = pe
+    if update.timezone is not None:
+        if not is_valid_zone(update.timezone):
+            raise HTTPException(status_code=400, detail="Unknown timezone")
+        update_data["timezone"] = update.timezone.strip()
     if not update_data:
         # No-op, return current
         result = supabase.table("users").select("*").eq("id", user_id).execute()
@@ -736,34 +956,175 @@ async def update_current_user(update: UserUpdate, claims: dict = Depends(verify_
         )
     result = supabase.table("users").update(update_data).eq("id", user_id).execute()
     user = result.data[0]
+    http_cache.bump(user_id, PROFILE)
+    if user.get("timezone"):
+        if "timezone" in update_data:
+            _user_timezone_changed(user_id, user["timezone"])
+        else:
+            _cache_user_timezone(user_id, user["timezone"])
+    if "phone_enc" in update_data:
+        sms_reply_service.phone_index.set(user_id, update_data["phone_enc"])
     return UserResponse(
         id=user["id"], auth0_sub=user["auth0_sub"], name=user["name"], role=user["role"], created_at=user["created_at"]
     )
 
 @app.get("/api/v1/user/next-dose")
-async def get_next_dose(claims: dict = Depends(verify_jwt)):
+async def get_next_dose(request: Request, response: Response, claims: dict = Depends(verify_jwt)):
     user_id = await get_or_create_user(claims)
+    cond = http_cache.conditional(request, user_id, "next_dose", (DOSES, MEDICATIONS))
+    if cond.not_modified:
+        return cond.response()
+    response.headers.update(cond.headers)
     
-    # Use the view created in schema
-    result = supabase.rpc("exec_sql", {
-        "sql": f"SELECT * FROM v_next_dose WHERE user_id = '{user_id}'"
-    }).execute()
+    # next_doses() joins the medication name (see supabase/final_schema.sql)
+    result = supabase.rpc("next_doses", {"p_user_ids": [user_id]}).execute()
     
     if result.data and len(result.data) > 0:
         dose_data = result.data[0]
-        # Get medication name
-        med_result = supabase.table("medications").select("name").eq("id", dose_data["medication_id"]).execute()
-        med_name = med_result.data[0]["name"] if med_result.data else "Unknown"
-        
+        # Once it is due, a later dose becomes the next one without any write
+        http_cache.expire_at(user_id, "next_dose", parse_instant(dose_data["scheduled_at"]).timestamp())
         return {
             "dose_id": dose_data["dose_id"],
-            "medication_name": med_name,
+            "medication_name": dose_data.get("medication_name") or "Unknown",
             "scheduled_at": dose_data["scheduled_at"]
         }
     
+    http_cache.expire_at(user_id, "next_dose", None)
     return {"message": "No pending doses"}
 
 
+class CaregiverPatientSummary(BaseModel):
+    patient_id: str
+    name: str
+    timezone: str
+    next_dose_at: Optional[str] = None
+    next_medication: Optional[str] = None
+    adherence_7d: Optional[float] = None
+    taken_7d: int = 0
+    due_7d: int = 0
+    overdue_count: int = 0
+    risk_score: Optional[int] = None
+    risk_bucket: Optional[str] = None
+    risk_date: Optional[str] = None
+
+
+class CaregiverSummary(BaseModel):
+    count: int
+    patients: List[CaregiverPatientSummary]
+
+
+@app.get("/api/v1/caregiver/patients/summary", response_model=CaregiverSummary)
+async def caregiver_patients_summary(claims: dict = Depends(verify_jwt)):
+    """One-call dashboard for every patient linked to the current caregiver.
+
+    Next dose (in the patient's timezone), 7-day adherence, overdue count and
+    the latest stored risk score; patients with overdue doses come first.
+    """
+    user_id = await get_or_create_user(claims)
+    try:
+        patients = await caregiver_service.patients_summary(user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load patients: {e}")
+    return CaregiverSummary(count=len(patients), patients=[CaregiverPatientSummary(**p) for p in patients])
+
+
+class CohortPatient(BaseModel):
+    user_id: str
+    name: str
+    taken_7d: int = 0
+    due_7d: int = 0
+    skipped_7d: int = 0
+    snoozed_7d: int = 0
+    adherence_7d: Optional[float] = None
+    worst_block: Optional[str] = None
+    medications: int = 0
+    risk_score: Optional[int] = None
+    risk_bucket: Optional[str] = None
+    last_taken_day: Optional[str] = None
+    refreshed_at: Optional[str] = None
+
+
+class CohortTrendPoint(BaseModel):
+    day: str
+    taken: int
+    due: int
+    patients: int
+    adherence: Optional[float] = None
+
+
+class CohortPage(BaseModel):
+    total: int
+    offset: int
+    limit: int
+    sort: str
+    order: str
+    total_patients: int
+    avg_adherence: Optional[float] = None
+    risk_counts: Dict[str, int]
+    trend: List[CohortTrendPoint]
+    patients: List[CohortPatient]
+
+
+@app.get("/api/v1/clinician/cohort", response_model=CohortPage)
+async def clinician_cohort(
+    sort: str = "adherence",
+    order: str = "asc",
+    risk: Optional[str] = None,
+    q: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 50,
+    claims: dict = Depends(verify_jwt),
+):
+    """Adherence page for the clinician's linked patients, from precomputed rollups.
+
+    sort: adherence | risk | name | last_taken; order: asc | desc;
+    risk: comma-separated buckets (low,medium,high); q: name substring.
+    """
+    user_id = await get_or_create_user(claims)
+    role = (supabase.table("users").select("role").eq("id", user_id).execute().data or [{}])[0].get("role")
+    if role != UserRole.CLINICIAN.value:
+        raise HTTPException(status_code=403, detail="Clinician role required")
+    if sort not in COHORT_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(COHORT_SORTS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    buckets = [b.strip().lower() for b in (risk or "").split(",") if b.strip()]
+    if any(b not in RISK_BUCKETS for b in buckets):
+        raise HTTPException(status_code=400, detail="risk must be low, medium and/or high")
+    offset = max(offset, 0)
+    limit = min(max(limit, 1), COHORT_MAX_LIMIT)
+
+    rows, total = cohort_service.page(user_id, sort, order == "desc", buckets, q, offset, limit)
+    summary = cohort_service.summary(user_id)
+    return CohortPage(
+        total=total,
+        offset=offset,
+        limit=limit,
+        sort=sort,
+        order=order,
+        total_patients=summary["total_patients"],
+        avg_adherence=summary["avg_adherence"],
+        risk_counts=summary["risk_counts"],
+        trend=[CohortTrendPoint(**{**t, "day": str(t["day"])}) for t in summary["trend"]],
+        patients=[
+            CohortPatient(**{
+                **r,
+                "last_taken_day": str(r["last_taken_day"]) if r.get("last_taken_day") else None,
+                "refreshed_at": str(r["refreshed_at"]) if r.get("refreshed_at") else None,
+            })
+            for r in rows
+        ],
+    )
+
+
+def _materialize_doses(medication_ids: List[str]) -> None:
+    """Generate upcoming doses right away instead of waiting for the next materializer run."""
+    try:
+        dose_materializer.materialize_medications(medication_ids)
+    except Exception as e:
+        print(f"Dose materialization failed for {medication_ids}: {e}")
+
+
 # Medications endpoints
 @app.post("/api/v1/medications", response_model=MedicationResponse)
 async def create_medication(
@@ -771,11 +1132,17 @@ async def create_medication(
     claims: dict = Depends(verify_jwt)
 ):
     user_id = await get_or_create_user(claims)
+    # Explicit times win; otherwise derive them from the sig text
+    schedule = Recurrence.from_times(t for t in med.times if isinstance(t, str) and t)
+    if not schedule.minutes:
+        schedule = compile_schedule(med.instructions or med.frequency_text)
     # Basic validation to avoid 500s from DB
-    if not med.name or not isinstance(med.times, list) or len([t for t in med.times if t]) == 0:
+    if not med.name or not schedule.minutes:
         raise HTTPException(status_code=400, detail="name and at least one time are required")
 
-    med_times_clean = [t for t in med.times if isinstance(t, str) and t]
+    med_times_clean = schedule.times
+    if not med.frequency_text and schedule.frequency_text:
+        med.frequency_text = schedule.frequency_text
 
     med_data = {
         "user_id": user_id,
@@ -803,6 +1170,10 @@ async def create_medication(
             # Supabase client raises on error; if no data returned, consider it a failure
             if not getattr(t_res, "data", None):
                 raise Exception("Insert med_times failed: no data returned")
+        _materialize_doses([medication["id"]])
+        alert_feed.on_medication_added(user_id, medication)
+        http_cache.bump(user_id, MEDICATIONS)
+        log_writer.audit(user_id, "MED_CREATED", "med", medication["id"], {"name": medication["name"], "times": med_times_clean})
 
         return MedicationResponse(
             id=medication["id"],
@@ -828,12 +1199,15 @@ async def create_medication(
             medication = result2.data[0]
 
             # Add times
-            med_times_clean = [t for t in med.times if isinstance(t, str) and t]
             if med_times_clean:
                 supabase.table("med_times").insert([
                     {"medication_id": medication["id"], "time_of_day": t}
                     for t in med_times_clean
                 ]).execute()
+            _materialize_doses([medication["id"]])
+            alert_feed.on_medication_added(user_id, medication)
+            http_cache.bump(user_id, MEDICATIONS)
+            log_writer.audit(user_id, "MED_CREATED", "med", medication["id"], {"name": medication["name"], "times": med_times_clean})
 
             return MedicationResponse(
                 id=medication["id"],
@@ -849,9 +1223,138 @@ async def create_medication(
             raise HTTPException(status_code=500, detail=f"Create medication failed: {str(e2)}")
 
 
+def _insert_medications_once(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """INSERT ... ON CONFLICT (user_id, client_key) DO NOTHING; returns only new rows.
+
+    Retries without frequency_text for schemas that lack the column; the
+    conflict target makes the retry (and any client retry) safe.
+    """
+    try:
+        return supabase.table("medications").upsert(
+            rows, on_conflict="user_id,client_key", ignore_duplicates=True
+        ).execute().data or []
+    except Exception as e:
+        print(f"medications batch insert failed, retrying without frequency_text: {e}")
+        minimal = [{k: v for k, v in r.items() if k != "frequency_text"} for r in rows]
+        return supabase.table("medications").upsert(
+            minimal, on_conflict="user_id,client_key", ignore_duplicates=True
+        ).execute().data or []
+
+
+@app.post("/api/v1/medications/batch", response_model=MedicationBatchResponse)
+async def create_medications_batch(body: MedicationBatch, claims: dict = Depends(verify_jwt)):
+    """Create many medications (e.g. from a label-extract result) safely under retries.
+
+    Each item carries a ``client_key``. Medications are inserted in one
+    statement that skips keys the user already has, and all their med_times in
+    a second one; a retried batch reports those items as "existing" (adding
+    times that a failed earlier attempt did not write) instead of duplicating
+    them. Doses are materialized once for the whole batch.
+    """
+    user_id = await get_or_create_user(claims)
+    if len(body.medications) > MEDICATION_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MEDICATION_BATCH_MAX_ITEMS} medications per batch")
+
+    results: Dict[str, MedicationBatchResult] = {}
+    wanted: Dict[str, Dict[str, Any]] = {}  # client_key -> {"row": ..., "times": [...]}
+    for med in body.medications:
+        key = med.client_key.strip()
+        if not key:
+            continue
+        schedule = Recurrence.from_times(t for t in med.times if isinstance(t, str) and t)
+        if not schedule.minutes:
+            schedule = compile_schedule(med.instructions or med.frequency_text)
+        if not med.name or not schedule.minutes:
+            results[key] = MedicationBatchResult(client_key=key, result="rejected", detail="name and at least one time are required")
+            wanted.pop(key, None)
+            continue
+        results.pop(key, None)
+        wanted[key] = {
+            "row": {
+                "user_id": user_id,
+                "client_key": key,
+                "name": med.name,
+                "strength_text": med.strength_text,
+                "dose_text": med.dose_text,
+                "instructions": med.instructions,
+                "frequency_text": med.frequency_text or schedule.frequency_text,
+            },
+            "times": schedule.times,
+        }
+
+    created: Dict[str, Dict[str, Any]] = {}
+    existing: Dict[str, Dict[str, Any]] = {}
+    existing_times: Dict[str, List[str]] = {}
+    if wanted:
+        try:
+            created = {m["client_key"]: m for m in _insert_medications_once([w["row"] for w in wanted.values()])}
+            retried = [k for k in wanted if k not in created]
+            if retried:
+                existing = {
+                    m["client_key"]: m
+                    for m in select_in("medications", "*", "client_key", retried, refine=lambda q: q.eq("user_id", user_id))
+                }
+                for t in select_in("med_times", "medication_id, time_of_day", "medication_id", [m["id"] for m in existing.values()]):
+                    existing_times.setdefault(t["medication_id"], []).append(t["time_of_day"])
+
+            # Second statement: times for new medications, and for earlier attempts that stopped short
+            times_rows = [
+                {"medication_id": med["id"], "time_of_day": t}
+                for key, med in [*created.items(), *existing.items()]
+                if key in created or med["id"] not in existing_times
+                for t in wanted[key]["times"]
+            ]
+            if times_rows:
+                supabase.table("med_times").upsert(
+                    times_rows, on_conflict="medication_id,time_of_day", ignore_duplicates=True
+                ).execute()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Create medications failed: {str(e)}")
+
+        touched = [m["id"] for m in created.values()] + [m["id"] for m in existing.values() if m["id"] not in existing_times]
+        if touched:
+            _materialize_doses(touched)
+            http_cache.bump(user_id, MEDICATIONS)
+        for med in created.values():
+            alert_feed.on_medication_added(user_id, med)
+            log_writer.audit(user_id, "MED_CREATED", "med", med["id"], {"name": med["name"], "client_key": med.get("client_key")})
+
+    for key, w in wanted.items():
+        med = created.get(key) or existing.get(key)
+        if med is None:
+            results[key] = MedicationBatchResult(client_key=key, result="rejected", detail="not stored")
+            continue
+        times = sorted(existing_times.get(med["id"]) or w["times"])
+        results[key] = MedicationBatchResult(
+            client_key=key,
+            result="created" if key in created else "existing",
+            medication=MedicationResponse(
+                id=med["id"],
+                name=med["name"],
+                strength_text=med.get("strength_text"),
+                dose_text=med.get("dose_text"),
+                instructions=med.get("instructions"),
+                times=times,
+                frequency_text=med.get("frequency_text"),
+                created_at=med["created_at"],
+            ),
+        )
+
+    ordered = [results[k] for k in dict.fromkeys(m.client_key.strip() for m in body.medications) if k in results]
+    return MedicationBatchResponse(
+        created=sum(r.result == "created" for r in ordered),
+        existing=sum(r.result == "existing" for r in ordered),
+        rejected=sum(r.result == "rejected" for r in ordered),
+        results=ordered,
+    )
+
+
 @app.get("/api/v1/medications", response_model=List[MedicationResponse])
-async def get_medications(claims: dict = Depends(verify_jwt)):
+async def get_medications(request: Request, claims: dict = Depends(verify_jwt)):
     user_id = await get_or_create_user(claims)
+    cond = http_cache.conditional(request, user_id, "medications", (MEDICATIONS,))
+    if cond.not_modified:
+        return cond.response()
     
     # Get medications
     meds_result = supabase.table("medications").select("*").eq("user_id", user_id).execute()
@@ -862,34 +1365,65 @@ async def get_medications(claims: dict = Depends(verify_jwt)):
         times_result = supabase.table("med_times").select("time_of_day").eq("medication_id", med["id"]).execute()
         times = [t["time_of_day"] for t in times_result.data]
         
-        medications.append(MedicationResponse(
-            id=med["id"],
-            name=med["name"],
-            strength_text=med["strength_text"],
-            dose_text=med["dose_text"],
-            instructions=med["instructions"],
-            times=times,
-            frequency_text=med.get("frequency_text"),
-            created_at=med["created_at"]
-        ))
+        # Rows in MedicationResponse's shape, encoded without a model per row
+        medications.append({
+            "id": med["id"],
+            "name": med["name"],
+            "strength_text": med["strength_text"],
+            "dose_text": med["dose_text"],
+            "instructions": med["instructions"],
+            "times": times,
+            "frequency_text": med.get("frequency_text"),
+            "created_at": to_local_json(med["created_at"], None),
+        })
     
-    return medications
+    return FastJSONResponse(medications, headers=cond.headers)
 
 
-@app.delete("/api/v1/medications/{medication_id}")
-async def delete_medication(medication_id: str, claims: dict = Depends(verify_jwt)):
-    """Delete medication and its times for current user."""
+@app.put("/api/v1/medications/{medication_id}/times")
+async def replace_medication_times(medication_id: str, body: MedTimesUpdate, claims: dict = Depends(verify_jwt)):
+    """Replace a medication's times and re-plan its future pending doses."""
     user_id = await get_or_create_user(claims)
-    # Ensure medication belongs to user
     med = supabase.table("medications").select("id").eq("id", medication_id).eq("user_id", user_id).execute()
     if not med.data:
         raise HTTPException(status_code=404, detail="Medication not found")
+    times = sorted({t for t in body.times if isinstance(t, str) and t})
+    if not times:
+        raise HTTPException(status_code=400, detail="at least one time is required")
+    supabase.table("med_times").delete().eq("medication_id", medication_id).execute()
+    supabase.table("med_times").insert([{"medication_id": medication_id, "time_of_day": t} for t in times]).execute()
+    # Drops pending doses at removed times and adds the new ones
+    result = dose_materializer.materialize_medications([medication_id])
+    alert_feed.invalidate(user_id)
+    http_cache.bump(user_id, MEDICATIONS)
+    log_writer.audit(user_id, "MED_TIMES_REPLACED", "med", medication_id, {"times": times})
+    return {"success": True, "times": times, "doses_added": result["inserted"], "doses_removed": result["deleted"]}
+
+
+def _delete_medication(user_id: str, medication_id: str) -> bool:
+    """Delete a medication with its times and doses; False when the user has no such medication."""
+    # Ensure medication belongs to user
+    med = supabase.table("medications").select("id").eq("id", medication_id).eq("user_id", user_id).execute()
+    if not med.data:
+        return False
     # Delete dependent times first
     supabase.table("med_times").delete().eq("medication_id", medication_id).execute()
     # Delete doses associated with this medication (optional cleanup)
     supabase.table("doses").delete().eq("medication_id", medication_id).eq("user_id", user_id).execute()
     # Delete medication
     supabase.table("medications").delete().eq("id", medication_id).eq("user_id", user_id).execute()
+    alert_feed.invalidate(user_id)
+    http_cache.bump(user_id, MEDICATIONS, DOSES)
+    log_writer.audit(user_id, "MED_DELETED", "med", medication_id)
+    return True
+
+
+@app.delete("/api/v1/medications/{medication_id}")
+async def delete_medication(medication_id: str, claims: dict = Depends(verify_jwt)):
+    """Delete medication and its times for current user."""
+    user_id = await get_or_create_user(claims)
+    if not _delete_medication(user_id, medication_id):
+        raise HTTPException(status_code=404, detail="Medication not found")
     return {"success": True}
 
 
@@ -915,6 +1449,7 @@ async def create_dose(
     # Get medication name
     med_result = supabase.table("medications").select("name").eq("id", dose.medication_id).execute()
     med_name = med_result.data[0]["name"] if med_result.data else "Unknown"
+    _dose_changed(user_id, created_dose, med_name, action="DOSE_CREATED")
     
     return DoseResponse(
         id=created_dose["id"],
@@ -930,8 +1465,10 @@ async def create_dose(
 @app.get("/api/v1/doses", response_model=List[DoseResponse])
 async def get_doses(request: Request, claims: dict = Depends(verify_jwt)):
     user_id = await get_or_create_user(claims)
-    # Read user timezone from header; default UTC
-    user_tz = request.headers.get("X-User-Timezone", "UTC")
+    user_tz = get_user_timezone(user_id, request.headers.get("X-User-Timezone"))
+    cond = http_cache.conditional(request, user_id, "doses", (DOSES, MEDICATIONS), variant=user_tz, vary=("X-User-Timezone",))
+    if cond.not_modified:
+        return cond.response()
 
     try:
         # Simple select first (avoid relationship join issues on some PostgREST caches)
@@ -969,21 +1506,21 @@ async def get_doses(request: Request, claims: dict = Depends(verify_jwt)):
                     except Exception:
                         pass
 
-        doses: List[DoseResponse] = []
-        # Convert scheduled_at/taken_at into user's local time string (ISO) for consistent client behavior
-        # We avoid heavy tz libs; keep original ISO but annotate by client side using header when needed.
-        for row in rows:
-            doses.append(DoseResponse(
-                id=row["id"],
-                medication_id=row["medication_id"],
-                scheduled_at=row["scheduled_at"],
-                status=row["status"],
-                taken_at=row["taken_at"],
-                notes=row["notes"],
-                medication_name=id_to_name.get(row["medication_id"], "Unknown"),
-            ))
-
-        return doses
+        # Rows in DoseResponse's shape, encoded without building and re-validating a model per row.
+        # Timestamps go out in the user's local offset; conversions are memoized per distinct value
+        doses = [
+            {
+                "id": row["id"],
+                "medication_id": row["medication_id"],
+                "scheduled_at": to_local_json(row["scheduled_at"], user_tz),
+                "status": row["status"],
+                "taken_at": to_local_json(row["taken_at"], user_tz) if row.get("taken_at") else None,
+                "notes": row["notes"],
+                "medication_name": id_to_name.get(row["medication_id"], "Unknown"),
+            }
+            for row in rows
+        ]
+        return FastJSONResponse(doses, headers=cond.headers)
     except Exception as e:
         # If anything goes wrong, return an empty list instead of 500 to avoid breaking the dashboard,
         # but surface the error message for debugging.
@@ -994,6 +1531,123 @@ async def get_doses(request: Request, claims: dict = Depends(verify_jwt)):
         return []
 
 
+def _bulk_update_grouped(user_id: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fallback when bulk_update_doses() is not deployed: one UPDATE per distinct
+    (status, taken_at, notes, expected_status) plus one read of the rest."""
+    groups: Dict[tuple, List[str]] = {}
+    for it in items:
+        key = (it["status"], it.get("taken_at"), it.get("notes"), it.get("expected_status"))
+        groups.setdefault(key, []).append(it["id"])
+    rows: List[Dict[str, Any]] = []
+    for (status_value, taken_at, notes, expected), ids in groups.items():
+        patch: Dict[str, Any] = {"status": status_value}
+        if taken_at:
+            patch["taken_at"] = taken_at
+        if notes is not None:
+            patch["notes"] = notes
+        q = supabase.table("doses").update(patch).in_("id", ids).eq("user_id", user_id)
+        if expected:
+            q = q.eq("status", expected)
+        rows.extend({**r, "applied": True} for r in q.execute().data or [])
+    applied = {r["id"] for r in rows}
+    rest = [it["id"] for it in items if it["id"] not in applied]
+    if rest:
+        current = (
+            supabase
+            .table("doses")
+            .select("id, status, taken_at, notes, medication_id, scheduled_at")
+            .in_("id", rest)
+            .eq("user_id", user_id)
+            .execute()
+        )
+        rows.extend({**r, "applied": False} for r in current.data or [])
+    return rows
+
+
+def _apply_dose_updates(user_id: str, items: List[Dict[str, Any]]) -> List[tuple]:
+    """Apply {id, status, taken_at, notes, expected_status} items (unique ids) in one
+    bulk_update_doses() call. Returns (outcome, row) per item, in order, where
+    outcome is updated / conflict / not_found and row carries medication_name."""
+    if not items:
+        return []
+    try:
+        rows = supabase.rpc("bulk_update_doses", {"p_user_id": user_id, "p_items": items}).execute().data or []
+    except Exception as e:
+        print(f"bulk_update_doses rpc unavailable, using grouped updates: {e}")
+        rows = _bulk_update_grouped(user_id, items)
+
+    # One lookup for every medication name in the batch
+    med_ids = sorted({r["medication_id"] for r in rows if r.get("medication_id")})
+    names = {m["id"]: m.get("name") or "Unknown" for m in select_in("medications", "id, name", "id", med_ids)}
+
+    by_row = {r["id"]: r for r in rows}
+    out: List[tuple] = []
+    for it in items:
+        row = by_row.get(it["id"])
+        if row is None:
+            out.append(("not_found", None))
+            continue
+        row = {**row, "medication_name": names.get(row.get("medication_id"), "Unknown")}
+        if row.get("applied"):
+            if row.get("status") != DoseStatus.PENDING.value:
+                reminder_dispatcher.cancel(row["id"])
+            _dose_changed(user_id, row, row["medication_name"], source="bulk")
+            out.append(("updated", row))
+        else:
+            out.append(("conflict", row))
+    return out
+
+
+# Registered before /doses/{dose_id} so "bulk" is not captured as a dose id
+@app.patch("/api/v1/doses/bulk", response_model=BulkDoseResponse)
+async def bulk_update_doses(body: BulkDoseUpdate, claims: dict = Depends(verify_jwt)):
+    """Update many doses in one round-trip with per-item compare-and-set.
+
+    Items with ``expected_status`` only apply while the dose still has that
+    status, so a late "taken" cannot overwrite an escalated "missed"; those come
+    back as "conflict" with the dose's current values. Later items win when the
+    same id appears twice.
+    """
+    user_id = await get_or_create_user(claims)
+    if len(body.items) > BULK_DOSE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_DOSE_MAX_ITEMS} items per request")
+
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for it in body.items:
+        by_id[it.id] = {
+            "id": it.id,
+            "status": it.status.value,
+            "taken_at": it.taken_at.isoformat() if it.taken_at else None,
+            "notes": it.notes,
+            "expected_status": it.expected_status.value if it.expected_status else None,
+        }
+    items = list(by_id.values())
+
+    results: List[BulkDoseResult] = []
+    counts = {"updated": 0, "conflict": 0, "not_found": 0}
+    for it, (outcome, row) in zip(items, _apply_dose_updates(user_id, items)):
+        counts[outcome] += 1
+        dose = None
+        if row is not None:
+            dose = DoseResponse(
+                id=row["id"],
+                medication_id=row["medication_id"],
+                scheduled_at=row["scheduled_at"],
+                status=row["status"],
+                taken_at=row.get("taken_at"),
+                notes=row.get("notes"),
+                medication_name=row["medication_name"],
+            )
+        results.append(BulkDoseResult(id=it["id"], result=outcome, dose=dose))
+
+    return BulkDoseResponse(
+        updated=counts["updated"],
+        conflicts=counts["conflict"],
+        not_found=counts["not_found"],
+        results=results,
+    )
+
+
 @app.patch("/api/v1/doses/{dose_id}", response_model=DoseResponse)
 async def update_dose(
     dose_id: str,
@@ -1014,10 +1668,13 @@ async def update_dose(
         raise HTTPException(status_code=404, detail="Dose not found")
     
     updated_dose = result.data[0]
+    if updated_dose.get("status") != DoseStatus.PENDING.value:
+        reminder_dispatcher.cancel(updated_dose["id"])
     
     # Get medication name
     med_result = supabase.table("medications").select("name").eq("id", updated_dose["medication_id"]).execute()
     med_name = med_result.data[0]["name"] if med_result.data else "Unknown"
+    _dose_changed(user_id, updated_dose, med_name)
     
     return DoseResponse(
         id=updated_dose["id"],
@@ -1031,6 +1688,101 @@ async def update_dose(
 
 
 # Alert endpoints
+# Offline sync
+def _apply_sync_mutations(user_id: str, mutations: List[SyncMutation]) -> List[Dict[str, Any]]:
+    """Apply queued offline mutations in order; returns one result dict per mutation."""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(mutations)
+
+    def done(i: int, result: str, detail: Optional[str] = None) -> None:
+        m = mutations[i]
+        results[i] = {"key": m.key, "entity": m.entity, "id": m.id, "result": result, "detail": detail}
+
+    # Dose updates go through bulk_update_doses(); a dose touched twice (e.g.
+    # snoozed, then taken) is split into successive rounds to keep the order.
+    rounds: List[Dict[str, tuple]] = []
+    for i, m in enumerate(mutations):
+        if m.entity == "dose" and m.op == "update":
+            try:
+                upd = DoseUpdate(**m.data)
+            except Exception:
+                done(i, "rejected", "invalid dose update")
+                continue
+            item = {
+                "id": m.id,
+                "status": upd.status.value,
+                "taken_at": upd.taken_at.isoformat() if upd.taken_at else None,
+                "notes": upd.notes,
+                "expected_status": m.expected_status.value if m.expected_status else None,
+            }
+            target = next((r for r in rounds if m.id not in r), None)
+            if target is None:
+                target = {}
+                rounds.append(target)
+            target[m.id] = (i, item)
+        elif m.entity == "medication" and m.op == "update":
+            patch = {k: v for k, v in m.data.items() if k in SYNC_MEDICATION_FIELDS}
+            if not patch or ("name" in patch and not patch["name"]):
+                done(i, "rejected", "nothing to update")
+                continue
+            res = supabase.table("medications").update(patch).eq("id", m.id).eq("user_id", user_id).execute()
+            if res.data:
+                http_cache.bump(user_id, MEDICATIONS)
+                log_writer.audit(user_id, "MED_UPDATED", "med", m.id, {**patch, "source": "sync"})
+            done(i, "updated" if res.data else "not_found")
+        elif m.entity == "medication" and m.op == "delete":
+            done(i, "deleted" if _delete_medication(user_id, m.id) else "not_found")
+        else:
+            done(i, "rejected", f"unsupported {m.entity} {m.op}")
+
+    for r in rounds:
+        entries = list(r.values())
+        outcomes = _apply_dose_updates(user_id, [item for _, item in entries])
+        for (i, _), (outcome, _row) in zip(entries, outcomes):
+            done(i, outcome)
+    # A mutation left without a result is not remembered, so the client retries it
+    return [r for r in results if r is not None]
+
+
+@app.post("/api/v1/sync", response_model=SyncResponse)
+async def sync(body: SyncRequest, claims: dict = Depends(verify_jwt)):
+    """Delta sync for the offline PWA.
+
+    Applies the client's queued mutations (each with an idempotency key; a
+    retried key returns its stored result without re-applying), then returns
+    the medications, med_times and doses whose version is above the client's
+    per-entity cursor, plus ids deleted since its tombstone cursor. Timestamps
+    are UTC. Keep calling with the returned cursor while ``has_more``; when
+    ``reset`` is set the pages form a full snapshot that replaces local data.
+    """
+    user_id = await get_or_create_user(claims)
+    if len(body.mutations) > SYNC_MAX_MUTATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {SYNC_MAX_MUTATIONS} mutations per sync")
+
+    results: List[SyncMutationResult] = []
+    if body.mutations:
+        seen = sync_service.seen(user_id, sorted({m.key for m in body.mutations}))
+        fresh: List[SyncMutation] = []
+        batch_keys = set()
+        for m in body.mutations:
+            if m.key not in seen and m.key not in batch_keys:
+                batch_keys.add(m.key)  # a key repeated within the batch applies once
+                fresh.append(m)
+        applied = {r["key"]: r for r in _apply_sync_mutations(user_id, fresh)}
+        sync_service.remember(user_id, list(applied.values()))
+        for m in body.mutations:
+            if m.key in applied:
+                results.append(SyncMutationResult(**applied.pop(m.key)))
+            elif m.key in seen:
+                results.append(SyncMutationResult(**seen[m.key], replayed=True))
+
+    try:
+        delta = await sync_service.changes(user_id, body.cursor, body.limit)
+    except Exception as e:
+        print(f"/api/v1/sync read error: {e}")
+        raise HTTPException(status_code=500, detail="Sync failed")
+    return SyncResponse(**delta, mutations=results)
+
+
 @app.post("/api/v1/alerts/missed-dose")
 async def trigger_missed_dose_alert(
     dose_id: str,
@@ -1054,6 +1806,7 @@ async def trigger_missed_dose_alert(
     # Mark dose as missed if still pending
     if dose["status"] == "pending":
         supabase.table("doses").update({"status": "missed"}).eq("id", dose_id).execute()
+        _dose_changed(user_id, {**dose, "status": "missed"}, source="escalation")
     
     # Get caregivers for this patient
     caregivers_result = supabase.table("caregiver_links").select("""
@@ -1096,20 +1849,8 @@ async def get_missed_doses(claims: dict = Depends(verify_jwt)):
     """Get doses that are overdue and should trigger alerts"""
     user_id = await get_or_create_user(claims)
     
-    # Get doses that are past their scheduled time and still pending
-    missed_result = supabase.rpc("exec_sql", {
-        "sql": f"""
-        SELECT d.id, d.scheduled_at, d.status, m.name as medication_name,
-               e.grace_minutes
-        FROM doses d
-        JOIN medications m ON d.medication_id = m.id
-        LEFT JOIN escalation_rules e ON d.user_id = e.user_id
-        WHERE d.user_id = '{user_id}'
-          AND d.status = 'pending'
-          AND d.scheduled_at < NOW() - INTERVAL '1 minute' * COALESCE(e.grace_minutes, 10)
-        ORDER BY d.scheduled_at
-        """
-    }).execute()
+    # Get doses that are past their scheduled time (plus grace) and still pending
+    missed_result = supabase.rpc("missed_doses", {"p_user_id": user_id}).execute()
     
     return {
         "missed_doses": missed_result.data if missed_result.data else [],
@@ -1137,6 +1878,36 @@ async def acknowledge_alert(
     return {"success": True, "acknowledged_at": datetime.now().isoformat()}
 
 
+@app.post("/api/v1/sms/inbound")
+async def sms_inbound(request: Request):
+    """Inbound SMS webhook for patient replies ("TAKEN"/"SKIP").
+
+    Accepts an SNS HTTPS notification, or an SQS-style batch ({"Records": [...]}
+    or {"Messages": [...]}) forwarded by a poller. Authenticated with a shared
+    token in the X-Webhook-Token header or ?token= query parameter.
+    """
+    if not SMS_WEBHOOK_TOKEN:
+        raise HTTPException(status_code=503, detail="Inbound SMS not configured")
+    token = request.headers.get("X-Webhook-Token") or request.query_params.get("token") or ""
+    if not hmac.compare_digest(token, SMS_WEBHOOK_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+
+    # SNS posts JSON with a text/plain content type, so parse the raw body
+    try:
+        payload = json.loads(await request.body() or b"null")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be JSON")
+
+    if isinstance(payload, dict) and payload.get("Type") == "SubscriptionConfirmation":
+        return {"confirmed": await sms_reply_service.confirm_subscription(payload)}
+
+    result = sms_reply_service.ingest(parse_inbound_payload(payload))
+    for d in result["doses"]:
+        reminder_dispatcher.cancel(d["id"])
+        _dose_changed(d["user_id"], d, source="sms")
+    return result
+
+
 @app.post("/api/v1/test/sms")
 async def test_sms(
     phone: str,
@@ -1176,7 +1947,7 @@ async def send_insights_sms(claims: dict = Depends(verify_jwt)):
 
     # Pull insights and risk
     risk = await risk_today(claims)  # reuse handler
-    insights = await risk_insights(claims)
+    insights = await _risk_insights(claims)
 
     # Build SMS body (160-300 chars preferred)
     parts = [
@@ -1194,43 +1965,70 @@ async def send_insights_sms(claims: dict = Depends(verify_jwt)):
     return {"success": True, "sid": sid}
 
 
+EXPORT_COLUMNS = ["id", "medication_name", "scheduled_at", "status", "taken_at", "notes"]
+_EXPORT_FLUSH_ROWS = 500
+
+
+def _export_csv_rows(user_id: str, hot_rows: List[Dict[str, Any]], names: Dict[str, str]) -> Iterator[str]:
+    """CSV text in chunks: archived months (cold tier) first, then doses still in Postgres."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    pending = 0
+
+    def rows():
+        # A month is briefly in both tiers if archiving stopped between writing its file and dropping its partition
+        hot_ids = {r.get("id") for r in hot_rows}
+        for r in dose_archiver.read_user(user_id):
+            if r.get("id") not in hot_ids:
+                yield r, r.get("medication_name") or "Unknown"
+        for r in hot_rows:
+            yield r, names.get(r.get("medication_id") or "", "Unknown")
+
+    for r, med_name in rows():
+        writer.writerow([
+            r.get("id"),
+            med_name,
+            r.get("scheduled_at"),
+            r.get("status"),
+            r.get("taken_at"),
+            (r.get("notes") or "").replace("\n", " ").strip(),
+        ])
+        pending += 1
+        if pending >= _EXPORT_FLUSH_ROWS:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+    yield buf.getvalue()
+
+
 @app.get("/api/v1/export/adherence.csv")
 async def export_adherence_csv(claims: dict = Depends(verify_jwt)):
-    """Export all doses for the user as CSV: id,medication_name,scheduled_at,status,taken_at,notes"""
+    """Export all doses for the user as CSV: id,medication_name,scheduled_at,status,taken_at,notes
+
+    Reads both tiers: months archived to Parquet by app/dose_archive.py and
+    the doses still in Postgres (paged, so exports are not cut at one
+    PostgREST response).
+    """
     user_id = await get_or_create_user(claims)
     try:
-        doses_res = (
+        rows = select_paged(lambda: (
             supabase
             .table("doses")
             .select("id, medication_id, scheduled_at, status, taken_at, notes")
             .eq("user_id", user_id)
             .order("scheduled_at")
-            .execute()
-        )
-        rows = doses_res.data or []
+            .order("id")
+        ))
         med_ids = sorted({r.get("medication_id") for r in rows if r.get("medication_id")})
-        names = {}
-        if med_ids:
-            meds = supabase.table("medications").select("id,name").in_("id", med_ids).execute()
-            for m in meds.data or []:
-                names[m["id"]] = m["name"]
+        names = {m["id"]: m["name"] for m in select_in("medications", "id, name", "id", med_ids)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch data: {e}")
 
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(["id", "medication_name", "scheduled_at", "status", "taken_at", "notes"])
-    for r in rows:
-        writer.writerow([
-            r.get("id"),
-            names.get(r.get("medication_id"), "Unknown"),
-            r.get("scheduled_at"),
-            r.get("status"),
-            r.get("taken_at"),
-            (r.get("notes") or "").replace("\n", " ").strip(),
-        ])
-    buf.seek(0)
     headers = {"Content-Disposition": "attachment; filename=adherence.csv"}
-    return StreamingResponse(iter([buf.getvalue()]), media_type="text/csv", headers=headers)
+    return StreamingResponse(_export_csv_rows(user_id, rows, names), media_type="text/csv", headers=headers)
 
 
+# Last statement, so the gauge covers every import and route definition above
+registry.import_seconds = perf_counter() - IMPORT_STARTED
@@ -15,6 +15,7 @@ class DoseStatus(str, enum.Enum):
     TAKEN = "taken"
     SKIPPED = "skipped"
     SNOOZED = "snoozed"
+    MISSED = "missed"
 
 class User(Base):
     __tablename__ = "users"
@@ -24,6 +25,7 @@ class User(Base):
     role = Column(Enum(UserRole), nullable=False)
     name = Column(Text, nullable=False)
     phone_enc = Column(Text)
+    timezone = Column(Text, nullable=False, server_default="UTC")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class CaregiverLink(Base):
@@ -0,0 +1,234 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from itertools import count
+from types import CodeType, FrameType
+from typing import Any, Deque, Dict, List, Optional
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # bearer token for /api/v1/admin/*; disabled when unset
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "60"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))  # 0 disables slow-request capture
+SLOW_SAMPLE_AFTER_MS = float(os.getenv("SLOW_SAMPLE_AFTER_MS", "250"))
+SLOW_SAMPLE_INTERVAL_MS = float(os.getenv("SLOW_SAMPLE_INTERVAL_MS", "10"))
+SLOW_REQUEST_BUFFER = int(os.getenv("SLOW_REQUEST_BUFFER", "50"))
+
+# Leaf frames of threads that are parked rather than working (an idle pool
+# worker blocks inside the C queue get, so its Python leaf is _worker itself)
+_IDLE_LEAVES = {("selectors", "select"), ("threading", "wait"), ("queue", "get"), ("thread", "_worker")}
+_POOL_SUFFIX = re.compile(r"[_-]\d+$")
+_PATH_PREFIX = re.compile(r"^.*/(?:site-packages|dist-packages|lib/python3\.\d+|backend)/")
+_labels: Dict[CodeType, str] = {}
+
+
+def _label(code: CodeType) -> str:
+    label = _labels.get(code)
+    if label is None:
+        path = _PATH_PREFIX.sub("", code.co_filename.replace("\\", "/"))
+        name = getattr(code, "co_qualname", code.co_name)
+        label = _labels[code] = f"{name} ({path}:{code.co_firstlineno})"
+    return label
+
+
+def _is_idle(frame: FrameType) -> bool:
+    code = frame.f_code
+    module = code.co_filename.replace("\\", "/").rsplit("/", 1)[-1].removesuffix(".py")
+    return (module, code.co_name) in _IDLE_LEAVES
+
+
+def collapse(frame: Optional[FrameType], thread: str) -> str:
+    """One stack in collapsed ("folded") form, root first: ``thread;outer;...;leaf``."""
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    stack.append(thread)
+    return ";".join(reversed(stack))
+
+
+def _thread_names() -> Dict[int, str]:
+    # Pool threads differ only by a counter; fold them into one root
+    return {t.ident: _POOL_SUFFIX.sub("", t.name) for t in threading.enumerate() if t.ident is not None}
+
+
+def folded(samples: Dict[str, int]) -> List[str]:
+    """flamegraph.pl / speedscope input lines, heaviest first."""
+    return [f"{stack} {n}" for stack, n in sorted(samples.items(), key=lambda kv: -kv[1])]
+
+
+class Profiler:
+    """On-demand sampling profiler over every thread of this worker.
+
+    A plain thread reads sys._current_frames() every ``interval`` seconds, so
+    handlers run unmodified and the cost is one stack walk per thread per
+    sample. Only one profile runs at a time.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, seconds: float, interval: float, include_idle: bool = False) -> Dict[str, Any]:
+        """Sample for ``seconds`` (blocking; call it from a thread). Returns folded stacks."""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("a profile is already running")
+        try:
+            me = threading.get_ident()
+            samples: Dict[str, int] = {}
+            taken = 0
+            names = _thread_names()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me or (not include_idle and _is_idle(frame)):
+                        continue
+                    if ident not in names:
+                        names = _thread_names()
+                    stack = collapse(frame, names.get(ident, "thread"))
+                    samples[stack] = samples.get(stack, 0) + 1
+                taken += 1
+                time.sleep(interval)
+            return {"ticks": taken, "interval_ms": interval * 1000, "stacks": folded(samples)}
+        finally:
+            self._lock.release()
+
+
+class SlowRequestLog:
+    """Ring buffer of requests slower than SLOW_REQUEST_MS, with their spans and stack samples.
+
+    TimingMiddleware registers each request's trace and its own coroutine
+    frame. A watchdog thread samples only while some request has been running
+    longer than SLOW_SAMPLE_AFTER_MS, so samples cover the slow tail of a
+    request, not its first SLOW_SAMPLE_AFTER_MS. A sample of the event loop
+    thread belongs to the request whose middleware frame is on that stack;
+    a sample of a worker thread belongs to the request whose upstream span
+    that thread is inside (see telemetry.span).
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float = SLOW_REQUEST_MS,
+        sample_after_ms: float = SLOW_SAMPLE_AFTER_MS,
+        interval_ms: float = SLOW_SAMPLE_INTERVAL_MS,
+        size: int = SLOW_REQUEST_BUFFER,
+    ):
+        self.enabled = threshold_ms > 0
+        self.threshold = threshold_ms / 1000
+        self.sample_after = min(sample_after_ms, threshold_ms) / 1000
+        self.interval = interval_ms / 1000
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self.thread_traces: Dict[int, Any] = {}  # worker thread -> trace whose span it runs
+        self._inflight: Dict[int, Any] = {}  # id(middleware frame) -> trace
+        self._ids = count(1)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"captured": 0, "sample_ticks": 0}
+
+    # ---------- called by TimingMiddleware ----------
+
+    def begin(self, trace: Any, frame: FrameType) -> None:
+        if self.enabled:
+            self._inflight[id(frame)] = trace
+
+    def end(self, frame: FrameType) -> None:
+        self._inflight.pop(id(frame), None)
+
+    def record(self, trace: Any, entry: Dict[str, Any], path: str) -> None:
+        """Keep ``entry`` (the request's log line) if the request was slow enough."""
+        if not self.enabled or entry["ms"] < self.threshold * 1000:
+            return
+        samples = trace.samples or {}
+        self.entries.append({
+            **entry,
+            "id": next(self._ids),
+            "at": datetime.now(timezone.utc).isoformat(),
+            "path": path,
+            "span_tree": {
+                "name": f"{entry['method']} {entry['route']}",
+                "start_ms": 0.0,
+                "ms": entry["ms"],
+                "children": [
+                    {
+                        "name": f"{upstream} {op}",
+                        "start_ms": round(start * 1000, 2),
+                        "ms": round(duration * 1000, 2),
+                        "ok": ok,
+                    }
+                    for upstream, op, start, duration, ok in trace.spans
+                ],
+            },
+            "samples": sum(samples.values()),
+            "sample_interval_ms": self.interval * 1000,
+            "stacks": folded(samples),
+        })
+        self.stats["captured"] += 1
+
+    # ---------- reads ----------
+
+    def recent(self) -> List[Dict[str, Any]]:
+        keys = ("id", "at", "method", "route", "path", "status", "ms", "app_ms", "samples")
+        return [{k: e.get(k) for k in keys} for e in reversed(self.entries)]
+
+    def get(self, entry_id: int) -> Optional[Dict[str, Any]]:
+        return next((e for e in self.entries if e["id"] == entry_id), None)
+
+    # ---------- watchdog ----------
+
+    def _sample(self, due: Dict[int, Any]) -> None:
+        me = threading.get_ident()
+        names = None
+        due_traces = set(map(id, due.values()))
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            trace = self.thread_traces.get(ident)
+            if trace is None:
+                f = frame
+                while f is not None and id(f) not in due:
+                    f = f.f_back
+                trace = due.get(id(f)) if f is not None else None
+            if trace is None or id(trace) not in due_traces:
+                continue
+            if names is None:
+                names = _thread_names()
+            stack = collapse(frame, names.get(ident, "thread"))
+            if trace.samples is None:
+                trace.samples = {}
+            trace.samples[stack] = trace.samples.get(stack, 0) + 1
+        self.stats["sample_ticks"] += 1
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            if not self._inflight:
+                continue
+            try:
+                now = time.perf_counter()
+                due = {k: t for k, t in list(self._inflight.items()) if now - t.start >= self.sample_after}
+                if due:
+                    self._sample(due)
+            except Exception as e:
+                print(f"Slow request sampler error: {e}")
+
+    def start(self) -> None:
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="slow-request-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+
+# Global instances
+profiler = Profiler()
+slow_requests = SlowRequestLog()
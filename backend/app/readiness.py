@@ -0,0 +1,153 @@
+import os
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .database import SUPABASE_CONFIGURED, engine, supabase
+from .gemini_service import GOOGLE_API_KEY, gemini_service
+from .sns_service import sns_service
+
+READY_PROBE_SECONDS = float(os.getenv("READY_PROBE_SECONDS", "15"))
+READY_PROBE_TIMEOUT_SECONDS = float(os.getenv("READY_PROBE_TIMEOUT_SECONDS", "3"))
+# Checks that must be ok (or not configured) for /readyz to return 200; the rest only report
+READY_REQUIRED = tuple(c.strip() for c in os.getenv("READY_REQUIRED", "db_pool,postgrest").split(",") if c.strip())
+
+OK = "ok"
+DEGRADED = "degraded"
+DOWN = "down"
+NOT_CONFIGURED = "not_configured"
+
+
+class ReadinessProber:
+    """Probes upstream dependencies in the background and caches the result for /readyz.
+
+    Every ``interval`` seconds it checks, concurrently and each with a
+    timeout: the SQLAlchemy pool (SELECT 1), PostgREST (a one-row select),
+    SNS (GetSMSAttributes) and the Gemini circuit breaker, which is read
+    from process state since a Gemini call costs money. /readyz only reads the
+    cached snapshot, so a health check never touches an upstream however
+    often the load balancer polls. A snapshot older than three intervals
+    (a stuck prober) counts as not ready.
+    """
+
+    def __init__(
+        self,
+        interval: float = READY_PROBE_SECONDS,
+        timeout: float = READY_PROBE_TIMEOUT_SECONDS,
+        required: Tuple[str, ...] = READY_REQUIRED,
+    ):
+        self.interval = interval
+        self.timeout = timeout
+        self.required = required
+        self._task: Optional[asyncio.Task] = None
+        self._snapshot: Optional[Tuple[float, str, Dict[str, Dict[str, Any]]]] = None  # monotonic, iso, checks
+
+    # ---------- checks (blocking; run on a thread) ----------
+
+    def _db_pool(self) -> Dict[str, Any]:
+        if engine is None:
+            return {"status": NOT_CONFIGURED}
+        from sqlalchemy import text
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return {"status": OK, "pool": engine.pool.status()}
+
+    def _postgrest(self) -> Dict[str, Any]:
+        if not SUPABASE_CONFIGURED:
+            return {"status": NOT_CONFIGURED}
+        supabase.table("users").select("id").limit(1).execute()
+        return {"status": OK}
+
+    def _sns(self) -> Dict[str, Any]:
+        client = sns_service.client
+        if client is None:
+            return {"status": NOT_CONFIGURED}
+        client.get_sms_attributes(attributes=["DefaultSMSType"])
+        return {"status": OK}
+
+    def _gemini(self) -> Dict[str, Any]:
+        if not GOOGLE_API_KEY:
+            return {"status": NOT_CONFIGURED}
+        circuit = gemini_service.circuit
+        state = circuit.state
+        result: Dict[str, Any] = {
+            "status": {"closed": OK, "half_open": DEGRADED}.get(state, DOWN),
+            "circuit": state,
+            "consecutive_failures": circuit.failures,
+        }
+        if circuit.last_error and state != "closed":
+            result["last_error"] = circuit.last_error
+        return result
+
+    # ---------- probing ----------
+
+    async def _check(self, probe: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result: Dict[str, Any]
+        try:
+            result = await asyncio.wait_for(asyncio.to_thread(probe), self.timeout)
+        except asyncio.TimeoutError:
+            result = {"status": DOWN, "error": f"timed out after {self.timeout:g}s"}
+        except Exception as e:
+            result = {"status": DOWN, "error": str(e)[:200]}
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    async def probe(self) -> Dict[str, Dict[str, Any]]:
+        names = ("db_pool", "postgrest", "gemini", "sns")
+        probes = (self._db_pool, self._postgrest, self._gemini, self._sns)
+        results = await asyncio.gather(*(self._check(p) for p in probes))
+        checks: Dict[str, Dict[str, Any]] = dict(zip(names, results))
+        self._snapshot = (time.monotonic(), datetime.now(timezone.utc).isoformat(), checks)
+        return checks
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.probe()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Readiness probe error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # ---------- reads ----------
+
+    def status(self) -> Tuple[bool, Dict[str, Any]]:
+        """(ready, body) from the cached snapshot; O(1), no I/O."""
+        if self._snapshot is None:
+            return False, {"status": "starting", "checks": {}}
+        probed, checked_at, checks = self._snapshot
+        age = time.monotonic() - probed
+        failing = [name for name in self.required if checks.get(name, {}).get("status") not in (OK, NOT_CONFIGURED)]
+        stale = age > 3 * self.interval
+        ready = not failing and not stale
+        body: Dict[str, Any] = {
+            "status": "ready" if ready else "not_ready",
+            "checked_at": checked_at,
+            "age_seconds": round(age, 1),
+            "checks": checks,
+        }
+        if failing:
+            body["failing"] = failing
+        if stale:
+            body["stale"] = True
+        return ready, body
+
+
+# Global instance
+readiness = ReadinessProber()
@@ -0,0 +1,285 @@
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from .database import LeaderLock, supabase, select_paged, select_in
+from .sns_service import sns_service
+from .timezones import parse_instant, resolve_zone
+
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "true").lower() in ("1", "true", "yes")
+REMINDER_HORIZON_HOURS = int(os.getenv("REMINDER_HORIZON_HOURS", "6"))
+REMINDER_REFRESH_MINUTES = int(os.getenv("REMINDER_REFRESH_MINUTES", "15"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "5000"))
+# Every worker and instance starts the dispatcher, so only the holder of a Postgres advisory
+# lock (needs DATABASE_URL) sends. Set false only when exactly one process runs it.
+REMINDER_LEADER_LOCK = os.getenv("REMINDER_LEADER_LOCK", "true").lower() in ("1", "true", "yes")
+
+_LEADER_LOCK_KEY = 0x50696C6C01  # pg_try_advisory_lock key for the reminder dispatcher
+
+
+class Reminder(NamedTuple):
+    dose_id: str
+    user_id: str
+    phone: str
+    medication_name: str
+    time_text: str
+
+
+def _epoch_minute(dt: datetime) -> int:
+    return int(dt.timestamp()) // 60
+
+
+class ReminderDispatcher:
+    """Fires patient reminder SMS for pending doses.
+
+    Upcoming pending doses are precomputed into an in-memory index of
+    epoch-minute buckets covering the next ``horizon_hours``. A background loop
+    wakes once per minute, pops every bucket that has come due and sends it to
+    SNS in batches. The index is rebuilt from the database every
+    ``refresh_minutes``, so doses resolved or rescheduled by other processes
+    drop out; doses already fired or cancelled are not re-added. Each bucket
+    is also re-checked against the database right before it is sent.
+
+    With a ``leader`` lock only the process holding it runs cycles; the
+    others keep an empty index and rebuild it if the lock comes to them.
+    """
+
+    def __init__(
+        self,
+        sender=sns_service,
+        horizon_hours: int = REMINDER_HORIZON_HOURS,
+        refresh_minutes: int = REMINDER_REFRESH_MINUTES,
+        batch_size: int = REMINDER_BATCH_SIZE,
+        leader: Optional[LeaderLock] = None,
+    ):
+        self.sender = sender
+        self.horizon_hours = horizon_hours
+        self.refresh_minutes = refresh_minutes
+        self.batch_size = batch_size
+        self.leader = leader
+        self._buckets: Dict[int, Dict[str, Reminder]] = {}
+        self._bucket_of: Dict[str, int] = {}
+        self._done: Dict[str, int] = {}  # dose_id -> minute it was fired/cancelled
+        self._cursor: Optional[int] = None
+        self._last_refresh: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "indexed": 0, "sent": 0, "failed": 0, "resolved": 0, "last_batch_seconds": 0.0, "leader": leader is None,
+        }
+
+    # ---------- index ----------
+
+    def __len__(self) -> int:
+        return len(self._bucket_of)
+
+    def add(self, reminder: Reminder, fire_minute: int) -> None:
+        if reminder.dose_id in self._done:
+            return
+        prev = self._bucket_of.get(reminder.dose_id)
+        if prev is not None and prev != fire_minute:
+            self._buckets.get(prev, {}).pop(reminder.dose_id, None)
+        self._buckets.setdefault(fire_minute, {})[reminder.dose_id] = reminder
+        self._bucket_of[reminder.dose_id] = fire_minute
+
+    def cancel(self, dose_id: str) -> bool:
+        """Drop a queued reminder, e.g. when the dose is marked taken before it fires."""
+        minute = self._bucket_of.pop(dose_id, None)
+        if minute is None:
+            return False
+        bucket = self._buckets.get(minute)
+        if bucket is not None:
+            bucket.pop(dose_id, None)
+            if not bucket:
+                del self._buckets[minute]
+        self._done[dose_id] = minute
+        return True
+
+    def index_rows(
+        self,
+        doses: Iterable[Dict[str, Any]],
+        users: Dict[str, Dict[str, Any]],
+        med_names: Dict[str, str],
+    ) -> int:
+        """Add reminders for dose rows ({id, user_id, medication_id, scheduled_at}).
+
+        ``users`` maps user id -> {phone_enc, timezone}; users without a phone are skipped.
+        The displayed time is rendered in the user's own timezone.
+        """
+        # Many doses share a wall-clock time; parse each instant and format each (instant, zone) pair once
+        parsed: Dict[str, Tuple[datetime, int]] = {}
+        time_text_cache: Dict[Tuple[str, str], str] = {}
+        added = 0
+        for row in doses:
+            user = users.get(row["user_id"]) or {}
+            phone = user.get("phone_enc")
+            sched = row.get("scheduled_at")
+            if not phone or not sched:
+                continue
+            tz_name = user.get("timezone") or "UTC"
+            key = (sched, tz_name)
+            hit = parsed.get(sched)
+            if hit is None:
+                ts = parse_instant(sched)
+                hit = parsed[sched] = (ts, _epoch_minute(ts))
+            ts, minute = hit
+            text = time_text_cache.get(key)
+            if text is None:
+                text = ts.astimezone(resolve_zone(tz_name)).strftime("%I:%M %p").lstrip("0")
+                time_text_cache[key] = text
+            self.add(
+                Reminder(
+                    dose_id=row["id"],
+                    user_id=row["user_id"],
+                    phone=phone,
+                    medication_name=med_names.get(row["medication_id"], "medication"),
+                    time_text=text,
+                ),
+                minute,
+            )
+            added += 1
+        self.stats["indexed"] = len(self._bucket_of)
+        return added
+
+    def pop_due(self, now_minute: int) -> List[Reminder]:
+        if self._cursor is None:
+            self._cursor = now_minute
+        due: List[Reminder] = []
+        while self._cursor <= now_minute:
+            bucket = self._buckets.pop(self._cursor, None)
+            if bucket:
+                for dose_id in bucket:
+                    self._bucket_of.pop(dose_id, None)
+                    self._done[dose_id] = self._cursor
+                due.extend(bucket.values())
+            self._cursor += 1
+        return due
+
+    def _clear(self) -> None:
+        """Forget queued reminders: another process is sending them."""
+        self._buckets.clear()
+        self._bucket_of.clear()
+        self._cursor = None
+        self._last_refresh = None
+        self.stats["indexed"] = 0
+
+    def _prune_done(self, now_minute: int) -> None:
+        cutoff = now_minute - self.horizon_hours * 60
+        stale = [d for d, m in self._done.items() if m < cutoff]
+        for d in stale:
+            del self._done[d]
+
+    # ---------- loading ----------
+
+    def _load_window(self, start: datetime, end: datetime):
+        doses = select_paged(lambda: (
+            supabase
+            .table("doses")
+            .select("id, user_id, medication_id, scheduled_at")
+            .eq("status", "pending")
+            .gte("scheduled_at", start.isoformat())
+            .lt("scheduled_at", end.isoformat())
+            .order("scheduled_at")
+            .order("id")
+        ))
+
+        user_ids = sorted({d["user_id"] for d in doses if d.get("user_id")})
+        users = {
+            u["id"]: u
+            for u in select_in("users", "id, phone_enc, timezone", "id", user_ids)
+            if u.get("phone_enc")
+        }
+        med_ids = sorted({d["medication_id"] for d in doses if d.get("user_id") in users})
+        med_names = {m["id"]: m.get("name") or "medication" for m in select_in("medications", "id, name", "id", med_ids)}
+        return doses, users, med_names
+
+    async def refresh(self, now: Optional[datetime] = None) -> int:
+        now = now or datetime.now(timezone.utc)
+        # Start at the current minute so doses due right now are still picked up
+        start = now.replace(second=0, microsecond=0)
+        end = start + timedelta(hours=self.horizon_hours)
+        doses, users, med_names = await asyncio.to_thread(self._load_window, start, end)
+        # Rebuild rather than merge: anything the query no longer returns is gone
+        self._buckets = {}
+        self._bucket_of = {}
+        added = self.index_rows(doses, users, med_names)
+        self._last_refresh = _epoch_minute(now)
+        self._prune_done(self._last_refresh)
+        return added
+
+    # ---------- firing ----------
+
+    def _still_pending(self, dose_ids: List[str]) -> Set[str]:
+        rows = select_in("doses", "id", "id", dose_ids, refine=lambda q: q.eq("status", "pending"))
+        return {r["id"] for r in rows}
+
+    async def fire_due(self, now: Optional[datetime] = None) -> int:
+        now_minute = _epoch_minute(now or datetime.now(timezone.utc))
+        due = self.pop_due(now_minute)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if due:
+            # cancel() only reaches this process; doses taken through another worker
+            # since the last refresh are caught here
+            try:
+                pending = await asyncio.to_thread(self._still_pending, [r.dose_id for r in due])
+                self.stats["resolved"] += len(due) - len(pending)
+                due = [r for r in due if r.dose_id in pending]
+            except Exception as e:
+                print(f"Reminder pending check failed, sending anyway: {e}")
+        for i in range(0, len(due), self.batch_size):
+            batch = due[i:i + self.batch_size]
+            ids = await self.sender.send_reminder_batch(
+                [(r.phone, r.medication_name, r.time_text) for r in batch]
+            )
+            ok = sum(1 for mid in ids if mid)
+            self.stats["sent"] += ok
+            self.stats["failed"] += len(batch) - ok
+        self.stats["last_batch_seconds"] = round(loop.time() - started, 3)
+        self.stats["indexed"] = len(self._bucket_of)
+        return len(due)
+
+    async def run(self) -> None:
+        while True:
+            now = datetime.now(timezone.utc)
+            minute = _epoch_minute(now)
+            try:
+                leading = self.leader is None or await asyncio.to_thread(self.leader.acquire)
+                if leading != self.stats["leader"]:
+                    print(f"Reminder dispatcher {'is now' if leading else 'is no longer'} the leader")
+                    self.stats["leader"] = leading
+                if not leading:
+                    self._clear()
+                elif self._last_refresh is None or minute - self._last_refresh >= self.refresh_minutes:
+                    await self.refresh(now)
+                if leading:
+                    await self.fire_due(now)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Reminder dispatcher error: {e}")
+            # Sleep until the start of the next minute
+            await asyncio.sleep(60 - datetime.now(timezone.utc).second + 0.05)
+
+    def start(self) -> None:
+        if self.leader is not None and not self.leader.available:
+            print("Reminder dispatcher not started: the leader lock needs DATABASE_URL and psycopg "
+                  "(or set REMINDER_LEADER_LOCK=false when only one process runs it)")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.leader is not None:
+            await asyncio.to_thread(self.leader.release)
+
+
+# Global instance
+reminder_dispatcher = ReminderDispatcher(leader=LeaderLock(_LEADER_LOCK_KEY) if REMINDER_LEADER_LOCK else None)
@@ -0,0 +1,196 @@
+import re
+from datetime import time
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class Recurrence(NamedTuple):
+    """Compact daily schedule: minutes after local midnight, sorted and unique.
+
+    ``every_hours`` is set for interval sigs (q8h, every 6 hours); their times
+    are already expanded into ``minutes`` starting at 08:00.
+    """
+    frequency_text: Optional[str]
+    minutes: Tuple[int, ...]
+    every_hours: Optional[int] = None
+
+    @property
+    def times(self) -> List[str]:
+        return [f"{m // 60:02d}:{m % 60:02d}" for m in self.minutes]
+
+    def clock_times(self) -> List[time]:
+        return [time(m // 60, m % 60) for m in self.minutes]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"frequency_text": self.frequency_text, "times": self.times}
+
+    @classmethod
+    def from_times(cls, values: Iterable[Any], frequency_text: Optional[str] = None) -> "Recurrence":
+        """Build from "HH:MM[:SS]" strings or time objects (e.g. med_times rows)."""
+        minutes = set()
+        for v in values:
+            if isinstance(v, time):
+                minutes.add(v.hour * 60 + v.minute)
+                continue
+            m = _HHMM.match(str(v or "").strip())
+            if m and int(m.group(1)) < 24 and int(m.group(2)) < 60:
+                minutes.add(int(m.group(1)) * 60 + int(m.group(2)))
+        return cls(frequency_text, tuple(sorted(minutes)))
+
+
+# ---------- sig grammar (compiled once at import) ----------
+#
+# A sig is lowercased, stripped of dots ("b.i.d." -> "bid", "8 a.m." -> "8 am")
+# and split into word / number / HH:MM tokens by one regex. Everything else is
+# dictionary lookups over the token list, so cost is linear in the token count.
+
+_HHMM = re.compile(r"(\d{1,2}):(\d{2})")
+_TOKEN = re.compile(r"\d{1,2}:\d{2}|\d+|[a-z]+")
+
+# Doses per day; the most frequent keyword wins ("twice daily" beats "daily")
+_PER_DAY_WORDS: Dict[str, int] = {
+    "qid": 4, "tid": 3, "bid": 2,
+    "daily": 1, "qd": 1, "qam": 1, "qpm": 1, "qhs": 1,
+}
+# Per day only when a day follows: "once daily", "twice a day" (but not "once weekly")
+_PER_DAY_COUNTS: Dict[str, int] = {"once": 1, "twice": 2}
+_DAY_WORDS = frozenset(("daily", "day", "nightly"))
+_PER_LEADS = frozenset(("a", "per", "each", "every"))
+# Periods longer than a day ("once weekly", "every other day", "q2d"): the daily
+# model cannot express them, so such sigs compile to no schedule at all
+_PERIOD_WORDS = frozenset((
+    "week", "weeks", "weekly", "biweekly", "fortnight", "fortnightly",
+    "month", "months", "monthly", "year", "years", "yearly", "annually",
+    "qod", "qow", "qwk", "qmo",
+))
+_DURATION_LEADS = frozenset(("for", "x"))  # "daily for 2 weeks" is a course length, not a period
+# "<count> times" / "<count> x", unless a strength or dose form follows ("2 x 500mg" is a quantity)
+_COUNT_WORDS: Dict[str, int] = {"four": 4, "4": 4, "three": 3, "3": 3, "two": 2, "2": 2, "one": 1, "1": 1}
+_TIMES_WORDS = frozenset(("times", "x"))
+_DOSE_UNITS = frozenset((
+    "mg", "mcg", "g", "ml", "units", "iu",
+    "tab", "tabs", "tablet", "tablets", "cap", "caps", "capsule", "capsules", "pill", "pills",
+    "puff", "puffs", "drop", "drops", "spray", "sprays", "patch", "patches",
+))
+# "every 8 hours", "q8h", "q 6 hrs"
+_INTERVAL_LEADS = frozenset(("every", "q"))
+_HOUR_WORDS = frozenset(("h", "hr", "hrs", "hour", "hours"))
+_MEAL_WORDS = frozenset(("meal", "meals"))
+_MEAL_LEADS = frozenset(("with", "before", "after", "each"))
+_AMPM = frozenset(("am", "pm"))
+
+_PER_DAY_LABELS = {1: "Once daily", 2: "Twice daily", 3: "Three times daily", 4: "Four times daily"}
+
+# Meal and time-of-day anchors -> minutes after midnight
+_ANCHOR_WORDS: Dict[str, Tuple[int, ...]] = {
+    "morning": (8 * 60,), "breakfast": (8 * 60,), "qam": (8 * 60,),
+    "noon": (12 * 60,), "lunch": (12 * 60,), "midday": (12 * 60,), "afternoon": (12 * 60,),
+    "evening": (18 * 60,), "dinner": (18 * 60,), "supper": (18 * 60,), "qpm": (18 * 60,),
+    "bedtime": (21 * 60,), "night": (21 * 60,), "nightly": (21 * 60,), "tonight": (21 * 60,),
+    "hs": (21 * 60,), "qhs": (21 * 60,),
+}
+_MEAL_MINUTES = (8 * 60, 12 * 60, 18 * 60)
+
+_DEFAULT_TIMES: Dict[int, Tuple[int, ...]] = {
+    1: (9 * 60,),
+    2: (9 * 60, 21 * 60),
+    3: (8 * 60, 14 * 60, 20 * 60),
+    4: (0, 6 * 60, 12 * 60, 18 * 60),
+}
+
+
+def _clock(token: str, suffix: str) -> Optional[int]:
+    """Minutes after midnight for "20:00", "8:30" + "pm" or "8" + "am"; None otherwise."""
+    if ":" in token:
+        hh, mm = token.split(":")
+        h, m = int(hh), int(mm)
+    elif suffix in _AMPM:
+        h, m = int(token), 0
+    else:
+        return None  # bare numbers ("take 2 tablets") are doses, not times
+    if suffix in _AMPM:
+        if not 1 <= h <= 12:
+            return None
+        h = h % 12 + (12 if suffix == "pm" else 0)
+    if h < 24 and m < 60:
+        return h * 60 + m
+    return None
+
+
+_NO_SCHEDULE = Recurrence(None, ())
+
+
+def _compile_tokens(tokens: Tuple[str, ...]) -> Recurrence:
+    per_day = 0
+    counted = False  # per_day comes from an explicit count (bid, twice, 3 x), not just "daily"
+    every_hours: Optional[int] = None
+    minutes = set()
+    n = len(tokens)
+
+    for i, tok in enumerate(tokens):
+        nxt = tokens[i + 1] if i + 1 < n else ""
+
+        if tok in _PERIOD_WORDS and not _DURATION_LEADS.intersection(tokens[max(0, i - 3):i]):
+            return _NO_SCHEDULE
+        k = _PER_DAY_WORDS.get(tok)
+        if k:
+            per_day = max(per_day, k)
+            counted = counted or k > 1
+        elif tok in _PER_DAY_COUNTS:
+            if nxt in _DAY_WORDS or (nxt in _PER_LEADS and i + 2 < n and tokens[i + 2] == "day"):
+                per_day = max(per_day, _PER_DAY_COUNTS[tok])
+                counted = True
+        elif nxt in _TIMES_WORDS and tok in _COUNT_WORDS:
+            after = tokens[i + 2] if i + 2 < n else ""
+            if not (after[:1].isdigit() or after in _DOSE_UNITS):
+                per_day = max(per_day, _COUNT_WORDS[tok])
+                counted = True
+        elif tok in _INTERVAL_LEADS:
+            if nxt == "day":
+                per_day = max(per_day, 1)
+            elif nxt == "other" or (nxt.isdigit() and i + 2 < n and tokens[i + 2] in ("days", "d") and int(nxt) > 1):
+                return _NO_SCHEDULE  # every other day, every 3 days, q2d
+            elif nxt.isdigit() and i + 2 < n and tokens[i + 2] in _HOUR_WORDS and int(nxt) > 0:
+                every_hours = every_hours or int(nxt)
+
+        anchor = _ANCHOR_WORDS.get(tok)
+        if anchor:
+            minutes.update(anchor)
+        elif tok in _MEAL_WORDS and i and tokens[i - 1] in _MEAL_LEADS:
+            minutes.update(_MEAL_MINUTES)
+        elif tok[0].isdigit():
+            clock = _clock(tok, nxt)
+            if clock is not None:
+                minutes.add(clock)
+
+    if "morning" in tokens and "evening" in tokens:
+        per_day = max(per_day, 2)
+
+    if every_hours:
+        frequency_text: Optional[str] = f"Every {every_hours} hours"
+        if not minutes:
+            minutes.update((8 * 60 + i * every_hours * 60) % (24 * 60) for i in range(max(1, 24 // every_hours)))
+    else:
+        if per_day and minutes and len(minutes) != per_day:
+            if counted:
+                # "twice daily in the morning": the count is what was prescribed
+                minutes = set(_DEFAULT_TIMES[per_day])
+            else:
+                # "daily at 8am and 8pm": daily only says every day, the times give the count
+                per_day = len(minutes)
+        frequency_text = _PER_DAY_LABELS.get(per_day)
+        if frequency_text and not minutes:
+            minutes.update(_DEFAULT_TIMES[per_day])
+
+    return Recurrence(frequency_text, tuple(sorted(minutes)), every_hours)
+
+
+@lru_cache(maxsize=65536)
+def _compile_normalized(s: str) -> Recurrence:
+    return _compile_tokens(tuple(_TOKEN.findall(s)))
+
+
+@lru_cache(maxsize=65536)
+def compile_schedule(instructions: Optional[str]) -> Recurrence:
+    """Compile a free-text sig ("1 tab PO BID with meals", "q8h", "8am and 8pm")."""
+    return _compile_normalized((instructions or "").lower().replace(".", ""))
@@ -1,13 +1,9 @@
 import os
 from typing import Dict, Iterable
-from fastapi import HTTPException, Security
+from fastapi import HTTPException, Request, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import jwt
 from jose.exceptions import JWTError
-from dotenv import load_dotenv
-
-# Ensure environment variables are loaded before reading
-load_dotenv()
 
 def _as_list(value: object) -> Iterable[str]:
     if value is None:
@@ -43,3 +39,11 @@ def verify_jwt(credentials: HTTPAuthorizationCredentials = Security(bearer_schem
         raise HTTPException(status_code=401, detail="Invalid token") from exc
 
 
+def verify_jwt_or_query(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Security(bearer_scheme),
+) -> Dict:
+    """verify_jwt that also accepts ?access_token=, since browsers' EventSource cannot set headers."""
+    if credentials is None and request.query_params.get("access_token"):
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=request.query_params["access_token"])
+    return verify_jwt(credentials)
@@ -0,0 +1,165 @@
+import os
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+SERVICE_WARMUP = os.getenv("SERVICE_WARMUP", "true").lower() in ("1", "true", "yes")
+
+
+class LazyService:
+    """A client that is built on first use instead of at import.
+
+    Stands in for the client itself: attribute access (``supabase.table``)
+    builds it once, thread-safely, then forwards. ``override`` swaps in
+    another object (a fake, in benchmarks) without building the real one.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[], Any],
+        warm: Optional[Callable[[Any], None]] = None,
+        close: Optional[Callable[[Any], None]] = None,
+    ):
+        self.name = name
+        self._factory = factory
+        self._warm = warm
+        self._close = close
+        self._lock = threading.Lock()
+        self._value: Any = None
+        self.built = False
+        self.warmed = False
+        self.init_seconds = 0.0
+        self.warm_seconds = 0.0
+        self.trigger: Optional[str] = None  # "warmup" or "first use"
+
+    def get(self, trigger: str = "first use") -> Any:
+        if self.built:
+            return self._value
+        with self._lock:
+            if not self.built:
+                started = time.perf_counter()
+                self._value = self._factory()
+                self.init_seconds = time.perf_counter() - started
+                self.trigger = trigger
+                self.built = True
+        return self._value
+
+    def override(self, value: Any) -> None:
+        with self._lock:
+            self._value = value
+            self.built = True
+            self.trigger = "override"
+
+    def warm(self) -> None:
+        """Build (if needed) and pre-open connections; never raises."""
+        try:
+            value = self.get("warmup")
+            if self._warm is not None and value is not None and not self.warmed:
+                started = time.perf_counter()
+                self._warm(value)
+                self.warm_seconds = time.perf_counter() - started
+            self.warmed = True
+        except Exception as e:
+            print(f"Warmup of {self.name} failed: {e}")
+
+    def close(self) -> None:
+        if self.built and self._close is not None and self._value is not None:
+            try:
+                self._close(self._value)
+            except Exception as e:
+                print(f"Closing {self.name} failed: {e}")
+
+    def __getattr__(self, attr: str) -> Any:
+        # Only reached for names LazyService itself does not define
+        return getattr(self.get(), attr)
+
+
+class ServiceRegistry:
+    """Upstream clients (Supabase, Gemini, SNS, the SQL pool), built lazily.
+
+    Modules register a factory at import, which costs nothing; the client is
+    built on first use. The app lifespan calls ``start_warmup`` so that, with
+    SERVICE_WARMUP on, clients are built and their connection pools opened
+    in the background right after startup instead of inside the first
+    request, and ``close`` on shutdown.
+    """
+
+    def __init__(self) -> None:
+        self.services: Dict[str, LazyService] = {}
+        self.import_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(
+        self,
+        name: str,
+        factory: Callable[[], Any],
+        warm: Optional[Callable[[Any], None]] = None,
+        close: Optional[Callable[[Any], None]] = None,
+    ) -> LazyService:
+        service = self.services[name] = LazyService(name, factory, warm, close)
+        return service
+
+    def get(self, name: str) -> Any:
+        return self.services[name].get()
+
+    # ---------- lifespan ----------
+
+    async def warmup(self) -> None:
+        started = time.perf_counter()
+        # Each warm hook blocks on I/O; run them side by side
+        await asyncio.gather(*(asyncio.to_thread(s.warm) for s in list(self.services.values())))
+        self.warmup_seconds = time.perf_counter() - started
+
+    def start_warmup(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.warmup())
+
+    async def wait_warmup(self) -> None:
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for service in self.services.values():
+            service.close()
+
+    # ---------- reporting ----------
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "built": s.built,
+                "warmed": s.warmed,
+                "trigger": s.trigger,
+                "init_ms": round(s.init_seconds * 1000, 1),
+                "warm_ms": round(s.warm_seconds * 1000, 1),
+            }
+            for name, s in self.services.items()
+        }
+
+    def render(self) -> str:
+        """Prometheus gauges for import and per-service init time."""
+        out: List[str] = []
+        if self.import_seconds is not None:
+            out.append("# HELP pillpal_import_seconds Time to import app.main in this worker.")
+            out.append("# TYPE pillpal_import_seconds gauge")
+            out.append(f"pillpal_import_seconds {self.import_seconds:.6f}")
+        out.append("# HELP pillpal_service_init_seconds Time to build each upstream client, by what built it.")
+        out.append("# TYPE pillpal_service_init_seconds gauge")
+        for name, s in sorted(self.services.items()):
+            if s.built:
+                out.append(f'pillpal_service_init_seconds{{service="{name}",trigger="{s.trigger}"}} {s.init_seconds:.6f}')
+        return "\n".join(out) + "\n"
+
+
+# Global instance
+registry = ServiceRegistry()
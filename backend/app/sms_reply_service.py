@@ -0,0 +1,307 @@
+import os
+import re
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+from urllib.parse import urlparse
+import httpx
+
+from .database import IN_CHUNK, supabase, select_paged, select_in
+from .timezones import parse_instant
+
+SMS_WEBHOOK_TOKEN = os.getenv("SMS_WEBHOOK_TOKEN", "")
+PHONE_INDEX_TTL_SECONDS = int(os.getenv("PHONE_INDEX_TTL_SECONDS", "300"))
+PHONE_INDEX_MIN_REBUILD_SECONDS = 30
+
+# Replies are matched on their first word
+REPLY_KEYWORDS = {
+    "TAKEN": "taken",
+    "TOOK": "taken",
+    "DONE": "taken",
+    "SKIP": "skipped",
+    "SKIPPED": "skipped",
+}
+
+# A reply answers every reminder still outstanding: all pending doses due in the last
+# REPLY_LOOKBACK. With none due it refers to the upcoming dose(s) from v_next_dose
+REPLY_LOOKBACK = timedelta(hours=3)
+
+_NON_DIGITS = re.compile(r"[^\d]")
+_FIRST_WORD = re.compile(r"[A-Za-z]+")
+
+
+def normalize_phone(raw: Optional[str]) -> Optional[str]:
+    """Reduce a phone number to E.164-ish form ("+15551234567") for index lookups."""
+    if not raw:
+        return None
+    digits = _NON_DIGITS.sub("", raw)
+    if not digits:
+        return None
+    if len(digits) == 10 and not raw.strip().startswith("+"):
+        digits = "1" + digits  # assume NANP when no country code given
+    return "+" + digits
+
+
+class InboundSMS(NamedTuple):
+    message_id: Optional[str]
+    phone: str
+    body: str
+
+
+def _sns_message(obj: Dict[str, Any]) -> Optional[InboundSMS]:
+    """Decode one SNS notification whose Message is an SMS inbound JSON document."""
+    msg = obj.get("Message", obj)
+    if isinstance(msg, str):
+        try:
+            msg = json.loads(msg)
+        except ValueError:
+            return None
+    if not isinstance(msg, dict):
+        return None
+    phone = msg.get("originationNumber") or msg.get("from")
+    body = msg.get("messageBody") or msg.get("body") or ""
+    if not phone:
+        return None
+    return InboundSMS(
+        message_id=msg.get("inboundMessageId") or obj.get("MessageId"),
+        phone=phone,
+        body=body,
+    )
+
+
+def parse_inbound_payload(payload: Any) -> List[InboundSMS]:
+    """Accept a single SNS notification, an SQS batch (Records/Messages), or a plain list."""
+    if isinstance(payload, list):
+        items = payload
+    elif isinstance(payload, dict) and isinstance(payload.get("Records"), list):
+        items = payload["Records"]
+    elif isinstance(payload, dict) and isinstance(payload.get("Messages"), list):
+        items = payload["Messages"]
+    else:
+        items = [payload]
+
+    out: List[InboundSMS] = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        # SQS wraps the SNS envelope in a string body; SNS->Lambda records nest it under "Sns"
+        body = item.get("body", item.get("Body"))
+        if isinstance(body, str):
+            try:
+                item = json.loads(body)
+            except ValueError:
+                continue
+        elif isinstance(item.get("Sns"), dict):
+            item = item["Sns"]
+        parsed = _sns_message(item)
+        if parsed:
+            out.append(parsed)
+    return out
+
+
+def reply_action(body: str) -> Optional[str]:
+    m = _FIRST_WORD.search(body or "")
+    return REPLY_KEYWORDS.get(m.group(0).upper()) if m else None
+
+
+class PhoneIndex:
+    """Cached normalized phone -> user id map built from users.phone_enc.
+
+    The whole map is rebuilt at most every ``ttl`` seconds; individual entries
+    are updated in place when a user changes their phone number.
+    """
+
+    def __init__(self, ttl: int = PHONE_INDEX_TTL_SECONDS):
+        self.ttl = ttl
+        self._by_phone: Dict[str, str] = {}
+        self._by_user: Dict[str, str] = {}
+        self._loaded_at = 0.0
+
+    def _rebuild(self) -> None:
+        rows = select_paged(lambda: (
+            supabase
+            .table("users")
+            .select("id, phone_enc")
+            .not_.is_("phone_enc", "null")
+            .order("id")
+        ))
+        by_phone: Dict[str, str] = {}
+        by_user: Dict[str, str] = {}
+        for r in rows:
+            phone = normalize_phone(r.get("phone_enc"))
+            if phone:
+                by_phone[phone] = r["id"]
+                by_user[r["id"]] = phone
+        self._by_phone, self._by_user = by_phone, by_user
+        self._loaded_at = time.monotonic()
+
+    def lookup_many(self, phones: List[str]) -> Dict[str, str]:
+        age = time.monotonic() - self._loaded_at
+        if not self._loaded_at or age > self.ttl:
+            self._rebuild()
+        found = {p: self._by_phone[p] for p in phones if p in self._by_phone}
+        # A number added by another worker shows up after one (rate-limited) rebuild
+        if len(found) < len(phones) and age > PHONE_INDEX_MIN_REBUILD_SECONDS:
+            self._rebuild()
+            found = {p: self._by_phone[p] for p in phones if p in self._by_phone}
+        return found
+
+    def set(self, user_id: str, phone: Optional[str]) -> None:
+        old = self._by_user.pop(user_id, None)
+        if old:
+            self._by_phone.pop(old, None)
+        norm = normalize_phone(phone)
+        if norm:
+            self._by_phone[norm] = user_id
+            self._by_user[user_id] = norm
+
+
+class SMSReplyService:
+    def __init__(self, seen_capacity: int = 50_000):
+        self.phone_index = PhoneIndex()
+        # Recently processed inbound ids, so SNS/SQS redeliveries are no-ops
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._seen_capacity = seen_capacity
+
+    def _seen_before(self, message_id: Optional[str]) -> bool:
+        return bool(message_id) and message_id in self._seen
+
+    def _remember(self, message_ids: List[str]) -> None:
+        """Record ids as processed; only called once their updates have been written."""
+        for message_id in message_ids:
+            self._seen[message_id] = None
+        while len(self._seen) > self._seen_capacity:
+            self._seen.popitem(last=False)
+
+    def _resolve_doses(self, user_ids: List[str], now: datetime) -> Dict[str, List[Dict[str, Any]]]:
+        """Pending doses each user's reply refers to: every one due within
+        REPLY_LOOKBACK (several medications are often due together), otherwise
+        the doses at the user's next scheduled time from v_next_dose."""
+        resolved: Dict[str, List[Dict[str, Any]]] = {}
+        recent = select_in(
+            "doses", "id, user_id, medication_id, scheduled_at", "user_id", user_ids,
+            refine=lambda q: (
+                q.eq("status", "pending")
+                .gte("scheduled_at", (now - REPLY_LOOKBACK).isoformat())
+                .lte("scheduled_at", now.isoformat())
+            ),
+        )
+        for d in recent:
+            resolved.setdefault(d["user_id"], []).append(d)
+
+        missing = [u for u in user_ids if u not in resolved]
+        if not missing:
+            return resolved
+        upcoming = {
+            nd["user_id"]: parse_instant(nd["scheduled_at"])
+            for nd in select_in("v_next_dose", "user_id, scheduled_at", "user_id", missing)
+            if nd.get("scheduled_at")
+        }
+        if not upcoming:
+            return resolved
+        # v_next_dose has one row per user; the other medications due at that same time come from doses
+        siblings = select_in(
+            "doses", "id, user_id, medication_id, scheduled_at", "user_id", sorted(upcoming),
+            refine=lambda q: (
+                q.eq("status", "pending")
+                .gte("scheduled_at", min(upcoming.values()).isoformat())
+                .lte("scheduled_at", max(upcoming.values()).isoformat())
+            ),
+            page_by="id",
+        )
+        for d in siblings:
+            if parse_instant(d["scheduled_at"]) == upcoming[d["user_id"]]:
+                resolved.setdefault(d["user_id"], []).append(d)
+        return resolved
+
+    async def confirm_subscription(self, payload: Dict[str, Any]) -> bool:
+        """Visit the SubscribeURL of an SNS SubscriptionConfirmation (AWS hosts only)."""
+        url = str(payload.get("SubscribeURL") or "")
+        host = urlparse(url).hostname or ""
+        if urlparse(url).scheme != "https" or not host.endswith(".amazonaws.com"):
+            return False
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                res = await client.get(url)
+            return res.status_code == 200
+        except Exception as e:
+            print(f"SNS subscription confirmation failed: {e}")
+            return False
+
+    def ingest(self, messages: List[InboundSMS]) -> Dict[str, Any]:
+        """Apply a batch of replies with one bulk UPDATE per target status.
+
+        Message ids are recorded as processed only after the updates are
+        written: if one raises, the webhook fails and the SNS/SQS redelivery
+        is applied instead of being dropped as a duplicate. Re-applying is
+        harmless, as only pending doses are updated.
+        """
+        now = datetime.now(timezone.utc)
+        actions: Dict[str, str] = {}  # normalized phone -> action; last reply in the batch wins
+        ignored = 0
+        batch_ids: List[str] = []
+        for m in messages:
+            if self._seen_before(m.message_id) or m.message_id in batch_ids:
+                ignored += 1
+                continue
+            if m.message_id:
+                batch_ids.append(m.message_id)
+            action = reply_action(m.body)
+            phone = normalize_phone(m.phone)
+            if not action or not phone:
+                ignored += 1
+                continue
+            actions[phone] = action
+
+        users = self.phone_index.lookup_many(list(actions))
+        unmatched = len(actions) - len(users)
+        if not users:
+            self._remember(batch_ids)
+            return {"received": len(messages), "updated": 0, "unmatched": unmatched, "ignored": ignored, "doses": []}
+
+        user_ids = sorted(set(users.values()))
+        doses = self._resolve_doses(user_ids, now)
+
+        by_status: Dict[str, Set[str]] = {}
+        for phone, user_id in users.items():
+            user_doses = doses.get(user_id)
+            if not user_doses:
+                unmatched += 1
+                continue
+            by_status.setdefault(actions[phone], set()).update(d["id"] for d in user_doses)
+
+        updated: List[Dict[str, Any]] = []
+        for status_value, dose_ids in by_status.items():
+            patch: Dict[str, Any] = {"status": status_value}
+            if status_value == "taken":
+                patch["taken_at"] = now.isoformat()
+            # Only flip doses that are still pending so late or duplicate replies are harmless
+            ids = sorted(dose_ids)
+            for i in range(0, len(ids), IN_CHUNK):
+                res = (
+                    supabase
+                    .table("doses")
+                    .update(patch)
+                    .in_("id", ids[i:i + IN_CHUNK])
+                    .eq("status", "pending")
+                    .execute()
+                )
+                updated.extend(res.data or [])
+
+        self._remember(batch_ids)
+        return {
+            "received": len(messages),
+            "updated": len(updated),
+            "unmatched": unmatched,
+            "ignored": ignored,
+            "doses": [
+                {k: d.get(k) for k in ("id", "user_id", "medication_id", "scheduled_at", "status", "taken_at")}
+                for d in updated
+            ],
+        }
+
+
+# Global instance
+sms_reply_service = SMSReplyService()
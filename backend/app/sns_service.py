@@ -1,25 +1,44 @@
 import os
-import boto3
-from typing import Optional
-from dotenv import load_dotenv
-
-load_dotenv()
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+from .services import LazyService, registry
+from .telemetry import span
 
 class SNSService:
-    def __init__(self):
+    def __init__(self, client=None):
         self.aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
         self.aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY")
         self.aws_region = os.getenv("AWS_REGION", "us-east-1")
         
-        if self.aws_access_key_id and self.aws_secret_access_key:
-            self.client = boto3.client(
-                'sns',
-                aws_access_key_id=self.aws_access_key_id,
-                aws_secret_access_key=self.aws_secret_access_key,
-                region_name=self.aws_region
-            )
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        if client is not None:
+            # Any object with a boto3-style publish(PhoneNumber=..., Message=...)
+            self._client = LazyService("sns", self._create_client)
+            self.client = client
         else:
-            self.client = None
+            self._client = registry.register("sns", self._create_client)
+
+    def _create_client(self):
+        if not (self.aws_access_key_id and self.aws_secret_access_key):
+            return None
+        # Deferred: boto3/botocore load their service models on import
+        import boto3
+        return boto3.client(
+            'sns',
+            aws_access_key_id=self.aws_access_key_id,
+            aws_secret_access_key=self.aws_secret_access_key,
+            region_name=self.aws_region
+        )
+
+    @property
+    def client(self):
+        return self._client.get()
+
+    @client.setter
+    def client(self, client) -> None:
+        self._client.override(client)
     
     async def send_missed_dose_alert(
         self,
@@ -43,10 +62,7 @@ class SNSService:
 Please check on them."""
         
         try:
-            response = self.client.publish(
-                PhoneNumber=caregiver_phone,
-                Message=message_body
-            )
+            response = self._publish(caregiver_phone, message_body)
             return response.get('MessageId')
         except Exception as e:
             print(f"Failed to send SMS: {e}")
@@ -64,23 +80,69 @@ Please check on them."""
             print("AWS SNS not configured - would send reminder SMS")
             return None
         
-        message_body = f"""💊 PillPal Reminder
-
-Time to take your {medication_name}
-⏰ {time_to_take}
-
-Reply 'TAKEN' when you've taken it."""
+        message_body = self._reminder_body(medication_name, time_to_take)
         
         try:
-            response = self.client.publish(
-                PhoneNumber=patient_phone,
-                Message=message_body
-            )
+            response = self._publish(patient_phone, message_body)
             return response.get('MessageId')
         except Exception as e:
             print(f"Failed to send reminder SMS: {e}")
             return None
 
+    def _publish(self, phone: str, body: str) -> dict:
+        with span("sns", "publish"):
+            return self.client.publish(PhoneNumber=phone, Message=body)
+
+    @staticmethod
+    def _reminder_body(medication_name: str, time_to_take: str) -> str:
+        return f"""💊 PillPal Reminder
+
+Time to take your {medication_name}
+⏰ {time_to_take}
+
+Reply 'TAKEN' when you've taken it."""
+
+    def _publish_chunk(self, messages: Sequence[Tuple[str, str]]) -> List[Optional[str]]:
+        ids: List[Optional[str]] = []
+        for phone, body in messages:
+            try:
+                response = self._publish(phone, body)
+                ids.append(response.get('MessageId'))
+            except Exception as e:
+                print(f"Failed to send reminder SMS: {e}")
+                ids.append(None)
+        return ids
+
+    async def send_reminder_batch(
+        self,
+        reminders: Sequence[Tuple[str, str, str]],
+        chunk_size: int = 250,
+        max_workers: int = 16
+    ) -> List[Optional[str]]:
+        """Send many (patient_phone, medication_name, time_to_take) reminders.
+
+        boto3 publish is blocking, so chunks are published on a thread pool
+        instead of one coroutine per message on the event loop.
+        """
+        if not reminders:
+            return []
+        if not self.client:
+            print(f"AWS SNS not configured - would send {len(reminders)} reminder SMS")
+            return [None] * len(reminders)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sns")
+        messages = [(phone, self._reminder_body(med, when)) for phone, med, when in reminders]
+        loop = asyncio.get_running_loop()
+        futures = [
+            loop.run_in_executor(self._executor, self._publish_chunk, messages[i:i + chunk_size])
+            for i in range(0, len(messages), chunk_size)
+        ]
+        ids: List[Optional[str]] = []
+        for chunk_ids in await asyncio.gather(*futures):
+            ids.extend(chunk_ids)
+        return ids
+
     async def send_text(self, to: str, body: str) -> Optional[str]:
         """Send a generic SMS message."""
         if not self.client:
@@ -88,10 +150,7 @@ Reply 'TAKEN' when you've taken it."""
             return None
         
         try:
-            response = self.client.publish(
-                PhoneNumber=to,
-                Message=body
-            )
+            response = self._publish(to, body)
             return response.get('MessageId')
         except Exception as e:
             print(f"Failed to send SMS: {e}")
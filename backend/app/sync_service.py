@@ -0,0 +1,205 @@
+import os
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .database import supabase
+
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500"))
+SYNC_MAX_MUTATIONS = int(os.getenv("SYNC_MAX_MUTATIONS", "200"))
+SYNC_TOMBSTONE_DAYS = int(os.getenv("SYNC_TOMBSTONE_DAYS", "30"))
+SYNC_PRUNE_ENABLED = os.getenv("SYNC_PRUNE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Synced table -> columns sent to clients (all rows also carry user_id and version)
+SYNC_ENTITIES = {
+    "medications": "*",
+    "med_times": "id, medication_id, time_of_day, version",
+    "doses": "id, medication_id, scheduled_at, status, taken_at, notes, version",
+}
+TOMBSTONES = "tombstones"
+
+_PRUNE_INTERVAL_SECONDS = 3600
+_FLOOR_TTL_SECONDS = 300
+
+
+class SyncService:
+    """Version-cursor reads and idempotency bookkeeping for /api/v1/sync.
+
+    Rows of each synced table carry a version from one Postgres sequence that
+    a trigger re-stamps on every update; deletes leave sync_tombstones rows
+    (see supabase/final_schema.sql). A client keeps one cursor per entity (plus
+    one for tombstones) and each sync reads ``version > cursor`` per entity,
+    so the work is proportional to what changed rather than to history.
+
+    Tombstones and mutation keys are pruned after SYNC_TOMBSTONE_DAYS; a
+    client whose tombstone cursor predates the pruned range is told to reset.
+    """
+
+    def __init__(self, page_size: int = SYNC_PAGE_SIZE, keep_days: int = SYNC_TOMBSTONE_DAYS):
+        self.page_size = page_size
+        self.keep_days = keep_days
+        self._task: Optional[asyncio.Task] = None
+        self._floor: Optional[Tuple[float, int]] = None
+        self.stats = {"syncs": 0, "resets": 0, "replayed": 0}
+
+    # ---------- reads ----------
+
+    def tombstone_floor(self) -> int:
+        """Highest pruned tombstone version (cached; 0 when nothing was pruned yet)."""
+        if self._floor and time.monotonic() - self._floor[0] < _FLOOR_TTL_SECONDS:
+            return self._floor[1]
+        floor = 0
+        try:
+            res = supabase.table("sync_meta").select("value").eq("key", "tombstone_floor").execute()
+            if res.data:
+                floor = int(res.data[0]["value"])
+        except Exception as e:
+            print(f"sync_meta read failed: {e}")
+        self._floor = (time.monotonic(), floor)
+        return floor
+
+    def _changed(self, table: str, user_id: str, since: int, limit: int) -> List[Dict[str, Any]]:
+        res = (
+            supabase
+            .table(table)
+            .select(SYNC_ENTITIES[table])
+            .eq("user_id", user_id)
+            .gt("version", since)
+            .order("version")
+            .limit(limit)
+            .execute()
+        )
+        return res.data or []
+
+    def _tombstones(self, user_id: str, since: int, limit: int) -> List[Dict[str, Any]]:
+        res = (
+            supabase
+            .table("sync_tombstones")
+            .select("version, entity, entity_id")
+            .eq("user_id", user_id)
+            .gt("version", since)
+            .order("version")
+            .limit(limit)
+            .execute()
+        )
+        return res.data or []
+
+    def _latest_tombstone(self, user_id: str) -> int:
+        res = (
+            supabase
+            .table("sync_tombstones")
+            .select("version")
+            .eq("user_id", user_id)
+            .order("version", desc=True)
+            .limit(1)
+            .execute()
+        )
+        return int(res.data[0]["version"]) if res.data else 0
+
+    async def changes(self, user_id: str, cursor: Dict[str, int], limit: Optional[int] = None) -> Dict[str, Any]:
+        """Rows and deletes after ``cursor`` ({entity: version}), at most ``limit`` per entity.
+
+        With no usable cursor (first sync, or a tombstone cursor older than the
+        pruned range) this is a full snapshot with ``reset`` set: the client
+        should drop local rows that the snapshot pages do not return. A
+        snapshot has no tombstones to send; its tombstone cursor is read before
+        the rows so a delete racing the snapshot is still delivered next time.
+        """
+        limit = max(1, min(limit or self.page_size, self.page_size))
+        cursor = {k: max(0, int(cursor.get(k) or 0)) for k in (*SYNC_ENTITIES, TOMBSTONES)}
+        reset = not any(cursor.values())
+        if not reset and 0 < cursor[TOMBSTONES] < self.tombstone_floor():
+            reset = True
+        if reset:
+            cursor = {k: 0 for k in cursor}
+            cursor[TOMBSTONES] = await asyncio.to_thread(self._latest_tombstone, user_id)
+            self.stats["resets"] += 1
+
+        reads = [asyncio.to_thread(self._changed, table, user_id, cursor[table], limit) for table in SYNC_ENTITIES]
+        if not reset:
+            reads.append(asyncio.to_thread(self._tombstones, user_id, cursor[TOMBSTONES], limit))
+        results = await asyncio.gather(*reads)
+
+        out: Dict[str, Any] = {"reset": reset, "has_more": False, "deleted": {table: [] for table in SYNC_ENTITIES}}
+        next_cursor = dict(cursor)
+        for table, rows in zip(SYNC_ENTITIES, results):
+            out[table] = rows
+            if rows:
+                next_cursor[table] = int(rows[-1]["version"])
+            out["has_more"] |= len(rows) == limit
+        if not reset:
+            tombstones = results[-1]
+            for t in tombstones:
+                out["deleted"].setdefault(t["entity"], []).append(t["entity_id"])
+            if tombstones:
+                next_cursor[TOMBSTONES] = int(tombstones[-1]["version"])
+            out["has_more"] |= len(tombstones) == limit
+        out["cursor"] = next_cursor
+        self.stats["syncs"] += 1
+        return out
+
+    # ---------- idempotency keys ----------
+
+    def seen(self, user_id: str, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Stored results for mutation keys this user already sent."""
+        if not keys:
+            return {}
+        res = (
+            supabase
+            .table("sync_mutations")
+            .select("key, result")
+            .eq("user_id", user_id)
+            .in_("key", keys)
+            .execute()
+        )
+        found = {r["key"]: r["result"] for r in res.data or []}
+        self.stats["replayed"] += len(found)
+        return found
+
+    def remember(self, user_id: str, results: List[Dict[str, Any]]) -> None:
+        """Record applied mutation results so a retried batch replays them instead of re-applying."""
+        if not results:
+            return
+        try:
+            supabase.table("sync_mutations").upsert(
+                [{"user_id": user_id, "key": r["key"], "result": r} for r in results],
+                on_conflict="user_id,key",
+                ignore_duplicates=True,
+            ).execute()
+        except Exception as e:
+            print(f"sync_mutations insert failed: {e}")
+
+    # ---------- pruning ----------
+
+    def prune(self) -> int:
+        floor = supabase.rpc("prune_sync_state", {"p_keep_days": self.keep_days}).execute().data
+        floor = int(floor or 0)
+        self._floor = (time.monotonic(), floor)
+        return floor
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.prune)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Sync prune error: {e}")
+            await asyncio.sleep(_PRUNE_INTERVAL_SECONDS)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Global instance
+sync_service = SyncService()
@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .profiler import slow_requests
+
+TIMING_ENABLED = os.getenv("TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+TIMING_LOG_ENABLED = os.getenv("TIMING_LOG_ENABLED", "true").lower() in ("1", "true", "yes")
+TIMING_LOG_SLOW_MS = float(os.getenv("TIMING_LOG_SLOW_MS", "0"))  # only log requests at least this slow
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # bearer token for /metrics; open when unset
+
+# Histogram upper bounds in seconds (Prometheus "le" buckets)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_MAX_SPANS = 256  # per request; later spans still count towards the totals
+_SKIP_PATHS = frozenset(("/metrics", "/healthz", "/readyz"))
+_SKIP_PREFIX = "/api/v1/admin/"  # a profile run would always land in the slow-request log
+
+# (upstream, op, start offset from request start, duration, ok), all in seconds
+Span = Tuple[str, str, float, float, bool]
+
+
+class Trace:
+    """Upstream spans recorded while one request is being handled."""
+
+    __slots__ = ("start", "spans", "totals", "dropped", "samples")
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.spans: List[Span] = []
+        self.totals: Dict[str, List[float]] = {}  # upstream -> [calls, seconds]
+        self.dropped = 0
+        self.samples: Optional[Dict[str, int]] = None  # folded stack -> count, slow requests only
+
+    def add(self, upstream: str, op: str, started: float, duration: float, ok: bool) -> None:
+        total = self.totals.get(upstream)
+        if total is None:
+            self.totals[upstream] = [1, duration]
+        else:
+            total[0] += 1
+            total[1] += duration
+        if len(self.spans) < _MAX_SPANS:
+            self.spans.append((upstream, op, started - self.start, duration, ok))
+        else:
+            self.dropped += 1
+
+    def waiting(self) -> float:
+        """Wall time covered by at least one upstream call (overlapping calls count once)."""
+        busy = 0.0
+        end = 0.0
+        for _, _, start, duration, _ in sorted(self.spans, key=lambda s: s[2]):
+            stop = start + duration
+            if stop > end:
+                busy += stop - max(start, end)
+                end = stop
+        return busy
+
+    def server_timing(self, now: float) -> str:
+        total = now - self.start
+        parts = [
+            f'{name};dur={seconds * 1000:.1f};desc="{int(calls)} calls"'
+            for name, (calls, seconds) in self.totals.items()
+        ]
+        parts.append(f"app;dur={max(0.0, total - self.waiting()) * 1000:.1f}")
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("pillpal_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+class Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+
+class Metrics:
+    """Per-route and per-upstream latency histograms, rendered for Prometheus.
+
+    Everything is in-process and per worker; Prometheus sums across workers.
+    Spans recorded outside a request (background jobs) still land in the
+    upstream histograms.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str, str], Histogram] = {}
+        self.upstreams: Dict[Tuple[str, str], Histogram] = {}
+        self.upstream_errors: Dict[Tuple[str, str], int] = {}
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float) -> None:
+        key = (method, route, f"{status // 100}xx")
+        with self._lock:
+            hist = self.requests.get(key)
+            if hist is None:
+                hist = self.requests[key] = Histogram()
+            hist.observe(seconds)
+
+    def observe_upstream(self, upstream: str, op: str, seconds: float, ok: bool) -> None:
+        key = (upstream, op)
+        with self._lock:
+            hist = self.upstreams.get(key)
+            if hist is None:
+                hist = self.upstreams[key] = Histogram()
+            hist.observe(seconds)
+            if not ok:
+                self.upstream_errors[key] = self.upstream_errors.get(key, 0) + 1
+
+    @staticmethod
+    def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+        return ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+
+    def _histogram(self, out: List[str], name: str, help_text: str, names: Tuple[str, ...], series) -> None:
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} histogram")
+        for key, hist in sorted(series.items()):
+            labels = self._labels(names, key)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, hist.counts):
+                cumulative += count
+                out.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += hist.counts[-1]
+            out.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            out.append(f"{name}_sum{{{labels}}} {hist.sum:.6f}")
+            out.append(f"{name}_count{{{labels}}} {cumulative}")
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            requests = {k: _copy(h) for k, h in self.requests.items()}
+            upstreams = {k: _copy(h) for k, h in self.upstreams.items()}
+            errors = dict(self.upstream_errors)
+        out: List[str] = []
+        self._histogram(
+            out, "pillpal_http_request_duration_seconds", "Time to handle a request, by route template.",
+            ("method", "route", "status"), requests,
+        )
+        self._histogram(
+            out, "pillpal_upstream_duration_seconds", "Time spent in one upstream call.",
+            ("upstream", "op"), upstreams,
+        )
+        out.append("# HELP pillpal_upstream_errors_total Upstream calls that raised.")
+        out.append("# TYPE pillpal_upstream_errors_total counter")
+        for key, count in sorted(errors.items()):
+            out.append(f"pillpal_upstream_errors_total{{{self._labels(('upstream', 'op'), key)}}} {count}")
+        return "\n".join(out) + "\n"
+
+
+def _copy(hist: Histogram) -> Histogram:
+    clone = Histogram()
+    clone.counts = list(hist.counts)
+    clone.sum = hist.sum
+    return clone
+
+
+# Global instance
+metrics = Metrics()
+
+
+class _Span:
+    __slots__ = ("upstream", "op", "started", "trace")
+
+    def __init__(self, upstream: str, op: str) -> None:
+        self.upstream = upstream
+        self.op = op
+
+    def __enter__(self) -> "_Span":
+        self.trace = _current.get()
+        if self.trace is not None and slow_requests.enabled:
+            # Lets the slow-request sampler attribute this thread's stacks
+            slow_requests.thread_traces[threading.get_ident()] = self.trace
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration = time.perf_counter() - self.started
+        ok = exc_type is None
+        metrics.observe_upstream(self.upstream, self.op, duration, ok)
+        if self.trace is not None:
+            self.trace.add(self.upstream, self.op, self.started, duration, ok)
+            if slow_requests.enabled:
+                slow_requests.thread_traces.pop(threading.get_ident(), None)
+
+
+def span(upstream: str, op: str) -> _Span:
+    """Time one upstream call: ``with span("gemini", "risk_insights"): ...``.
+
+    Works from threads too: asyncio.to_thread copies the request's context.
+    ``op`` becomes a metric label, so keep it to a fixed set of names.
+    """
+    return _Span(upstream, op)
+
+
+# ---------- supabase (PostgREST) ----------
+
+_POSTGREST_OPS = {"GET": "select", "HEAD": "count", "POST": "insert", "PATCH": "update", "DELETE": "delete"}
+
+
+def _postgrest_op(builder: Any) -> str:
+    path = builder.path.strip("/")
+    if path.startswith("rpc/"):
+        return f"rpc {path[4:]}"
+    verb = _POSTGREST_OPS.get(builder.http_method, builder.http_method.lower())
+    if verb == "insert" and "resolution=" in (builder.headers.get("Prefer") or ""):
+        verb = "upsert"
+    return f"{verb} {path}"
+
+
+def instrument_postgrest() -> None:
+    """Wrap every PostgREST execute() (which is what supabase.table()/rpc() run) in a span.
+
+    Patches the request builder classes once, so it also covers queries built
+    in modules that captured the client at import time.
+    """
+    try:
+        from postgrest._sync import request_builder
+    except ImportError:
+        return
+    # SyncMaybeSingleRequestBuilder delegates to SyncSingleRequestBuilder.execute
+    for cls in (request_builder.SyncQueryRequestBuilder, request_builder.SyncSingleRequestBuilder):
+        execute = cls.__dict__["execute"]
+        if getattr(execute, "_timed", False):
+            continue
+
+        def timed(self, _execute: Callable = execute):
+            with span("supabase", _postgrest_op(self)):
+                return _execute(self)
+
+        setattr(timed, "_timed", True)
+        timed.__doc__ = execute.__doc__
+        cls.execute = timed
+
+
+# ---------- middleware ----------
+
+class TimingMiddleware:
+    """ASGI middleware: times each request and the upstream spans made while handling it.
+
+    Adds a Server-Timing header (per-upstream totals, ``app`` = time not spent
+    waiting on any upstream, and ``total``), feeds the request histogram and
+    prints one JSON log line per request. Written as plain ASGI rather than
+    BaseHTTPMiddleware so streaming responses are not buffered. Requests
+    slower than SLOW_REQUEST_MS also go to the slow-request log.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._routes: Optional[Dict[Any, str]] = None
+
+    def _route(self, scope: Scope) -> str:
+        # The router records the matched endpoint in the (shared) scope
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None:
+            self._routes = {
+                getattr(r, "endpoint", None): r.path
+                for r in getattr(scope.get("app"), "routes", [])
+                if hasattr(r, "path")
+            }
+        return self._routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not TIMING_ENABLED or path in _SKIP_PATHS or path.startswith(_SKIP_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        trace = Trace()
+        token = _current.set(trace)
+        frame = sys._getframe()
+        slow_requests.begin(trace, frame)
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing(time.perf_counter()).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            slow_requests.end(frame)
+            _current.reset(token)
+            self._finish(scope, trace, status)
+
+    def _finish(self, scope: Scope, trace: Trace, status: int) -> None:
+        try:
+            total = time.perf_counter() - trace.start
+            route = self._route(scope)
+            metrics.observe_request(scope["method"], route, status, total)
+            log = TIMING_LOG_ENABLED and total * 1000 >= TIMING_LOG_SLOW_MS
+            if not log and not (slow_requests.enabled and total >= slow_requests.threshold):
+                return
+            entry: Dict[str, Any] = {
+                "event": "request",
+                "method": scope["method"],
+                "route": route,
+                "status": status,
+                "ms": round(total * 1000, 1),
+                "app_ms": round(max(0.0, total - trace.waiting()) * 1000, 1),
+                "upstream": {
+                    name: {"calls": int(calls), "ms": round(seconds * 1000, 1)}
+                    for name, (calls, seconds) in trace.totals.items()
+                },
+            }
+            if trace.dropped:
+                entry["spans_dropped"] = trace.dropped
+            if log:
+                print(json.dumps(entry, separators=(",", ":")))
+            slow_requests.record(trace, entry, scope["path"])
+        except Exception as e:
+            print(f"Request timing failed: {e}")
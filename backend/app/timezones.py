@@ -0,0 +1,63 @@
+from datetime import date, datetime, time, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+UTC = ZoneInfo("UTC")
+
+
+@lru_cache(maxsize=512)
+def resolve_zone(name: str | None) -> ZoneInfo:
+    """Return the ZoneInfo for an IANA name (e.g. "America/New_York"), falling back to UTC."""
+    if not name:
+        return UTC
+    try:
+        return ZoneInfo(name.strip())
+    except (ZoneInfoNotFoundError, ValueError):
+        return UTC
+
+
+def is_valid_zone(name: str | None) -> bool:
+    if not name:
+        return False
+    return resolve_zone(name) is not UTC or name.strip().upper() == "UTC"
+
+
+def local_instant(day: date, t: time, zone: ZoneInfo) -> datetime:
+    """The real instant for a wall-clock time on a local date.
+
+    Across DST transitions: a time inside the spring-forward gap (02:30 when
+    clocks jump 02:00 -> 03:00) is moved forward by the gap (03:30), and an
+    ambiguous fall-back time (01:30 twice) resolves to its first occurrence.
+    """
+    # fold=0 applies the pre-transition offset in both cases (PEP 495);
+    # the round trip normalizes the wall clock of gap times
+    return datetime.combine(day, t, tzinfo=zone).astimezone(timezone.utc).astimezone(zone)
+
+
+# Stored timestamps repeat heavily (same dose times across days and users), so
+# parsing and zone conversion are memoized per distinct string instead of per row.
+
+@lru_cache(maxsize=131072)
+def parse_instant(value: str) -> datetime:
+    """Parse a PostgREST timestamptz string into an aware UTC datetime."""
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+@lru_cache(maxsize=131072)
+def to_local(value: str, tz_name: str | None) -> datetime:
+    return parse_instant(value).astimezone(resolve_zone(tz_name))
+
+
+@lru_cache(maxsize=131072)
+def to_local_iso(value: str, tz_name: str | None) -> str:
+    return to_local(value, tz_name).isoformat()
+
+
+@lru_cache(maxsize=131072)
+def to_local_json(value: str, tz_name: str | None) -> str:
+    """to_local_iso as pydantic serializes a datetime: a zero UTC offset is written as Z."""
+    text = to_local_iso(value, tz_name)
+    return text[:-6] + "Z" if text.endswith("+00:00") else text
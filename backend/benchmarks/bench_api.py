@@ -0,0 +1,370 @@
+"""End-to-end /api/v1 benchmarks against in-process stand-ins (benchmarks/fakes.py).
+
+Usage (from backend/):
+    python -m benchmarks.bench_api                                   # 200 patients x 90 days, every route
+    python -m benchmarks.bench_api --patients 1000 --days 180 --requests 500
+    python -m benchmarks.bench_api --routes doses,sync --db-latency-ms 2
+    python -m benchmarks.bench_api --save baseline.json
+    python -m benchmarks.bench_api --compare baseline.json --tolerance 0.2
+
+Seeds a FakeSupabase with a synthetic population (benchmarks/population.py):
+patients with realistic regimens and ``--days`` of dose history plus two
+days ahead, caregivers, clinicians, escalation rules, risk scores and
+alerts. Requests go through the real ASGI app
+(middleware, auth dependency, handlers, response models) over
+httpx.ASGITransport, so nothing but the network and Postgres is simulated.
+Supabase, Gemini and SNS calls sleep the configured latency to stand in for
+the round trip.
+
+Each scenario runs ``--warmup`` untimed requests, then ``--requests`` timed
+ones across ``--concurrency`` in-flight clients, each as a randomly chosen
+user. Reports throughput and p50/p95/p99/max latency per route. With
+``--compare`` the run exits non-zero when any route's p95 is more than
+``--tolerance`` slower than in the saved baseline.
+
+/api/v1/stream (long-lived SSE) and the admin endpoints are not covered.
+"""
+import os
+
+# Per-request JSON log lines would dominate the output; timing stays on
+os.environ.setdefault("TIMING_LOG_ENABLED", "false")
+os.environ.setdefault("SMS_WEBHOOK_TOKEN", "bench-webhook-token")
+os.environ.setdefault("COHORT_REFRESH_ENABLED", "false")
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import count
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+
+from benchmarks.fakes import FakeGenerativeModel, FakeSNSClient, FakeSupabase, install, utc_iso
+from benchmarks.population import CATALOG, TABLES, Population, generate, headers_for, write_fake
+
+import app.main as main
+from app.event_log import log_writer
+from app.sms_reply_service import SMS_WEBHOOK_TOKEN
+
+SIGS = [d.sig for d in CATALOG]
+TIMES = [["08:00"], ["08:00", "20:00"], ["08:00", "14:00", "20:00"], ["21:30"]]
+
+
+class User(NamedTuple):
+    id: str
+    role: str
+    timezone: str
+    phone: Optional[str]
+    headers: Dict[str, str]
+
+
+class Scenario(NamedTuple):
+    name: str
+    build: Callable[["Bench", random.Random], Tuple[str, str, Dict[str, Any]]]  # -> method, url, httpx kwargs
+    expect: Tuple[int, ...] = (200,)
+
+
+class Bench:
+    """Seeded population plus the helpers scenarios use to pick targets."""
+
+    def __init__(self, db: FakeSupabase, pop: Population):
+        self.db = db
+        write_fake(db, pop)
+        users = {r["id"]: r for r in pop.rows["users"]}
+        self.users = {uid: User(uid, r["role"], r["timezone"], r["phone_enc"], headers_for(r)) for uid, r in users.items()}
+        self.patients = [self.users[r["id"]] for r in pop.patients]
+        self.with_phone = [p for p in self.patients if p.phone]
+        self.caregivers = [self.users[r["id"]] for r in pop.caregivers]
+        self.clinician = self.users[pop.clinicians[0]["id"]]
+        self.meds = {pid: [m["id"] for m in meds] for pid, meds in pop.meds.items()}  # patient id -> medication ids
+        self.alerts = [a["id"] for a in pop.rows["alerts"]]
+        self.seq = count()
+
+# ---------- target pickers (untimed) ----------
+
+    def patient(self, rng: random.Random) -> User:
+        return rng.choice(self.patients)
+
+    def doses_of(self, user_id: str) -> List[Dict[str, Any]]:
+        return list(self.db.get("doses").index["user_id"].get(user_id, {}).values())
+
+    def summary(self) -> str:
+        counts = ", ".join(f"{t}={self.db.count(t)}" for t in TABLES)
+        return f"Seeded {counts}"
+
+
+# ---------- scenarios ----------
+
+def _call(method: str, path: str, who: str = "patient") -> Callable[[Bench, random.Random], Tuple[str, str, Dict[str, Any]]]:
+    def build(b: Bench, rng: random.Random) -> Tuple[str, str, Dict[str, Any]]:
+        user = {"patient": b.patient, "caregiver": lambda r: r.choice(b.caregivers), "clinician": lambda r: b.clinician}[who](rng)
+        return method, path, {"headers": user.headers}
+    return build
+
+
+def _patch_me(b: Bench, rng: random.Random):
+    p = b.patient(rng)
+    return "PATCH", "/api/v1/user/me", {"headers": p.headers, "json": {"timezone": p.timezone}}
+
+
+def _create_med(b: Bench, rng: random.Random):
+    p = b.patient(rng)
+    drug = rng.choice(CATALOG)
+    body = {"name": drug.name, "strength_text": drug.strength_text, "dose_text": drug.dose_text, "instructions": drug.sig}
+    return "POST", "/api/v1/medications", {"headers": p.headers, "json": body}
+
+
+def _batch_meds(b: Bench, rng: random.Random):
+    p = b.patient(rng)
+    items = [
+        {"client_key": str(uuid.uuid4()), "name": drug.name, "strength_text": drug.strength_text, "instructions": drug.sig}
+        for drug in rng.sample(CATALOG, 5)
+    ]
+    return "POST", "/api/v1/medications/batch", {"headers": p.headers, "json": {"medications": items}}
+
+
+def _replace_times(b: Bench, rng: random.Random):
+    p = b.patient(rng)
+    mid = rng.choice(b.meds[p.id])
+    return "PUT", f"/api/v1/medications/{mid}/times", {"headers": p.headers, "json": {"times": rng.choice(TIMES)}}
+
+
+def _delete_med(b: Bench, rng: random.Random):
+    p = b.patient(rng)
+    med = b.db.load("medications", [{"user_id": p.id, "name": "Temporary"}])[0]
+    return "DELETE", f"/api/v1/medications/{med['id']}", {"headers": p.headers}
+
+
+def _create_dose(b: Bench, rng: random.Random):
+    p = b.patient(rng)
+    at = datetime.now(timezone.utc) + timedelta(days=30, seconds=next(b.seq))
+    body = {"medication_id": rng.choice(b.meds[p.id]), "scheduled_at": at.isoformat()}
+    return "POST", "/api/v1/doses", {"headers": p.headers, "json": body}
+
+
+def _update_dose(b: Bench, rng: random.Random):
+    p = b.patient(rng)
+    dose = rng.choice(b.doses_of(p.id))
+    return "PATCH", f"/api/v1/doses/{dose['id']}", {"headers": p.headers, "json": {"status": "taken"}}
+
+
+def _bulk_doses(b: Bench, rng: random.Random):
+    p = b.patient(rng)
+    doses = b.doses_of(p.id)
+    items = [
+        {"id": d["id"], "status": "taken", "taken_at": d["scheduled_at"], "expected_status": d["status"]}
+        for d in rng.sample(doses, min(20, len(doses)))
+    ]
+    return "PATCH", "/api/v1/doses/bulk", {"headers": p.headers, "json": {"items": items}}
+
+
+def _sync_snapshot(b: Bench, rng: random.Random):
+    p = b.patient(rng)
+    return "POST", "/api/v1/sync", {"headers": p.headers, "json": {}}
+
+
+def _sync_delta(b: Bench, rng: random.Random):
+    # Cursor just behind the newest rows: a client that was offline for a few changes
+    p = b.patient(rng)
+    latest = max((d["version"] for d in b.doses_of(p.id)), default=0)
+    cursor = {"medications": latest, "med_times": latest, "doses": max(0, latest - 20), "tombstones": latest}
+    return "POST", "/api/v1/sync", {"headers": p.headers, "json": {"cursor": cursor}}
+
+
+def _missed_dose(b: Bench, rng: random.Random):
+    p = b.patient(rng)
+    past = [d for d in b.doses_of(p.id) if d["status"] in ("pending", "missed") and d["scheduled_at"] < utc_iso(datetime.now(timezone.utc))]
+    dose = rng.choice(past or b.doses_of(p.id))
+    return "POST", "/api/v1/alerts/missed-dose", {"headers": p.headers, "params": {"dose_id": dose["id"]}}
+
+
+def _acknowledge(b: Bench, rng: random.Random):
+    return "POST", f"/api/v1/alerts/acknowledge/{rng.choice(b.alerts)}", {"headers": rng.choice(b.caregivers).headers}
+
+
+def _intent(b: Bench, rng: random.Random):
+    return "POST", "/api/v1/intent", {"headers": b.patient(rng).headers, "json": {"query": "When is my next dose?"}}
+
+
+_LABEL_IMAGE = b"\xff\xd8\xff\xe0" + bytes(48_000)  # ~48 KB phone photo stand-in
+
+
+def _label_extract(b: Bench, rng: random.Random):
+    files = {"file": ("label.jpg", _LABEL_IMAGE, "image/jpeg")}
+    return "POST", "/api/v1/label-extract", {"headers": b.patient(rng).headers, "files": files}
+
+
+def _sms_inbound(b: Bench, rng: random.Random):
+    p = rng.choice(b.with_phone)
+    message = {"originationNumber": p.phone, "messageBody": rng.choice(["TAKEN", "SKIP"]), "inboundMessageId": str(uuid.uuid4())}
+    body = {"Type": "Notification", "MessageId": str(uuid.uuid4()), "Message": json.dumps(message)}
+    return "POST", "/api/v1/sms/inbound", {"headers": {"X-Webhook-Token": SMS_WEBHOOK_TOKEN}, "json": body}
+
+
+def _test_sms(b: Bench, rng: random.Random):
+    return "POST", "/api/v1/test/sms", {"headers": b.patient(rng).headers, "params": {"phone": "+15550000000"}}
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("user.me", _call("GET", "/api/v1/user/me")),
+    Scenario("user.update", _patch_me),
+    Scenario("user.next_dose", _call("GET", "/api/v1/user/next-dose")),
+    Scenario("medications.list", _call("GET", "/api/v1/medications")),
+    Scenario("medications.create", _create_med),
+    Scenario("medications.batch", _batch_meds),
+    Scenario("medications.times", _replace_times),
+    Scenario("medications.delete", _delete_med),
+    Scenario("doses.create", _create_dose),
+    Scenario("doses.list", _call("GET", "/api/v1/doses")),
+    Scenario("doses.update", _update_dose),
+    Scenario("doses.bulk", _bulk_doses),
+    Scenario("sync.snapshot", _sync_snapshot),
+    Scenario("sync.delta", _sync_delta),
+    Scenario("risk", _call("GET", "/api/v1/risk")),
+    Scenario("risk.today", _call("GET", "/api/v1/risk/today")),
+    Scenario("risk.insights", _call("GET", "/api/v1/risk/insights")),
+    Scenario("alerts.feed", _call("GET", "/api/v1/alerts/feed")),
+    Scenario("alerts.missed_doses", _call("GET", "/api/v1/alerts/missed-doses")),
+    Scenario("alerts.missed_dose", _missed_dose),
+    Scenario("alerts.acknowledge", _acknowledge),
+    Scenario("caregiver.summary", _call("GET", "/api/v1/caregiver/patients/summary", "caregiver")),
+    Scenario("clinician.cohort", _call("GET", "/api/v1/clinician/cohort?sort=risk&order=desc", "clinician")),
+    Scenario("intent", _intent),
+    Scenario("label_extract", _label_extract),
+    Scenario("sms.inbound", _sms_inbound),
+    Scenario("sms.test", _test_sms),
+    Scenario("notify.insights", _call("POST", "/api/v1/notify/insights")),
+    Scenario("export.csv", _call("GET", "/api/v1/export/adherence.csv")),
+]
+
+
+# ---------- runner ----------
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, bench: Bench, scenario: Scenario, requests: int, concurrency: int, warmup: int, seed: int
+) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    todo = count()
+
+    async def worker(n: int, timed: bool) -> None:
+        while next(todo) < n:
+            method, url, kwargs = scenario.build(bench, rng)
+            started = time.perf_counter()
+            res = await client.request(method, url, **kwargs)
+            elapsed = time.perf_counter() - started
+            if timed:
+                latencies.append(elapsed * 1000)
+            if res.status_code not in scenario.expect:
+                key = str(res.status_code)
+                errors[key] = errors.get(key, 0) + 1
+                if errors[key] == 1:
+                    print(f"  {scenario.name}: {method} {url} -> {res.status_code} {res.text[:200]}")
+
+    await asyncio.gather(*(worker(warmup, False) for _ in range(concurrency)))
+    todo = count()
+    errors.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(requests, True) for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+        "errors": sum(errors.values()),
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("p95_ms"):
+            continue
+        ratio = r["p95_ms"] / base["p95_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f} -> {r['p95_ms']:.2f} ms ({ratio:.2f}x)")
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    db = FakeSupabase(args.db_latency_ms)
+    install(db, FakeGenerativeModel(args.gemini_latency_ms), FakeSNSClient(args.sns_latency_ms))
+    started = time.perf_counter()
+    bench = Bench(db, generate(args.patients, args.days, seed=args.seed))
+    print(f"{bench.summary()} in {time.perf_counter() - started:.1f}s")
+
+    wanted = [s.strip() for s in args.routes.split(",") if s.strip()] if args.routes else None
+    scenarios = [s for s in SCENARIOS if not wanted or any(s.name == w or s.name.startswith(w + ".") for w in wanted)]
+
+    log_writer.start()
+    results: Dict[str, Dict[str, Any]] = {}
+    header = f"{'route':<22}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for i, scenario in enumerate(scenarios):
+                r = await run_scenario(client, bench, scenario, args.requests, args.concurrency, args.warmup, args.seed + i)
+                results[scenario.name] = r
+                print(f"{scenario.name:<22}{r['rps']:>9.1f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}{r['errors']:>8}")
+    finally:
+        await log_writer.stop()
+    print(f"Supabase queries: {db.stats['queries']}")
+    return results
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--days", type=int, default=90, help="days of dose history per patient")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=0.0)
+    parser.add_argument("--sns-latency-ms", type=float, default=0.0)
+    parser.add_argument("--routes", default="", help="comma-separated route names or prefixes, e.g. doses,sync.delta")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON from --save; exit 1 on p95 regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown vs baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"Saved {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No p95 regressions beyond {args.tolerance:.0%} vs {args.compare}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,187 @@
+"""Cold start: import time, upstream client construction and first-request latency.
+
+Usage (from backend/):
+    python -m benchmarks.bench_cold_start                    # 5 fresh processes per mode
+    python -m benchmarks.bench_cold_start --runs 10 --top 20
+    python -m benchmarks.bench_cold_start --db-latency-ms 3 --gemini-latency-ms 400
+
+Every measurement runs in a fresh interpreter, with dummy Supabase, Google
+and AWS credentials so each lazily built client (app/services.py) goes
+through its real constructor:
+
+* import: ``python -X importtime -c "import app.main"``, self time summed
+  per top-level package
+* with SERVICE_WARMUP off and on: app.main import time, how long the startup
+  warmup took, the build time of each client (and whether warmup or a
+  request built it), and the latency of the first and second
+  GET /api/v1/user/next-dose (Supabase) and POST /api/v1/intent (Supabase and
+  Gemini) made after startup
+
+Clients are built for real but requests are answered by benchmarks/fakes.py
+with the given latencies, so nothing leaves the machine. Reports the median
+over ``--runs`` processes. Warmup builds the clients side by side, so their
+build times overlap (and share import locks) rather than add up.
+"""
+import os
+
+# Dummy credentials: enough for the real constructors, never dialled
+CHILD_ENV = {
+    "SUPABASE_URL": "http://127.0.0.1:9",
+    "SUPABASE_SERVICE_ROLE": "bench.service.role",
+    "GOOGLE_API_KEY": "bench-google-api-key",
+    "AWS_ACCESS_KEY_ID": "AKIABENCHBENCHBENCH0",
+    "AWS_SECRET_ACCESS_KEY": "bench-aws-secret-access-key",
+    "AWS_REGION": "us-east-1",
+    "TIMING_LOG_ENABLED": "false",
+    "DOSE_MATERIALIZER_ENABLED": "false",
+    "REMINDERS_ENABLED": "false",
+    "COHORT_REFRESH_ENABLED": "false",
+    "SYNC_PRUNE_ENABLED": "false",
+    "DOSE_ARCHIVE_ENABLED": "false",
+}
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+ROUTES = [
+    ("next_dose", "GET", "/api/v1/user/next-dose", None),
+    ("intent", "POST", "/api/v1/intent", {"query": "When is my next dose?"}),
+]
+
+
+def _env(warmup: bool) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update(CHILD_ENV)
+    env.pop("DATABASE_URL", None)  # no SQL pool to dial
+    env["SERVICE_WARMUP"] = "true" if warmup else "false"
+    return env
+
+
+def import_breakdown(top: int) -> Dict[str, Any]:
+    """Self time per top-level package from -X importtime (microseconds in, seconds out)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        env=_env(False), capture_output=True, text=True, check=True,
+    )
+    packages: Dict[str, int] = {}
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+        if name.strip() == "app.main":
+            total = int(cumulative_us)
+    ranked = sorted(packages.items(), key=lambda kv: -kv[1])[:top]
+    return {"total": total / 1e6, "packages": [(p, us / 1e6) for p, us in ranked]}
+
+
+def child(db_latency_ms: float, gemini_latency_ms: float) -> None:
+    """One cold start; prints a RESULT line of JSON for the parent."""
+    started = time.perf_counter()
+    import app.main as main
+    import_s = time.perf_counter() - started
+
+    import asyncio
+    import httpx
+    from app.services import SERVICE_WARMUP, registry
+    from benchmarks.fakes import FakeGenerativeModel, FakeSNSClient, FakeSupabase
+    from benchmarks.population import generate, headers_for, write_fake
+
+    db = FakeSupabase(db_latency_ms)
+    pop = generate(patients=5, days=7, seed=1)
+    write_fake(db, pop)
+    model = FakeGenerativeModel(gemini_latency_ms)
+    stand_ins = {"supabase": db, "gemini_text": model, "gemini_vision": model, "sns": FakeSNSClient()}
+    # Build the real client (that is the cost being measured), then answer with the fake
+    for name, service in registry.services.items():
+        service._factory = lambda real=service._factory, fake=stand_ins.get(name): (real(), fake)[1]
+    headers = headers_for(pop.patients[0])
+
+    async def run() -> Dict[str, Any]:
+        out: Dict[str, Any] = {"import": import_s, "warmup": None, "requests": {}}
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.lifespan(main.app):
+            if SERVICE_WARMUP:
+                await registry.wait_warmup()
+                out["warmup"] = registry.warmup_seconds
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for label, method, path, body in ROUTES:
+                    timings = []
+                    for _ in range(2):
+                        t = time.perf_counter()
+                        resp = await client.request(method, path, headers=headers, json=body)
+                        timings.append(time.perf_counter() - t)
+                        if resp.status_code != 200:
+                            raise SystemExit(f"{method} {path}: {resp.status_code} {resp.text[:200]}")
+                    out["requests"][label] = timings
+        out["services"] = registry.status()
+        for name, service in registry.services.items():
+            if not service.built:
+                service.get("after requests")  # never used by these routes; still report its cost
+                out["services"][name] = registry.status()[name]
+        return out
+
+    result = asyncio.run(run())
+    print("RESULT " + json.dumps(result))
+
+
+def spawn(warmup: bool, args: argparse.Namespace) -> Dict[str, Any]:
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_cold_start", "--child",
+         "--db-latency-ms", str(args.db_latency_ms), "--gemini-latency-ms", str(args.gemini_latency_ms)],
+        env=_env(warmup), capture_output=True, text=True,
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise SystemExit(f"child failed:\n{proc.stdout[-2000:]}\n{proc.stderr[-2000:]}")
+
+
+def report_mode(label: str, runs: List[Dict[str, Any]]) -> None:
+    ms = lambda values: statistics.median(values) * 1000
+    print(f"\nSERVICE_WARMUP={label}")
+    print(f"  import app.main   {ms([r['import'] for r in runs]):9.1f} ms")
+    if runs[0]["warmup"] is not None:
+        print(f"  startup warmup    {ms([r['warmup'] for r in runs]):9.1f} ms  (in the background, before the first request)")
+    for name, _, _, _ in ROUTES:
+        first = ms([r["requests"][name][0] for r in runs])
+        second = ms([r["requests"][name][1] for r in runs])
+        print(f"  {name:<17} first {first:8.1f} ms   second {second:8.1f} ms")
+    print("  client builds:")
+    for name in sorted(runs[0]["services"]):
+        init = statistics.median(r["services"][name]["init_ms"] for r in runs)
+        triggers = sorted({r["services"][name]["trigger"] for r in runs})
+        print(f"    {name:<15} {init:9.1f} ms  built by {', '.join(triggers)}")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="packages to list in the import breakdown")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=0.0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.db_latency_ms, args.gemini_latency_ms)
+        return
+
+    breakdown = import_breakdown(args.top)
+    print(f"import app.main: {breakdown['total'] * 1000:.1f} ms (-X importtime, one run); self time by package:")
+    for package, seconds in breakdown["packages"]:
+        print(f"  {package:<28} {seconds * 1000:8.1f} ms")
+
+    for warmup in (False, True):
+        report_mode("true" if warmup else "false", [spawn(warmup, args) for _ in range(args.runs)])
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,201 @@
+"""Response compression: bytes saved and CPU spent per endpoint, encoding and level.
+
+Usage (from backend/):
+    python -m benchmarks.bench_compression                          # 20 patients x 90 days
+    python -m benchmarks.bench_compression --days 365 --link-kbps 400 --repeat 20
+    python -m benchmarks.bench_compression --routes doses,export.csv --levels gzip=1,5,9 br=4,11
+
+Seeds a FakeSupabase with a synthetic population (benchmarks/population.py)
+and fetches each endpoint uncompressed through the real ASGI app for the
+patient with the longest history (caregiver and clinician routes as the
+first of each). For every body it reports, per encoding and level:
+
+* compressed size and ratio
+* CPU per response (best of ``--repeat``, process CPU time)
+* net time at ``--link-kbps``: transfer time saved minus the CPU spent;
+  negative means compressing that body costs more than it saves
+
+Levels marked ``*`` are the app's defaults (COMPRESSION_*_LEVEL). The CSV
+export is also compressed as the middleware streams it, flushing after
+each chunk of _EXPORT_FLUSH_ROWS rows the endpoint yields, to show what
+flushing costs over one-shot.
+Finally each route is requested through the middleware with and without
+Accept-Encoding and the median latency of both is reported.
+
+br and zstd are measured only when brotli / zstandard are installed.
+"""
+import os
+
+os.environ.setdefault("TIMING_LOG_ENABLED", "false")
+os.environ.setdefault("COHORT_REFRESH_ENABLED", "false")
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import httpx
+
+import app.main as main
+from app.compression import _Stream, available_encodings, compress, default_levels
+from benchmarks.fakes import FakeGenerativeModel, FakeSNSClient, FakeSupabase, install
+from benchmarks.population import generate, headers_for, write_fake
+
+ROUTES: List[Tuple[str, str, str, str]] = [
+    ("user.me", "GET", "/api/v1/user/me", "patient"),
+    ("medications", "GET", "/api/v1/medications", "patient"),
+    ("doses", "GET", "/api/v1/doses", "patient"),
+    ("alerts.feed", "GET", "/api/v1/alerts/feed", "patient"),
+    ("sync.snapshot", "POST", "/api/v1/sync", "patient"),
+    ("caregiver.summary", "GET", "/api/v1/caregiver/patients/summary", "caregiver"),
+    ("clinician.cohort", "GET", "/api/v1/clinician/cohort?sort=risk&order=desc", "clinician"),
+    ("export.csv", "GET", "/api/v1/export/adherence.csv", "patient"),
+]
+
+LEVELS = {"gzip": [1, 5, 6, 9], "br": [1, 4, 5, 11], "zstd": [1, 3, 9, 19]}
+
+
+def parse_levels(specs: List[str]) -> Dict[str, List[int]]:
+    levels = dict(LEVELS)
+    for spec in specs:
+        encoding, _, values = spec.partition("=")
+        levels[encoding] = [int(v) for v in values.split(",") if v]
+    return levels
+
+
+def cpu_best(repeat: int, fn: Callable[[], Any]) -> Tuple[float, Any]:
+    """Best process CPU time of ``repeat`` calls (several calls per sample when one is too quick to time)."""
+    loops = 1
+    t0 = time.process_time()
+    out = fn()
+    once = time.process_time() - t0
+    if once < 0.001:
+        loops = max(1, int(0.001 / max(once, 1e-6)))
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.process_time()
+        for _ in range(loops):
+            out = fn()
+        best = min(best, (time.process_time() - t0) / loops)
+    return best, out
+
+
+def export_chunks(body: bytes) -> List[bytes]:
+    """The export as the endpoint yields it: the header with the first rows, then _EXPORT_FLUSH_ROWS rows a chunk."""
+    lines = body.splitlines(keepends=True)
+    size = main._EXPORT_FLUSH_ROWS
+    return [b"".join(lines[:size + 1])] + [b"".join(lines[i:i + size]) for i in range(size + 1, len(lines), size)]
+
+
+def streamed(chunks: List[bytes], encoding: str, level: int) -> bytes:
+    stream = _Stream(encoding, level)
+    out = [stream.chunk(c) for c in chunks if c]
+    out.append(stream.finish())
+    return b"".join(out)
+
+
+async def fetch_all(client: httpx.AsyncClient, who: Dict[str, Dict[str, str]]) -> Dict[str, bytes]:
+    """Identity body of each route."""
+    bodies = {}
+    for name, method, path, role in ROUTES:
+        kwargs: Dict[str, Any] = {"headers": {**who[role], "Accept-Encoding": "identity"}}
+        if method == "POST":
+            kwargs["json"] = {}
+        resp = await client.request(method, path, **kwargs)
+        if resp.status_code != 200:
+            raise SystemExit(f"{method} {path}: {resp.status_code}")
+        bodies[name] = resp.content
+    return bodies
+
+
+async def latency(client: httpx.AsyncClient, who: Dict[str, Dict[str, str]], accept: str, n: int) -> Dict[str, Tuple[float, int]]:
+    """Median latency (seconds) and bytes on the wire per route with the given Accept-Encoding."""
+    out = {}
+    for name, method, path, role in ROUTES:
+        kwargs: Dict[str, Any] = {"headers": {**who[role], "Accept-Encoding": accept}}
+        if method == "POST":
+            kwargs["json"] = {}
+        times, size = [], 0
+        for _ in range(n):
+            t = time.perf_counter()
+            async with client.stream(method, path, **kwargs) as resp:
+                size = sum([len(c) async for c in resp.aiter_raw()])
+            times.append(time.perf_counter() - t)
+        out[name] = (statistics.median(times), size)
+    return out
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=20)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--requests", type=int, default=15, help="requests per route for the end-to-end latency")
+    parser.add_argument("--link-kbps", type=float, default=1000, help="client bandwidth for the net time column")
+    parser.add_argument("--routes", default="", help="comma-separated route names (default: all)")
+    parser.add_argument("--levels", nargs="*", default=[], help="override levels, e.g. gzip=1,6 zstd=3")
+    args = parser.parse_args()
+
+    if args.routes:
+        wanted = {r.strip() for r in args.routes.split(",")}
+        ROUTES[:] = [r for r in ROUTES if r[0] in wanted]
+    levels = parse_levels(args.levels)
+    defaults = default_levels()
+    encodings = available_encodings()
+    transfer_ms = lambda n: n * 8 / args.link_kbps  # bytes at kbit/s -> ms
+
+    db = FakeSupabase()
+    install(db, FakeGenerativeModel(), FakeSNSClient())
+    pop = generate(args.patients, args.days, seed=args.seed)
+    write_fake(db, pop)
+    doses_by_user: Dict[str, int] = {}
+    for d in pop.rows["doses"]:
+        doses_by_user[d["user_id"]] = doses_by_user.get(d["user_id"], 0) + 1
+    patient = max(pop.patients, key=lambda p: doses_by_user.get(p["id"], 0))
+    who = {
+        "patient": headers_for(patient),
+        "caregiver": headers_for(pop.caregivers[0]),
+        "clinician": headers_for(pop.clinicians[0]),
+    }
+
+    async def run() -> Tuple[Dict[str, bytes], Dict[str, Any], Dict[str, Any]]:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            bodies = await fetch_all(client, who)
+            plain = await latency(client, who, "identity", args.requests)
+            negotiated = await latency(client, who, ", ".join(("gzip", "deflate") + encodings), args.requests)
+        return bodies, plain, negotiated
+
+    bodies, plain, negotiated = asyncio.run(run())
+    print(f"{doses_by_user.get(patient['id'], 0)} doses for the patient; encodings: {', '.join(encodings)}; "
+          f"link {args.link_kbps:g} kbit/s; CPU best of {args.repeat}")
+    print(f"{'route':<18} {'enc':<5} {'lvl':>4} {'bytes':>10} {'ratio':>6} {'cpu ms':>8} {'net ms':>9}")
+    for name, _, _, _ in ROUTES:
+        body = bodies[name]
+        print(f"{name:<18} {'-':<5} {'':>4} {len(body):>10}")
+        for encoding in encodings:
+            for level in levels.get(encoding, []):
+                cpu, out = cpu_best(args.repeat, lambda: compress(body, encoding, level))
+                net = transfer_ms(len(body) - len(out)) - cpu * 1000
+                mark = "*" if defaults.get(encoding) == level else " "
+                print(f"{'':<18} {encoding:<5} {level:>3}{mark} {len(out):>10} {len(body) / max(len(out), 1):6.1f} "
+                      f"{cpu * 1000:8.3f} {net:9.1f}")
+        if name == "export.csv":
+            chunks = export_chunks(body)
+            for encoding in encodings:
+                level = defaults[encoding]
+                cpu, out = cpu_best(args.repeat, lambda: streamed(chunks, encoding, level))
+                print(f"{'':<18} {encoding:<5} {level:>3}* {len(out):>10} {len(body) / max(len(out), 1):6.1f} "
+                      f"{cpu * 1000:8.3f} {'':>9}  streamed, flushed after each of {len(chunks)} chunks")
+
+    print(f"\nThrough the middleware, median of {args.requests} requests")
+    print(f"{'route':<18} {'identity ms':>12} {'bytes':>10} {'compressed ms':>14} {'bytes':>10}")
+    for name, _, _, _ in ROUTES:
+        (t0, n0), (t1, n1) = plain[name], negotiated[name]
+        print(f"{name:<18} {t0 * 1000:12.2f} {n0:>10} {t1 * 1000:14.2f} {n1:>10}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,200 @@
+"""Dose analytics: dict-list rows (legacy risk endpoints) vs app.dose_history.DoseHistory.
+
+Usage (from backend/):
+    python -m benchmarks.bench_dose_history                       # 2,000 users x 7 days
+    python -m benchmarks.bench_dose_history --users 500 --days 90
+
+Each user gets ``--per-day`` doses per day with a realistic status mix. For
+each representation the benchmark measures resident memory of the loaded
+histories (tracemalloc) and CPU for the metrics the risk features/insights
+compute: 7-day adherence, streak, misses/snoozes windows, daily series,
+time-block histograms, last taken and next due.
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+import numpy as np
+from app.dose_history import DoseHistory, PENDING, SKIPPED, SNOOZED, MISSED, TAKEN, epoch_minute
+from app.timezones import parse_instant, resolve_zone
+
+STATUSES = ["taken"] * 7 + ["skipped", "snoozed", "pending"]
+
+
+def synthetic_rows(days: int, per_day: int, now: datetime, rng: random.Random) -> List[Dict[str, Any]]:
+    rows = []
+    start = (now - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    meds = [f"med-{i}" for i in range(per_day)]
+    for d in range(days + 1):
+        for i in range(per_day):
+            at = start + timedelta(days=d, hours=8 + i * 12 // max(1, per_day), minutes=rng.choice([0, 15, 30]))
+            status = rng.choice(STATUSES) if at < now else "pending"
+            rows.append({
+                "scheduled_at": at.isoformat(),
+                "status": status,
+                "taken_at": (at + timedelta(minutes=rng.randint(0, 40))).isoformat() if status == "taken" else None,
+                "medication_id": meds[i],
+            })
+    # Round-trip through JSON so strings are fresh objects, as they are off the wire
+    return json.loads(json.dumps(rows))
+
+
+# ---------- legacy (verbatim logic from the pre-DoseHistory endpoints) ----------
+
+def _bin(ts: str) -> str:
+    try:
+        hh = int(ts[11:13])
+    except Exception:
+        return "morning"
+    if 5 <= hh < 12: return "morning"
+    if 12 <= hh < 17: return "midday"
+    if 17 <= hh < 21: return "evening"
+    return "night"
+
+
+def legacy_metrics(rows7: List[Dict[str, Any]], now: datetime) -> Dict[str, Any]:
+    now = now.replace(tzinfo=None)
+    start7 = now - timedelta(days=6)
+    taken7 = [r for r in rows7 if r.get("status") == "taken"]
+    adherence_7d = (len(taken7) / len(rows7)) if rows7 else 0.0
+
+    streak = 0
+    by_day: Dict[str, List[Dict[str, Any]]] = {}
+    for r in rows7:
+        by_day.setdefault((r["scheduled_at"] or "")[:10], []).append(r)
+    for i in range(0, 7):
+        day_rows = by_day.get((start7 + timedelta(days=i)).strftime("%Y-%m-%d"), [])
+        streak = streak + 1 if day_rows and all(rr.get("status") == "taken" for rr in day_rows) else 0
+
+    t48 = (now - timedelta(hours=48)).isoformat()
+    misses_48h = len([r for r in rows7 if r.get("status") in ("skipped", "missed") and (r.get("scheduled_at") or "") >= t48])
+    t24 = (now - timedelta(hours=24)).isoformat()
+    snoozes_24h = len([r for r in rows7 if r.get("status") == "snoozed" and (r.get("scheduled_at") or "") >= t24])
+
+    last_taken = max(taken7, key=lambda r: r.get("taken_at") or r.get("scheduled_at") or "") if taken7 else None
+    last_taken_delta = None
+    if last_taken:
+        ts = last_taken.get("taken_at") or last_taken.get("scheduled_at")
+        last_taken_delta = int((now - datetime.fromisoformat(ts.replace("Z", "+00:00")).replace(tzinfo=None)).total_seconds() // 60)
+    upcoming = [r for r in rows7 if r.get("status") in ("pending", "snoozed") and (r.get("scheduled_at") or "") >= now.isoformat()]
+    nxt = min(upcoming, key=lambda r: r["scheduled_at"]) if upcoming else None
+    time_to_next = int((datetime.fromisoformat(nxt["scheduled_at"]).replace(tzinfo=None) - now).total_seconds() // 60) if nxt else None
+
+    series = []
+    for i in range(6, -1, -1):
+        d0 = datetime(now.year, now.month, now.day) - timedelta(days=i)
+        d1 = d0 + timedelta(hours=23, minutes=59, seconds=59)
+        day_rows = [r for r in rows7 if d0.isoformat() <= (r.get("scheduled_at") or "") <= d1.isoformat()]
+        taken = len([r for r in day_rows if r.get("status") == "taken"])
+        series.append(int(round(100 * taken / len(day_rows))) if day_rows else 0)
+
+    snooze_bins = Counter(_bin(r["scheduled_at"]) for r in rows7 if r.get("status") == "snoozed")
+    miss_bins = Counter(_bin(r["scheduled_at"]) for r in rows7 if r.get("status") in ("skipped", "missed"))
+    return {
+        "adherence": adherence_7d, "streak": streak, "misses_48h": misses_48h, "snoozes_24h": snoozes_24h,
+        "last_taken": last_taken_delta, "next": time_to_next, "series": series,
+        "snooze_bins": snooze_bins.most_common(3), "miss_block": miss_bins.most_common(1),
+    }
+
+
+# ---------- DoseHistory ----------
+
+def history_metrics(h: DoseHistory, now: datetime) -> Dict[str, Any]:
+    now_min = epoch_minute(now)
+    today = now.date()
+    first_day = today - timedelta(days=6)
+    end = h.local_day_start(today + timedelta(days=1))
+    taken, total = h.daily_counts(first_day, 7)
+    last = h.last_taken_minute()
+    nxt = h.first_scheduled((PENDING, SNOOZED), now_min)
+    return {
+        "adherence": h.adherence(None, end) or 0.0,
+        "streak": h.streak(first_day, 7),
+        "misses_48h": h.count((SKIPPED, MISSED), now_min - 48 * 60),
+        "snoozes_24h": h.count((SNOOZED,), now_min - 24 * 60),
+        "last_taken": now_min - last if last is not None else None,
+        "next": nxt - now_min if nxt is not None else None,
+        "series": [int(round(100 * t / n)) if n else 0 for t, n in zip(taken.tolist(), total.tolist())],
+        "snooze_bins": h.block_histogram((SNOOZED,), None, end),
+        "miss_block": h.block_histogram((SKIPPED, MISSED), None, end),
+    }
+
+
+def dst_mismatches() -> int:
+    """Local minutes that disagree with zoneinfo across 2025-2026 (both DST transitions each year)."""
+    start = epoch_minute(datetime(2025, 1, 1, tzinfo=timezone.utc))
+    at = np.arange(start, start + 2 * 365 * 1440, 13, dtype=np.int64)
+    bad = 0
+    for tz in ("America/New_York", "Europe/London", "Australia/Lord_Howe", "America/Santiago"):
+        h = DoseHistory(at, np.full(at.size, -1), np.zeros(at.size, np.int8), np.zeros(at.size, np.int32), [None], tz)
+        zone = resolve_zone(tz)
+        want = [
+            epoch_minute(datetime.fromtimestamp(m * 60, timezone.utc).astimezone(zone).replace(tzinfo=timezone.utc))
+            for m in at.tolist()
+        ]
+        bad += int(np.count_nonzero(h.local != np.array(want, dtype=np.int64)))
+    return bad
+
+
+def measure_memory(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return after - before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--per-day", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    payloads = [json.dumps(synthetic_rows(args.days, args.per_day, now, rng)) for _ in range(args.users)]
+    n_rows = sum(len(json.loads(p)) for p in payloads[:1]) * args.users
+
+    dict_bytes = measure_memory(lambda: [json.loads(p) for p in payloads])
+    hist_bytes = measure_memory(lambda: [DoseHistory.from_rows(json.loads(p)) for p in payloads])
+
+    user_rows = [json.loads(p) for p in payloads]
+    # Warm the shared ISO parse cache so both sides pay the same parsing cost profile
+    for rows in user_rows[:1]:
+        for r in rows:
+            parse_instant(r["scheduled_at"])
+
+    t0 = time.perf_counter()
+    for rows in user_rows:
+        legacy_metrics(rows, now)
+    legacy_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    histories = [DoseHistory.from_rows(rows) for rows in user_rows]
+    build_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for h in histories:
+        history_metrics(h, now)
+    query_s = time.perf_counter() - t0
+
+    u = args.users
+    print(f"{u} users x {args.days} days x {args.per_day}/day = {n_rows} doses")
+    print(f"memory  dict rows:    {dict_bytes / 1e6:8.2f} MB  ({dict_bytes / n_rows:.0f} B/dose)")
+    print(f"memory  DoseHistory:  {hist_bytes / 1e6:8.2f} MB  ({hist_bytes / n_rows:.0f} B/dose)")
+    print(f"cpu     legacy metrics:          {legacy_s * 1e6 / u:8.1f} us/user")
+    print(f"cpu     DoseHistory build:       {build_s * 1e6 / u:8.1f} us/user")
+    print(f"cpu     DoseHistory metrics:     {query_s * 1e6 / u:8.1f} us/user")
+    print(f"cpu     DoseHistory total:       {(build_s + query_s) * 1e6 / u:8.1f} us/user")
+    print(f"check   DST local times:         {dst_mismatches()} mismatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Next-dose / missed-dose SQL: string-built view queries vs parameterized functions.
+
+Usage (from backend/, against a scratch Postgres; needs DATABASE_URL):
+    python -m benchmarks.bench_next_dose_sql                        # ~10M doses
+    python -m benchmarks.bench_next_dose_sql --users 2500 --keep    # ~1M doses, keep data
+
+Everything lives in a throwaway schema (``bench_next_dose``, dropped at the
+end unless --keep). Each medication gets two doses a day from 90 days ago to
+10 days ahead; past doses are mostly taken with a few left pending. Reports
+EXPLAIN (ANALYZE, BUFFERS) planning/execution time and buffer counts for one
+sampled user, then the mean round-trip over --calls users:
+
+  before: v_next_dose as aggregate-over-all-users view, exec_sql-style
+          literal SQL, indexes (user_id, scheduled_at) and (status)
+  after:  partial index on pending doses, next_doses() / missed_doses()
+          called with bound parameters, and the lateral v_next_dose that
+          select_in() callers (caregiver summary, SMS replies) still read
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+import psycopg
+
+from app.database import DATABASE_URL
+
+SCHEMA = "bench_next_dose"
+
+SETUP = f"""
+drop schema if exists {SCHEMA} cascade;
+create schema {SCHEMA};
+set search_path = {SCHEMA}, public;
+create table users (id uuid primary key default gen_random_uuid(), timezone text not null default 'UTC');
+create table medications (id uuid primary key default gen_random_uuid(), user_id uuid not null, name text not null);
+create table doses (
+  id uuid primary key default gen_random_uuid(),
+  user_id uuid not null,
+  medication_id uuid not null,
+  scheduled_at timestamptz not null,
+  status text not null default 'pending'
+);
+create table escalation_rules (user_id uuid primary key, grace_minutes int not null default 10);
+"""
+
+SEED = """
+insert into users select gen_random_uuid() from generate_series(1, {users});
+insert into medications (user_id, name)
+  select u.id, 'Med ' || g from users u cross join generate_series(1, {meds}) g;
+insert into doses (user_id, medication_id, scheduled_at, status)
+  select m.user_id, m.id, ts,
+         case when ts >= now() then 'pending' when random() < 0.03 then 'pending' else 'taken' end
+  from medications m
+  cross join generate_series(now() - interval '90 days', now() + interval '10 days', interval '12 hours') ts;
+insert into escalation_rules (user_id, grace_minutes) select id, 15 from users where random() < 0.2;
+create index idx_doses_user_time on doses(user_id, scheduled_at);
+create index idx_doses_status on doses(status);
+analyze;
+"""
+
+BEFORE = """
+create or replace view v_next_dose as
+select d.user_id, d.id as dose_id, d.medication_id, d.scheduled_at
+from doses d
+join (
+  select user_id, min(scheduled_at) as next_time
+  from doses
+  where status = 'pending' and scheduled_at >= now()
+  group by user_id
+) nd on nd.user_id = d.user_id and nd.next_time = d.scheduled_at;
+"""
+
+AFTER = """
+create index idx_doses_pending_user_time on doses(user_id, scheduled_at) where status = 'pending';
+create or replace view v_next_dose as
+select u.id as user_id, d.id as dose_id, d.medication_id, d.scheduled_at
+from users u
+cross join lateral (
+  select d.id, d.medication_id, d.scheduled_at
+  from doses d
+  where d.user_id = u.id and d.status = 'pending' and d.scheduled_at >= now()
+  order by d.scheduled_at, d.id
+  limit 1
+) d;
+create or replace function next_doses(p_user_ids uuid[])
+returns table (user_id uuid, dose_id uuid, medication_id uuid, medication_name text, scheduled_at timestamptz)
+language sql stable as $$
+  select u.user_id, d.id, d.medication_id, m.name, d.scheduled_at
+  from unnest(p_user_ids) as u(user_id)
+  cross join lateral (
+    select d.id, d.medication_id, d.scheduled_at
+    from doses d
+    where d.user_id = u.user_id and d.status = 'pending' and d.scheduled_at >= now()
+    order by d.scheduled_at, d.id
+    limit 1
+  ) d
+  join medications m on m.id = d.medication_id;
+$$;
+create or replace function missed_doses(p_user_id uuid)
+returns table (id uuid, scheduled_at timestamptz, status text, medication_name text, grace_minutes integer)
+language sql stable as $$
+  select d.id, d.scheduled_at, d.status, m.name, e.grace_minutes
+  from doses d
+  join medications m on m.id = d.medication_id
+  left join escalation_rules e on e.user_id = p_user_id
+  where d.user_id = p_user_id
+    and d.status = 'pending'
+    and d.scheduled_at < now() - make_interval(mins => coalesce(e.grace_minutes, 10))
+  order by d.scheduled_at;
+$$;
+analyze doses;
+"""
+
+# What the endpoints sent through exec_sql before: literal SQL, re-parsed per call
+OLD_NEXT = "SELECT * FROM v_next_dose WHERE user_id = '{user_id}'"
+OLD_MISSED = """
+SELECT d.id, d.scheduled_at, d.status, m.name as medication_name, e.grace_minutes
+FROM doses d
+JOIN medications m ON d.medication_id = m.id
+LEFT JOIN escalation_rules e ON d.user_id = e.user_id
+WHERE d.user_id = '{user_id}'
+  AND d.status = 'pending'
+  AND d.scheduled_at < NOW() - INTERVAL '1 minute' * COALESCE(e.grace_minutes, 10)
+ORDER BY d.scheduled_at
+"""
+NEW_NEXT = "select * from next_doses(array[%s]::uuid[])"
+NEW_MISSED = "select * from missed_doses(%s::uuid)"
+# EXPLAIN does not take bind parameters; the plans are the same with a literal
+NEW_NEXT_LITERAL = "select * from next_doses(array['{user_id}']::uuid[])"
+NEW_MISSED_LITERAL = "select * from missed_doses('{user_id}'::uuid)"
+
+
+def explain(conn: psycopg.Connection, sql: str) -> Dict[str, Any]:
+    row = conn.execute(f"explain (analyze, buffers, format json) {sql}").fetchone()
+    plan = row[0] if isinstance(row[0], list) else json.loads(row[0])
+    top = plan[0]
+    root = top["Plan"]
+    return {
+        "planning_ms": top.get("Planning Time", 0.0),
+        "execution_ms": top.get("Execution Time", 0.0),
+        "buffers": root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0),
+        "node": root.get("Node Type"),
+    }
+
+
+def round_trips(conn: psycopg.Connection, users: List[str], literal: str = "", bound: str = "") -> float:
+    started = time.perf_counter()
+    for uid in users:
+        if literal:
+            conn.execute(literal.format(user_id=uid), prepare=False).fetchall()
+        else:
+            conn.execute(bound, (uid,), prepare=True).fetchall()
+    return (time.perf_counter() - started) * 1000 / len(users)
+
+
+def report(label: str, plan: Dict[str, Any], mean_ms: float) -> None:
+    print(
+        f"{label:<22} plan {plan['planning_ms']:8.2f} ms  exec {plan['execution_ms']:9.2f} ms  "
+        f"buffers {plan['buffers']:>8}  top {plan['node']:<14}  round-trip {mean_ms:9.2f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=25000)
+    parser.add_argument("--meds", type=int, default=2, help="medications per user (201 doses each)")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--keep", action="store_true", help="keep the bench schema afterwards")
+    args = parser.parse_args()
+    if not DATABASE_URL:
+        raise SystemExit("DATABASE_URL is not set")
+
+    with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+        t0 = time.perf_counter()
+        conn.execute(SETUP)
+        conn.execute(f"set search_path = {SCHEMA}, public")
+        conn.execute(SEED.format(users=int(args.users), meds=int(args.meds)))
+        n = conn.execute("select count(*) from doses").fetchone()[0]
+        users = [str(r[0]) for r in conn.execute("select id from users").fetchall()]
+        print(f"seeded {n:,} doses for {len(users):,} users in {time.perf_counter() - t0:.1f}s")
+        sample = random.Random(3).sample(users, min(args.calls, len(users)))
+        uid = sample[0]
+
+        try:
+            conn.execute(BEFORE)
+            report("before next dose", explain(conn, OLD_NEXT.format(user_id=uid)), round_trips(conn, sample, literal=OLD_NEXT))
+            report("before missed doses", explain(conn, OLD_MISSED.format(user_id=uid)), round_trips(conn, sample, literal=OLD_MISSED))
+
+            conn.execute(AFTER)
+            report("after next_doses()", explain(conn, NEW_NEXT_LITERAL.format(user_id=uid)), round_trips(conn, sample, bound=NEW_NEXT))
+            report("after v_next_dose", explain(conn, OLD_NEXT.format(user_id=uid)), round_trips(conn, sample, literal=OLD_NEXT))
+            report("after missed_doses()", explain(conn, NEW_MISSED_LITERAL.format(user_id=uid)), round_trips(conn, sample, bound=NEW_MISSED))
+        finally:
+            if not args.keep:
+                conn.execute(f"drop schema if exists {SCHEMA} cascade")
+
+
+if __name__ == "__main__":
+    main()
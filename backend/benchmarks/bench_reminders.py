@@ -0,0 +1,70 @@
+"""Reminder dispatcher throughput with a fake SNS transport.
+
+Usage (from backend/):  python -m benchmarks.bench_reminders --reminders 100000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import app.database
+import app.reminder_service
+from app.reminder_service import ReminderDispatcher
+from app.sns_service import SNSService
+from benchmarks.fakes import FakeSupabase
+
+ZONES = ["America/New_York", "America/Chicago", "America/Denver", "America/Los_Angeles", "Europe/London", "UTC"]
+
+
+class FakeSNSClient:
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, PhoneNumber: str, Message: str):
+        self.published += 1
+        return {"MessageId": f"fake-{self.published}"}
+
+
+def build_rows(n: int, fire_at: datetime):
+    users = {}
+    doses = []
+    sched = fire_at.isoformat()
+    for i in range(n):
+        uid = f"user-{i // 3}"
+        users.setdefault(uid, {"phone_enc": f"+1555{i // 3:07d}", "timezone": ZONES[(i // 3) % len(ZONES)]})
+        doses.append({"id": f"dose-{i}", "user_id": uid, "medication_id": f"med-{i % 50}", "scheduled_at": sched})
+    med_names = {f"med-{i}": f"Medication {i}" for i in range(50)}
+    return doses, users, med_names
+
+
+async def main(n: int) -> None:
+    fake = FakeSNSClient()
+    dispatcher = ReminderDispatcher(sender=SNSService(client=fake))
+    fire_at = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    doses, users, med_names = build_rows(n, fire_at)
+    # fire_due re-checks the bucket against doses; a tenth were taken elsewhere meanwhile
+    db = FakeSupabase()
+    db.load("doses", [
+        {**d, "medication_id": d["id"], "status": "taken" if i % 10 == 0 else "pending"}  # (medication_id, scheduled_at) is unique
+        for i, d in enumerate(doses)
+    ])
+    app.database.supabase = app.reminder_service.supabase = db
+
+    t0 = time.perf_counter()
+    dispatcher.index_rows(doses, users, med_names)
+    t1 = time.perf_counter()
+    sent = await dispatcher.fire_due(fire_at)
+    t2 = time.perf_counter()
+
+    print(f"reminders:      {n}")
+    print(f"index build:    {t1 - t0:.3f}s")
+    print(f"fire bucket:    {t2 - t1:.3f}s  ({sent / max(t2 - t1, 1e-9):,.0f} msg/s)")
+    print(f"published:      {fake.published}  (skipped {dispatcher.stats['resolved']} already resolved)")
+    print(f"fits in minute: {(t2 - t0) < 60}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reminders", type=int, default=100_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.reminders))
@@ -0,0 +1,202 @@
+"""Sig parsing: legacy GeminiService._parse_frequency_and_times vs app.schedule_compiler.
+
+Usage (from backend/):
+    python -m benchmarks.bench_schedule_compiler                  # synthetic 100k corpus
+    python -m benchmarks.bench_schedule_compiler --corpus sigs.txt  # one sig per line
+
+The synthetic corpus mixes common pharmacy sig phrasings with a long tail of
+unique variants (explicit times, doses, counts), with repetition skewed the
+way real label text is: a few phrasings account for most labels.
+
+Before timing anything the compiler is checked against REGRESSIONS, sigs
+whose expected schedule is pinned; the run exits non-zero on a mismatch.
+"""
+import argparse
+import random
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.schedule_compiler import compile_schedule, _compile_normalized
+
+TEMPLATES = [
+    "Take 1 tablet by mouth once daily",
+    "Take 1 tablet by mouth twice daily",
+    "Take 1 capsule by mouth three times daily",
+    "Take 1 tablet by mouth every {h} hours as needed for pain",
+    "1 tab PO BID with meals",
+    "1 tab PO TID",
+    "1 cap PO QID",
+    "Take {n} tablets by mouth daily in the morning",
+    "Take 1 tablet by mouth at bedtime",
+    "Take 1 tablet q{h}h prn",
+    "Take 1 tablet with breakfast and dinner",
+    "Inhale 2 puffs every {h} hours",
+    "Take 1 tablet at {hh}:{mm} and {hh2}:{mm}",
+    "Take 1 tablet at {h12}am",
+    "Take {n} tablets qhs",
+    "Apply to affected area twice a day",
+    "Take 1 tablet every morning and evening with food",
+    "Take 1 tablet daily with lunch",
+    "Take 1/2 tablet by mouth once daily for blood pressure",
+    "Take 1 capsule by mouth every day at {h12} pm",
+]
+
+
+# (sig, frequency_text, times). Periods longer than a day must not compile to a
+# daily schedule: the materializer would create a dose every day.
+REGRESSIONS = [
+    ("Take 1 tablet by mouth once daily", "Once daily", ["09:00"]),
+    ("Apply to affected area twice a day", "Twice daily", ["09:00", "21:00"]),
+    ("Take 1 tablet once per day", "Once daily", ["09:00"]),
+    ("Take 1 tablet twice daily for 2 weeks", "Twice daily", ["09:00", "21:00"]),
+    ("Take 1 tablet daily x 3 weeks", "Once daily", ["09:00"]),
+    ("Take 1 tablet once weekly", None, []),
+    ("Take 1 tablet once a week on Mondays at 8am", None, []),
+    ("Take 1 tablet twice weekly", None, []),
+    ("Take 3 times a week", None, []),
+    ("Inject once a month", None, []),
+    ("Take 1 tablet monthly", None, []),
+    ("Take 1 tablet every other day", None, []),
+    ("Take 1 tablet every 3 days", None, []),
+    ("1 tab PO QOD", None, []),
+    ("Take 1 tablet once at bedtime", None, ["21:00"]),
+    # "N x <strength>" is how much to take, not how often
+    ("2 x 500mg daily", "Once daily", ["09:00"]),
+    ("Take 2 x tablets twice daily", "Twice daily", ["09:00", "21:00"]),
+    ("Take 1 tablet 3x a day", "Three times daily", ["08:00", "14:00", "20:00"]),
+    # Anchors that disagree with an explicit count fall back to the count's default times
+    ("Take 1 tablet twice daily in the morning", "Twice daily", ["09:00", "21:00"]),
+    ("Take 1 tablet daily at 8am and 8pm", "Twice daily", ["08:00", "20:00"]),
+    ("Take 1 tablet twice daily at 8am and 8pm", "Twice daily", ["08:00", "20:00"]),
+]
+
+
+def check_regressions() -> List[str]:
+    failures = []
+    for sig, frequency_text, times in REGRESSIONS:
+        got = compile_schedule(sig).as_dict()
+        if got != {"frequency_text": frequency_text, "times": times}:
+            failures.append(f"{sig!r}: got {got}, expected {frequency_text!r} {times}")
+    return failures
+
+
+def legacy_parse(instructions: str) -> Dict[str, Any]:
+    """Verbatim copy of the pre-compiler GeminiService._parse_frequency_and_times."""
+    frequency_text: Optional[str] = None
+    times: List[str] = []
+    s = (instructions or "").lower()
+
+    if "once daily" in s or "qd" in s or "every day" in s or "daily" in s:
+        frequency_text = "Once daily"
+    elif "twice daily" in s or "bid" in s or re.search(r"morning.*evening|evening.*morning", s):
+        frequency_text = "Twice daily"
+    elif "three times" in s or "tid" in s:
+        frequency_text = "Three times daily"
+    elif "four times" in s or "qid" in s:
+        frequency_text = "Four times daily"
+    elif re.search(r"every\s+\d+\s+hours", s):
+        m = re.search(r"every\s+(\d+)\s+hours", s)
+        if m:
+            h = int(m.group(1))
+            frequency_text = f"Every {h} hours"
+    elif re.search(r"q\d+h", s):
+        m = re.search(r"q(\d+)h", s)
+        if m:
+            h = int(m.group(1))
+            frequency_text = f"Every {h} hours"
+
+    times += sorted(list({m for m in re.findall(r"\b(\d{1,2}:\d{2})\b", instructions or "")}))
+
+    if "morning" in s or "breakfast" in s:
+        times.append("08:00")
+    if "noon" in s or "lunch" in s:
+        times.append("12:00")
+    if "evening" in s or "dinner" in s:
+        times.append("18:00")
+    if "bedtime" in s or "night" in s:
+        times.append("21:00")
+
+    if frequency_text and not times:
+        if frequency_text == "Once daily":
+            times = ["09:00"]
+        elif frequency_text == "Twice daily":
+            times = ["09:00", "21:00"]
+        elif frequency_text == "Three times daily":
+            times = ["08:00", "14:00", "20:00"]
+        elif frequency_text == "Four times daily":
+            times = ["06:00", "12:00", "18:00", "00:00"]
+        elif frequency_text.startswith("Every"):
+            m = re.search(r"Every\s+(\d+)\s+hours", frequency_text)
+            if m:
+                h = int(m.group(1))
+                cur = datetime.strptime("08:00", "%H:%M")
+                for _ in range(max(1, 24 // max(1, h))):
+                    times.append(cur.strftime("%H:%M"))
+                    cur += timedelta(hours=h)
+
+    times = sorted(list({t for t in times}))
+    return {"frequency_text": frequency_text, "times": times}
+
+
+def synthetic_corpus(n: int, seed: int = 7) -> List[str]:
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(len(TEMPLATES))]  # Zipf-like
+    out = []
+    for _ in range(n):
+        t = rng.choices(TEMPLATES, weights)[0]
+        out.append(t.format(
+            h=rng.choice([4, 6, 8, 12]),
+            n=rng.choice([1, 2]),
+            hh=f"{rng.randint(6, 11):02d}",
+            hh2=f"{rng.randint(17, 22):02d}",
+            mm=rng.choice(["00", "15", "30", "45"]),
+            h12=rng.randint(1, 12),
+        ))
+    return out
+
+
+def timed(fn, corpus) -> float:
+    t0 = time.perf_counter()
+    for s in corpus:
+        fn(s)
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="file with one sig string per line")
+    parser.add_argument("--size", type=int, default=100_000)
+    args = parser.parse_args()
+
+    failures = check_regressions()
+    if failures:
+        raise SystemExit("schedule compiler regressions:\n  " + "\n  ".join(failures))
+    print(f"regressions: {len(REGRESSIONS)} sigs ok")
+
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        corpus = synthetic_corpus(args.size)
+
+    distinct = len(set(corpus))
+    legacy = timed(legacy_parse, corpus)
+    uncached = timed(lambda s: _compile_normalized.__wrapped__(s.lower().replace(".", "")), corpus)
+    compile_schedule.cache_clear()
+    _compile_normalized.cache_clear()
+    cold = timed(compile_schedule, corpus)
+    warm = timed(compile_schedule, corpus)
+
+    n = len(corpus)
+    print(f"corpus: {n} sigs, {distinct} distinct")
+    print(f"legacy parser:         {legacy:.3f}s  {legacy / n * 1e6:.2f} us/sig")
+    print(f"compiler (no cache):   {uncached:.3f}s  {uncached / n * 1e6:.2f} us/sig")
+    print(f"compiler (cold cache):  {cold:.3f}s  {cold / n * 1e6:.2f} us/sig")
+    print(f"compiler (warm cache):  {warm:.3f}s  {warm / n * 1e6:.2f} us/sig")
+    print(f"cache: {compile_schedule.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
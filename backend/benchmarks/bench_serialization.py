@@ -0,0 +1,235 @@
+"""List endpoint serialization: response models per row (before) vs rows encoded directly (after).
+
+Usage (from backend/):
+    python -m benchmarks.bench_serialization                       # 10,000 rows per endpoint
+    python -m benchmarks.bench_serialization --rows 50000 --repeat 10 --tz Asia/Kolkata
+
+For the row shapes of GET /api/v1/doses, /api/v1/medications and
+/api/v1/alerts/feed this times, per row, the previous response path:
+
+* build a DoseResponse / MedicationResponse / AlertFeedItem per row
+* FastAPI's serialize_response against the route's response_model
+  (re-validation, then dump to JSON-able data)
+* JSONResponse rendering (stdlib json)
+
+against the current one: plain dicts built from the rows, rendered by
+app.fast_json.FastJSONResponse, with orjson and with its stdlib fallback.
+Both paths go over the same rows, and their bodies are checked to be byte
+for byte equal. Reports the best of ``--repeat`` runs.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+import app.fast_json as fast_json
+import app.main as main
+from app.fast_json import FastJSONResponse
+from app.main import AlertFeedItem, DoseResponse, MedicationResponse
+from app.timezones import to_local, to_local_iso, to_local_json
+
+STATUSES = ["taken"] * 7 + ["skipped", "snoozed", "pending"]
+NAMES = ["Metformin", "Lisinopril", "Atorvastatin", "Levothyroxine", "Amlodipine", "Omeprazole"]
+
+
+def synthetic_rows(n: int, now: datetime, rng: random.Random) -> Dict[str, List[Dict[str, Any]]]:
+    med_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in NAMES]
+    start = (now - timedelta(days=n // 4)).replace(hour=0, minute=0, second=0, microsecond=0)
+    doses, meds, alerts = [], [], []
+    for i in range(n):
+        at = start + timedelta(days=i // 4, hours=(8, 12, 17, 21)[i % 4], minutes=rng.choice([0, 15, 30]))
+        status = rng.choice(STATUSES) if at < now else "pending"
+        doses.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "medication_id": med_ids[i % len(med_ids)],
+            "scheduled_at": at.isoformat(),
+            "status": status,
+            "taken_at": (at + timedelta(minutes=rng.randint(0, 40), seconds=rng.random())).isoformat() if status == "taken" else None,
+            "notes": None if rng.random() < 0.9 else "taken with food",
+        })
+        meds.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "name": NAMES[i % len(NAMES)],
+            "strength_text": "10 mg",
+            "dose_text": "1 tablet",
+            "instructions": "Take 1 tablet by mouth twice daily",
+            "times": ["08:00", "20:00"],
+            "frequency_text": "twice daily",
+            "created_at": (start + timedelta(seconds=i * 37)).isoformat(),
+        })
+        alerts.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "type": "missed_dose" if i % 3 else "dose_taken",
+            "title": "Missed Dose" if i % 3 else "Dose Taken",
+            "message": f"{NAMES[i % len(NAMES)]} overdue by {i % 90} min",
+            "priority": ("low", "medium", "high")[i % 3],
+            "status": "active",
+            "createdAt": at.isoformat(),
+            "medicationName": NAMES[i % len(NAMES)],
+        })
+    # Round-trip through JSON so strings are fresh objects, as they are off the wire
+    rows = json.loads(json.dumps({"doses": doses, "meds": meds, "alerts": alerts}))
+    rows["names"] = dict(zip(med_ids, NAMES))
+    return rows
+
+
+# ---------- before: a model per row, then response_model validation ----------
+
+def models_doses(rows: Dict[str, Any], tz: str) -> List[DoseResponse]:
+    names = rows["names"]
+    return [
+        DoseResponse(
+            id=row["id"],
+            medication_id=row["medication_id"],
+            scheduled_at=to_local(row["scheduled_at"], tz),
+            status=row["status"],
+            taken_at=to_local(row["taken_at"], tz) if row.get("taken_at") else None,
+            notes=row["notes"],
+            medication_name=names.get(row["medication_id"], "Unknown"),
+        )
+        for row in rows["doses"]
+    ]
+
+
+def models_meds(rows: Dict[str, Any], tz: str) -> List[MedicationResponse]:
+    return [
+        MedicationResponse(
+            id=med["id"],
+            name=med["name"],
+            strength_text=med["strength_text"],
+            dose_text=med["dose_text"],
+            instructions=med["instructions"],
+            times=med["times"],
+            frequency_text=med.get("frequency_text"),
+            created_at=med["created_at"],
+        )
+        for med in rows["meds"]
+    ]
+
+
+def models_alerts(rows: Dict[str, Any], tz: str) -> List[AlertFeedItem]:
+    return [AlertFeedItem(**{**r, "createdAt": to_local_iso(r["createdAt"], tz)}) for r in rows["alerts"]]
+
+
+# ---------- after: dicts in the response shape (as app/main.py builds them) ----------
+
+def dicts_doses(rows: Dict[str, Any], tz: str) -> List[Dict[str, Any]]:
+    names = rows["names"]
+    return [
+        {
+            "id": row["id"],
+            "medication_id": row["medication_id"],
+            "scheduled_at": to_local_json(row["scheduled_at"], tz),
+            "status": row["status"],
+            "taken_at": to_local_json(row["taken_at"], tz) if row.get("taken_at") else None,
+            "notes": row["notes"],
+            "medication_name": names.get(row["medication_id"], "Unknown"),
+        }
+        for row in rows["doses"]
+    ]
+
+
+def dicts_meds(rows: Dict[str, Any], tz: str) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": med["id"],
+            "name": med["name"],
+            "strength_text": med["strength_text"],
+            "dose_text": med["dose_text"],
+            "instructions": med["instructions"],
+            "times": med["times"],
+            "frequency_text": med.get("frequency_text"),
+            "created_at": to_local_json(med["created_at"], None),
+        }
+        for med in rows["meds"]
+    ]
+
+
+def dicts_alerts(rows: Dict[str, Any], tz: str) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": r["id"],
+            "type": r["type"],
+            "title": r["title"],
+            "message": r["message"],
+            "priority": r["priority"],
+            "status": r.get("status", "active"),
+            "createdAt": to_local_iso(r["createdAt"], tz),
+            "medicationName": r.get("medicationName"),
+        }
+        for r in rows["alerts"]
+    ]
+
+
+ENDPOINTS: List[Tuple[str, str, Callable, Callable]] = [
+    ("doses", "/api/v1/doses", models_doses, dicts_doses),
+    ("medications", "/api/v1/medications", models_meds, dicts_meds),
+    ("alerts.feed", "/api/v1/alerts/feed", models_alerts, dicts_alerts),
+]
+
+
+def response_field(path: str):
+    for route in main.app.routes:
+        if getattr(route, "path", None) == path and "GET" in route.methods:
+            return route.response_field
+    raise LookupError(path)
+
+
+def best(repeat: int, fn: Callable[[], Any]) -> Tuple[float, Any]:
+    times, out = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), out
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tz", default="America/New_York", help="user timezone timestamps are rendered in")
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows, datetime.now(timezone.utc), random.Random(5))
+    n = args.rows
+    loop = asyncio.new_event_loop()
+    us = lambda seconds: seconds * 1e6 / n
+    print(f"{n} rows per endpoint, timestamps in {args.tz}; best of {args.repeat}, us/row "
+          f"(orjson {'installed' if fast_json.ORJSON_AVAILABLE else 'not installed'})")
+    print(f"{'endpoint':<13} {'models':>8} {'validate':>9} {'render':>8} {'before':>8} | "
+          f"{'dicts':>7} {'orjson':>8} {'stdlib':>8} {'after':>8} {'speedup':>8}")
+
+    for name, path, build_models, build_dicts in ENDPOINTS:
+        field = response_field(path)
+        build_s, models = best(args.repeat, lambda: build_models(rows, args.tz))
+        validate_s, content = best(args.repeat, lambda: loop.run_until_complete(
+            serialize_response(field=field, response_content=models)))
+        render_s, before = best(args.repeat, lambda: JSONResponse(content).body)
+
+        dicts_s, items = best(args.repeat, lambda: build_dicts(rows, args.tz))
+        orjson_s, after = best(args.repeat, lambda: FastJSONResponse(items).body)
+        saved, fast_json.orjson = fast_json.orjson, None
+        try:
+            stdlib_s, after_stdlib = best(args.repeat, lambda: FastJSONResponse(items).body)
+        finally:
+            fast_json.orjson = saved
+        if before != after or before != after_stdlib:
+            raise SystemExit(f"{name}: response bodies differ")
+
+        before_s = build_s + validate_s + render_s
+        after_s = dicts_s + (orjson_s if fast_json.ORJSON_AVAILABLE else stdlib_s)
+        print(f"{name:<13} {us(build_s):8.2f} {us(validate_s):9.2f} {us(render_s):8.2f} {us(before_s):8.2f} | "
+              f"{us(dicts_s):7.2f} {us(orjson_s):8.2f} {us(stdlib_s):8.2f} {us(after_s):8.2f} {before_s / after_s:7.1f}x")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main_cli()
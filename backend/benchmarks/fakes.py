@@ -0,0 +1,828 @@
+"""In-process stand-ins for Supabase, Gemini and SNS, for benchmarks.
+
+``FakeSupabase`` answers the subset of the supabase-py query builder the app
+uses (table/select/eq/neq/in_/gt/gte/lt/lte/is_/not_/ilike/order/range/limit,
+single/maybe_single, insert/upsert/update/delete and rpc) over in-memory
+tables. It reproduces the parts of supabase/final_schema.sql the handlers
+depend on: column defaults, unique keys, the sync version sequence and
+tombstones, cascading medication deletes, the v_next_dose view and the SQL
+functions (next_doses, missed_doses, bulk_update_doses,
+refresh_cohort_stats, clinician_cohort_page/_summary). Functions and triggers are approximated in Python, so
+these fakes measure the application, not Postgres.
+
+Every execute() can sleep ``latency_ms`` to stand in for the network round
+trip, and runs inside a telemetry span like the real client does.
+"""
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import count
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.dose_history import block_of
+from app.telemetry import span
+from app.timezones import resolve_zone
+
+
+class TableSpec(NamedTuple):
+    unique: Tuple[Tuple[str, ...], ...] = ()
+    indexed: Tuple[str, ...] = ()
+    has_id: bool = True
+    versioned: bool = False
+    defaults: Dict[str, Any] = {}
+    now: Tuple[str, ...] = ("created_at",)  # columns that default to now()
+
+
+SCHEMA: Dict[str, TableSpec] = {
+    "users": TableSpec(unique=(("id",), ("auth0_sub",)), indexed=("id", "auth0_sub"), defaults={"timezone": "UTC", "phone_enc": None}),
+    "caregiver_links": TableSpec(unique=(("id",), ("patient_id", "caregiver_id")), indexed=("id", "patient_id", "caregiver_id")),
+    "clinician_links": TableSpec(unique=(("id",), ("clinician_id", "patient_id")), indexed=("id", "patient_id", "clinician_id")),
+    "medications": TableSpec(
+        unique=(("id",), ("user_id", "client_key")), indexed=("id", "user_id"), versioned=True,
+        defaults={"strength_text": None, "dose_text": None, "instructions": None, "frequency_text": None, "client_key": None},
+    ),
+    "med_times": TableSpec(unique=(("id",), ("medication_id", "time_of_day")), indexed=("id", "medication_id", "user_id"), versioned=True),
+    "doses": TableSpec(
+        unique=(("id",), ("medication_id", "scheduled_at")), indexed=("id", "user_id", "medication_id"), versioned=True,
+        defaults={"status": "pending", "taken_at": None, "notes": None, "source": "manual"},
+    ),
+    "alerts": TableSpec(
+        unique=(("id",),), indexed=("id", "dose_id"), now=("sent_at",),
+        defaults={"meta": {}, "ack_at": None, "ack_by_user_id": None},
+    ),
+    "escalation_rules": TableSpec(unique=(("id",), ("user_id",)), indexed=("user_id",), defaults={"grace_minutes": 10}),
+    "risk_daily": TableSpec(unique=(("id",), ("user_id", "for_date")), indexed=("user_id",)),
+    "cohort_stats": TableSpec(unique=(("user_id",),), indexed=("user_id",), has_id=False, now=("refreshed_at",)),
+    "sync_tombstones": TableSpec(unique=(("version",),), indexed=("user_id",), has_id=False, now=("deleted_at",)),
+    "sync_mutations": TableSpec(unique=(("user_id", "key"),), indexed=("user_id",), has_id=False),
+    "sync_meta": TableSpec(unique=(("key",),), has_id=False, now=()),
+    "dose_archives": TableSpec(unique=(("month",),), has_id=False, now=("archived_at",)),
+}
+_PLAIN = TableSpec(unique=(("id",),), indexed=("id",))
+
+# (table, column) -> referenced table, for embedded selects
+FOREIGN_KEYS = {
+    ("caregiver_links", "patient_id"): "users",
+    ("caregiver_links", "caregiver_id"): "users",
+    ("clinician_links", "patient_id"): "users",
+    ("clinician_links", "clinician_id"): "users",
+    ("medications", "user_id"): "users",
+    ("med_times", "medication_id"): "medications",
+    ("doses", "medication_id"): "medications",
+    ("doses", "user_id"): "users",
+    ("alerts", "dose_id"): "doses",
+}
+# parent table -> (child table, column) deleted with it
+CASCADES = {
+    "users": (
+        ("medications", "user_id"), ("caregiver_links", "patient_id"), ("caregiver_links", "caregiver_id"),
+        ("clinician_links", "patient_id"), ("clinician_links", "clinician_id"),
+    ),
+    "medications": (("med_times", "medication_id"), ("doses", "medication_id")),
+}
+TIMESTAMPS = {"scheduled_at", "taken_at", "created_at", "sent_at", "ack_at", "deleted_at", "refreshed_at", "archived_at", "updated_at"}
+_TOMBSTONED = ("medications", "med_times", "doses")
+
+
+class FakeAPIError(Exception):
+    """Raised where PostgREST would answer with an error (e.g. 23505 unique violation)."""
+
+    def __init__(self, message: str, code: str = ""):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+def utc_iso(value: Any) -> Any:
+    """Canonical timestamptz text, as PostgREST returns it (UTC, +00:00)."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        try:
+            dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return value
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+
+def _time_of_day(value: Any) -> Any:
+    parts = str(value).split(":")
+    try:
+        h, m = int(parts[0]), int(parts[1])
+        s = int(parts[2]) if len(parts) > 2 else 0
+    except (ValueError, IndexError):
+        return value
+    return f"{h:02d}:{m:02d}:{s:02d}"
+
+
+def _normalize(column: str, value: Any) -> Any:
+    if column in TIMESTAMPS:
+        return utc_iso(value)
+    if column == "time_of_day" and value is not None:
+        return _time_of_day(value)
+    return value
+
+
+def _compare(a: Any, b: Any) -> int:
+    if type(a) is not type(b) and not (isinstance(a, (int, float)) and isinstance(b, (int, float))):
+        try:
+            a, b = float(a), float(b)
+        except (TypeError, ValueError):
+            a, b = str(a), str(b)
+    return (a > b) - (a < b)
+
+
+def _split_columns(columns: str) -> List[str]:
+    out, depth, cur = [], 0, []
+    for ch in columns:
+        if ch == "," and depth == 0:
+            out.append("".join(cur).strip())
+            cur = []
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        cur.append(ch)
+    out.append("".join(cur).strip())
+    return [c for c in out if c]
+
+
+_EMBED = re.compile(r"^(?:(\w+):)?(\w+)\((.*)\)$", re.S)
+
+
+class _Table:
+    def __init__(self, name: str):
+        self.name = name
+        self.spec = SCHEMA.get(name, _PLAIN)
+        self.rows: Dict[int, Dict[str, Any]] = {}
+        self.index: Dict[str, Dict[Any, Dict[int, Dict[str, Any]]]] = {c: {} for c in self.spec.indexed}
+        self.keys: Dict[Tuple[str, ...], Dict[tuple, Dict[str, Any]]] = {cols: {} for cols in self.spec.unique}
+
+    @staticmethod
+    def _key(row: Dict[str, Any], cols: Tuple[str, ...]) -> Optional[tuple]:
+        key = tuple(row.get(c) for c in cols)
+        return None if any(v is None for v in key) else key  # NULLs never conflict
+
+    def find(self, row: Dict[str, Any], cols: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        key = self._key(row, cols)
+        return self.keys.get(cols, {}).get(key) if key is not None else None
+
+    def add(self, row: Dict[str, Any]) -> None:
+        for cols in self.keys:
+            if self.find(row, cols) is not None:
+                raise FakeAPIError(
+                    f'duplicate key value violates unique constraint "{self.name}_{"_".join(cols)}_key"', "23505"
+                )
+        self.rows[id(row)] = row
+        self._link(row)
+
+    def _link(self, row: Dict[str, Any]) -> None:
+        for cols, keyed in self.keys.items():
+            key = self._key(row, cols)
+            if key is not None:
+                keyed[key] = row
+        for col, buckets in self.index.items():
+            buckets.setdefault(row.get(col), {})[id(row)] = row
+
+    def _unlink(self, row: Dict[str, Any]) -> None:
+        for cols, keyed in self.keys.items():
+            key = self._key(row, cols)
+            if key is not None and keyed.get(key) is row:
+                del keyed[key]
+        for col, buckets in self.index.items():
+            bucket = buckets.get(row.get(col))
+            if bucket is not None:
+                bucket.pop(id(row), None)
+                if not bucket:
+                    del buckets[row.get(col)]
+
+    def remove(self, row: Dict[str, Any]) -> None:
+        self._unlink(row)
+        del self.rows[id(row)]
+
+    def change(self, row: Dict[str, Any], patch: Dict[str, Any]) -> None:
+        candidate = {**row, **patch}
+        for cols in self.keys:
+            other = self.find(candidate, cols)
+            if other is not None and other is not row:
+                raise FakeAPIError(f'duplicate key value violates unique constraint "{self.name}_{"_".join(cols)}_key"', "23505")
+        self._unlink(row)
+        row.update(patch)
+        self._link(row)
+
+    def candidates(self, filters: List[Tuple[str, str, Any, bool]]) -> Iterable[Dict[str, Any]]:
+        """Smallest index lookup that the eq/in filters allow, else a full scan."""
+        best: Optional[List[Dict[str, Any]]] = None
+        for col, op, value, negated in filters:
+            if negated or col not in self.index or op not in ("eq", "in"):
+                continue
+            buckets = self.index[col]
+            if op == "eq":
+                found = list(buckets.get(_normalize(col, value), {}).values())
+            else:
+                found = [r for v in dict.fromkeys(_normalize(col, v) for v in value) for r in buckets.get(v, {}).values()]
+            if best is None or len(found) < len(best):
+                best = found
+        return best if best is not None else list(self.rows.values())
+
+
+def _matches(row: Dict[str, Any], filters: List[Tuple[str, str, Any, bool]]) -> bool:
+    for col, op, value, negated in filters:
+        v = row.get(col)
+        if op == "is":
+            ok = v is None if value in (None, "null") else v is (value in (True, "true"))
+        elif op == "in":
+            ok = v is not None and any(_compare(v, _normalize(col, x)) == 0 for x in value)
+        elif op == "ilike":
+            ok = v is not None and value.fullmatch(str(v)) is not None
+        elif v is None:
+            ok = False
+        else:
+            c = _compare(v, _normalize(col, value))
+            ok = {"eq": c == 0, "neq": c != 0, "gt": c > 0, "gte": c >= 0, "lt": c < 0, "lte": c <= 0}[op]
+        if ok == negated:
+            return False
+    return True
+
+
+class FakeResponse(NamedTuple):
+    data: Any
+    count: Optional[int] = None
+
+
+class _Not:
+    def __init__(self, query: "FakeQuery"):
+        self._query = query
+
+    def __getattr__(self, name: str) -> Callable[..., "FakeQuery"]:
+        method = getattr(self._query, name)
+
+        def negated(*args: Any, **kwargs: Any) -> "FakeQuery":
+            self._query._negate = True
+            return method(*args, **kwargs)
+
+        return negated
+
+
+class FakeQuery:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.op = "select"
+        self.columns = "*"
+        self.payload: Any = None
+        self.on_conflict: Optional[str] = None
+        self.ignore_duplicates = False
+        self.filters: List[Tuple[str, str, Any, bool]] = []
+        self.orders: List[Tuple[str, bool]] = []
+        self.offset = 0
+        self.limit_n: Optional[int] = None
+        self.count: Optional[str] = None
+        self.head = False
+        self.single_row: Optional[str] = None
+        self._negate = False
+
+    # ---------- verbs ----------
+
+    def select(self, *columns: str, count: Optional[str] = None, head: bool = False) -> "FakeQuery":
+        self.columns = ",".join(columns) or "*"
+        self.count = count
+        self.head = head
+        return self
+
+    def insert(self, rows: Any, **_: Any) -> "FakeQuery":
+        self.op, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows: Any, on_conflict: str = "", ignore_duplicates: bool = False, **_: Any) -> "FakeQuery":
+        self.op, self.payload = "upsert", rows
+        self.on_conflict = on_conflict
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, patch: Dict[str, Any], **_: Any) -> "FakeQuery":
+        self.op, self.payload = "update", patch
+        return self
+
+    def delete(self, **_: Any) -> "FakeQuery":
+        self.op = "delete"
+        return self
+
+    # ---------- filters ----------
+
+    def _filter(self, column: str, op: str, value: Any) -> "FakeQuery":
+        self.filters.append((column, op, value, self._negate))
+        self._negate = False
+        return self
+
+    @property
+    def not_(self) -> _Not:
+        return _Not(self)
+
+    def eq(self, column: str, value: Any) -> "FakeQuery":
+        return self._filter(column, "eq", value)
+
+    def neq(self, column: str, value: Any) -> "FakeQuery":
+        return self._filter(column, "neq", value)
+
+    def gt(self, column: str, value: Any) -> "FakeQuery":
+        return self._filter(column, "gt", value)
+
+    def gte(self, column: str, value: Any) -> "FakeQuery":
+        return self._filter(column, "gte", value)
+
+    def lt(self, column: str, value: Any) -> "FakeQuery":
+        return self._filter(column, "lt", value)
+
+    def lte(self, column: str, value: Any) -> "FakeQuery":
+        return self._filter(column, "lte", value)
+
+    def in_(self, column: str, values: Iterable[Any]) -> "FakeQuery":
+        return self._filter(column, "in", list(values))
+
+    def is_(self, column: str, value: Any) -> "FakeQuery":
+        return self._filter(column, "is", value)
+
+    def ilike(self, column: str, pattern: str) -> "FakeQuery":
+        regex = "".join(".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern)
+        return self._filter(column, "ilike", re.compile(regex, re.I | re.S))
+
+    def match(self, query: Dict[str, Any]) -> "FakeQuery":
+        for column, value in query.items():
+            self.eq(column, value)
+        return self
+
+    # ---------- modifiers ----------
+
+    def order(self, column: str, desc: bool = False, **_: Any) -> "FakeQuery":
+        self.orders.append((column, desc))
+        return self
+
+    def range(self, start: int, end: int) -> "FakeQuery":
+        self.offset, self.limit_n = start, end - start + 1
+        return self
+
+    def limit(self, n: int) -> "FakeQuery":
+        self.limit_n = n
+        return self
+
+    def single(self) -> "FakeQuery":
+        self.single_row = "single"
+        return self
+
+    def maybe_single(self) -> "FakeQuery":
+        self.single_row = "maybe"
+        return self
+
+    # ---------- execution ----------
+
+    def _label(self) -> str:
+        if self.op == "upsert":
+            return f"upsert {self.table}"
+        return f"{self.op} {self.table}" if self.op in ("select", "insert") else self.op
+
+    def execute(self) -> Any:
+        with span("supabase", self._label()):
+            self.db.round_trip()
+            with self.db.lock:
+                rows, total = self._run()
+        if self.single_row:
+            if len(rows) != 1:
+                if self.single_row == "maybe" and not rows:
+                    return None
+                raise FakeAPIError(f"JSON object requested, multiple (or no) rows returned ({len(rows)})", "PGRST116")
+            return FakeResponse(rows[0], total)
+        return FakeResponse([] if self.head else rows, total)
+
+    def _run(self) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        db = self.db
+        if self.op == "insert":
+            return [self._project(r) for r in db.insert_rows(self.table, self._payload_rows())], None
+        if self.op == "upsert":
+            return [self._project(r) for r in db.upsert_rows(self.table, self._payload_rows(), self.on_conflict, self.ignore_duplicates)], None
+
+        matched = db.query_rows(self.table, self.filters)
+        if self.op == "update":
+            return [self._project(r) for r in db.update_rows(self.table, matched, self.payload)], None
+        if self.op == "delete":
+            return [self._project(r) for r in db.delete_rows(self.table, matched)], None
+
+        for column, desc in reversed(self.orders):
+            matched.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        total = len(matched) if self.count else None
+        end = None if self.limit_n is None else self.offset + self.limit_n
+        return [self._project(r) for r in matched[self.offset:end]], total
+
+    def _payload_rows(self) -> List[Dict[str, Any]]:
+        return [self.payload] if isinstance(self.payload, dict) else list(self.payload)
+
+    def _project(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        return self.db.project(self.table, row, self.columns)
+
+
+class FakeRPC:
+    def __init__(self, db: "FakeSupabase", name: str, params: Dict[str, Any]):
+        self.db = db
+        self.name = name
+        self.params = params or {}
+
+    def execute(self) -> FakeResponse:
+        fn = getattr(self.db, f"rpc_{self.name}", None)
+        with span("supabase", f"rpc {self.name}"):
+            self.db.round_trip()
+            if fn is None:
+                raise FakeAPIError(f"Could not find the function public.{self.name}", "PGRST202")
+            with self.db.lock:
+                return FakeResponse(fn(**self.params))
+
+
+class FakeSupabase:
+    """Thread-safe in-memory database answering supabase-py style queries."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.lock = threading.RLock()
+        self.tables: Dict[str, _Table] = {}
+        self._versions = count(1)
+        self.stats = {"queries": 0}
+        self.views: Dict[str, Callable[[List[Tuple[str, str, Any, bool]]], List[Dict[str, Any]]]] = {
+            "v_next_dose": self._v_next_dose,
+        }
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> FakeRPC:
+        return FakeRPC(self, name, params or {})
+
+    def round_trip(self) -> None:
+        self.stats["queries"] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get(self, name: str) -> _Table:
+        t = self.tables.get(name)
+        if t is None:
+            t = self.tables[name] = _Table(name)
+        return t
+
+    def _by_id(self, name: str, row_id: Any) -> Optional[Dict[str, Any]]:
+        return self.get(name).find({"id": row_id}, ("id",))
+
+    # ---------- row operations (caller holds the lock) ----------
+
+    def _prepare(self, name: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        spec = SCHEMA.get(name, _PLAIN)
+        out = {**spec.defaults, **{k: _normalize(k, v) for k, v in row.items()}}
+        if spec.has_id and not out.get("id"):
+            out["id"] = str(uuid.uuid4())
+        if name == "sync_tombstones" and "version" not in out:
+            out["version"] = next(self._versions)
+        for column in spec.now:
+            if out.get(column) is None:
+                out[column] = utc_iso(datetime.now(timezone.utc))
+        if name == "med_times" and not out.get("user_id"):
+            med = self._by_id("medications", out.get("medication_id"))
+            out["user_id"] = med["user_id"] if med else None
+        if spec.versioned:
+            out["version"] = next(self._versions)
+        return out
+
+    def insert_rows(self, name: str, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        table = self.get(name)
+        prepared = [self._prepare(name, r) for r in rows]
+        added: List[Dict[str, Any]] = []
+        try:
+            for row in prepared:
+                table.add(row)
+                added.append(row)
+        except FakeAPIError:
+            for row in added:  # one statement: all rows or none
+                table.remove(row)
+            raise
+        return prepared
+
+    def upsert_rows(self, name: str, rows: Iterable[Dict[str, Any]], on_conflict: Optional[str], ignore: bool) -> List[Dict[str, Any]]:
+        table = self.get(name)
+        cols = tuple(c.strip() for c in on_conflict.split(",")) if on_conflict else table.spec.unique[0]
+        out = []
+        for row in rows:
+            existing = table.find({k: _normalize(k, v) for k, v in row.items()}, cols)
+            if existing is None:
+                out.extend(self.insert_rows(name, [row]))
+            elif not ignore:
+                out.extend(self.update_rows(name, [existing], {k: v for k, v in row.items() if k != "id"}))
+        return out
+
+    def update_rows(self, name: str, rows: List[Dict[str, Any]], patch: Dict[str, Any]) -> List[Dict[str, Any]]:
+        table = self.get(name)
+        patch = {k: _normalize(k, v) for k, v in patch.items()}
+        for row in rows:
+            change = dict(patch)
+            if table.spec.versioned:
+                change["version"] = next(self._versions)
+            table.change(row, change)
+        return rows
+
+    def delete_rows(self, name: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        table = self.get(name)
+        for row in rows:
+            table.remove(row)
+        for child, column in CASCADES.get(name, ()):
+            ids = [r["id"] for r in rows]
+            if ids and child in self.tables:
+                self.delete_rows(child, self.query_rows(child, [(column, "in", ids, False)]))
+        if name in _TOMBSTONED:
+            now = utc_iso(datetime.now(timezone.utc))
+            self.insert_rows("sync_tombstones", [
+                {"user_id": r["user_id"], "entity": name, "entity_id": r["id"], "deleted_at": now}
+                for r in rows if r.get("user_id")
+            ])
+        return rows
+
+    def query_rows(self, name: str, filters: List[Tuple[str, str, Any, bool]]) -> List[Dict[str, Any]]:
+        if name in self.views:
+            return [r for r in self.views[name](filters) if _matches(r, filters)]
+        return [r for r in self.get(name).candidates(filters) if _matches(r, filters)]
+
+    def project(self, name: str, row: Dict[str, Any], columns: str) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for item in _split_columns(columns):
+            m = _EMBED.match(item)
+            if m is None:
+                if item == "*":
+                    out.update(row)
+                else:
+                    out[item] = row.get(item)
+                continue
+            alias, rel, inner = m.groups()
+            if (name, rel) in FOREIGN_KEYS:
+                column, target = rel, FOREIGN_KEYS[(name, rel)]
+            else:
+                column = next((c for (t, c), ref in FOREIGN_KEYS.items() if t == name and ref == rel), None)
+                target = rel
+            parent = None
+            if column is not None and row.get(column) is not None:
+                parent = self._by_id(target, row[column])
+            out[alias or rel] = self.project(target, parent, inner) if parent is not None else None
+        return out
+
+    # ---------- bulk loading ----------
+
+    def load(self, name: str, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert seed rows directly (no latency, no span); returns the stored rows."""
+        with self.lock:
+            return self.insert_rows(name, rows)
+
+    def count(self, name: str) -> int:
+        return len(self.get(name).rows)
+
+    # ---------- views and functions ----------
+
+    def _pending_after(self, user_id: str, after: str) -> Optional[Dict[str, Any]]:
+        best = None
+        for d in self.get("doses").index["user_id"].get(user_id, {}).values():
+            if d["status"] == "pending" and d["scheduled_at"] >= after:
+                if best is None or (d["scheduled_at"], d["id"]) < (best["scheduled_at"], best["id"]):
+                    best = d
+        return best
+
+    def _user_ids(self, filters: List[Tuple[str, str, Any, bool]]) -> List[str]:
+        for col, op, value, negated in filters:
+            if col == "user_id" and not negated and op in ("eq", "in"):
+                return [value] if op == "eq" else list(value)
+        return list(self.get("doses").index["user_id"])
+
+    def _v_next_dose(self, filters: List[Tuple[str, str, Any, bool]]) -> List[Dict[str, Any]]:
+        now = utc_iso(datetime.now(timezone.utc))
+        out = []
+        for user_id in self._user_ids(filters):
+            d = self._pending_after(user_id, now)
+            if d is not None:
+                out.append({"user_id": user_id, "dose_id": d["id"], "medication_id": d["medication_id"], "scheduled_at": d["scheduled_at"]})
+        return out
+
+    def _medication_name(self, medication_id: str) -> Optional[str]:
+        med = self._by_id("medications", medication_id)
+        return med["name"] if med else None
+
+    def rpc_next_doses(self, p_user_ids: List[str]) -> List[Dict[str, Any]]:
+        return [
+            {**r, "medication_name": self._medication_name(r["medication_id"])}
+            for r in self._v_next_dose([("user_id", "in", p_user_ids, False)])
+        ]
+
+    def rpc_missed_doses(self, p_user_id: str) -> List[Dict[str, Any]]:
+        rule = self.get("escalation_rules").find({"user_id": p_user_id}, ("user_id",))
+        grace = rule["grace_minutes"] if rule else None
+        cutoff = utc_iso(datetime.now(timezone.utc) - timedelta(minutes=grace if grace is not None else 10))
+        rows = [
+            d for d in self.get("doses").index["user_id"].get(p_user_id, {}).values()
+            if d["status"] == "pending" and d["scheduled_at"] < cutoff
+        ]
+        rows.sort(key=lambda d: d["scheduled_at"])
+        return [
+            {"id": d["id"], "scheduled_at": d["scheduled_at"], "status": d["status"],
+             "medication_name": self._medication_name(d["medication_id"]), "grace_minutes": grace}
+            for d in rows
+        ]
+
+    def rpc_bulk_update_doses(self, p_user_id: str, p_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        out = []
+        for item in p_items:
+            d = self._by_id("doses", item.get("id"))
+            if d is None or d["user_id"] != p_user_id:
+                continue
+            applied = not item.get("expected_status") or d["status"] == item["expected_status"]
+            if applied:
+                patch = {"status": item["status"]}
+                for key in ("taken_at", "notes"):
+                    if item.get(key) is not None:
+                        patch[key] = item[key]
+                self.update_rows("doses", [d], patch)
+            out.append({"id": d["id"], "applied": applied, **{k: d[k] for k in ("status", "taken_at", "notes", "medication_id", "scheduled_at")}})
+        return out
+
+    def rpc_refresh_cohort_stats(self) -> None:
+        """refresh_cohort_stats() computed from doses directly (adherence_daily is not kept)."""
+        today = datetime.now(timezone.utc).date()
+        first = today - timedelta(days=7)
+        users = self.get("users")
+        stats = []
+        for user in list(users.rows.values()):
+            if user.get("role") != "patient":
+                continue
+            zone = resolve_zone(user.get("timezone"))
+            taken = skipped = snoozed = due = 0
+            last_taken = None
+            misses: Dict[str, int] = {}
+            for d in self.get("doses").index["user_id"].get(user["id"], {}).values():
+                local = datetime.fromisoformat(d["scheduled_at"]).astimezone(zone)
+                day = local.date()
+                if not first <= day <= today:
+                    continue
+                status = d["status"]
+                counted = status != "pending" or day < today
+                if status == "taken":
+                    taken += 1
+                    last_taken = max(last_taken or day, day)
+                elif counted:
+                    skipped += status in ("skipped", "missed")
+                    snoozed += status == "snoozed"
+                    block = block_of(local)
+                    misses[block] = misses.get(block, 0) + 1
+                if counted:
+                    due += 1
+            risk = [r for r in self.get("risk_daily").index["user_id"].get(user["id"], {}).values() if str(r["for_date"]) >= first.isoformat()]
+            score = max(risk, key=lambda r: str(r["for_date"]))["score"] if risk else None
+            stats.append({
+                "user_id": user["id"], "name": user.get("name") or "", "taken_7d": taken, "due_7d": due,
+                "skipped_7d": skipped, "snoozed_7d": snoozed, "adherence_7d": taken / due if due else None,
+                "worst_block": min(misses, key=lambda b: (-misses[b], b)) if misses else None,
+                "medications": len(self.get("medications").index["user_id"].get(user["id"], {})),
+                "risk_score": score,
+                "risk_bucket": None if score is None else "low" if score < 35 else "medium" if score < 65 else "high",
+                "last_taken_day": last_taken.isoformat() if last_taken else None,
+                "refreshed_at": datetime.now(timezone.utc),
+            })
+        self.upsert_rows("cohort_stats", stats, "user_id", False)
+
+    def _panel(self, clinician_id: str) -> List[str]:
+        clinician = self._by_id("users", clinician_id)
+        if clinician is None or clinician.get("role") != "clinician":
+            return []
+        return [l["patient_id"] for l in self.get("clinician_links").index["clinician_id"].get(clinician_id, {}).values()]
+
+    def rpc_clinician_cohort_page(
+        self, p_clinician: str, p_sort: str, p_desc: bool, p_risk: Optional[List[str]],
+        p_search: Optional[str], p_offset: int, p_limit: int,
+    ) -> Dict[str, Any]:
+        stats = self.get("cohort_stats")
+        rows = [r for r in (stats.find({"user_id": u}, ("user_id",)) for u in self._panel(p_clinician)) if r is not None]
+        if p_risk is not None:
+            rows = [r for r in rows if r.get("risk_bucket") in p_risk]
+        if p_search is not None:
+            rows = [r for r in rows if p_search.lower() in (r.get("name") or "").lower()]
+        # Postgres ordering: nulls last ascending, first descending; ties by user_id
+        rows.sort(key=lambda r: r["user_id"])
+        present = sorted((r for r in rows if r.get(p_sort) is not None), key=lambda r: r[p_sort], reverse=p_desc)
+        missing = [r for r in rows if r.get(p_sort) is None]
+        ordered = missing + present if p_desc else present + missing
+        return {"total": len(rows), "rows": [dict(r) for r in ordered[p_offset:p_offset + p_limit]]}
+
+    def rpc_clinician_cohort_summary(self, p_clinician: str) -> Dict[str, Any]:
+        today = datetime.now(timezone.utc).date()
+        first = today - timedelta(days=13)
+        panel = self._panel(p_clinician)
+        buckets = [r.get("risk_bucket") for r in (self.get("cohort_stats").find({"user_id": u}, ("user_id",)) for u in panel) if r is not None]
+        daily: Dict[Any, Dict[str, Any]] = {}
+        for user_id in panel:
+            user = self._by_id("users", user_id)
+            zone = resolve_zone(user.get("timezone") if user else None)
+            for d in self.get("doses").index["user_id"].get(user_id, {}).values():
+                day = datetime.fromisoformat(d["scheduled_at"]).astimezone(zone).date()
+                if not first <= day <= today:
+                    continue
+                cell = daily.setdefault(day, {"taken": 0, "due": 0, "patients": set()})
+                cell["patients"].add(user_id)
+                cell["taken"] += d["status"] == "taken"
+                cell["due"] += d["status"] != "pending" or day < today
+        return {
+            "total_patients": len(buckets),
+            "risk_counts": {b: buckets.count(b) for b in ("low", "medium", "high")},
+            "trend": [
+                {"day": day.isoformat(), "taken": c["taken"], "due": c["due"], "patients": len(c["patients"]),
+                 "adherence": c["taken"] / c["due"] if c["due"] else None}
+                for day, c in sorted(daily.items())
+            ],
+        }
+
+    def rpc_prune_sync_state(self, p_keep_days: int = 30) -> int:
+        return 0
+
+    def rpc_ensure_dose_partitions(self, p_months_back: int = 0, p_months_ahead: int = 3) -> int:
+        return 0
+
+
+class FakeGenerativeModel:
+    """google.generativeai GenerativeModel stand-in: canned JSON per prompt kind, after ``latency_ms``."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.calls = 0
+
+    @staticmethod
+    def _reply(prompt: str) -> Dict[str, Any]:
+        if "pharmacy label" in prompt:
+            return {"medications": [{
+                "name": "Lisinopril", "strength_text": "10 mg", "instructions": "Take 1 tablet by mouth twice daily",
+                "frequency_text": "twice daily", "confidence": 0.92,
+            }]}
+        if "score_0_100" in prompt:
+            return {
+                "score_0_100": 42, "bucket": "medium", "rationale": "Two snoozes in the last day.",
+                "suggestion": "Move the evening dose earlier.", "contributing_factors": ["snoozes_24h"],
+            }
+        if "insight card" in prompt:
+            return {
+                "title": "Evenings are the weak spot", "highlights": ["Most misses happen after 8pm"],
+                "advice": "Pair the evening dose with dinner.", "next_best_action": "Set a 7pm reminder",
+            }
+        return {
+            "intent": "next_dose", "confidence": 0.9, "entities": {},
+            "suggested_response": "Your next dose is coming up soon.",
+        }
+
+    def generate_content(self, contents: Any, **_: Any) -> Any:
+        self.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        parts = contents if isinstance(contents, list) else [contents]
+        prompt = " ".join(p if isinstance(p, str) else str(p.get("text", "")) if isinstance(p, dict) else "" for p in parts)
+        return SimpleNamespace(text=json.dumps(self._reply(prompt)))
+
+
+class FakeSNSClient:
+    """boto3 SNS client stand-in: publish() returns a MessageId after ``latency_ms``."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.published = 0
+
+    def publish(self, PhoneNumber: str = "", Message: str = "", **_: Any) -> Dict[str, Any]:
+        self.published += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return {"MessageId": str(uuid.uuid4())}
+
+    def get_sms_attributes(self, attributes: Optional[List[str]] = None) -> Dict[str, Any]:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return {"attributes": {"DefaultSMSType": "Transactional"}}
+
+
+def install(db: FakeSupabase, model: Optional[FakeGenerativeModel] = None, sns_client: Optional[FakeSNSClient] = None) -> None:
+    """Point the imported app at the fakes (call after importing app.main)."""
+    import app.main  # noqa: F401  (imports every module that holds a client)
+    from app.gemini_service import gemini_service
+    from app.sns_service import sns_service
+    from app.services import registry
+
+    # So the startup warmup never builds (or dials) the real client
+    registry.services["supabase"].override(db)
+    for name, module in list(sys.modules.items()):
+        if (name == "app" or name.startswith("app.")) and hasattr(module, "supabase"):
+            module.supabase = db
+    if model is not None:
+        gemini_service.model_text = model
+        gemini_service.model_vision = model
+    if sns_client is not None:
+        sns_service.client = sns_client
@@ -0,0 +1,315 @@
+"""Replay a day of PillPal traffic against app.main:app.
+
+Usage (from backend/):
+    python -m benchmarks.load_test                                   # 200 patients, one day in 60 s, in process
+    python -m benchmarks.load_test --patients 2000 --duration 300 --concurrency 64 --db-latency-ms 3
+    python -m benchmarks.load_test --url http://localhost:8000 --patients 5000 --now 2026-03-02T12:00:00+00:00
+
+Builds a synthetic population (benchmarks/population.py) and turns the next
+24 hours of it into a request schedule, in each user's local time:
+
+* dose times: the patient opens the app shortly before (next dose), then
+  takes, snoozes or skips in the app (one bulk update when several doses are
+  due together) or by SMS reply, following their adherence behavior; doses
+  left unanswered past the grace period are escalated to caregivers
+* morning check-in (risk card, alerts feed, sync) and an occasional
+  evening look at the dose history
+* caregiver dashboard sessions polling the patient summary and alerts feed,
+  acknowledging alerts
+* clinicians paging through the cohort during office hours
+* prescription label uploads followed by a batch import
+
+so load peaks around the morning and evening dose times. The day is
+compressed into ``--duration`` seconds and requests are fired on schedule
+with at most ``--concurrency`` in flight; when the target cannot keep up the
+schedule lag grows and is reported.
+
+In process (default) the app talks to benchmarks/fakes.py with the given
+latencies. With ``--url`` requests go to a running deployment whose database
+was seeded by ``python -m benchmarks.population --postgres`` with the same
+``--patients``, ``--days``, ``--seed`` and ``--now``; SMS replies need
+SMS_WEBHOOK_TOKEN to match the server's.
+"""
+import os
+
+os.environ.setdefault("TIMING_LOG_ENABLED", "false")
+os.environ.setdefault("SMS_WEBHOOK_TOKEN", "bench-webhook-token")
+os.environ.setdefault("COHORT_REFRESH_ENABLED", "false")
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import httpx
+
+from benchmarks.bench_api import percentile
+from benchmarks.population import CATALOG, NOT_TAKEN, Population, generate, headers_for, take_probability, write_fake
+
+from app.sms_reply_service import SMS_WEBHOOK_TOKEN
+from app.timezones import resolve_zone
+
+DAY_SECONDS = 86400
+_LABEL_IMAGE = b"\xff\xd8\xff\xe0" + bytes(48_000)
+
+
+class Event(NamedTuple):
+    at: float  # seconds into the simulated day
+    kind: str
+    method: str
+    url: str
+    kwargs: Dict[str, Any]
+
+
+class Schedule:
+    """The simulated day as a time-ordered list of requests."""
+
+    def __init__(self, pop: Population, start: datetime, days: int, seed: int, uploads: float, poll_minutes: float):
+        self.pop = pop
+        self.start = start
+        self.days = days
+        self.rng = random.Random(seed)
+        self.uploads = uploads
+        self.poll = poll_minutes * 60
+        self.events: List[Event] = []
+        self.headers = {u["id"]: headers_for(u) for u in pop.rows["users"]}
+        self.grace = {r["user_id"]: r["grace_minutes"] for r in pop.rows["escalation_rules"]}
+        alerted = {a["dose_id"]: a["id"] for a in pop.rows["alerts"]}
+        self.alerts_of: Dict[str, List[str]] = {}  # patient id -> alert ids
+        for pid, doses in pop.doses.items():
+            for d in doses:
+                if d["id"] in alerted:
+                    self.alerts_of.setdefault(pid, []).append(alerted[d["id"]])
+
+    def add(self, at: float, kind: str, method: str, url: str, user_id: Optional[str] = None, **kwargs: Any) -> None:
+        if 0 <= at < DAY_SECONDS:
+            if user_id is not None:
+                kwargs["headers"] = self.headers[user_id]
+            self.events.append(Event(at, kind, method, url, kwargs))
+
+    def offset(self, instant: datetime) -> float:
+        return (instant - self.start).total_seconds()
+
+    def local_offset(self, zone_name: str, hour: float) -> float:
+        """Seconds into the simulated day of the next local ``hour`` o'clock in ``zone_name``."""
+        local = self.start.astimezone(resolve_zone(zone_name))
+        at = local.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(hours=hour)
+        if at < local:
+            at += timedelta(days=1)
+        return self.offset(at.astimezone(timezone.utc))
+
+    def build(self) -> List[Event]:
+        for p in self.pop.patients:
+            self._patient(p)
+        for c in self.pop.caregivers:
+            self._caregiver(c)
+        for c in self.pop.clinicians:
+            self._clinician(c)
+        self.events.sort(key=lambda e: e.at)
+        return self.events
+
+    # ---------- patients ----------
+
+    def _patient(self, p: Dict[str, Any]) -> None:
+        rng, uid = self.rng, p["id"]
+        behavior = self.pop.behavior[uid]
+        end = self.start + timedelta(seconds=DAY_SECONDS)
+        due: Dict[datetime, List[Dict[str, Any]]] = {}
+        for d in self.pop.doses[uid]:
+            if self.start <= d["scheduled_at"] < end and d["status"] == "pending":
+                due.setdefault(d["scheduled_at"], []).append(d)
+        zone = resolve_zone(p["timezone"])
+        grace = self.grace.get(uid)  # only patients with caregivers have escalation rules
+
+        for at, doses in due.items():
+            t = self.offset(at)
+            self.add(t - rng.uniform(0, 300), "app.next_dose", "GET", "/api/v1/user/next-dose", uid)
+            taken = rng.random() < take_probability(behavior, at.astimezone(zone), 0, self.days)
+            status = "taken" if taken else rng.choices([s for s, _ in NOT_TAKEN], [w for _, w in NOT_TAKEN])[0]
+            acted = t + max(0.0, rng.gauss(8, 10)) * 60
+            if status in ("taken", "skipped") and p["phone_enc"] and rng.random() < 0.25:
+                self._sms(acted, p["phone_enc"], "TAKEN" if status == "taken" else "SKIP")
+            elif status in ("taken", "skipped", "snoozed"):
+                if len(doses) > 1:
+                    items = [{"id": d["id"], "status": status, "expected_status": "pending"} for d in doses]
+                    self.add(acted, "app.dose_bulk", "PATCH", "/api/v1/doses/bulk", uid, json={"items": items})
+                else:
+                    self.add(acted, "app.dose_update", "PATCH", f"/api/v1/doses/{doses[0]['id']}", uid, json={"status": status})
+            elif grace is not None:
+                for d in doses:
+                    self.add(t + (grace + 1) * 60, "escalation", "POST", "/api/v1/alerts/missed-dose", uid, params={"dose_id": d["id"]})
+
+        if rng.random() < 0.6:
+            t = self.local_offset(p["timezone"], rng.uniform(7, 10))
+            self.add(t, "app.risk_today", "GET", "/api/v1/risk/today", uid)
+            self.add(t + 2, "app.alerts_feed", "GET", "/api/v1/alerts/feed", uid)
+            self.add(t + 3, "app.sync", "POST", "/api/v1/sync", uid, json={"cursor": {}, "limit": 200})
+        if rng.random() < 0.3:
+            self.add(self.local_offset(p["timezone"], rng.uniform(19, 22)), "app.history", "GET", "/api/v1/doses", uid)
+        if rng.random() < self.uploads:
+            t = self.local_offset(p["timezone"], rng.uniform(9, 20))
+            self.add(t, "upload.label", "POST", "/api/v1/label-extract", uid, files={"file": ("label.jpg", _LABEL_IMAGE, "image/jpeg")})
+            drug = rng.choice(CATALOG)
+            item = {"client_key": str(uuid.UUID(int=rng.getrandbits(128))), "name": drug.name, "instructions": drug.sig}
+            self.add(t + 60, "upload.import", "POST", "/api/v1/medications/batch", uid, json={"medications": [item]})
+
+    def _sms(self, at: float, phone: str, body: str) -> None:
+        message = {"originationNumber": phone, "messageBody": body, "inboundMessageId": str(uuid.UUID(int=self.rng.getrandbits(128)))}
+        payload = {"Type": "Notification", "MessageId": message["inboundMessageId"], "Message": json.dumps(message)}
+        self.add(at, "sms.reply", "POST", "/api/v1/sms/inbound", headers={"X-Webhook-Token": SMS_WEBHOOK_TOKEN}, json=payload)
+
+    # ---------- caregivers and clinicians ----------
+
+    def _caregiver(self, c: Dict[str, Any]) -> None:
+        rng, uid = self.rng, c["id"]
+        alerts = [a for pid, cids in self.pop.caregivers_of.items() if uid in cids for a in self.alerts_of.get(pid, ())]
+        for _ in range(rng.randint(2, 4)):
+            t = self.local_offset(c["timezone"], rng.uniform(8, 21))
+            for k in range(6):  # a ~30 minute session with the dashboard open
+                self.add(t + k * self.poll, "caregiver.summary", "GET", "/api/v1/caregiver/patients/summary", uid)
+                self.add(t + k * self.poll + 1, "caregiver.alerts", "GET", "/api/v1/alerts/feed", uid)
+            if alerts and rng.random() < 0.5:
+                self.add(t + 30, "caregiver.ack", "POST", f"/api/v1/alerts/acknowledge/{rng.choice(alerts)}", uid)
+
+    def _clinician(self, c: Dict[str, Any]) -> None:
+        rng, uid = self.rng, c["id"]
+        t = self.local_offset(c["timezone"], 9)
+        for k in range(16):  # every 30 minutes of office hours
+            sort = rng.choice(["adherence", "risk", "name", "last_taken"])
+            params = {"sort": sort, "order": rng.choice(["asc", "desc"]), "offset": rng.choice([0, 0, 50, 100]), "limit": 50}
+            if rng.random() < 0.3:
+                params["risk"] = "high"
+            self.add(t + k * 1800, "clinician.cohort", "GET", "/api/v1/clinician/cohort", uid, params=params)
+
+
+# ---------- replay ----------
+
+class Results:
+    def __init__(self) -> None:
+        self.latency: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.hours: List[List[float]] = [[] for _ in range(24)]
+        self.lag: List[float] = []
+        self.samples: Dict[str, str] = {}
+
+    def record(self, event: Event, ms: float, status: Optional[int], detail: str) -> None:
+        self.latency.setdefault(event.kind, []).append(ms)
+        self.hours[int(event.at // 3600) % 24].append(ms)
+        if status is None or status >= 400:
+            self.errors[event.kind] = self.errors.get(event.kind, 0) + 1
+            self.samples.setdefault(event.kind, f"{event.method} {event.url} -> {status} {detail[:200]}")
+
+
+async def replay(client: httpx.AsyncClient, events: List[Event], duration: float, concurrency: int) -> Results:
+    results = Results()
+    slots = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    scale = duration / DAY_SECONDS
+    tasks = set()
+
+    async def fire(event: Event) -> None:
+        started = time.perf_counter()
+        try:
+            res = await client.request(event.method, event.url, **event.kwargs)
+            status, detail = res.status_code, res.text if res.status_code >= 400 else ""
+        except Exception as e:
+            status, detail = None, repr(e)
+        finally:
+            slots.release()
+        results.record(event, (time.perf_counter() - started) * 1000, status, detail)
+
+    t0 = loop.time()
+    for event in events:
+        due = t0 + event.at * scale
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await slots.acquire()
+        results.lag.append(max(0.0, loop.time() - due) * 1000)
+        task = asyncio.create_task(fire(event))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return results
+
+
+def report(results: Results, duration: float, wall: float) -> None:
+    total = sum(len(v) for v in results.latency.values())
+    print(f"\n{total} requests in {wall:.1f}s ({total / wall:.1f} req/s; schedule asked for {total / duration:.1f})")
+    lag = sorted(results.lag)
+    print(f"Schedule lag: p50 {percentile(lag, 0.5):.1f} ms, p95 {percentile(lag, 0.95):.1f} ms, max {lag[-1] if lag else 0:.1f} ms\n")
+
+    header = f"{'action':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for kind in sorted(results.latency, key=lambda k: -len(results.latency[k])):
+        values = sorted(results.latency[kind])
+        print(f"{kind:<20}{len(values):>8}{percentile(values, 0.5):>10.2f}{percentile(values, 0.95):>10.2f}"
+              f"{percentile(values, 0.99):>10.2f}{results.errors.get(kind, 0):>8}")
+
+    hour_seconds = duration / 24
+    print(f"\n{'UTC hour':<10}{'requests':>10}{'req/s':>9}{'p95 ms':>10}")
+    for h, values in enumerate(results.hours):
+        values.sort()
+        print(f"{h:02d}:00     {len(values):>10}{len(values) / hour_seconds:>9.1f}{percentile(values, 0.95):>10.2f}")
+    for kind, sample in results.samples.items():
+        print(f"first {kind} error: {sample}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    now = datetime.fromisoformat(args.now) if args.now else datetime.now(timezone.utc).replace(microsecond=0)
+    started = time.perf_counter()
+    pop = generate(args.patients, args.days, seed=args.seed, now=now)
+    print(f"Generated {pop.summary()} in {time.perf_counter() - started:.1f}s")
+
+    events = Schedule(pop, now, args.days, args.seed, args.uploads, args.poll_minutes).build()
+    print(f"Scheduled {len(events)} requests over one simulated day, replayed in {args.duration:.0f}s")
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30)
+        writer = None
+    else:
+        from benchmarks.fakes import FakeGenerativeModel, FakeSNSClient, FakeSupabase, install
+        import app.main as main
+        from app.event_log import log_writer as writer
+
+        db = FakeSupabase(args.db_latency_ms)
+        install(db, FakeGenerativeModel(args.gemini_latency_ms), FakeSNSClient(args.sns_latency_ms))
+        write_fake(db, pop)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest", timeout=30)
+        writer.start()
+    try:
+        async with client:
+            started = time.perf_counter()
+            results = await replay(client, events, args.duration, args.concurrency)
+            wall = time.perf_counter() - started
+    finally:
+        if writer is not None:
+            await writer.stop()
+    report(results, args.duration, wall)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--days", type=int, default=30, help="days of dose history in the population")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--now", help="population reference time (ISO 8601), as passed to benchmarks.population")
+    parser.add_argument("--duration", type=float, default=60.0, help="wall seconds to replay the simulated day in")
+    parser.add_argument("--concurrency", type=int, default=32, help="max requests in flight")
+    parser.add_argument("--uploads", type=float, default=0.02, help="share of patients uploading a label per day")
+    parser.add_argument("--poll-minutes", type=float, default=5.0, help="caregiver dashboard refresh interval")
+    parser.add_argument("--url", help="target a running server instead of the in-process app")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=0.0)
+    parser.add_argument("--sns-latency-ms", type=float, default=0.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""Synthetic patient population for load tests and benchmarks.
+
+Usage (from backend/):
+    python -m benchmarks.population --patients 5000 --days 90            # summary only (dry run)
+    python -m benchmarks.population --patients 5000 --days 90 --postgres # COPY into DATABASE_URL
+
+Patients get a regimen drawn from a weighted catalog of common chronic
+medications (1-8 per patient, weighted towards 2-4), each with a real sig
+string whose times come from app.schedule_compiler exactly as the API would
+derive them. Every patient has an IANA timezone and one adherence behavior
+(steady, evening misser, weekend slipper, declining, erratic) that decides
+the status of each past dose from its local hour, weekday and age. About
+half of the patients have one or two caregivers; clinicians each see a
+panel of up to ``--panel`` patients, linked in clinician_links.
+
+Generation is deterministic for a given ``--seed``, shape and reference time
+(``--now``), including row ids, so a load driver can regenerate the
+population it seeded into Postgres without reading it back. Doses are written ``--ahead`` days into the future
+as pending, the way the materializer would have left them.
+
+``--postgres`` writes with COPY (psycopg) into DATABASE_URL. The schema's
+triggers still run: adherence_daily rollups, med_times owners and sync
+versions. Run it against a scratch database; it does not delete anything.
+"""
+import argparse
+import math
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from jose import jwt
+
+from app.database import DATABASE_URL
+from app.schedule_compiler import compile_schedule
+from app.security import AUTH0_AUDIENCE, AUTH0_ISSUER
+from app.timezones import local_instant, resolve_zone
+
+try:
+    import psycopg
+except ImportError:  # only needed for --postgres
+    psycopg = None
+
+
+class Drug(NamedTuple):
+    name: str
+    strength_text: str
+    dose_text: str
+    sig: str
+    weight: int
+
+
+# Common chronic regimens of an older-adult panel; weight ~ how often it is prescribed
+CATALOG = [
+    Drug("Lisinopril", "10 mg", "1 tablet", "Take 1 tablet by mouth once daily", 10),
+    Drug("Metformin", "500 mg", "1 tablet", "Take 1 tablet by mouth b.i.d.", 10),
+    Drug("Atorvastatin", "20 mg", "1 tablet", "Take 1 tablet at bedtime", 10),
+    Drug("Amlodipine", "5 mg", "1 tablet", "Take 1 tablet every morning", 8),
+    Drug("Levothyroxine", "50 mcg", "1 tablet", "Take 1 tablet daily with breakfast", 7),
+    Drug("Omeprazole", "20 mg", "1 capsule", "Take 1 capsule before breakfast and dinner", 6),
+    Drug("Metoprolol", "25 mg", "1 tablet", "Take 1 tablet at 7:30 am and 7:30 pm", 6),
+    Drug("Sertraline", "50 mg", "1 tablet", "Take 1 tablet daily in the evening", 5),
+    Drug("Gabapentin", "300 mg", "1 capsule", "Take 1 capsule three times daily", 4),
+    Drug("Warfarin", "5 mg", "1 tablet", "Take 1 tablet by mouth once daily", 3),
+    Drug("Insulin glargine", "100 units/mL", "10 units", "Inject 10 units under the skin at bedtime", 3),
+    Drug("Amoxicillin", "500 mg", "1 capsule", "Take 1 capsule every 8 hours", 2),
+    Drug("Prednisone", "10 mg", "1 tablet", "Take 2 tablets by mouth daily with breakfast", 2),
+    Drug("Donepezil", "10 mg", "1 tablet", "Take 1 tablet at bedtime", 2),
+    Drug("Furosemide", "40 mg", "1 tablet", "Take 1 tablet every morning", 3),
+    Drug("Tramadol", "50 mg", "1 tablet", "Take 1 tablet 4 times a day", 1),
+]
+REGIMEN_SIZES = [(1, 12), (2, 22), (3, 24), (4, 18), (5, 11), (6, 7), (7, 4), (8, 2)]
+ZONES = [
+    ("America/New_York", 30), ("America/Chicago", 20), ("America/Denver", 8), ("America/Los_Angeles", 20),
+    ("America/Phoenix", 3), ("Pacific/Honolulu", 1), ("Europe/London", 6), ("Asia/Kolkata", 6), ("UTC", 6),
+]
+BEHAVIORS = [("steady", 45), ("evening_misser", 20), ("weekend_slipper", 15), ("declining", 10), ("erratic", 10)]
+# How a dose that was not taken ended up
+NOT_TAKEN = [("skipped", 35), ("snoozed", 25), ("missed", 25), ("pending", 15)]
+
+# Tables in foreign-key order
+TABLES = ("users", "caregiver_links", "clinician_links", "medications", "med_times", "doses", "escalation_rules", "risk_daily", "alerts")
+
+
+def _weighted(rng: random.Random, choices: List[Tuple[Any, int]]) -> Any:
+    return rng.choices([c for c, _ in choices], weights=[w for _, w in choices])[0]
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def take_probability(behavior: str, local: datetime, age_days: int, history_days: int) -> float:
+    """Chance that a patient with ``behavior`` takes the dose due at ``local``, ``age_days`` ago."""
+    if behavior == "steady":
+        return 0.96
+    if behavior == "evening_misser":
+        return 0.95 if local.hour < 17 else 0.68
+    if behavior == "weekend_slipper":
+        return 0.74 if local.weekday() >= 5 else 0.94
+    if behavior == "declining":
+        # Was adherent at the start of the history, slipping towards today
+        return 0.95 - 0.3 * (1 - age_days / max(1, history_days))
+    return 0.6
+
+
+def headers_for(user: Dict[str, Any]) -> Dict[str, str]:
+    """Bearer header the API accepts for ``user`` (claims are read unverified, see app.security)."""
+    claims = {"sub": user["auth0_sub"], "name": user["name"], "iss": AUTH0_ISSUER or "https://loadtest.local/", "aud": AUTH0_AUDIENCE}
+    return {"Authorization": "Bearer " + jwt.encode(claims, "loadtest", algorithm="HS256")}
+
+
+class Population:
+    """Rows per table, plus per-patient lookups for traffic generators."""
+
+    def __init__(self) -> None:
+        self.rows: Dict[str, List[Dict[str, Any]]] = {t: [] for t in TABLES}
+        self.patients: List[Dict[str, Any]] = []
+        self.caregivers: List[Dict[str, Any]] = []
+        self.clinicians: List[Dict[str, Any]] = []
+        self.behavior: Dict[str, str] = {}  # patient id -> behavior
+        self.meds: Dict[str, List[Dict[str, Any]]] = {}  # patient id -> medication rows
+        self.doses: Dict[str, List[Dict[str, Any]]] = {}  # patient id -> dose rows, by scheduled_at
+        self.caregivers_of: Dict[str, List[str]] = {}  # patient id -> caregiver ids
+
+    def add(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        self.rows[table].append(row)
+        return row
+
+    def summary(self) -> str:
+        return ", ".join(f"{t}={len(rows)}" for t, rows in self.rows.items())
+
+
+def generate(
+    patients: int,
+    days: int = 30,
+    ahead: int = 2,
+    caregiver_share: float = 0.5,
+    panel: int = 250,
+    seed: int = 7,
+    now: Optional[datetime] = None,
+) -> Population:
+    """Build a population of ``patients`` with ``days`` of dose history."""
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    pop = Population()
+    schedules = {d.sig: compile_schedule(d.sig).clock_times() for d in CATALOG}
+    drugs = [(d, d.weight) for d in CATALOG]
+
+    def user(sub: str, name: str, role: str, zone: str, phone: Optional[str]) -> Dict[str, Any]:
+        return pop.add("users", {
+            "id": _uuid(rng), "auth0_sub": sub, "role": role, "name": name, "phone_enc": phone, "timezone": zone,
+            "created_at": now - timedelta(days=days + rng.randint(1, 365)),
+        })
+
+    for i in range(patients):
+        zone_name = _weighted(rng, ZONES)
+        p = user(f"loadtest|patient-{i}", f"Patient {i}", "patient", zone_name, f"+1555{i:07d}" if rng.random() < 0.8 else None)
+        pop.patients.append(p)
+        behavior = pop.behavior[p["id"]] = _weighted(rng, BEHAVIORS)
+        zone = resolve_zone(zone_name)
+        today = now.astimezone(zone).date()
+
+        picked: Dict[str, Drug] = {}
+        for _ in range(_weighted(rng, REGIMEN_SIZES)):
+            d = _weighted(rng, drugs)
+            picked[d.name] = d
+        meds = pop.meds[p["id"]] = []
+        doses = pop.doses[p["id"]] = []
+        for d in picked.values():
+            med = pop.add("medications", {
+                "id": _uuid(rng), "user_id": p["id"], "name": d.name, "strength_text": d.strength_text,
+                "dose_text": d.dose_text, "instructions": d.sig, "created_at": p["created_at"],
+            })
+            meds.append(med)
+            for t in schedules[d.sig]:
+                pop.add("med_times", {"id": _uuid(rng), "medication_id": med["id"], "user_id": p["id"], "time_of_day": t.isoformat()})
+            for day_offset in range(-days, ahead + 1):
+                day = today + timedelta(days=day_offset)
+                for t in schedules[d.sig]:
+                    local = local_instant(day, t, zone)
+                    at = local.astimezone(timezone.utc)
+                    status, taken_at = "pending", None
+                    if at < now:
+                        if rng.random() < take_probability(behavior, local, -day_offset, days):
+                            status = "taken"
+                            taken_at = at + timedelta(minutes=min(120, max(-30, rng.gauss(10, 15))))
+                        else:
+                            status = _weighted(rng, NOT_TAKEN)
+                    doses.append(pop.add("doses", {
+                        "id": _uuid(rng), "user_id": p["id"], "medication_id": med["id"], "scheduled_at": at,
+                        "status": status, "taken_at": taken_at, "notes": None, "created_at": at - timedelta(days=30),
+                        "source": "schedule",
+                    }))
+        doses.sort(key=lambda r: r["scheduled_at"])
+
+        past = [r for r in doses if r["scheduled_at"] < now][-7 * 4:]
+        misses = sum(r["status"] != "taken" for r in past)
+        base = 100 * misses / len(past) if past else 30
+        for k in range(7):
+            pop.add("risk_daily", {
+                "id": _uuid(rng), "user_id": p["id"], "for_date": (today - timedelta(days=k)).isoformat(),
+                "score": int(min(100, max(0, rng.gauss(base * 1.5 + 10, 8)))),
+            })
+
+    # Caregivers: about ``caregiver_share`` of patients have one (some two); a caregiver has 1-3 patients
+    cared = [p for p in pop.patients if rng.random() < caregiver_share]
+    i = 0
+    while cared:
+        zone = _weighted(rng, ZONES)
+        c = user(f"loadtest|caregiver-{i}", f"Caregiver {i}", "caregiver", zone, f"+1666{i:07d}")
+        pop.caregivers.append(c)
+        for p in [cared.pop() for _ in range(min(len(cared), rng.choice([1, 1, 2, 2, 3])))]:
+            links = [c] + ([rng.choice(pop.caregivers)] if len(pop.caregivers) > 1 and rng.random() < 0.15 else [])
+            for cg in {cg["id"]: cg for cg in links}.values():
+                pop.add("caregiver_links", {"id": _uuid(rng), "patient_id": p["id"], "caregiver_id": cg["id"], "created_at": p["created_at"]})
+                pop.caregivers_of.setdefault(p["id"], []).append(cg["id"])
+            pop.add("escalation_rules", {
+                "id": _uuid(rng), "user_id": p["id"], "grace_minutes": rng.choice([10, 15, 30, 60]), "escalate_sms": True,
+            })
+            # Missed doses of the last week were escalated to the caregivers
+            week_ago = now - timedelta(days=7)
+            for d in pop.doses[p["id"]]:
+                if d["status"] == "missed" and week_ago <= d["scheduled_at"] < now:
+                    pop.add("alerts", {
+                        "id": _uuid(rng), "dose_id": d["id"], "sent_at": d["scheduled_at"] + timedelta(minutes=15),
+                        "ack_by_user_id": None, "ack_at": None, "meta": {"phone": c["phone_enc"]},
+                    })
+        i += 1
+
+    size = max(1, panel)
+    for k in range(max(1, math.ceil(patients / size))):
+        clinician = user(f"loadtest|clinician-{k}", f"Dr. Clinician {k}", "clinician", _weighted(rng, ZONES[:6]), None)
+        pop.clinicians.append(clinician)
+        for p in pop.patients[k * size:(k + 1) * size]:
+            pop.add("clinician_links", {"id": _uuid(rng), "patient_id": p["id"], "clinician_id": clinician["id"], "created_at": clinician["created_at"]})
+    return pop
+
+
+# ---------- writers ----------
+
+def write_fake(db: Any, pop: Population) -> None:
+    """Load into a benchmarks.fakes.FakeSupabase and refresh the cohort rollups."""
+    for table in TABLES:
+        db.load(table, pop.rows[table])
+    with db.lock:
+        db.rpc_refresh_cohort_stats()
+
+
+def write_postgres(pop: Population, dsn: str = DATABASE_URL) -> Dict[str, float]:
+    """COPY every table into ``dsn`` in one transaction; returns seconds per table."""
+    if psycopg is None or not dsn:
+        raise RuntimeError("writing to Postgres needs psycopg and DATABASE_URL")
+    from psycopg.types.json import Jsonb
+
+    timings: Dict[str, float] = {}
+    oldest = min((r["scheduled_at"] for r in pop.rows["doses"]), default=datetime.now(timezone.utc))
+    today = datetime.now(timezone.utc).date()
+    months_back = (today.year - oldest.year) * 12 + today.month - oldest.month
+    with psycopg.connect(dsn) as conn:
+        conn.execute("select ensure_dose_partitions(%s, %s)", (months_back, 3))
+        for table in TABLES:
+            rows = pop.rows[table]
+            if not rows:
+                continue
+            columns = list(rows[0])
+            started = time.perf_counter()
+            with conn.cursor() as cur:
+                with cur.copy(f"copy {table} ({', '.join(columns)}) from stdin") as copy:
+                    for row in rows:
+                        copy.write_row([Jsonb(v) if isinstance(v, dict) else v for v in (row[c] for c in columns)])
+            timings[table] = round(time.perf_counter() - started, 2)
+            print(f"  {table}: {len(rows)} rows in {timings[table]}s")
+        conn.execute("select refresh_cohort_stats()")
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=30, help="days of dose history")
+    parser.add_argument("--ahead", type=int, default=2, help="days of pending doses after today")
+    parser.add_argument("--caregiver-share", type=float, default=0.5)
+    parser.add_argument("--panel", type=int, default=250, help="patients per clinician")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--now", help="reference time (ISO 8601); defaults to the current time")
+    parser.add_argument("--postgres", action="store_true", help="COPY into DATABASE_URL")
+    args = parser.parse_args()
+
+    now = datetime.fromisoformat(args.now) if args.now else datetime.now(timezone.utc).replace(microsecond=0)
+    started = time.perf_counter()
+    pop = generate(args.patients, args.days, args.ahead, args.caregiver_share, args.panel, args.seed, now)
+    print(f"Generated {pop.summary()} in {time.perf_counter() - started:.1f}s (--now {now.isoformat()})")
+    behaviors: Dict[str, int] = {}
+    for b in pop.behavior.values():
+        behaviors[b] = behaviors.get(b, 0) + 1
+    print("Behaviors: " + ", ".join(f"{b}={n}" for b, n in sorted(behaviors.items())))
+    if args.postgres:
+        started = time.perf_counter()
+        write_postgres(pop)
+        print(f"Wrote to Postgres in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import { NextRequest } from 'next/server'
 
 const BACKEND = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8080'
+// Content encodings Node's fetch decodes transparently
+const UPSTREAM_ENCODINGS = ['gzip', 'br']
 
 function readCookie(req: NextRequest, name: string): string | undefined {
   const raw = req.headers.get('cookie') || ''
@@ -35,10 +37,19 @@ async function proxy(request: NextRequest, context: { params: Promise<{ path: st
   if (accessToken) (init.headers as Headers).set('Authorization', `Bearer ${accessToken}`)
   if (idToken) (init.headers as Headers).set('x-id-token', idToken)
 
+  // Only ask for encodings every Node fetch decodes (zstd support depends on the Node release)
+  ;(init.headers as Headers).set('accept-encoding', UPSTREAM_ENCODINGS.join(', '))
+
   const res = await fetch(target, init)
-  const body = await res.text()
   const headers = new Headers(res.headers)
-  return new Response(body, { status: res.status, headers })
+  const encoding = (res.headers.get('content-encoding') || '').trim().toLowerCase()
+  if (UPSTREAM_ENCODINGS.includes(encoding)) {
+    // fetch has already decoded the body; Next compresses the response to the client again
+    headers.delete('content-encoding')
+    headers.delete('content-length')
+  }
+  // Pass the body through as a stream so CSV exports are not buffered here
+  return new Response(res.body, { status: res.status, headers })
 }
 
 export { proxy as GET, proxy as POST, proxy as PATCH, proxy as DELETE }
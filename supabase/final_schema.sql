@@ -18,6 +18,9 @@ begin
   end if;
 end $$;
 
+-- Set by the missed-dose escalation (/api/v1/alerts/missed-dose)
+alter type dose_status add value if not exists 'missed';
+
 -- 1) Core Identity & Access
 ------------------------------------------------------------
 create table if not exists users (
@@ -26,9 +29,12 @@ create table if not exists users (
   role          user_role not null,
   name          text not null,
   phone_enc     text,                               -- optionally store encrypted phone
+  timezone      text not null default 'UTC',        -- IANA zone from X-User-Timezone
   created_at    timestamptz not null default now()
 );
 
+alter table users add column if not exists timezone text not null default 'UTC';
+
 create table if not exists caregiver_links (
   id            uuid primary key default gen_random_uuid(),
   patient_id    uuid not null references users(id) on delete cascade,
@@ -40,6 +46,17 @@ create table if not exists caregiver_links (
 create index if not exists idx_caregiver_links_patient on caregiver_links(patient_id);
 create index if not exists idx_caregiver_links_caregiver on caregiver_links(caregiver_id);
 
+-- A clinician's panel: the only patients /api/v1/clinician/cohort shows them
+create table if not exists clinician_links (
+  id            uuid primary key default gen_random_uuid(),
+  patient_id    uuid not null references users(id) on delete cascade,
+  clinician_id  uuid not null references users(id) on delete cascade,
+  created_at    timestamptz not null default now(),
+  unique (clinician_id, patient_id)
+);
+
+create index if not exists idx_clinician_links_patient on clinician_links(patient_id);
+
 -- 2) Medications & Schedules
 ------------------------------------------------------------
 create table if not exists medications (
@@ -54,6 +71,11 @@ create table if not exists medications (
 
 create index if not exists idx_meds_user on medications(user_id);
 
+-- Client idempotency key for batch imports (/api/v1/medications/batch);
+-- NULLs are distinct, so medications created without a key are unaffected
+alter table medications add column if not exists client_key text;
+create unique index if not exists uq_meds_client_key on medications(user_id, client_key);
+
 create table if not exists med_times (
   id             uuid primary key default gen_random_uuid(),
   medication_id  uuid not null references medications(id) on delete cascade,
@@ -61,11 +83,16 @@ create table if not exists med_times (
 );
 
 create index if not exists idx_med_times_med on med_times(medication_id);
+create unique index if not exists uq_med_times_med_time on med_times(medication_id, time_of_day);
 
 -- 3) Dose Instances
 ------------------------------------------------------------
+-- Monthly range partitions on scheduled_at (see 7f). Hot queries touch a few
+-- days around now, so they prune to one or two partitions; closed months are
+-- archived out of Postgres. Keys must include the partition key.
+-- Existing unpartitioned databases: supabase/migrations/partition_doses.sql
 create table if not exists doses (
-  id             uuid primary key default gen_random_uuid(),
+  id             uuid not null default gen_random_uuid(),
   user_id        uuid not null references users(id) on delete cascade,
   medication_id  uuid not null references medications(id) on delete cascade,
   scheduled_at   timestamptz not null,             -- concrete datetime for the dose
@@ -73,17 +100,32 @@ create table if not exists doses (
   taken_at       timestamptz,
   notes          text,
   created_at     timestamptz not null default now(),
+  primary key (id, scheduled_at),
   unique (medication_id, scheduled_at)
-);
+) partition by range (scheduled_at);
+
+-- Catches rows outside the pre-created months; should stay (nearly) empty
+do $$
+begin
+  if (select relkind from pg_class where oid = 'doses'::regclass) = 'p'
+     and to_regclass('doses_default') is null then
+    create table doses_default partition of doses default;
+  end if;
+end $$;
 
 create index if not exists idx_doses_user_time on doses(user_id, scheduled_at);
-create index if not exists idx_doses_status on doses(status);
+-- 'schedule' rows were written by the dose materializer, which may remove them
+-- again when a medication's times change. Manual doses (and rows from before
+-- this column) are never deleted by it.
+alter table doses add column if not exists source text not null default 'manual';
+-- Low-cardinality and spanning all history; pending lookups use idx_doses_pending_user_time
+drop index if exists idx_doses_status;
 
 -- 4) Alerts & Escalation
 ------------------------------------------------------------
 create table if not exists alerts (
   id               uuid primary key default gen_random_uuid(),
-  dose_id          uuid not null references doses(id) on delete cascade,
+  dose_id          uuid not null,           -- doses(id); no FK since doses is partitioned
   sent_at          timestamptz not null default now(),
   ack_by_user_id   uuid references users(id),
   ack_at           timestamptz,
@@ -92,6 +134,18 @@ create table if not exists alerts (
 
 create index if not exists idx_alerts_dose on alerts(dose_id);
 
+-- Stands in for the former ON DELETE CASCADE from doses
+create or replace function trg_dose_alerts_cleanup() returns trigger
+language plpgsql as $$
+begin
+  delete from alerts a using old_rows o where a.dose_id = o.id;
+  return null;
+end $$;
+
+drop trigger if exists dose_alerts_cleanup on doses;
+create trigger dose_alerts_cleanup after delete on doses
+  referencing old table as old_rows for each statement execute function trg_dose_alerts_cleanup();
+
 create table if not exists escalation_rules (
   id               uuid primary key default gen_random_uuid(),
   user_id          uuid not null references users(id) on delete cascade,
@@ -139,76 +193,578 @@ create table if not exists audit_log (
 
 create index if not exists idx_audit_user on audit_log(user_id, created_at desc);
 
+-- Pending doses are a small, hot slice of doses; next-dose and overdue
+-- lookups read only this index
+create index if not exists idx_doses_pending_user_time on doses(user_id, scheduled_at) where status = 'pending';
+
 -- Helpful view: next pending dose per user (for dashboard)
+-- One row per user. The lateral LIMIT 1 lets a user_id filter reach the index
+-- instead of aggregating every user's pending doses first.
 create or replace view v_next_dose as
-select d.user_id,
+select u.id as user_id,
        d.id as dose_id,
        d.medication_id,
        d.scheduled_at
-from doses d
-join (
-  select user_id, min(scheduled_at) as next_time
-  from doses
-  where status = 'pending' and scheduled_at >= now()
-  group by user_id
-) nd on nd.user_id = d.user_id and nd.next_time = d.scheduled_at;
-
--- 7) Helper Functions & Triggers (dose generation)
+from users u
+cross join lateral (
+  select d.id, d.medication_id, d.scheduled_at
+  from doses d
+  where d.user_id = u.id and d.status = 'pending' and d.scheduled_at >= now()
+  order by d.scheduled_at, d.id
+  limit 1
+) d;
+
+-- 7) Helper Functions (dose generation)
 ------------------------------------------------------------
--- Generate doses for [start_date, end_date) for a specific medication
+-- Dose generation is owned by the backend (app/dose_materializer.py), which keeps
+-- a rolling horizon of pending doses for every medication and re-plans future
+-- doses when med_times are edited or deleted. This function is kept for seeding
+-- and manual backfills: one set-based INSERT for [start_date, end_date).
+-- Wall-clock times are interpreted in the patient's timezone, not the session's.
 create or replace function gen_doses_for_med(
   p_med_id uuid,
   p_user_id uuid,
   p_start_date date,
   p_end_date   date
-) returns void language plpgsql as $$
-declare
-  t record;
-  d date;
-  ts timestamptz;
+) returns void language sql as $$
+  insert into doses (user_id, medication_id, scheduled_at)
+  select p_user_id, p_med_id, (d::date + t.time_of_day) at time zone u.timezone
+  from generate_series(p_start_date, p_end_date - 1, interval '1 day') as d
+  cross join med_times t
+  join users u on u.id = p_user_id
+  where t.medication_id = p_med_id
+  on conflict (medication_id, scheduled_at) do nothing;
+$$;
+
+-- The per-row triggers regenerated 7 days of doses on every medication and
+-- med_times insert; the backend materializer replaces them.
+drop trigger if exists med_after_insert on medications;
+drop trigger if exists medtimes_after_upsert on med_times;
+drop function if exists trg_med_or_time_after_change();
+
+-- 7b) Adherence Rollups (clinician cohort)
+------------------------------------------------------------
+-- Per-patient, per-local-day, per-time-block dose counts, kept current by a
+-- trigger on doses: every insert/update/delete moves one count between cells,
+-- so reads never scan raw doses. Blocks follow the patient's timezone:
+-- morning 05-12, midday 12-17, evening 17-21, night otherwise. Each dose
+-- stores the cell it was counted in (rollup_day/rollup_block, set when it is
+-- inserted or rescheduled), and the decrement uses that cell rather than the
+-- user's current timezone, so totals do not drift when the timezone changes.
+create table if not exists adherence_daily (
+  user_id   uuid not null references users(id) on delete cascade,
+  day       date not null,
+  block     text not null check (block in ('morning','midday','evening','night')),
+  taken     integer not null default 0,
+  skipped   integer not null default 0,   -- includes escalated 'missed' doses
+  snoozed   integer not null default 0,
+  pending   integer not null default 0,
+  primary key (user_id, day, block)
+);
+
+create index if not exists idx_adherence_daily_day on adherence_daily(day);
+
+create or replace function dose_time_block(p_local timestamp) returns text
+language sql immutable as $$
+  select case
+    when extract(hour from p_local) >= 5  and extract(hour from p_local) < 12 then 'morning'
+    when extract(hour from p_local) >= 12 and extract(hour from p_local) < 17 then 'midday'
+    when extract(hour from p_local) >= 17 and extract(hour from p_local) < 21 then 'evening'
+    else 'night'
+  end
+$$;
+
+-- Null on doses written before the columns existed; those fall back to the current timezone
+alter table doses add column if not exists rollup_day date;
+alter table doses add column if not exists rollup_block text;
+
+create or replace function trg_dose_rollup_cell() returns trigger
+language plpgsql as $$
 begin
-  for d in select generate_series(p_start_date, p_end_date - interval '1 day', interval '1 day')::date loop
-    for t in select time_of_day from med_times where medication_id = p_med_id loop
-      ts := (d::timestamptz + t.time_of_day);
-      insert into doses (user_id, medication_id, scheduled_at)
-      values (p_user_id, p_med_id, ts)
-      on conflict (medication_id, scheduled_at) do nothing;
-    end loop;
-  end loop;
+  select (new.scheduled_at at time zone u.timezone)::date,
+         dose_time_block(new.scheduled_at at time zone u.timezone)
+    into new.rollup_day, new.rollup_block
+  from users u
+  where u.id = new.user_id;
+  return new;
+end $$;
+
+drop trigger if exists dose_rollup_cell on doses;
+create trigger dose_rollup_cell
+before insert or update of scheduled_at, user_id on doses
+for each row execute function trg_dose_rollup_cell();
+
+drop function if exists bump_adherence(uuid, timestamptz, dose_status, integer);
+create or replace function bump_adherence(
+  p_user uuid, p_at timestamptz, p_day date, p_block text, p_status dose_status, p_delta integer
+)
+returns void language sql as $$
+  insert into adherence_daily as a (user_id, day, block, taken, skipped, snoozed, pending)
+  select p_user,
+         coalesce(p_day, (p_at at time zone u.timezone)::date),
+         coalesce(p_block, dose_time_block(p_at at time zone u.timezone)),
+         case when p_status = 'taken'   then p_delta else 0 end,
+         case when p_status::text in ('skipped', 'missed') then p_delta else 0 end,
+         case when p_status = 'snoozed' then p_delta else 0 end,
+         case when p_status = 'pending' then p_delta else 0 end
+  from users u
+  where u.id = p_user
+  on conflict (user_id, day, block) do update set
+    taken   = a.taken   + excluded.taken,
+    skipped = a.skipped + excluded.skipped,
+    snoozed = a.snoozed + excluded.snoozed,
+    pending = a.pending + excluded.pending;
+$$;
+
+create or replace function trg_dose_rollup() returns trigger
+language plpgsql as $$
+begin
+  if tg_op in ('UPDATE', 'DELETE') then
+    perform bump_adherence(old.user_id, old.scheduled_at, old.rollup_day, old.rollup_block, old.status, -1);
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    perform bump_adherence(new.user_id, new.scheduled_at, new.rollup_day, new.rollup_block, new.status, 1);
+  end if;
+  return null;
 end $$;
 
--- Trigger function: after medication created OR med_times inserted/updated,
--- generate the next 7 days of doses.
-create or replace function trg_med_or_time_after_change()
-returns trigger language plpgsql as $$
+drop trigger if exists dose_rollup on doses;
+create trigger dose_rollup
+after insert or delete or update of status, scheduled_at, user_id on doses
+for each row execute function trg_dose_rollup();
+
+-- One-off backfill (or repair): recompute every cell from doses, in the cells the trigger counted them in
+create or replace function rebuild_adherence_daily() returns void
+language sql as $$
+  delete from adherence_daily;
+  insert into adherence_daily (user_id, day, block, taken, skipped, snoozed, pending)
+  select d.user_id,
+         coalesce(d.rollup_day, (d.scheduled_at at time zone u.timezone)::date),
+         coalesce(d.rollup_block, dose_time_block(d.scheduled_at at time zone u.timezone)),
+         count(*) filter (where d.status = 'taken'),
+         count(*) filter (where d.status::text in ('skipped', 'missed')),
+         count(*) filter (where d.status = 'snoozed'),
+         count(*) filter (where d.status = 'pending')
+  from doses d
+  join users u on u.id = d.user_id
+  group by 1, 2, 3;
+$$;
+
+-- One row per patient with 7-day aggregates, refreshed from adherence_daily by
+-- the backend (app/cohort_service.py). Indexed for the cohort page's sorts.
+create table if not exists cohort_stats (
+  user_id        uuid primary key references users(id) on delete cascade,
+  name           text not null,
+  taken_7d       integer not null default 0,
+  due_7d         integer not null default 0,
+  skipped_7d     integer not null default 0,
+  snoozed_7d     integer not null default 0,
+  adherence_7d   real,                       -- taken / due; null when nothing was due
+  worst_block    text,                       -- time block with the most non-taken doses
+  medications    integer not null default 0,
+  risk_score     smallint,
+  risk_bucket    text,                       -- low | medium | high (from risk_score)
+  last_taken_day date,
+  refreshed_at   timestamptz not null default now()
+);
+
+create index if not exists idx_cohort_adherence on cohort_stats(adherence_7d, user_id);
+create index if not exists idx_cohort_risk on cohort_stats(risk_score, user_id);
+create index if not exists idx_cohort_bucket_adherence on cohort_stats(risk_bucket, adherence_7d, user_id);
+create index if not exists idx_cohort_name on cohort_stats(name, user_id);
+
+-- Superseded by the per-panel trend in clinician_cohort_summary
+drop table if exists cohort_daily;
+
+-- Window: the 7 complete local days before today, plus today's doses already
+-- acted on (today's pending doses are mostly still in the future).
+create or replace function refresh_cohort_stats() returns void
+language sql as $$
+  with cells as (
+    select a.*
+    from adherence_daily a
+    where a.day >= current_date - 7 and a.day <= current_date
+  ),
+  agg as (
+    select user_id,
+           sum(taken)::int   as taken_7d,
+           sum(skipped)::int as skipped_7d,
+           sum(snoozed)::int as snoozed_7d,
+           sum(taken + skipped + snoozed + case when day < current_date then pending else 0 end)::int as due_7d,
+           max(day) filter (where taken > 0) as last_taken_day
+    from cells
+    group by user_id
+  ),
+  worst as (
+    select distinct on (user_id) user_id, block
+    from (
+      select user_id, block,
+             sum(skipped + snoozed + case when day < current_date then pending else 0 end) as misses
+      from cells
+      group by user_id, block
+    ) b
+    where misses > 0
+    order by user_id, misses desc, block
+  ),
+  risk as (
+    select distinct on (user_id) user_id, score
+    from risk_daily
+    where for_date >= current_date - 7
+    order by user_id, for_date desc
+  ),
+  meds as (
+    select user_id, count(*)::int as n from medications group by user_id
+  )
+  insert into cohort_stats as c (
+    user_id, name, taken_7d, due_7d, skipped_7d, snoozed_7d, adherence_7d,
+    worst_block, medications, risk_score, risk_bucket, last_taken_day, refreshed_at
+  )
+  select u.id, u.name,
+         coalesce(agg.taken_7d, 0), coalesce(agg.due_7d, 0),
+         coalesce(agg.skipped_7d, 0), coalesce(agg.snoozed_7d, 0),
+         case when coalesce(agg.due_7d, 0) > 0 then agg.taken_7d::real / agg.due_7d end,
+         worst.block,
+         coalesce(meds.n, 0),
+         risk.score,
+         case when risk.score is null then null
+              when risk.score < 35 then 'low'
+              when risk.score < 65 then 'medium'
+              else 'high' end,
+         agg.last_taken_day,
+         now()
+  from users u
+  left join agg   on agg.user_id = u.id
+  left join worst on worst.user_id = u.id
+  left join risk  on risk.user_id = u.id
+  left join meds  on meds.user_id = u.id
+  where u.role = 'patient'
+  on conflict (user_id) do update set
+    name = excluded.name, taken_7d = excluded.taken_7d, due_7d = excluded.due_7d,
+    skipped_7d = excluded.skipped_7d, snoozed_7d = excluded.snoozed_7d,
+    adherence_7d = excluded.adherence_7d, worst_block = excluded.worst_block,
+    medications = excluded.medications, risk_score = excluded.risk_score,
+    risk_bucket = excluded.risk_bucket, last_taken_day = excluded.last_taken_day,
+    refreshed_at = excluded.refreshed_at;
+$$;
+
+-- One page of a clinician's panel from cohort_stats: {"total": n, "rows": [...]}.
+-- The panel comes from clinician_links, and only for a user whose role is
+-- clinician, so the scope is enforced here rather than by the caller.
+create or replace function clinician_cohort_page(
+  p_clinician uuid,
+  p_sort      text,            -- adherence_7d | risk_score | name | last_taken_day
+  p_desc      boolean,
+  p_risk      text[],          -- null: every bucket
+  p_search    text,            -- null: no name filter
+  p_offset    integer,
+  p_limit     integer
+) returns jsonb
+language plpgsql stable as $$
 declare
-  v_med_id uuid;
-  v_user_id uuid;
+  result jsonb;
 begin
-  if tg_table_name = 'medications' then
-    v_med_id := new.id;
-    v_user_id := new.user_id;
-  elsif tg_table_name = 'med_times' then
-    select m.id, m.user_id into v_med_id, v_user_id
-    from medications m
-    where m.id = new.medication_id;
+  if p_sort not in ('adherence_7d', 'risk_score', 'name', 'last_taken_day') then
+    raise exception 'unknown cohort sort %', p_sort;
   end if;
+  execute format($q$
+    with panel as (
+      select c.*
+      from clinician_links l
+      join users cl on cl.id = l.clinician_id and cl.role = 'clinician'
+      join cohort_stats c on c.user_id = l.patient_id
+      where l.clinician_id = $1
+        and ($2::text[] is null or c.risk_bucket = any($2))
+        and ($3::text is null or c.name ilike '%%' || $3 || '%%')
+    ),
+    page as (
+      select row_number() over (order by %I %s, user_id) as rn, p.*
+      from panel p
+      order by %I %s, user_id
+      offset $4 limit $5
+    )
+    select jsonb_build_object(
+      'total', (select count(*) from panel),
+      'rows', coalesce((select jsonb_agg(to_jsonb(page) - 'rn' order by rn) from page), '[]'::jsonb)
+    )$q$, p_sort, case when p_desc then 'desc' else 'asc' end, p_sort, case when p_desc then 'desc' else 'asc' end)
+  into result
+  using p_clinician, p_risk, p_search, p_offset, p_limit;
+  return result;
+end $$;
 
-  perform gen_doses_for_med(v_med_id, v_user_id, current_date, current_date + 7);
+-- Overview of a clinician's panel: patient count, risk buckets and a 14-day
+-- adherence trend from adherence_daily (same due rule as refresh_cohort_stats)
+create or replace function clinician_cohort_summary(p_clinician uuid) returns jsonb
+language sql stable as $$
+  with panel as (
+    select l.patient_id
+    from clinician_links l
+    join users cl on cl.id = l.clinician_id and cl.role = 'clinician'
+    where l.clinician_id = p_clinician
+  ),
+  stats as (
+    select c.risk_bucket from cohort_stats c join panel p on p.patient_id = c.user_id
+  ),
+  trend as (
+    select a.day,
+           sum(a.taken)::int as taken,
+           sum(a.taken + a.skipped + a.snoozed + case when a.day < current_date then a.pending else 0 end)::int as due,
+           count(distinct a.user_id)::int as patients
+    from adherence_daily a
+    join panel p on p.patient_id = a.user_id
+    where a.day >= current_date - 13 and a.day <= current_date
+    group by a.day
+  )
+  select jsonb_build_object(
+    'total_patients', (select count(*) from stats),
+    'risk_counts', jsonb_build_object(
+      'low',    (select count(*) from stats where risk_bucket = 'low'),
+      'medium', (select count(*) from stats where risk_bucket = 'medium'),
+      'high',   (select count(*) from stats where risk_bucket = 'high')
+    ),
+    'trend', coalesce((
+      select jsonb_agg(jsonb_build_object(
+        'day', day, 'taken', taken, 'due', due, 'patients', patients,
+        'adherence', case when due > 0 then taken::real / due end
+      ) order by day)
+      from trend
+    ), '[]'::jsonb)
+  );
+$$;
+
+-- 7c) Bulk dose updates
+------------------------------------------------------------
+-- Applies many {id, status, taken_at, notes, expected_status} items in one
+-- UPDATE. An item with expected_status only applies while the dose still has
+-- that status (compare-and-set), so e.g. a late "taken" cannot overwrite an
+-- escalated "missed". Returns one row per existing dose of the user:
+-- applied=true with the new values, or applied=false with the current ones.
+create or replace function bulk_update_doses(p_user_id uuid, p_items jsonb)
+returns table (
+  id uuid, applied boolean, status dose_status, taken_at timestamptz,
+  notes text, medication_id uuid, scheduled_at timestamptz
+)
+language sql as $$
+  with items as (
+    select *
+    from jsonb_to_recordset(p_items)
+      as i(id uuid, status dose_status, taken_at timestamptz, notes text, expected_status dose_status)
+  ),
+  upd as (
+    update doses d
+    set status   = i.status,
+        taken_at = coalesce(i.taken_at, d.taken_at),
+        notes    = coalesce(i.notes, d.notes)
+    from items i
+    where d.id = i.id
+      and d.user_id = p_user_id
+      and (i.expected_status is null or d.status = i.expected_status)
+    returning d.id, d.status, d.taken_at, d.notes, d.medication_id, d.scheduled_at
+  )
+  select u.id, true, u.status, u.taken_at, u.notes, u.medication_id, u.scheduled_at
+  from upd u
+  union all
+  select d.id, false, d.status, d.taken_at, d.notes, d.medication_id, d.scheduled_at
+  from items i
+  join doses d on d.id = i.id and d.user_id = p_user_id
+  where not exists (select 1 from upd u where u.id = i.id);
+$$;
+
+-- 7d) Delta Sync (offline PWA, /api/v1/sync)
+------------------------------------------------------------
+-- Every medications / med_times / doses row carries a version from one shared
+-- sequence, re-stamped on each update, so "changed since N" is an index range
+-- scan on (user_id, version). Deletes leave a tombstone under the same
+-- sequence. Adding the columns rewrites the tables once (volatile default).
+create sequence if not exists sync_version_seq;
+
+alter table medications add column if not exists version bigint not null default nextval('sync_version_seq');
+alter table med_times   add column if not exists version bigint not null default nextval('sync_version_seq');
+alter table doses       add column if not exists version bigint not null default nextval('sync_version_seq');
+
+-- med_times has no owner column; keep a copy of the medication's user_id
+alter table med_times add column if not exists user_id uuid references users(id) on delete cascade;
+update med_times t set user_id = m.user_id from medications m where m.id = t.medication_id and t.user_id is null;
+
+create index if not exists idx_meds_user_version on medications(user_id, version);
+create index if not exists idx_med_times_user_version on med_times(user_id, version);
+create index if not exists idx_doses_user_version on doses(user_id, version);
+
+create or replace function trg_sync_version() returns trigger
+language plpgsql as $$
+begin
+  new.version := nextval('sync_version_seq');
   return new;
 end $$;
 
-drop trigger if exists med_after_insert on medications;
-create trigger med_after_insert
-after insert on medications
-for each row execute procedure trg_med_or_time_after_change();
+create or replace function trg_med_times_owner() returns trigger
+language plpgsql as $$
+begin
+  select m.user_id into new.user_id from medications m where m.id = new.medication_id;
+  return new;
+end $$;
 
-drop trigger if exists medtimes_after_upsert on med_times;
-create trigger medtimes_after_upsert
-after insert or update on med_times
-for each row execute procedure trg_med_or_time_after_change();
+drop trigger if exists medications_sync_version on medications;
+create trigger medications_sync_version before update on medications
+  for each row execute function trg_sync_version();
+drop trigger if exists med_times_sync_version on med_times;
+create trigger med_times_sync_version before update on med_times
+  for each row execute function trg_sync_version();
+drop trigger if exists doses_sync_version on doses;
+create trigger doses_sync_version before update on doses
+  for each row execute function trg_sync_version();
+drop trigger if exists med_times_owner on med_times;
+create trigger med_times_owner before insert or update of medication_id on med_times
+  for each row execute function trg_med_times_owner();
+
+create table if not exists sync_tombstones (
+  version     bigint primary key default nextval('sync_version_seq'),
+  user_id     uuid not null,
+  entity      text not null,               -- 'medications','med_times','doses'
+  entity_id   uuid not null,
+  deleted_at  timestamptz not null default now()
+);
+
+create index if not exists idx_sync_tombstones_user on sync_tombstones(user_id, version);
+create index if not exists idx_sync_tombstones_deleted on sync_tombstones(deleted_at);
+
+-- Statement-level, so deleting a medication's doses is one INSERT ... SELECT
+create or replace function trg_sync_tombstones() returns trigger
+language plpgsql as $$
+begin
+  insert into sync_tombstones (user_id, entity, entity_id)
+  select o.user_id, tg_table_name, o.id from old_rows o where o.user_id is not null;
+  return null;
+end $$;
+
+drop trigger if exists medications_tombstones on medications;
+create trigger medications_tombstones after delete on medications
+  referencing old table as old_rows for each statement execute function trg_sync_tombstones();
+drop trigger if exists med_times_tombstones on med_times;
+create trigger med_times_tombstones after delete on med_times
+  referencing old table as old_rows for each statement execute function trg_sync_tombstones();
+drop trigger if exists doses_tombstones on doses;
+create trigger doses_tombstones after delete on doses
+  referencing old table as old_rows for each statement execute function trg_sync_tombstones();
+
+-- Replayed offline mutations: (user, client key) -> stored result
+create table if not exists sync_mutations (
+  user_id     uuid not null references users(id) on delete cascade,
+  key         text not null,
+  result      jsonb not null,
+  created_at  timestamptz not null default now(),
+  primary key (user_id, key)
+);
+
+create index if not exists idx_sync_mutations_created on sync_mutations(created_at);
+
+create table if not exists sync_meta (
+  key    text primary key,
+  value  bigint not null
+);
+
+-- Drops tombstones and mutation keys older than p_keep_days and records the
+-- highest pruned tombstone version ("tombstone_floor"). Clients whose cursor is
+-- below the floor may have missed deletes and get a full resync.
+create or replace function prune_sync_state(p_keep_days integer) returns bigint
+language plpgsql as $$
+declare
+  v_floor bigint;
+begin
+  with gone as (
+    delete from sync_tombstones
+    where deleted_at < now() - make_interval(days => p_keep_days)
+    returning version
+  )
+  select max(version) into v_floor from gone;
+
+  if v_floor is not null then
+    insert into sync_meta (key, value) values ('tombstone_floor', v_floor)
+    on conflict (key) do update set value = greatest(sync_meta.value, excluded.value);
+  end if;
+
+  delete from sync_mutations where created_at < now() - make_interval(days => p_keep_days);
+
+  return coalesce((select value from sync_meta where key = 'tombstone_floor'), 0);
+end $$;
+
+-- 7e) Dose Lookups (parameterized; replace string-built exec_sql queries)
+------------------------------------------------------------
+-- Called through supabase.rpc(); plain SQL functions are inlined or planned
+-- once per session instead of re-parsing interpolated SQL text per request.
+create or replace function next_doses(p_user_ids uuid[])
+returns table (user_id uuid, dose_id uuid, medication_id uuid, medication_name text, scheduled_at timestamptz)
+language sql stable as $$
+  select u.user_id, d.id, d.medication_id, m.name, d.scheduled_at
+  from unnest(p_user_ids) as u(user_id)
+  cross join lateral (
+    select d.id, d.medication_id, d.scheduled_at
+    from doses d
+    where d.user_id = u.user_id and d.status = 'pending' and d.scheduled_at >= now()
+    order by d.scheduled_at, d.id
+    limit 1
+  ) d
+  join medications m on m.id = d.medication_id;
+$$;
+
+-- Pending doses past the user's grace period (escalation_rules, default 10 min)
+create or replace function missed_doses(p_user_id uuid)
+returns table (id uuid, scheduled_at timestamptz, status dose_status, medication_name text, grace_minutes integer)
+language sql stable as $$
+  select d.id, d.scheduled_at, d.status, m.name, e.grace_minutes
+  from doses d
+  join medications m on m.id = d.medication_id
+  left join escalation_rules e on e.user_id = p_user_id
+  where d.user_id = p_user_id
+    and d.status = 'pending'
+    and d.scheduled_at < now() - make_interval(mins => coalesce(e.grace_minutes, 10))
+  order by d.scheduled_at;
+$$;
+
+-- 7f) Dose Partitions & Archival
+------------------------------------------------------------
+-- Months that app/dose_archive.py moved to Parquet files (cold tier). Their
+-- partitions are detached and dropped; exports read the files instead.
+create table if not exists dose_archives (
+  month        date primary key,             -- first day of the month (UTC)
+  path         text not null,
+  row_count    bigint not null,
+  archived_at  timestamptz not null default now()
+);
+
+-- Creates the monthly partitions doses_pYYYYMM (UTC bounds) from p_months_back
+-- before the current month through p_months_ahead after it, skipping months
+-- already archived. The archiver calls it daily; returns partitions created.
+create or replace function ensure_dose_partitions(p_months_back integer, p_months_ahead integer)
+returns integer
+language plpgsql as $$
+declare
+  v_month   date;
+  v_name    text;
+  v_created integer := 0;
+begin
+  if (select relkind from pg_class where oid = 'doses'::regclass) <> 'p' then
+    return 0;  -- not migrated yet
+  end if;
+  for v_month in
+    select generate_series(
+      (date_trunc('month', now() at time zone 'UTC') - make_interval(months => p_months_back))::date,
+      (date_trunc('month', now() at time zone 'UTC') + make_interval(months => p_months_ahead))::date,
+      interval '1 month'
+    )::date
+  loop
+    v_name := 'doses_p' || to_char(v_month, 'YYYYMM');
+    if to_regclass(v_name) is null and not exists (select 1 from dose_archives a where a.month = v_month) then
+      execute format(
+        'create table %I partition of doses for values from (%L) to (%L)',
+        v_name, v_month::text || ' 00:00:00+00', (v_month + interval '1 month')::date::text || ' 00:00:00+00'
+      );
+      v_created := v_created + 1;
+    end if;
+  end loop;
+  return v_created;
+end $$;
 
--- NOTE: If a med_times row is DELETED, re-generate future doses via backend for simplicity.
+select ensure_dose_partitions(1, 3);
 
 -- 8) (Optional) RLS (skip for hackathon if all access is via backend service role)
 ------------------------------------------------------------
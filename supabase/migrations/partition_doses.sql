@@ -0,0 +1,56 @@
+-- =========================================================
+-- Convert an existing, unpartitioned doses table to monthly partitions
+-- =========================================================
+-- Fresh installs get the partitioned table from final_schema.sql directly.
+-- For an existing database: run this once (it holds an exclusive lock on doses
+-- while copying, so schedule it in a quiet window), then re-run
+-- final_schema.sql to recreate indexes, triggers, views and functions on the
+-- new table. Dropping the old table also drops the alerts -> doses foreign key,
+-- which partitioned tables cannot be the target of.
+
+begin;
+
+lock table doses in access exclusive mode;
+
+-- LIKE copies columns (in order), NOT NULLs and defaults, including
+-- the sync version default
+create table doses_partitioned (like doses including defaults)
+  partition by range (scheduled_at);
+
+alter table doses_partitioned add primary key (id, scheduled_at);
+alter table doses_partitioned add unique (medication_id, scheduled_at);
+alter table doses_partitioned add foreign key (user_id) references users(id) on delete cascade;
+alter table doses_partitioned add foreign key (medication_id) references medications(id) on delete cascade;
+
+create table doses_default partition of doses_partitioned default;
+
+-- One partition per month that has doses, plus the next three months
+do $$
+declare
+  v_month date;
+begin
+  for v_month in
+    select generate_series(
+      coalesce(date_trunc('month', min(scheduled_at) at time zone 'UTC'), date_trunc('month', now() at time zone 'UTC'))::date,
+      (date_trunc('month', greatest(max(scheduled_at), now()) at time zone 'UTC') + interval '3 months')::date,
+      interval '1 month'
+    )::date
+    from doses
+  loop
+    execute format(
+      'create table %I partition of doses_partitioned for values from (%L) to (%L)',
+      'doses_p' || to_char(v_month, 'YYYYMM'),
+      v_month::text || ' 00:00:00+00', (v_month + interval '1 month')::date::text || ' 00:00:00+00'
+    );
+  end loop;
+end $$;
+
+insert into doses_partitioned select * from doses;
+
+-- Cascades to v_next_dose, the alerts foreign key and the triggers on doses
+drop table doses cascade;
+alter table doses_partitioned rename to doses;
+
+commit;
+
+-- Now re-run supabase/final_schema.sql.